@@ -23,10 +23,29 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterNumber,
                        QgsProcessingParameterField,
                        QgsProcessingParameterRasterLayer,
-                       QgsProcessingParameterFolderDestination)
+                       QgsProcessingParameterVectorLayer,
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterFolderDestination,
+                       QgsProcessingOutputRasterLayer)
 import pandas as pd
 import gdal
 import numpy as np
+import os
+import sys
+
+# The se_torino package is kept in the same folder as the scripts
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+from se_torino.raster import intermediate_path, write_raster
+from se_torino.parameters import (DELTA, add_both_phases_parameters, add_output_profile_parameters,
+                                  add_species_table_parameter, output_profile, phase_states, species_counts,
+                                  vector_layer_source)
+from se_torino.lookup import LucodeTable, describe_unknown
+from se_torino.species import CATALOGUE
+from se_torino.threats import layer_point_attributes
+from se_torino.kernels import alberi
+from se_torino.kernels.carbonio import C_ABOVE_TABLE, C_SOIL_TABLE, TREE_LUCODES
 
 class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     """
@@ -59,7 +78,20 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     ESEMPL4 = 'ESEMPL4'    
     SPECIE5 = 'SPECIE5'
     ESEMPL5 = 'ESEMPL5'
+    SPECIES_SLOTS = [(SPECIE1, ESEMPL1), (SPECIE2, ESEMPL2), (SPECIE3, ESEMPL3), (SPECIE4, ESEMPL4),
+                     (SPECIE5, ESEMPL5)]
+    ALBERI = 'ALBERI'
+    ALBERI_FUTURO = 'ALBERI_FUTURO'
+    CAMPO_SPECIE = 'CAMPO_SPECIE'
+    CAMPO_ESEMPLARI = 'CAMPO_ESEMPLARI'
+    CAMPO_DIAMETRO = 'CAMPO_DIAMETRO'
+    DIAMETRO_RIFERIMENTO = 'DIAMETRO_RIFERIMENTO'
+    ESPONENTE_ALLOMETRICO = 'ESPONENTE_ALLOMETRICO'
     OUTPUT = 'OUTPUT'
+    SALVA_INTERMEDI = 'SALVA_INTERMEDI'
+    CARBONIO = 'CARBONIO'
+    CARBONIO_FUTURO = 'CARBONIO_FUTURO'
+    CARBONIO_DELTA = 'CARBONIO_DELTA'
 
     def tr(self, string):
         """
@@ -110,7 +142,13 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         should provide a basic description about what the algorithm does and the
         parameters and outputs associated with it..
         """
-        return self.tr("Calcolo Carbonio")
+        return self.tr("Calcolo Carbonio. Con il censimento degli alberi (layer di punti con specie, numero di "
+                       "esemplari e diametro del tronco in cm) il carbonio epigeo è assegnato ai pixel in cui si "
+                       "trovano gli alberi e sostituisce quello delle specie 1-5 e dei LUCODE; il diametro scala il carbonio "
+                       "della specie solo se è indicato il diametro a cui si riferisce. Con 'Entrambi gli stati' "
+                       "calcola in una volta lo stato attuale e quello di progetto (raster Uso suolo Stato di "
+                       "progetto) e, se richiesto, il raster differenza; il censimento vale solo per lo stato "
+                       "attuale, lo stato di progetto usa il censimento Stato di progetto se indicato")
 
     def initAlgorithm(self, config=None):
         """
@@ -120,12 +158,9 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
 
         # We add the input vector features source. It can have any kind of
         # geometry.
-        all_species = ['Abete (Picea abies, glauca, omorika, orientalis, pungens)', 'Acero seconda grandezza (Acer campestre, cappadocicum, pseudoplatanus, platanoides, platanoides Schwedleri, platanoides Crimson King, rubrum, saccharinum)', 'Acero terza grandezza (Acer negundo, opalus,palmatum, palmatum v. dissectum, x freemanii)', 'Bagolaro (Celtis australis, occidentalis)',
-                       'Carpino (Carpinus betulus, betulus fastigiata,Ostrya carpinifolia)', 'Cedro (Cedrus atlantica, atlantica v. glauca, deodara, libani)', 'Ciliegio da fiore (Prunus cerasifera, domestica, fruticosa, Kanzan,pissardii, serrulata, subhirtella)', 'Frassino (Fraxinus americana, excelsior, excelsior Pendula)',
-                       'Ippocastano (Aesculus hippocastanum, pavia)', 'Olmo  (Ulmus laevis, minor,parvifolia,pumila)', 'Pino (Pinus halepensis, nigra, pinea, strobus, sylvestris, wallichiana)', 'Pioppo (Populus alba,canescens, nigra, nigra var. italica, tremula, x canadensis)',
-                       'Platano (Platanus orientalis, occidentalis, hybrida)', 'Quercia (Quercus coccinea, ilex, petraea, pubescens, robur, robur Fastigiata, rubra)', 'Tiglio (Tilia cordata, cordata Greenspire, platyphyllos, x europaea)']
+        all_species = CATALOGUE.names
 
-        fasi = ['Stato attuale', 'Stato di progetto']
+        fasi = ['Stato attuale', 'Stato di progetto', 'Entrambi gli stati']
         
         self.addParameter(
             QgsProcessingParameterRasterLayer(
@@ -244,6 +279,81 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                self.ALBERI,
+                self.tr('Censimento alberi (opzionale, layer di punti)'),
+                [QgsProcessing.TypeVectorPoint],
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                self.ALBERI_FUTURO,
+                self.tr('Censimento alberi Stato di progetto (solo per entrambi gli stati, stessi campi)'),
+                [QgsProcessing.TypeVectorPoint],
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.CAMPO_SPECIE,
+                self.tr('Campo specie del censimento (nome, nome latino o numero della specie)'),
+                parentLayerParameterName=self.ALBERI,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.CAMPO_ESEMPLARI,
+                self.tr('Campo numero esemplari del censimento (opzionale, 1 per punto se assente)'),
+                parentLayerParameterName=self.ALBERI,
+                type=QgsProcessingParameterField.Numeric,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.CAMPO_DIAMETRO,
+                self.tr('Campo diametro del tronco del censimento (cm, opzionale)'),
+                parentLayerParameterName=self.ALBERI,
+                type=QgsProcessingParameterField.Numeric,
+                optional=True
+            )
+        )
+
+        double_param = QgsProcessingParameterNumber(
+            self.DIAMETRO_RIFERIMENTO,
+            self.tr('Diametro del tronco a cui si riferisce il carbonio per specie (cm, 0 = diametro non usato)'),
+            QgsProcessingParameterNumber.Double,
+            0,
+            minValue=0
+        )
+        double_param.setMetadata( {'widget_wrapper': { 'decimals': 1 }} )
+        self.addParameter(double_param)
+
+        double_param = QgsProcessingParameterNumber(
+            self.ESPONENTE_ALLOMETRICO,
+            self.tr('Esponente della relazione carbonio - diametro (Zianis e Mencuccini 2004)'),
+            QgsProcessingParameterNumber.Double,
+            alberi.ALLOMETRIC_EXPONENT,
+            minValue=0
+        )
+        double_param.setMetadata( {'widget_wrapper': { 'decimals': 2 }} )
+        self.addParameter(double_param)
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+            self.SALVA_INTERMEDI,
+            self.tr('Salva i raster intermedi su disco'),
+            defaultValue=True
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterFolderDestination(
                 self.OUTPUT,
@@ -251,284 +361,138 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        add_species_table_parameter(self)
+
+        add_both_phases_parameters(self)
+
+        add_output_profile_parameters(self)
+        self.addOutput(QgsProcessingOutputRasterLayer(self.CARBONIO, self.tr('Raster carbonio')))
+        self.addOutput(QgsProcessingOutputRasterLayer(self.CARBONIO_FUTURO, self.tr('Raster carbonio stato di progetto')))
+        self.addOutput(QgsProcessingOutputRasterLayer(self.CARBONIO_DELTA, self.tr('Raster differenza carbonio')))
+
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """
-        # List of all species
-        all_species = ['Abete (Picea abies, glauca, omorika, orientalis, pungens)', 'Acero seconda grandezza (Acer campestre, cappadocicum, pseudoplatanus, platanoides, platanoides Schwedleri, platanoides Crimson King, rubrum, saccharinum)', 'Acero terza grandezza (Acer negundo, opalus,palmatum, palmatum v. dissectum, x freemanii)', 'Bagolaro (Celtis australis, occidentalis)',
-                       'Carpino (Carpinus betulus, betulus fastigiata,Ostrya carpinifolia)', 'Cedro (Cedrus atlantica, atlantica v. glauca, deodara, libani)', 'Ciliegio da fiore (Prunus cerasifera, domestica, fruticosa, Kanzan,pissardii, serrulata, subhirtella)', 'Frassino (Fraxinus americana, excelsior, excelsior Pendula)',
-                       'Ippocastano (Aesculus hippocastanum, pavia)', 'Olmo  (Ulmus laevis, minor,parvifolia,pumila)', 'Pino (Pinus halepensis, nigra, pinea, strobus, sylvestris, wallichiana)', 'Pioppo (Populus alba,canescens, nigra, nigra var. italica, tremula, x canadensis)',
-                       'Platano (Platanus orientalis, occidentalis, hybrida)', 'Quercia (Quercus coccinea, ilex, petraea, pubescens, robur, robur Fastigiata, rubra)', 'Tiglio (Tilia cordata, cordata Greenspire, platyphyllos, x europaea)']
-        # List of all lucodes
-        lucode_list = [7, 9, 17, 19, 21, 23, 26, 29, 32, 38, 43, 44, 46, 48, 53, 57, 62, 69, 70, 74, 82, 83, 84, 85, 86, 87]
-        # Initialize dicionary of c sequestration per species
-        c_sequestration_species = {}
-        c_sequestration_species['Abete (Picea abies, glauca, omorika, orientalis, pungens)'] = 0.18
-        c_sequestration_species['Acero seconda grandezza (Acer campestre, cappadocicum, pseudoplatanus, platanoides, platanoides Schwedleri, platanoides Crimson King, rubrum, saccharinum)'] = 0,41
-        c_sequestration_species['Acero terza grandezza (Acer negundo, opalus,palmatum, palmatum v. dissectum, x freemanii)'] = 0.34
-        c_sequestration_species['Bagolaro (Celtis australis, occidentalis)'] = 0.75
-        c_sequestration_species['Carpino (Carpinus betulus, betulus fastigiata,Ostrya carpinifolia)'] = 0.38
-        c_sequestration_species['Cedro (Cedrus atlantica, atlantica v. glauca, deodara, libani)'] = 0.39
-        c_sequestration_species['Ciliegio da fiore (Prunus cerasifera, domestica, fruticosa, Kanzan,pissardii, serrulata, subhirtella)'] = 0.2
-        c_sequestration_species['Frassino (Fraxinus americana, excelsior, excelsior Pendula)'] = 0.35
-        c_sequestration_species['Ippocastano (Aesculus hippocastanum, pavia)'] = 0.44
-        c_sequestration_species['Olmo  (Ulmus laevis, minor,parvifolia,pumila)'] = 0.48
-        c_sequestration_species['Pino (Pinus halepensis, nigra, pinea, strobus, sylvestris, wallichiana)'] = 0.31
-        c_sequestration_species['Pioppo (Populus alba,canescens, nigra, nigra var. italica, tremula, x canadensis)'] = 0.67
-        c_sequestration_species['Platano (Platanus orientalis, occidentalis, hybrida)'] = 0.7
-        c_sequestration_species['Quercia (Quercus coccinea, ilex, petraea, pubescens, robur, robur Fastigiata, rubra)'] = 0.44
-        c_sequestration_species['Tiglio (Tilia cordata, cordata Greenspire, platyphyllos, x europaea)'] = 0.28
-        # c soil lucode specififc
-        c_soil = {}
-        c_soil[1] = 0.0056
-        c_soil[2] = 0.0056
-        c_soil[3] = 0
-        c_soil[4] = 0.0056
-        c_soil[5] = 0.0056
-        c_soil[6] = 0.0056
-        c_soil[7] = 0.0056
-        c_soil[8] = 0
-        c_soil[9] = 0.0056
-        c_soil[10] = 0
-        c_soil[11] = 0
-        c_soil[12] = 0
-        c_soil[13] = 0
-        c_soil[14] = 0
-        c_soil[15] = 0
-        c_soil[16] = 0
-        c_soil[17] = 0
-        c_soil[18] = 0
-        c_soil[19] = 0.0056
-        c_soil[20] = 0
-        c_soil[21] = 0.0056
-        c_soil[22] = 0.0056
-        c_soil[23] = 0.0056
-        c_soil[24] = 0.0056
-        c_soil[25] = 0
-        c_soil[26] = 0.0056
-        c_soil[27] = 0
-        c_soil[28] = 0
-        c_soil[29] = 0.0056
-        c_soil[30] = 0.0056
-        c_soil[31] = 0
-        c_soil[32] = 0.0056
-        c_soil[33] = 0.0056
-        c_soil[34] = 0.0056
-        c_soil[35] = 0
-        c_soil[36] = 0
-        c_soil[37] = 0.0056
-        c_soil[38] = 0.0056
-        c_soil[39] = 0.0056
-        c_soil[40] = 0.0056
-        c_soil[41] = 0.0056
-        c_soil[42] = 0.0056
-        c_soil[43] = 0.0056
-        c_soil[44] = 0.0056
-        c_soil[45] = 0
-        c_soil[46] = 0
-        c_soil[47] = 0
-        c_soil[48] = 0.0056
-        c_soil[49] = 0.0056
-        c_soil[50] = 0
-        c_soil[51] = 0
-        c_soil[52] = 0
-        c_soil[53] = 0.0056
-        c_soil[54] = 0.0056
-        c_soil[55] = 0
-        c_soil[56] = 0
-        c_soil[57] = 0.0056
-        c_soil[58] = 0.0056
-        c_soil[59] = 0.0056
-        c_soil[60] = 0
-        c_soil[61] = 0.00679
-        c_soil[62] = 0.00679
-        c_soil[63] = 0.00679
-        c_soil[64] = 0.0056
-        c_soil[65] = 0.0056
-        c_soil[66] = 0
-        c_soil[67] = 0
-        c_soil[68] = 0.00679
-        c_soil[69] = 0.00679
-        c_soil[70] = 0.00679
-        c_soil[71] = 0
-        c_soil[72] = 0
-        c_soil[73] = 0.0056
-        c_soil[74] = 0.0056
-        c_soil[75] = 0.0056
-        c_soil[76] = 0.0056
-        c_soil[77] = 0
-        c_soil[78] = 0
-        c_soil[79] = 0.0056
-        c_soil[80] = 0
-        c_soil[81] = 0
-        c_soil[82] = 0.0061
-        c_soil[83] = 0.0061
-        c_soil[84] = 0.0061
-        c_soil[85] = 0.0061
-        c_soil[86] = 0.0061
-        c_soil[87] = 0.0061
-
-        # Collect species and number of plants
-        esempl1 = self.parameterAsInt(parameters, self.ESEMPL1, context)
-        specie1 = self.parameterAsInt(parameters, self.SPECIE1, context)
-        esempl2 = self.parameterAsInt(parameters, self.ESEMPL2, context)
-        specie2 = self.parameterAsInt(parameters, self.SPECIE2, context)
-        esempl3 = self.parameterAsInt(parameters, self.ESEMPL3, context)
-        specie3 = self.parameterAsInt(parameters, self.SPECIE3, context)
-        esempl4 = self.parameterAsInt(parameters, self.ESEMPL4, context)
-        specie4 = self.parameterAsInt(parameters, self.SPECIE4, context)
-        esempl5 = self.parameterAsInt(parameters, self.ESEMPL5, context)
-        specie5 = self.parameterAsInt(parameters, self.SPECIE5, context)
+
+        # Output raster format
+        profile = output_profile(self, parameters, context)
+
+        # Collect species and number of plants, from the species parameters and from the species table
+        n_species, unknown_species = species_counts(self, parameters, context, self.SPECIES_SLOTS)
+        if unknown_species:
+            feedback.pushInfo(self.tr('Specie non riconosciute nella tabella specie (righe): %s') % unknown_species)
+        n_trees = np.sum(n_species)
 
         area_pixel = self.parameterAsInt(parameters, self.PIXEL_RES, context) * self.parameterAsInt(
             parameters, self.PIXEL_RES, context)
 
-        if (esempl1 == 0):
-            c_above = {}
-            c_above[1] = 0
-            c_above[2] = 0
-            c_above[3] = 0
-            c_above[4] = 0
-            c_above[5] = 0
-            c_above[6] = 0
-            c_above[7] = 0.000047
-            c_above[8] = 0
-            c_above[9] = 0.001439
-            c_above[10] = 0
-            c_above[11] = 0
-            c_above[12] = 0
-            c_above[13] = 0
-            c_above[14] = 0
-            c_above[15] = 0
-            c_above[16] = 0
-            c_above[17] = 0.000535
-            c_above[18] = 0
-            c_above[19] = 0.003
-            c_above[20] = 0
-            c_above[21] = 0.005
-            c_above[22] = 0
-            c_above[23] = 0.00029
-            c_above[24] = 0
-            c_above[25] = 0
-            c_above[26] = 0.000073
-            c_above[27] = 0
-            c_above[28] = 0
-            c_above[29] = 0.00003
-            c_above[30] = 0
-            c_above[31] = 0
-            c_above[32] = 0.003
-            c_above[33] = 0
-            c_above[34] = 0
-            c_above[35] = 0
-            c_above[36] = 0
-            c_above[37] = 0
-            c_above[38] = 0.005
-            c_above[39] = 0
-            c_above[40] = 0
-            c_above[41] = 0
-            c_above[42] = 0
-            c_above[43] = 0.0106
-            c_above[44] = 0.003
-            c_above[45] = 0
-            c_above[46] = 0.000756
-            c_above[47] = 0
-            c_above[48] = 0.000756
-            c_above[49] = 0
-            c_above[50] = 0
-            c_above[51] = 0
-            c_above[52] = 0
-            c_above[53] = 0.0003
-            c_above[54] = 0
-            c_above[55] = 0
-            c_above[56] = 0
-            c_above[57] = 0.00001
-            c_above[58] = 0
-            c_above[59] = 0
-            c_above[60] = 0
-            c_above[61] = 0
-            c_above[62] = 0.00001
-            c_above[63] = 0
-            c_above[64] = 0
-            c_above[65] = 0
-            c_above[66] = 0
-            c_above[67] = 0
-            c_above[68] = 0
-            c_above[69] = 0.00001
-            c_above[70] = 0
-            c_above[71] = 0
-            c_above[72] = 0
-            c_above[73] = 0
-            c_above[74] = 0.00001
-            c_above[75] = 0
-            c_above[76] = 0
-            c_above[77] = 0
-            c_above[78] = 0
-            c_above[79] = 0
-            c_above[80] = 0
-            c_above[81] = 0
-            c_above[82] = 0.006
-            c_above[83] = 0.02
-            c_above[84] = 0.02
-            c_above[85] = 0.0218
-            c_above[86] = 0.016
-            c_above[87] = 0.006
-
         # Calculate total carbon sequestration
-        c_sequestration = c_sequestration_species[all_species[specie1]] * esempl1 +\
-            c_sequestration_species[all_species[specie2]] * esempl2 +\
-            c_sequestration_species[all_species[specie3]] * esempl3 + \
-            c_sequestration_species[all_species[specie4]] * esempl4 +\
-            c_sequestration_species[all_species[specie5]] * esempl5
-        # Load present raster
-        lucode_raster = self.parameterAsRasterLayer(parameters, self.INPUT, context)
-        lucode_data_source = gdal.Open(lucode_raster.dataProvider().dataSourceUri())
-        arr_lucode = lucode_data_source.GetRasterBand(1).ReadAsArray()
-        [rows, cols] = arr_lucode.shape
-        n_pixel_lucode = 0
-        arr_c_above = np.zeros((rows, cols))
-        arr_c_soil = np.zeros((rows, cols))
-        arr_c_total = np.zeros((rows, cols))
-        for lucode in np.unique(arr_lucode):
-            try:
-                arr_c_soil[np.where(arr_lucode == lucode)] = c_soil[lucode] * area_pixel
-            except:
-                pass
-            if lucode in lucode_list:
-                n_pixel_lucode += np.sum(np.where(arr_lucode == lucode))
-                if esempl1 == 0:
-                    arr_c_above[np.where(arr_lucode == lucode)] = c_above[lucode] * area_pixel
-                else:
-                    arr_c_above[np.where(arr_lucode == lucode)] = 1
-        if n_pixel_lucode != 0:
-            c_sequestration_pixel = c_sequestration / n_pixel_lucode
-        else:
-            c_sequestration_pixel = 0
-        if esempl1 != 0:
-            arr_c_above = arr_c_above * c_sequestration_pixel
-        arr_c_total = arr_c_soil + arr_c_above
-        # Initialize and write on output raster
+        c_sequestration = CATALOGUE.total('c_sequestration', n_species)
         # Output parameters
         stati_list = ['Presente', 'Futuro']
         path_output = self.parameterAsString(parameters, self.OUTPUT, context)
-        stato = stati_list[self.parameterAsInt(parameters, self.FASE, context)]
-        driver = gdal.GetDriverByName("GTiff")
-
-        file_output = path_output + '/01_carbonio_' + stato + '_ton.tiff'
-        outdata = driver.Create(file_output, cols, rows, 1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(lucode_data_source.GetGeoTransform())  ##sets same geotransform as input
-        outdata.SetProjection(lucode_data_source.GetProjection())  ##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(arr_c_total)
-        outdata.FlushCache()  ##saves to disk!!
-        if n_pixel_lucode == 0 and esempl1 > 0:
-            output_str = 'Attenzione sono stati inseriti alberi in un LUCODE che non prevede alberi'
-        elif n_pixel_lucode == 0:
-            output_str = 'Nessun LUCODE accetta alberi'
-        elif (esempl1+esempl2+esempl3+esempl4+esempl5) / (n_pixel_lucode*area_pixel) > 1:
-            output_str = "Attenzione sono stati inseriti più alberi di quanti l'area ne può contenetere"
-        else:
-            output_str = 'Completato'
-        return {self.OUTPUT: output_str}
+        # Present and future states are computed in one call with 'Entrambi gli stati'
+        states = phase_states(self, parameters, context, self.FASE, self.INPUT)
+        write_delta = len(states) > 1 and self.parameterAsBool(parameters, DELTA, context)
+
+        # Without saving, the rasters are kept in memory for the SE algorithms run in the same process
+        save_intermediates = self.parameterAsBool(parameters, self.SALVA_INTERMEDI, context)
+        if not save_intermediates:
+            profile = profile.for_memory()
+        # Pixels of the lucodes that accept trees
+        tree_table = LucodeTable(dict.fromkeys(TREE_LUCODES, 1))
+        # Tree inventory of each state: the census of the state computed, or in both states mode the present
+        # census and the future one, when given
+        trees_layers = [self.parameterAsVectorLayer(parameters, self.ALBERI, context)]
+        if len(states) > 1:
+            trees_layers.append(self.parameterAsVectorLayer(parameters, self.ALBERI_FUTURO, context))
+        species_field = self.parameterAsString(parameters, self.CAMPO_SPECIE, context)
+        count_field = self.parameterAsString(parameters, self.CAMPO_ESEMPLARI, context)
+        dbh_field = self.parameterAsString(parameters, self.CAMPO_DIAMETRO, context)
+        dbh_reference = self.parameterAsDouble(parameters, self.DIAMETRO_RIFERIMENTO, context)
+        results = {}
+        output_list = []
+        notes = []
+        if any(layer is not None for layer in trees_layers):
+            if not species_field:
+                raise QgsProcessingException(self.tr('Indicare il campo specie del censimento degli alberi'))
+            if dbh_field and not dbh_reference:
+                feedback.pushInfo(self.tr('Diametro del censimento non usato: indicare il diametro di riferimento'))
+                notes.append('diametro del censimento non usato, manca il diametro di riferimento')
+
+        def read_inventory(trees_layer, reference, shape):
+            # Carbon of the trees of the census binned on the grid, and number of trees
+            fields = [field for field in [species_field, count_field, dbh_field] if field]
+            points, values = layer_point_attributes(vector_layer_source(trees_layer), reference, fields)
+            species_ids = CATALOGUE.ids(values[0])
+            unknown_species = CATALOGUE.unknown(values[0], species_ids)
+            if unknown_species:
+                feedback.pushInfo(self.tr('Specie non riconosciute nel censimento (punti): %s') % unknown_species)
+            counts = np.asarray(values[fields.index(count_field)], dtype=np.float64) if count_field else None
+            dbh = values[fields.index(dbh_field)] if dbh_field else None
+            carbon = alberi.tree_carbon(species_ids, CATALOGUE, counts, dbh, dbh_reference, self.parameterAsDouble(
+                parameters, self.ESPONENTE_ALLOMETRICO, context))
+            arr_inventory, n_outside = alberi.bin_points(points, carbon, shape)
+            if n_outside:
+                feedback.pushInfo(self.tr('Alberi del censimento fuori dal raster (punti): %d') % n_outside)
+            return arr_inventory, np.sum(counts[counts > 0]) if counts is not None else len(points)
+
+        state_shape = None
+        for phase, lucode_uri in states:
+            stato = stati_list[phase]
+            lucode_data_source = gdal.Open(lucode_uri)
+            arr_lucode = lucode_data_source.GetRasterBand(1).ReadAsArray()
+            if state_shape is not None and arr_lucode.shape != state_shape:
+                raise QgsProcessingException(self.tr('I raster Uso suolo dei due stati devono avere la stessa dimensione'))
+            state_shape = arr_lucode.shape
+            idx_lucode = C_SOIL_TABLE.indices(arr_lucode)
+            arr_c_soil = C_SOIL_TABLE.take(idx_lucode) * area_pixel
+            unknown_lucode = C_SOIL_TABLE.unknown(arr_lucode, idx_lucode)
+            if unknown_lucode:
+                feedback.pushInfo(self.tr('LUCODE non riconosciuti (%s): %s') % (stato, describe_unknown(unknown_lucode)))
+            idx_tree = tree_table.indices(arr_lucode)
+            n_pixel_lucode = np.count_nonzero(tree_table.known_mask(idx_tree))
+            n_trees_state = n_trees
+            if n_trees == 0:
+                arr_c_above = C_ABOVE_TABLE.map(arr_lucode)[0] * area_pixel
+            else:
+                arr_c_above = tree_table.take(idx_tree)
+            if n_pixel_lucode != 0:
+                c_sequestration_pixel = c_sequestration / n_pixel_lucode
+            else:
+                c_sequestration_pixel = 0
+            if n_trees != 0:
+                arr_c_above = arr_c_above * c_sequestration_pixel
+            trees_outside_lucode = n_pixel_lucode == 0 and n_trees > 0
+            # Trees of the inventory, placed on the pixels where they stand
+            trees_layer = trees_layers[phase] if len(states) > 1 else trees_layers[0]
+            if trees_layer is not None:
+                arr_c_above, n_trees_state = read_inventory(trees_layer, lucode_data_source, arr_lucode.shape)
+                trees_outside_lucode = bool(np.any(arr_c_above[~tree_table.known_mask(idx_tree)] > 0))
+            arr_c_total = arr_c_soil + arr_c_above
+            # Initialize and write on output raster
+            file_output = intermediate_path(path_output, '01_carbonio_' + stato + '_ton.tiff', save_intermediates)
+            write_raster(file_output, arr_c_total, lucode_data_source, profile)
+            results[self.CARBONIO_FUTURO if len(states) > 1 and phase == 1 else self.CARBONIO] = file_output
+            if trees_outside_lucode:
+                output_str = 'Attenzione sono stati inseriti alberi in un LUCODE che non prevede alberi'
+            elif n_pixel_lucode == 0:
+                output_str = 'Nessun LUCODE accetta alberi'
+            elif n_trees_state / (n_pixel_lucode*area_pixel) > 1:
+                output_str = "Attenzione sono stati inseriti più alberi di quanti l'area ne può contenetere"
+            else:
+                output_str = 'Completato'
+            output_list.append(output_str if len(states) == 1 else stato + ': ' + output_str)
+            if write_delta:
+                if phase == 0:
+                    arr_c_present = arr_c_total
+                else:
+                    file_delta = intermediate_path(path_output, '01_carbonio_delta_ton.tiff', save_intermediates)
+                    write_raster(file_delta, arr_c_total - arr_c_present, lucode_data_source, profile)
+                    results[self.CARBONIO_DELTA] = file_delta
+        results[self.OUTPUT] = '; '.join(output_list + notes)
+        return results
 
         
         # -----------------------------------------------------------------------------------  
@@ -23,9 +23,23 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterNumber,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterField,
-                       QgsProcessingParameterFolderDestination)
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterFolderDestination,
+                       QgsProcessingOutputRasterLayer)
 import numpy as np
 import gdal
+import os
+import sys
+
+# The se_torino package is kept in the same folder as the scripts
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+from se_torino.raster import intermediate_path, write_raster
+from se_torino.parameters import (DELTA, add_both_phases_parameters, add_output_profile_parameters,
+                                  add_species_table_parameter, output_profile, phase_states, species_counts)
+from se_torino.species import CATALOGUE
+from se_torino.lookup import LucodeTable, describe_unknown
 
 class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     """
@@ -59,7 +73,19 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     ESEMPL4 = 'ESEMPL4'    
     SPECIE5 = 'SPECIE5'
     ESEMPL5 = 'ESEMPL5'
+    SPECIES_SLOTS = [(SPECIE1, ESEMPL1), (SPECIE2, ESEMPL2), (SPECIE3, ESEMPL3), (SPECIE4, ESEMPL4),
+                     (SPECIE5, ESEMPL5)]
     OUTPUT = 'OUTPUT'
+    SALVA_INTERMEDI = 'SALVA_INTERMEDI'
+    OZONO = 'OZONO'
+    PM10 = 'PM10'
+    NO2 = 'NO2'
+    OZONO_FUTURO = 'OZONO_FUTURO'
+    PM10_FUTURO = 'PM10_FUTURO'
+    NO2_FUTURO = 'NO2_FUTURO'
+    OZONO_DELTA = 'OZONO_DELTA'
+    PM10_DELTA = 'PM10_DELTA'
+    NO2_DELTA = 'NO2_DELTA'
     STATO = 'STATO'
     PIXEL_RES = 'PIXEL_RES'
 
@@ -122,11 +148,8 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
 
         # We add the input vector features source. It can have any kind of
         # geometry.
-        all_species = ['Abete (Picea abies, glauca, omorika, orientalis, pungens)', 'Acero seconda grandezza (Acer campestre, cappadocicum, pseudoplatanus, platanoides, platanoides Schwedleri, platanoides Crimson King, rubrum, saccharinum)', 'Acero terza grandezza (Acer negundo, opalus,palmatum, palmatum v. dissectum, x freemanii)', 'Bagolaro (Celtis australis, occidentalis)',
-                       'Carpino (Carpinus betulus, betulus fastigiata,Ostrya carpinifolia)', 'Cedro (Cedrus atlantica, atlantica v. glauca, deodara, libani)', 'Ciliegio da fiore (Prunus cerasifera, domestica, fruticosa, Kanzan,pissardii, serrulata, subhirtella)', 'Frassino (Fraxinus americana, excelsior, excelsior Pendula)',
-                       'Ippocastano (Aesculus hippocastanum, pavia)', 'Olmo  (Ulmus laevis, minor,parvifolia,pumila)', 'Pino (Pinus halepensis, nigra, pinea, strobus, sylvestris, wallichiana)', 'Pioppo (Populus alba,canescens, nigra, nigra var. italica, tremula, x canadensis)',
-                       'Platano (Platanus orientalis, occidentalis, hybrida)', 'Quercia (Quercus coccinea, ilex, petraea, pubescens, robur, robur Fastigiata, rubra)', 'Tiglio (Tilia cordata, cordata Greenspire, platyphyllos, x europaea)']
-        stati_list = ['Presente', 'Futuro']
+        all_species = CATALOGUE.names
+        stati_list = ['Presente', 'Futuro', 'Entrambi gli stati']
         self.addParameter(
             QgsProcessingParameterRasterLayer(
                 self.INPUT,
@@ -270,6 +293,14 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+            self.SALVA_INTERMEDI,
+            self.tr('Salva i raster intermedi su disco'),
+            defaultValue=True
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterFolderDestination(
                 self.OUTPUT,
@@ -277,143 +308,58 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        add_species_table_parameter(self)
+
+        add_both_phases_parameters(self)
+
+        add_output_profile_parameters(self)
+        self.addOutput(QgsProcessingOutputRasterLayer(self.OZONO, self.tr('Raster ozono')))
+        self.addOutput(QgsProcessingOutputRasterLayer(self.PM10, self.tr('Raster PM10')))
+        self.addOutput(QgsProcessingOutputRasterLayer(self.NO2, self.tr('Raster NO2')))
+        self.addOutput(QgsProcessingOutputRasterLayer(self.OZONO_FUTURO, self.tr('Raster ozono stato di progetto')))
+        self.addOutput(QgsProcessingOutputRasterLayer(self.PM10_FUTURO, self.tr('Raster PM10 stato di progetto')))
+        self.addOutput(QgsProcessingOutputRasterLayer(self.NO2_FUTURO, self.tr('Raster NO2 stato di progetto')))
+        self.addOutput(QgsProcessingOutputRasterLayer(self.OZONO_DELTA, self.tr('Raster differenza ozono')))
+        self.addOutput(QgsProcessingOutputRasterLayer(self.PM10_DELTA, self.tr('Raster differenza PM10')))
+        self.addOutput(QgsProcessingOutputRasterLayer(self.NO2_DELTA, self.tr('Raster differenza NO2')))
+
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """
-        # List of all species
-        all_species = ['Abete (Picea abies, glauca, omorika, orientalis, pungens)',
-                       'Acero seconda grandezza (Acer campestre, cappadocicum, pseudoplatanus, platanoides, platanoides Schwedleri, platanoides Crimson King, rubrum, saccharinum)',
-                       'Acero terza grandezza (Acer negundo, opalus,palmatum, palmatum v. dissectum, x freemanii)',
-                       'Bagolaro (Celtis australis, occidentalis)',
-                       'Carpino (Carpinus betulus, betulus fastigiata,Ostrya carpinifolia)',
-                       'Cedro (Cedrus atlantica, atlantica v. glauca, deodara, libani)',
-                       'Ciliegio da fiore (Prunus cerasifera, domestica, fruticosa, Kanzan,pissardii, serrulata, subhirtella)',
-                       'Frassino (Fraxinus americana, excelsior, excelsior Pendula)',
-                       'Ippocastano (Aesculus hippocastanum, pavia)', 'Olmo  (Ulmus laevis, minor,parvifolia,pumila)',
-                       'Pino (Pinus halepensis, nigra, pinea, strobus, sylvestris, wallichiana)',
-                       'Pioppo (Populus alba,canescens, nigra, nigra var. italica, tremula, x canadensis)',
-                       'Platano (Platanus orientalis, occidentalis, hybrida)',
-                       'Quercia (Quercus coccinea, ilex, petraea, pubescens, robur, robur Fastigiata, rubra)',
-                       'Tiglio (Tilia cordata, cordata Greenspire, platyphyllos, x europaea)']
+
+        # Output raster format
+        profile = output_profile(self, parameters, context)
         # List of all lucodes with trees
         lucode_list = [7, 9, 17, 19, 21, 23, 26, 29, 32, 38, 43, 44, 46, 48, 53, 57, 62, 69, 70, 74, 82, 83, 84, 85, 86, 87]
-        # Collect species and number of plants
-        esempl1 = self.parameterAsInt(parameters, self.ESEMPL1, context)
-        specie1 = self.parameterAsInt(parameters, self.SPECIE1, context)
-        esempl2 = self.parameterAsInt(parameters, self.ESEMPL2, context)
-        specie2 = self.parameterAsInt(parameters, self.SPECIE2, context)
-        esempl3 = self.parameterAsInt(parameters, self.ESEMPL3, context)
-        specie3 = self.parameterAsInt(parameters, self.SPECIE3, context)
-        esempl4 = self.parameterAsInt(parameters, self.ESEMPL4, context)
-        specie4 = self.parameterAsInt(parameters, self.SPECIE4, context)
-        esempl5 = self.parameterAsInt(parameters, self.ESEMPL5, context)
-        specie5 = self.parameterAsInt(parameters, self.SPECIE5, context)
+        # Collect species and number of plants, from the species parameters and from the species table
+        n_species, unknown_species = species_counts(self, parameters, context, self.SPECIES_SLOTS)
+        if unknown_species:
+            feedback.pushInfo(self.tr('Specie non riconosciute nella tabella specie (righe): %s') % unknown_species)
         # Conc pm10
         concpm10 = self.parameterAsDouble(parameters, self.CONCPM10, context)
         Vd = 0.064
-        # Load lucode raster
-        lucode_raster = self.parameterAsRasterLayer(parameters, self.INPUT, context)
-        lucode_data_source = gdal.Open(lucode_raster.dataProvider().dataSourceUri())
-        arr_lucode = lucode_data_source.GetRasterBand(1).ReadAsArray()
-        [rows, cols] = arr_lucode.shape
-
         # Output parameters
         stati_list = ['Presente', 'Futuro']
         path_output = self.parameterAsString(parameters, self.OUTPUT, context)
-        stato = stati_list[self.parameterAsInt(parameters, self.STATO, context)]
-        driver = gdal.GetDriverByName("GTiff")
-        arr_ozono = np.zeros((rows, cols))
-        arr_q = np.zeros((rows, cols))
+        # Present and future states are computed in one call with 'Entrambi gli stati'
+        states = phase_states(self, parameters, context, self.STATO, self.INPUT)
+        write_delta = len(states) > 1 and self.parameterAsBool(parameters, DELTA, context)
 
         area_pixel = self.parameterAsInt(parameters, self.PIXEL_RES, context) * self.parameterAsInt(
             parameters, self.PIXEL_RES, context)
 
-        if (esempl1 > 0):
-            arr_lucode_list = np.zeros((rows, cols))
-            n_pixel_lucode = 0
-            for lucode in np.unique(arr_lucode):
-                if lucode in lucode_list:
-                    n_pixel_lucode += np.sum(np.where(arr_lucode == lucode))
-                    arr_lucode_list[np.where(arr_lucode == lucode)] = 1
-            # Initialize dicionary of c sequestration per species
-            ozono_species = {}
-            ozono_species['Abete (Picea abies, glauca, omorika, orientalis, pungens)'] = 131.01
-            ozono_species['Acero seconda grandezza (Acer campestre, cappadocicum, pseudoplatanus, platanoides, platanoides Schwedleri, platanoides Crimson King, rubrum, saccharinum)'] = 89,10
-            ozono_species['Acero terza grandezza (Acer negundo, opalus,palmatum, palmatum v. dissectum, x freemanii)'] = 82.33
-            ozono_species['Bagolaro (Celtis australis, occidentalis)'] = 207.25
-            ozono_species['Carpino (Carpinus betulus, betulus fastigiata,Ostrya carpinifolia)'] = 56.98
-            ozono_species['Cedro (Cedrus atlantica, atlantica v. glauca, deodara, libani)'] = 206.24
-            ozono_species['Ciliegio da fiore (Prunus cerasifera, domestica, fruticosa, Kanzan,pissardii, serrulata, subhirtella)'] = 23.76
-            ozono_species['Frassino (Fraxinus americana, excelsior, excelsior Pendula)'] = 100.70
-            ozono_species['Ippocastano (Aesculus hippocastanum, pavia)'] = 115.94
-            ozono_species['Olmo  (Ulmus laevis, minor,parvifolia,pumila)'] = 116.61
-            ozono_species['Pino (Pinus halepensis, nigra, pinea, strobus, sylvestris, wallichiana)'] = 90.25
-            ozono_species['Pioppo (Populus alba,canescens, nigra, nigra var. italica, tremula, x canadensis)'] = 85.20
-            ozono_species['Platano (Platanus orientalis, occidentalis, hybrida)'] = 209.79
-            ozono_species['Quercia (Quercus coccinea, ilex, petraea, pubescens, robur, robur Fastigiata, rubra)'] = 89.54
-            ozono_species['Tiglio (Tilia cordata, cordata Greenspire, platyphyllos, x europaea)'] = 122.20
-
+        # The tables are parsed once and shared by the states
+        tree_table = None
+        if np.sum(n_species) > 0:
+            # Pixels of the lucodes that accept trees
+            tree_table = LucodeTable(dict.fromkeys(lucode_list, 1))
             # Calculate total carbon sequestration
-            ozono = (ozono_species[all_species[specie1]] * esempl1 +\
-                ozono_species[all_species[specie2]] * esempl2 +\
-                ozono_species[all_species[specie3]] * esempl3 + \
-                ozono_species[all_species[specie4]] * esempl4 +\
-                ozono_species[all_species[specie5]] * esempl5) / 10e6
-
-            # Sequestration per mq
-            ozono_area = ozono / (n_pixel_lucode)
-            arr_ozono = arr_lucode_list * ozono_area
-
-            # Initialize dicionary of c sequestration per species
-            lai_species = {}
-            lai_species['Abete (Picea abies, glauca, omorika, orientalis, pungens)'] = 7.73
-            lai_species[
-                'Acero seconda grandezza (Acer campestre, cappadocicum, pseudoplatanus, platanoides, platanoides Schwedleri, platanoides Crimson King, rubrum, saccharinum)'] = 5, 41
-            lai_species['Acero terza grandezza (Acer negundo, opalus,palmatum, palmatum v. dissectum, x freemanii)'] = 4.48
-            lai_species['Bagolaro (Celtis australis, occidentalis)'] = 7.52
-            lai_species['Carpino (Carpinus betulus, betulus fastigiata,Ostrya carpinifolia)'] = 4.71
-            lai_species['Cedro (Cedrus atlantica, atlantica v. glauca, deodara, libani)'] = 8.25
-            lai_species[
-                'Ciliegio da fiore (Prunus cerasifera, domestica, fruticosa, Kanzan,pissardii, serrulata, subhirtella)'] = 3.9
-            lai_species['Frassino (Fraxinus americana, excelsior, excelsior Pendula)'] = 4.54
-            lai_species['Ippocastano (Aesculus hippocastanum, pavia)'] = 6.13
-            lai_species['Olmo  (Ulmus laevis, minor,parvifolia,pumila)'] = 6.66
-            lai_species['Pino (Pinus halepensis, nigra, pinea, strobus, sylvestris, wallichiana)'] = 5.24
-            lai_species['Pioppo (Populus alba,canescens, nigra, nigra var. italica, tremula, x canadensis)'] = 4.61
-            lai_species['Platano (Platanus orientalis, occidentalis, hybrida)'] = 6.38
-            lai_species['Quercia (Quercus coccinea, ilex, petraea, pubescens, robur, robur Fastigiata, rubra)'] = 0.44
-            lai_species['Tiglio (Tilia cordata, cordata Greenspire, platyphyllos, x europaea)'] = 6.41
-
-            # Initialize dicionary of c sequestration per species
-            T_species = {}
-            T_species['Abete (Picea abies, glauca, omorika, orientalis, pungens)'] = 365
-            T_species[
-                'Acero seconda grandezza (Acer campestre, cappadocicum, pseudoplatanus, platanoides, platanoides Schwedleri, platanoides Crimson King, rubrum, saccharinum)'] = 215
-            T_species['Acero terza grandezza (Acer negundo, opalus,palmatum, palmatum v. dissectum, x freemanii)'] = 215
-            T_species['Bagolaro (Celtis australis, occidentalis)'] = 215
-            T_species['Carpino (Carpinus betulus, betulus fastigiata,Ostrya carpinifolia)'] = 215
-            T_species['Cedro (Cedrus atlantica, atlantica v. glauca, deodara, libani)'] = 365
-            T_species[
-                'Ciliegio da fiore (Prunus cerasifera, domestica, fruticosa, Kanzan,pissardii, serrulata, subhirtella)'] = 265
-            T_species['Frassino (Fraxinus americana, excelsior, excelsior Pendula)'] = 215
-            T_species['Ippocastano (Aesculus hippocastanum, pavia)'] = 215
-            T_species['Olmo  (Ulmus laevis, minor,parvifolia,pumila)'] = 215
-            T_species['Pino (Pinus halepensis, nigra, pinea, strobus, sylvestris, wallichiana)'] = 365
-            T_species['Pioppo (Populus alba,canescens, nigra, nigra var. italica, tremula, x canadensis)'] = 215
-            T_species['Platano (Platanus orientalis, occidentalis, hybrida)'] = 215
-            T_species['Quercia (Quercus coccinea, ilex, petraea, pubescens, robur, robur Fastigiata, rubra)'] = 215
-            T_species['Tiglio (Tilia cordata, cordata Greenspire, platyphyllos, x europaea)'] = 215
+            ozono = CATALOGUE.total('ozono', n_species) / 10e6
 
             # Calculate total pm10 sequestration
-            q_tot = concpm10 * Vd * (T_species[all_species[specie1]] * lai_species[all_species[specie1]] * esempl1 + \
-                                 T_species[all_species[specie2]] * lai_species[all_species[specie2]] * esempl2 + \
-                                 T_species[all_species[specie3]] * lai_species[all_species[specie3]] * esempl3 + \
-                                 T_species[all_species[specie4]] * lai_species[all_species[specie4]] * esempl4 + \
-                                 T_species[all_species[specie5]] * lai_species[all_species[specie5]] * esempl5)
-            # Calculate total pm10 sequestration
-            q_area = q_tot / n_pixel_lucode
-            arr_q = arr_lucode_list * q_area
+            q_tot = concpm10 * Vd * np.dot(n_species,
+                                           CATALOGUE.coefficients['leaf_days'] * CATALOGUE.coefficients['lai'])
         else:
             ozono_lucode = {}
             ozono_lucode[1] = 0
@@ -679,29 +625,18 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
             lai_lucode[85] = 0.88
             lai_lucode[86] = 0.88
             lai_lucode[87] = 0.88
-            for lucode in np.unique(arr_lucode):
+            ozono_pixel = {}
+            q_pixel = {}
+            for lucode in ozono_lucode.keys():
                 try:
-                    arr_ozono[np.where(arr_lucode == lucode)] = (ozono_lucode[lucode] * area_pixel) / 1e6 * 1000
-                    arr_q[np.where(arr_lucode == lucode)] = (concpm10 * Vd * (
+                    q_pixel[lucode] = (concpm10 * Vd * (
                             T_lucode[lucode] * lai_lucode[lucode] * area_pixel * 0.5))/1e12 * 1000
-                except:
+                    ozono_pixel[lucode] = (ozono_lucode[lucode] * area_pixel) / 1e6 * 1000
+                except KeyError:
                     pass
+            ozono_table = LucodeTable(ozono_pixel)
+            q_table = LucodeTable(q_pixel)
 
-        # Initialize and write on output raster
-        file_output = path_output + '/02_concentrazione_Ozono_' + stato + '_kg.tiff'
-        outdata_ozono = driver.Create(file_output, cols, rows, 1, gdal.GDT_Float64)
-        outdata_ozono.SetGeoTransform(lucode_data_source.GetGeoTransform())  ##sets same geotransform as input
-        outdata_ozono.SetProjection(lucode_data_source.GetProjection())  ##sets same projection as input
-        outdata_ozono.GetRasterBand(1).WriteArray(arr_ozono)
-        outdata_ozono.FlushCache()
-
-        # Initialize and write on output raster
-        file_output = path_output + '/02_concentrazione_PM10_' + stato + '_kg.tiff'
-        outdata_pm10 = driver.Create(file_output, cols, rows, 1, gdal.GDT_Float64)
-        outdata_pm10.SetGeoTransform(lucode_data_source.GetGeoTransform())  ##sets same geotransform as input
-        outdata_pm10.SetProjection(lucode_data_source.GetProjection())  ##sets same projection as input
-        outdata_pm10.GetRasterBand(1).WriteArray(arr_q)
-        outdata_pm10.FlushCache()
         # Define alpha beta coefficient for each lucode
         alpha = {}
         beta = {}
@@ -797,17 +732,63 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         concno2 = self.parameterAsDouble(parameters, self.CONCNO2, context)
         # Wind speed input value
         vel = self.parameterAsDouble(parameters, self.VEL, context)
-        arr_F = np.zeros((rows, cols))
+        F_lucode = {}
         for lucode in alpha.keys():
-            arr_F[np.where(arr_lucode == lucode)] = ((alpha[lucode] + beta[lucode] * vel) * concno2 * 0.365) / 1e4 * 1000
-        # Initialize and write on output raster
-        file_output = path_output + '/02_concentrazione_NO2_' + stato + '_kg.tiff'
-        outdata_no2 = driver.Create(file_output, cols, rows, 1, gdal.GDT_Float64)
-        outdata_no2.SetGeoTransform(lucode_data_source.GetGeoTransform())##sets same geotransform as input
-        outdata_no2.SetProjection(lucode_data_source.GetProjection())##sets same projection as input
-        outdata_no2.GetRasterBand(1).WriteArray(arr_F)
-        outdata_no2.FlushCache()
-        return {self.OUTPUT: 'Completed'}
+            F_lucode[lucode] = ((alpha[lucode] + beta[lucode] * vel) * concno2 * 0.365) / 1e4 * 1000
+        F_table = LucodeTable(F_lucode)
+
+        # Without saving, the rasters are kept in memory for the SE algorithms run in the same process
+        save_intermediates = self.parameterAsBool(parameters, self.SALVA_INTERMEDI, context)
+        if not save_intermediates:
+            profile = profile.for_memory()
+        # Output name, file name and present raster of every pollutant
+        pollutants = [(self.OZONO, 'Ozono'), (self.PM10, 'PM10'), (self.NO2, 'NO2')]
+        arr_present = {}
+        results = {self.OUTPUT: 'Completed'}
+        for phase, lucode_uri in states:
+            stato = stati_list[phase]
+            # Load lucode raster
+            lucode_data_source = gdal.Open(lucode_uri)
+            arr_lucode = lucode_data_source.GetRasterBand(1).ReadAsArray()
+            if tree_table is not None:
+                idx_tree = tree_table.indices(arr_lucode)
+                arr_lucode_list = tree_table.take(idx_tree)
+                n_pixel_lucode = np.count_nonzero(tree_table.known_mask(idx_tree))
+                # Sequestration per mq
+                if n_pixel_lucode != 0:
+                    ozono_area = ozono / n_pixel_lucode
+                    q_area = q_tot / n_pixel_lucode
+                else:
+                    ozono_area = 0
+                    q_area = 0
+                arr_ozono = arr_lucode_list * ozono_area
+                arr_q = arr_lucode_list * q_area
+            else:
+                idx_lucode = ozono_table.indices(arr_lucode)
+                arr_ozono = ozono_table.take(idx_lucode)
+                arr_q = q_table.take(idx_lucode)
+                unknown_lucode = ozono_table.unknown(arr_lucode, idx_lucode)
+                if unknown_lucode:
+                    feedback.pushInfo(self.tr('LUCODE non riconosciuti (%s): %s') % (stato, describe_unknown(unknown_lucode)))
+            arr_F = F_table.map(arr_lucode)[0]
+            # Initialize and write on output raster
+            for (output_name, pollutant), arr in zip(pollutants, [arr_ozono, arr_q, arr_F]):
+                file_output = intermediate_path(
+                    path_output, '02_concentrazione_' + pollutant + '_' + stato + '_kg.tiff', save_intermediates)
+                write_raster(file_output, arr, lucode_data_source, profile)
+                results[output_name + '_FUTURO' if len(states) > 1 and phase == 1 else output_name] = file_output
+                if not write_delta:
+                    continue
+                if phase == 0:
+                    arr_present[pollutant] = arr
+                elif arr.shape != arr_present[pollutant].shape:
+                    raise QgsProcessingException(self.tr('I raster Uso suolo dei due stati devono avere la stessa dimensione'))
+                else:
+                    file_delta = intermediate_path(
+                        path_output, '02_concentrazione_' + pollutant + '_delta_kg.tiff', save_intermediates)
+                    write_raster(file_delta, arr - arr_present[pollutant], lucode_data_source, profile)
+                    results[output_name + '_DELTA'] = file_delta
+        return results
 
         
         # -----------------------------------------------------------------------------------  
@@ -23,12 +23,26 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterNumber,
                        QgsProcessingParameterField,
                        QgsProcessingParameterRasterLayer,
-                       QgsProcessingParameterFolderDestination)
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterFolderDestination,
+                       QgsProcessingOutputRasterLayer)
 from qgis import processing
 import pandas as pd
 import gdal
 import numpy as np
 import os
+import sys
+
+# The se_torino package is kept in the same folder as the scripts
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+from se_torino.raster import intermediate_path, write_raster
+from se_torino.parameters import (DELTA, add_both_phases_parameters, add_output_profile_parameters,
+                                  add_species_table_parameter, output_profile, phase_states, species_counts)
+from se_torino.species import CATALOGUE
+from se_torino.lookup import LucodeTable, describe_unknown
+from se_torino.kernels.infiltrazione import interception
 
 class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     """
@@ -49,6 +63,8 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     # calling from the QGIS console.
 
     INPUT = 'INPUT'
+    LAI = 'LAI'
+    LAI_FUTURO = 'LAI_FUTURO'
     CONC='CONC'
     PIXEL_RES = 'PIXEL_RES'
     SPECIE1 = 'SPECIE1'
@@ -61,8 +77,14 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     ESEMPL4 = 'ESEMPL4'    
     SPECIE5 = 'SPECIE5'
     ESEMPL5 = 'ESEMPL5'
+    SPECIES_SLOTS = [(SPECIE1, ESEMPL1), (SPECIE2, ESEMPL2), (SPECIE3, ESEMPL3), (SPECIE4, ESEMPL4),
+                     (SPECIE5, ESEMPL5)]
     FASE = 'FASE'
     OUTPUT = 'OUTPUT'
+    SALVA_INTERMEDI = 'SALVA_INTERMEDI'
+    INFILTRAZIONE = 'INFILTRAZIONE'
+    INFILTRAZIONE_FUTURO = 'INFILTRAZIONE_FUTURO'
+    INFILTRAZIONE_DELTA = 'INFILTRAZIONE_DELTA'
 
     def tr(self, string):
         """
@@ -113,7 +135,10 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         should provide a basic description about what the algorithm does and the
         parameters and outputs associated with it..
         """
-        return self.tr("Calcolo Infiltrazione")
+        return self.tr("Calcolo Infiltrazione. Con il raster LAI l'intercettazione della chioma è calcolata "
+                       "pixel per pixel e sostituisce le specie; dove il LAI manca (nodata) si usano i valori dei LUCODE. "
+                       "Il raster LAI descrive lo stato calcolato; con entrambi gli stati vale per lo stato attuale e "
+                       "lo stato di progetto usa il raster LAI Stato di progetto, se dato, altrimenti specie e LUCODE")
 
     def initAlgorithm(self, config=None):
         """
@@ -123,11 +148,8 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
 
         # We add the input vector features source. It can have any kind of
         # geometry.
-        all_species = ['Abete (Picea abies, glauca, omorika, orientalis, pungens)', 'Acero seconda grandezza (Acer campestre, cappadocicum, pseudoplatanus, platanoides, platanoides Schwedleri, platanoides Crimson King, rubrum, saccharinum)', 'Acero terza grandezza (Acer negundo, opalus,palmatum, palmatum v. dissectum, x freemanii)', 'Bagolaro (Celtis australis, occidentalis)',
-                       'Carpino (Carpinus betulus, betulus fastigiata,Ostrya carpinifolia)', 'Cedro (Cedrus atlantica, atlantica v. glauca, deodara, libani)', 'Ciliegio da fiore (Prunus cerasifera, domestica, fruticosa, Kanzan,pissardii, serrulata, subhirtella)', 'Frassino (Fraxinus americana, excelsior, excelsior Pendula)',
-                       'Ippocastano (Aesculus hippocastanum, pavia)', 'Olmo  (Ulmus laevis, minor,parvifolia,pumila)', 'Pino (Pinus halepensis, nigra, pinea, strobus, sylvestris, wallichiana)', 'Pioppo (Populus alba,canescens, nigra, nigra var. italica, tremula, x canadensis)',
-                       'Platano (Platanus orientalis, occidentalis, hybrida)', 'Quercia (Quercus coccinea, ilex, petraea, pubescens, robur, robur Fastigiata, rubra)', 'Tiglio (Tilia cordata, cordata Greenspire, platyphyllos, x europaea)']
-        fasi = ['Stato attuale', 'Stato di progetto']
+        all_species = CATALOGUE.names
+        fasi = ['Stato attuale', 'Stato di progetto', 'Entrambi gli stati']
         self.addParameter(
             QgsProcessingParameterRasterLayer(
                 self.INPUT,
@@ -136,6 +158,24 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.LAI,
+                self.tr('Raster LAI della chioma (opzionale, stessa griglia del raster Uso suolo)'),
+                [QgsProcessing.TypeRaster],
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.LAI_FUTURO,
+                self.tr('Raster LAI della chioma Stato di progetto (solo per entrambi gli stati, stessa griglia)'),
+                [QgsProcessing.TypeRaster],
+                optional=True
+            )
+        )
+
         double_param = QgsProcessingParameterNumber(
             self.CONC,
             self.tr('Totale cumulato delle precipitazioni [mm]'),
@@ -245,6 +285,14 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
                 )
                 )
 
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+            self.SALVA_INTERMEDI,
+            self.tr('Salva i raster intermedi su disco'),
+            defaultValue=True
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterFolderDestination(
                 self.OUTPUT,
@@ -252,281 +300,289 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        add_species_table_parameter(self)
+
+        add_both_phases_parameters(self)
+
+        add_output_profile_parameters(self)
+        self.addOutput(QgsProcessingOutputRasterLayer(self.INFILTRAZIONE, self.tr('Raster infiltrazione')))
+        self.addOutput(QgsProcessingOutputRasterLayer(self.INFILTRAZIONE_FUTURO,
+                                                      self.tr('Raster infiltrazione stato di progetto')))
+        self.addOutput(QgsProcessingOutputRasterLayer(self.INFILTRAZIONE_DELTA,
+                                                      self.tr('Raster differenza infiltrazione')))
+
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """
-        # List of all species
-        all_species = ['Abete (Picea abies, glauca, omorika, orientalis, pungens)',
-                       'Acero seconda grandezza (Acer campestre, cappadocicum, pseudoplatanus, platanoides, platanoides Schwedleri, platanoides Crimson King, rubrum, saccharinum)',
-                       'Acero terza grandezza (Acer negundo, opalus,palmatum, palmatum v. dissectum, x freemanii)',
-                       'Bagolaro (Celtis australis, occidentalis)',
-                       'Carpino (Carpinus betulus, betulus fastigiata,Ostrya carpinifolia)',
-                       'Cedro (Cedrus atlantica, atlantica v. glauca, deodara, libani)',
-                       'Ciliegio da fiore (Prunus cerasifera, domestica, fruticosa, Kanzan,pissardii, serrulata, subhirtella)',
-                       'Frassino (Fraxinus americana, excelsior, excelsior Pendula)',
-                       'Ippocastano (Aesculus hippocastanum, pavia)', 'Olmo  (Ulmus laevis, minor,parvifolia,pumila)',
-                       'Pino (Pinus halepensis, nigra, pinea, strobus, sylvestris, wallichiana)',
-                       'Pioppo (Populus alba,canescens, nigra, nigra var. italica, tremula, x canadensis)',
-                       'Platano (Platanus orientalis, occidentalis, hybrida)',
-                       'Quercia (Quercus coccinea, ilex, petraea, pubescens, robur, robur Fastigiata, rubra)',
-                       'Tiglio (Tilia cordata, cordata Greenspire, platyphyllos, x europaea)']
-        # Initialize dicionary of c sequestration per species
-        lai_species = {}
-        lai_species['Abete (Picea abies, glauca, omorika, orientalis, pungens)'] = 0.18
-        lai_species[
-            'Acero seconda grandezza (Acer campestre, cappadocicum, pseudoplatanus, platanoides, platanoides Schwedleri, platanoides Crimson King, rubrum, saccharinum)'] = 0, 41
-        lai_species['Acero terza grandezza (Acer negundo, opalus,palmatum, palmatum v. dissectum, x freemanii)'] = 0.34
-        lai_species['Bagolaro (Celtis australis, occidentalis)'] = 0.75
-        lai_species['Carpino (Carpinus betulus, betulus fastigiata,Ostrya carpinifolia)'] = 0.38
-        lai_species['Cedro (Cedrus atlantica, atlantica v. glauca, deodara, libani)'] = 0.39
-        lai_species[
-            'Ciliegio da fiore (Prunus cerasifera, domestica, fruticosa, Kanzan,pissardii, serrulata, subhirtella)'] = 0.2
-        lai_species['Frassino (Fraxinus americana, excelsior, excelsior Pendula)'] = 0.35
-        lai_species['Ippocastano (Aesculus hippocastanum, pavia)'] = 0.44
-        lai_species['Olmo  (Ulmus laevis, minor,parvifolia,pumila)'] = 0.48
-        lai_species['Pino (Pinus halepensis, nigra, pinea, strobus, sylvestris, wallichiana)'] = 0.31
-        lai_species['Pioppo (Populus alba,canescens, nigra, nigra var. italica, tremula, x canadensis)'] = 0.67
-        lai_species['Platano (Platanus orientalis, occidentalis, hybrida)'] = 0.7
-        lai_species['Quercia (Quercus coccinea, ilex, petraea, pubescens, robur, robur Fastigiata, rubra)'] = 0.44
-        lai_species['Tiglio (Tilia cordata, cordata Greenspire, platyphyllos, x europaea)'] = 0.28
-
-        # Collect species and number of plants
-        esempl1 = self.parameterAsInt(parameters, self.ESEMPL1, context)
-        specie1 = all_species[self.parameterAsInt(parameters, self.SPECIE1, context)]
-        esempl2 = self.parameterAsInt(parameters, self.ESEMPL2, context)
-        specie2 = all_species[self.parameterAsInt(parameters, self.SPECIE2, context)]
-        esempl3 = self.parameterAsInt(parameters, self.ESEMPL3, context)
-        specie3 = all_species[self.parameterAsInt(parameters, self.SPECIE3, context)]
-        esempl4 = self.parameterAsInt(parameters, self.ESEMPL4, context)
-        specie4 = all_species[self.parameterAsInt(parameters, self.SPECIE4, context)]
-        esempl5 = self.parameterAsInt(parameters, self.ESEMPL5, context)
-        specie5 = all_species[self.parameterAsInt(parameters, self.SPECIE5, context)]
+
+        # Output raster format
+        profile = output_profile(self, parameters, context)
+
+        # Collect species and number of plants, from the species parameters and from the species table
+        n_species, unknown_species = species_counts(self, parameters, context, self.SPECIES_SLOTS)
+        if unknown_species:
+            feedback.pushInfo(self.tr('Specie non riconosciute nella tabella specie (righe): %s') % unknown_species)
         conc = self.parameterAsDouble(parameters, self.CONC, context)
-        # Load present raster
-        lucode_raster = self.parameterAsRasterLayer(parameters, self.INPUT, context)
-        lucode = gdal.Open(lucode_raster.dataProvider().dataSourceUri())
-        arr_lucode = lucode.GetRasterBand(1).ReadAsArray()
-        [rows, cols] = arr_lucode.shape
 
-        arr_R = np.zeros((rows, cols))
         R = {}
-        R[1] = 27.60400151
-        R[2] = 27.65534109
-        R[3] = 27.83315114
-        R[4] = 18.55834169
-        R[5] = 19.51634168
-        R[6] = 10.21394173
-        R[7] = 36.28438303
-        R[8] = 48.82785829
-        R[9] = 15.97138114
-        R[10] = 14.51422075
-        R[11] = 48.72852875
-        R[12] = 28.895582
-        R[13] = 48.51622416
-        R[14] = 27.37849683
-        R[15] = 49.36813124
-        R[16] = 27.96605852
-        R[17] = 14.11070066
-        R[18] = 48.66588942
-        R[19] = 36.22383741
-        R[20] = 41.17580981
-        R[21] = 15.40753778
-        R[22] = 15.48867479
-        R[23] = 29.70774627
-        R[24] = 29.42066395
-        R[25] = 48.13092135
-        R[26] = 17.76264172
-        R[27] = 18.11290607
-        R[28] = 1.64163875
-        R[29] = 19.36504103
-        R[30] = 20.1104968
-        R[31] = 0.30421411
-        R[32] = 25.66532488
-        R[33] = 26.12120455
-        R[34] = 20.76559967
-        R[35] = 34.38456041
-        R[36] = 22.09414157
-        R[37] = 14.95357739
-        R[38] = 32.49942893
-        R[39] = 32.05539278
-        R[40] = 26.35653383
-        R[41] = 27.56389486
-        R[42] = 24.82414581
-        R[43] = 33.12276817
-        R[44] = 49.44629515
-        R[45] = 0.14467594
-        R[46] = 49.36724941
-        R[47] = 49.02557087
-        R[48] = 33.66124269
-        R[49] = 33.64659491
-        R[50] = 49.19989099
-        R[51] = 48.84244489
-        R[52] = 48.15353889
-        R[53] = 33.81907603
-        R[54] = 33.28475863
-        R[55] = 48.5761149
-        R[56] = 47.62077389
-        R[57] = 19.94862889
-        R[58] = 21.64782865
-        R[59] = 27.17783869
-        R[60] = 47.79304172
-        R[61] = 9.67848073
-        R[62] = 12.39895263
-        R[63] = 11.01411266
-        R[64] = 22.11736761
-        R[65] = 18.29311943
-        R[66] = 44.99975679
-        R[67] = 49.1108194
-        R[68] = 8.11029308
-        R[69] = 9.2286522
-        R[70] = 11.40581743
-        R[71] = 32.50563592
-        R[72] = 49.19309454
-        R[73] = 28.18575417
-        R[74] = 28.25313891
-        R[75] = 23.66870937
-        R[76] = 28.21083467
-        R[77] = 48.10130333
-        R[78] = 0.12401461
-        R[79] = 33.2333038
-        R[80] = 34.07063753
-        R[81] = 34.0654219
-        R[82] = 13.07725357
-        R[83] = 10.47765199
-        R[84] = 11.55907612
-        R[85] = 14.80240343
-        R[86] = 14.46532371
+        R[1] = 27.60400151
+        R[2] = 27.65534109
+        R[3] = 27.83315114
+        R[4] = 18.55834169
+        R[5] = 19.51634168
+        R[6] = 10.21394173
+        R[7] = 36.28438303
+        R[8] = 48.82785829
+        R[9] = 15.97138114
+        R[10] = 14.51422075
+        R[11] = 48.72852875
+        R[12] = 28.895582
+        R[13] = 48.51622416
+        R[14] = 27.37849683
+        R[15] = 49.36813124
+        R[16] = 27.96605852
+        R[17] = 14.11070066
+        R[18] = 48.66588942
+        R[19] = 36.22383741
+        R[20] = 41.17580981
+        R[21] = 15.40753778
+        R[22] = 15.48867479
+        R[23] = 29.70774627
+        R[24] = 29.42066395
+        R[25] = 48.13092135
+        R[26] = 17.76264172
+        R[27] = 18.11290607
+        R[28] = 1.64163875
+        R[29] = 19.36504103
+        R[30] = 20.1104968
+        R[31] = 0.30421411
+        R[32] = 25.66532488
+        R[33] = 26.12120455
+        R[34] = 20.76559967
+        R[35] = 34.38456041
+        R[36] = 22.09414157
+        R[37] = 14.95357739
+        R[38] = 32.49942893
+        R[39] = 32.05539278
+        R[40] = 26.35653383
+        R[41] = 27.56389486
+        R[42] = 24.82414581
+        R[43] = 33.12276817
+        R[44] = 49.44629515
+        R[45] = 0.14467594
+        R[46] = 49.36724941
+        R[47] = 49.02557087
+        R[48] = 33.66124269
+        R[49] = 33.64659491
+        R[50] = 49.19989099
+        R[51] = 48.84244489
+        R[52] = 48.15353889
+        R[53] = 33.81907603
+        R[54] = 33.28475863
+        R[55] = 48.5761149
+        R[56] = 47.62077389
+        R[57] = 19.94862889
+        R[58] = 21.64782865
+        R[59] = 27.17783869
+        R[60] = 47.79304172
+        R[61] = 9.67848073
+        R[62] = 12.39895263
+        R[63] = 11.01411266
+        R[64] = 22.11736761
+        R[65] = 18.29311943
+        R[66] = 44.99975679
+        R[67] = 49.1108194
+        R[68] = 8.11029308
+        R[69] = 9.2286522
+        R[70] = 11.40581743
+        R[71] = 32.50563592
+        R[72] = 49.19309454
+        R[73] = 28.18575417
+        R[74] = 28.25313891
+        R[75] = 23.66870937
+        R[76] = 28.21083467
+        R[77] = 48.10130333
+        R[78] = 0.12401461
+        R[79] = 33.2333038
+        R[80] = 34.07063753
+        R[81] = 34.0654219
+        R[82] = 13.07725357
+        R[83] = 10.47765199
+        R[84] = 11.55907612
+        R[85] = 14.80240343
+        R[86] = 14.46532371
         R[87] = 15.27980652
 
         area_pixel = self.parameterAsInt(parameters, self.PIXEL_RES, context) * self.parameterAsInt(
             parameters, self.PIXEL_RES, context)
 
-        for lucode_key in R.keys():
-            arr_R[np.where(arr_lucode == lucode_key)] = R[lucode_key]
-        runoff_total = np.sum(arr_R)
-        if (esempl1 > 0):
-            list_species = [specie1, specie2, specie3, specie4, specie5]
-            list_esempl = [esempl1, esempl2, esempl3, esempl4, esempl5]
-            Sv = 0
-            for specie_id, specie in enumerate(list_species):
-                Smax = 0.935 + 0.498 * lai_species[specie] * list_esempl[specie_id] - \
-                       0.00575 * lai_species[specie] * list_esempl[specie_id]
-                nu = 0.046 * lai_species[specie] * list_esempl[specie_id]
-                print('Smax', Smax)
-                Sv += Smax * (1 - np.exp(-nu * (conc / Smax)))
-        else:
-            lai_lucode = {}
-            lai_lucode[1] = 0
-            lai_lucode[2] = 0
-            lai_lucode[3] = 0
-            lai_lucode[4] = 0
-            lai_lucode[5] = 0
-            lai_lucode[6] = 0
-            lai_lucode[7] = 0.21
-            lai_lucode[8] = 0
-            lai_lucode[9] = 0.08
-            lai_lucode[10] = 0
-            lai_lucode[11] = 0
-            lai_lucode[12] = 0
-            lai_lucode[13] = 0
-            lai_lucode[14] = 0
-            lai_lucode[15] = 0
-            lai_lucode[16] = 0
-            lai_lucode[17] = 0.39
-            lai_lucode[18] = 0
-            lai_lucode[19] = 0.02
-            lai_lucode[20] = 0
-            lai_lucode[21] = 0.88
-            lai_lucode[22] = 0
-            lai_lucode[23] = 0.02
-            lai_lucode[24] = 0
-            lai_lucode[25] = 0
-            lai_lucode[26] = 0.02
-            lai_lucode[27] = 0
-            lai_lucode[28] = 0
-            lai_lucode[29] = 0.02
-            lai_lucode[30] = 0
-            lai_lucode[31] = 0
-            lai_lucode[32] = 0.02
-            lai_lucode[33] = 0
-            lai_lucode[34] = 0
-            lai_lucode[35] = 0
-            lai_lucode[36] = 0
-            lai_lucode[37] = 0
-            lai_lucode[38] = 0.02
-            lai_lucode[39] = 0
-            lai_lucode[40] = 0
-            lai_lucode[41] = 0
-            lai_lucode[42] = 0
-            lai_lucode[43] = 1.22
-            lai_lucode[44] = 1.22
-            lai_lucode[45] = 0
-            lai_lucode[46] = 0.53
-            lai_lucode[47] = 0
-            lai_lucode[48] = 0.53
-            lai_lucode[49] = 0
-            lai_lucode[50] = 0
-            lai_lucode[51] = 0
-            lai_lucode[52] = 0
-            lai_lucode[53] = 0.02
-            lai_lucode[54] = 0
-            lai_lucode[55] = 0
-            lai_lucode[56] = 0
-            lai_lucode[57] = 0
-            lai_lucode[58] = 0
-            lai_lucode[59] = 0
-            lai_lucode[60] = 0
-            lai_lucode[61] = 0
-            lai_lucode[62] = 0.02
-            lai_lucode[63] = 0
-            lai_lucode[64] = 0
-            lai_lucode[65] = 0
-            lai_lucode[66] = 0
-            lai_lucode[67] = 0
-            lai_lucode[68] = 0
-            lai_lucode[69] = 0.02
-            lai_lucode[70] = 0.02
-            lai_lucode[71] = 0
-            lai_lucode[72] = 0
-            lai_lucode[73] = 0
-            lai_lucode[74] = 0.02
-            lai_lucode[75] = 0
-            lai_lucode[76] = 0
-            lai_lucode[77] = 0
-            lai_lucode[78] = 0
-            lai_lucode[79] = 0
-            lai_lucode[80] = 0
-            lai_lucode[81] = 0
-            lai_lucode[82] = 0.88
-            lai_lucode[83] = 0.88
-            lai_lucode[84] = 0.88
-            lai_lucode[85] = 0.88
-            lai_lucode[86] = 0.88
-            lai_lucode[87] = 0.88
-
-            Sv = np.zeros((rows, cols))
-            for lucode_key in lai_lucode.keys():
-                Smax = 0.935 + 0.498 * lai_lucode[lucode_key] * area_pixel - \
-                       0.00575 * lai_lucode[lucode_key] * area_pixel
-                nu = 0.046 * lai_lucode[lucode_key] * area_pixel
-                Sv[np.where(arr_lucode == lucode_key)] = Smax * (1 - np.exp(-nu * (conc / Smax)))
-        I = conc - (arr_R + Sv)
-        # Initialize and write on output raster
+        # The tables are parsed once and shared by the states
+        R_table = LucodeTable(R)
+        if np.sum(n_species) > 0:
+            # Interception of the trees of every species, summed over the species
+            lai_trees = CATALOGUE.coefficients['lai_interception'] * n_species
+            Smax = 0.935 + 0.498 * lai_trees - 0.00575 * lai_trees
+            nu = 0.046 * lai_trees
+            Sv = np.sum(Smax * (1 - np.exp(-nu * (conc / Smax))))
+        # Interception of the lucodes, used without species and where the LAI raster is missing
+        lai_lucode = {}
+        lai_lucode[1] = 0
+        lai_lucode[2] = 0
+        lai_lucode[3] = 0
+        lai_lucode[4] = 0
+        lai_lucode[5] = 0
+        lai_lucode[6] = 0
+        lai_lucode[7] = 0.21
+        lai_lucode[8] = 0
+        lai_lucode[9] = 0.08
+        lai_lucode[10] = 0
+        lai_lucode[11] = 0
+        lai_lucode[12] = 0
+        lai_lucode[13] = 0
+        lai_lucode[14] = 0
+        lai_lucode[15] = 0
+        lai_lucode[16] = 0
+        lai_lucode[17] = 0.39
+        lai_lucode[18] = 0
+        lai_lucode[19] = 0.02
+        lai_lucode[20] = 0
+        lai_lucode[21] = 0.88
+        lai_lucode[22] = 0
+        lai_lucode[23] = 0.02
+        lai_lucode[24] = 0
+        lai_lucode[25] = 0
+        lai_lucode[26] = 0.02
+        lai_lucode[27] = 0
+        lai_lucode[28] = 0
+        lai_lucode[29] = 0.02
+        lai_lucode[30] = 0
+        lai_lucode[31] = 0
+        lai_lucode[32] = 0.02
+        lai_lucode[33] = 0
+        lai_lucode[34] = 0
+        lai_lucode[35] = 0
+        lai_lucode[36] = 0
+        lai_lucode[37] = 0
+        lai_lucode[38] = 0.02
+        lai_lucode[39] = 0
+        lai_lucode[40] = 0
+        lai_lucode[41] = 0
+        lai_lucode[42] = 0
+        lai_lucode[43] = 1.22
+        lai_lucode[44] = 1.22
+        lai_lucode[45] = 0
+        lai_lucode[46] = 0.53
+        lai_lucode[47] = 0
+        lai_lucode[48] = 0.53
+        lai_lucode[49] = 0
+        lai_lucode[50] = 0
+        lai_lucode[51] = 0
+        lai_lucode[52] = 0
+        lai_lucode[53] = 0.02
+        lai_lucode[54] = 0
+        lai_lucode[55] = 0
+        lai_lucode[56] = 0
+        lai_lucode[57] = 0
+        lai_lucode[58] = 0
+        lai_lucode[59] = 0
+        lai_lucode[60] = 0
+        lai_lucode[61] = 0
+        lai_lucode[62] = 0.02
+        lai_lucode[63] = 0
+        lai_lucode[64] = 0
+        lai_lucode[65] = 0
+        lai_lucode[66] = 0
+        lai_lucode[67] = 0
+        lai_lucode[68] = 0
+        lai_lucode[69] = 0.02
+        lai_lucode[70] = 0.02
+        lai_lucode[71] = 0
+        lai_lucode[72] = 0
+        lai_lucode[73] = 0
+        lai_lucode[74] = 0.02
+        lai_lucode[75] = 0
+        lai_lucode[76] = 0
+        lai_lucode[77] = 0
+        lai_lucode[78] = 0
+        lai_lucode[79] = 0
+        lai_lucode[80] = 0
+        lai_lucode[81] = 0
+        lai_lucode[82] = 0.88
+        lai_lucode[83] = 0.88
+        lai_lucode[84] = 0.88
+        lai_lucode[85] = 0.88
+        lai_lucode[86] = 0.88
+        lai_lucode[87] = 0.88
+
+        Sv_lucode = {}
+        for lucode_key in lai_lucode.keys():
+            Smax = 0.935 + 0.498 * lai_lucode[lucode_key] * area_pixel - \
+                   0.00575 * lai_lucode[lucode_key] * area_pixel
+            nu = 0.046 * lai_lucode[lucode_key] * area_pixel
+            Sv_lucode[lucode_key] = Smax * (1 - np.exp(-nu * (conc / Smax)))
+        Sv_table = LucodeTable(Sv_lucode)
         # Output parameters
         stati_list = ['presente', 'futuro']
         path_output = self.parameterAsString(parameters, self.OUTPUT, context)
-        stato = stati_list[self.parameterAsInt(parameters, self.FASE, context)]
-        driver = gdal.GetDriverByName("GTiff")
-
-        file_output = path_output + '/05_infiltrazione_' + stato + '_mm.tiff'
-        outdata = driver.Create(file_output, cols, rows, 1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(lucode.GetGeoTransform())  ##sets same geotransform as input
-        outdata.SetProjection(lucode.GetProjection())  ##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(I)
-        outdata.FlushCache()  ##saves to disk!!
-        outdata = None
-        return {self.OUTPUT: 'Completed'}
+        # Present and future states are computed in one call with 'Entrambi gli stati'
+        states = phase_states(self, parameters, context, self.FASE, self.INPUT)
+        write_delta = len(states) > 1 and self.parameterAsBool(parameters, DELTA, context)
+
+        # Without saving, the rasters are kept in memory for the SE algorithms run in the same process
+        save_intermediates = self.parameterAsBool(parameters, self.SALVA_INTERMEDI, context)
+        if not save_intermediates:
+            profile = profile.for_memory()
+        # Canopy LAI raster of each state: the LAI of the state computed, or in both states mode the present
+        # LAI and the future one, when given
+        lai_rasters = [self.parameterAsRasterLayer(parameters, self.LAI, context)]
+        if len(states) > 1:
+            lai_rasters.append(self.parameterAsRasterLayer(parameters, self.LAI_FUTURO, context))
+
+        def read_lai(lai_raster):
+            # Canopy LAI of every pixel, NaN where missing (dimensionless, measured on the pixel)
+            lai_band = gdal.Open(lai_raster.dataProvider().dataSourceUri()).GetRasterBand(1)
+            arr_lai = lai_band.ReadAsArray().astype(np.float64)
+            if lai_band.GetNoDataValue() is not None:
+                arr_lai[arr_lai == lai_band.GetNoDataValue()] = np.nan
+            return arr_lai
+
+        results = {self.OUTPUT: 'Completed'}
+        for phase, lucode_uri in states:
+            stato = stati_list[phase]
+            lai_raster = lai_rasters[phase] if len(states) > 1 else lai_rasters[0]
+            arr_lai = read_lai(lai_raster) if lai_raster is not None else None
+            lucode = gdal.Open(lucode_uri)
+            arr_lucode = lucode.GetRasterBand(1).ReadAsArray()
+            idx_lucode = R_table.indices(arr_lucode)
+            arr_R = R_table.take(idx_lucode)
+            unknown_lucode = R_table.unknown(arr_lucode, idx_lucode)
+            if unknown_lucode:
+                feedback.pushInfo(self.tr('LUCODE non riconosciuti (%s): %s') % (stato, describe_unknown(unknown_lucode)))
+            if arr_lai is not None:
+                if arr_lai.shape != arr_lucode.shape:
+                    raise QgsProcessingException(self.tr('Il raster LAI deve avere la stessa dimensione del raster Uso suolo'))
+                # Lucode table interception where the LAI is missing
+                Sv_state = interception(arr_lai, conc, 1.0, Sv_table.values, Sv_table.indices(arr_lucode))
+            elif np.sum(n_species) > 0:
+                Sv_state = Sv
+            else:
+                Sv_state = Sv_table.map(arr_lucode)[0]
+            I = conc - (arr_R + Sv_state)
+            # Initialize and write on output raster
+            file_output = intermediate_path(path_output, '05_infiltrazione_' + stato + '_mm.tiff', save_intermediates)
+            write_raster(file_output, I, lucode, profile)
+            results[self.INFILTRAZIONE_FUTURO if len(states) > 1 and phase == 1 else self.INFILTRAZIONE] = file_output
+            if write_delta:
+                if phase == 0:
+                    I_present = I
+                elif I.shape != I_present.shape:
+                    raise QgsProcessingException(self.tr('I raster Uso suolo dei due stati devono avere la stessa dimensione'))
+                else:
+                    file_delta = intermediate_path(path_output, '05_infiltrazione_delta_mm.tiff', save_intermediates)
+                    write_raster(file_delta, I - I_present, lucode, profile)
+                    results[self.INFILTRAZIONE_DELTA] = file_delta
+        return results
 
         
         # -----------------------------------------------------------------------------------  
@@ -21,12 +21,30 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterBoolean,
                        QgsProcessingParameterRasterLayer,
+                       QgsProcessingParameterVectorLayer,
                        QgsProcessingParameterFolderDestination)
 from qgis import processing
 import gdal
 import numpy as np
+import os
+import sys
 from datetime import datetime
 
+# The se_torino package is kept in the same folder as the scripts
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+from se_torino.raster import iter_windows, load_raster, raster_histogram, write_lucode_constant, write_raster
+from se_torino.parameters import add_output_profile_parameters, output_profile, vector_layer_source
+from se_torino.lookup import LucodeHistogram, describe_unknown
+from se_torino.parallel import map_states
+from se_torino.kernels import benefici
+from se_torino.kernels.benefici import BeneficiParameters
+from se_torino.kernels import accessibilita
+from se_torino.kernels.accessibilita import AccessibilitaParameters
+from se_torino.threats import layer_points, rasterize_layer
+from se_torino.kernels.popolazione import PopolazioneParameters, PopulationBlocks
+
 class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     """
     This is an example algorithm that takes a vector layer and
@@ -81,6 +99,19 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     SERF = 'SERF'
     FONF = 'FONF'
     PIXEL_RES = 'PIXEL_RES'
+    ACCESSIP = 'ACCESSIP'
+    ACCESSIF = 'ACCESSIF'
+    TEMPO_MAX = 'TEMPO_MAX'
+    # Optional point layers of the fruibility amenities, in the order of the fruibility booleans
+    AMENITIES_P = ['GIOPL', 'PIAPL', 'CANPL', 'CHIPL', 'SERPL', 'FONPL']
+    AMENITIES_F = ['GIOFL', 'PIAFL', 'CANFL', 'CHIFL', 'SERFL', 'FONFL']
+    AMENITY_NAMES = ['Area giochi', 'Piastra sportiva attrezzata', 'Area cani', 'Chiosco', 'Servizi igienici',
+                     'Fontana']
+    DISTANZA_FRUIBILITA = 'DISTANZA_FRUIBILITA'
+    POPOLAZIONE = 'POPOLAZIONE'
+    DIMENSIONE_BLOCCHI = 'DIMENSIONE_BLOCCHI'
+    DISTANZA_SERVIZIO = 'DISTANZA_SERVIZIO'
+    SOLO_REPORT = 'SOLO_REPORT'
     OUTPUT = 'OUTPUT'
 
     def tr(self, string):
@@ -397,23 +428,111 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                self.ACCESSIP,
+                self.tr('Punti di accesso Stato attuale (opzionale, sostituisce i punteggi di accessibilità dei LUCODE)'),
+                [QgsProcessing.TypeVectorPoint],
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterVectorLayer(
+                self.ACCESSIF,
+                self.tr('Punti di accesso Stato di progetto (opzionale, se assente quelli dello stato attuale)'),
+                [QgsProcessing.TypeVectorPoint],
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.TEMPO_MAX,
+            self.tr('Tempo di accesso a piedi oltre il quale l\'accessibilità è nulla (min)'),
+            QgsProcessingParameterNumber.Double,
+            15
+            )
+        )
+
+        # Amenity layers: the amenity counts on the pixels within the buffer of its points
+        for layers, state in [(self.AMENITIES_P, 'Stato attuale'), (self.AMENITIES_F, 'Stato di progetto')]:
+            for layer, amenity_name in zip(layers, self.AMENITY_NAMES):
+                self.addParameter(
+                    QgsProcessingParameterVectorLayer(
+                        layer,
+                        self.tr('Punti %s %s (opzionale, sostituisce la presenza nell\'area)') % (amenity_name, state),
+                        [QgsProcessing.TypeVectorPoint],
+                        optional=True
+                    )
+                )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.DISTANZA_FRUIBILITA,
+            self.tr('Buffer dei punti di fruibilità (m)'),
+            QgsProcessingParameterNumber.Double,
+            100
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.POPOLAZIONE,
+                self.tr('Raster Popolazione (abitanti per pixel, opzionale, stessa griglia dell\'uso suolo)'),
+                [QgsProcessing.TypeRaster],
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.DIMENSIONE_BLOCCHI,
+            self.tr('Lato dei blocchi di aggregazione della popolazione (m)'),
+            QgsProcessingParameterNumber.Double,
+            50
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.DISTANZA_SERVIZIO,
+            self.tr('Distanza a piedi entro cui le aree verdi servono la popolazione (m)'),
+            QgsProcessingParameterNumber.Double,
+            300
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+            self.SOLO_REPORT,
+            self.tr('Solo report (nessun raster in output)'),
+            defaultValue=False
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterFolderDestination(
                 self.OUTPUT,
                 self.tr('Salva nella cartella')
             )
         )
+
+        add_output_profile_parameters(self)
         
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """
-        # Load present raster
+
+        # Output raster format
+        profile = output_profile(self, parameters, context)
+        report_only = self.parameterAsBool(parameters, self.SOLO_REPORT, context)
+        # Present and future rasters
         present_raster = self.parameterAsRasterLayer(parameters, self.INPUTRP, context)
-        ds_present = gdal.Open(present_raster.dataProvider().dataSourceUri())
-        arr_present = ds_present.GetRasterBand(1).ReadAsArray()
-        # Clean negative values
-        arr_present[arr_present < 0] = 0
+        future_raster = self.parameterAsRasterLayer(parameters, self.INPUTRF, context)
+        present_uri = present_raster.dataProvider().dataSourceUri()
+        future_uri = future_raster.dataProvider().dataSourceUri()
 
         # # Load natural aspects raster
         # natural_aspects_raster = self.parameterAsRasterLayer(parameters, self.ASPNAT, context)
@@ -429,13 +548,6 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         # # Clean negative values
         # arr_urban_green[arr_urban_green < 0] = 0
 
-        # Load future raster
-        future_raster = self.parameterAsRasterLayer(parameters, self.INPUTRF, context)
-        ds_future = gdal.Open(future_raster.dataProvider().dataSourceUri())
-        arr_future = ds_future.GetRasterBand(1).ReadAsArray()
-        # Clean negative values
-        arr_future[arr_future < 0] = 0
-
         # Load natural aspects booleans present
         natural_aspects_bool_pres = []
         natural_aspects_bool_pres.append(self.parameterAsBool(parameters, self.BELP, context))
@@ -484,308 +596,175 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         fruibility_bool_fut.append(self.parameterAsBool(parameters, self.SERF, context))
         fruibility_bool_fut.append(self.parameterAsBool(parameters, self.FONF, context))
 
-        area_pixel = self.parameterAsInt(parameters, self.PIXEL_RES, context) * self.parameterAsInt(
-            parameters, self.PIXEL_RES, context)
-
-        # Scores of single lucode
-        score_lucode = {}
-        score_lucode[1] = 0.4
-        score_lucode[2] = 0.4
-        score_lucode[3] = 0.1
-        score_lucode[4] = 0.1
-        score_lucode[5] = 0.4
-        score_lucode[6] = 0.4
-        score_lucode[7] = 0.1
-        score_lucode[8] = 0
-        score_lucode[9] = 0.2
-        score_lucode[10] = 0.2
-        score_lucode[11] = 0.2
-        score_lucode[12] = 0.2
-        score_lucode[13] = 0.2
-        score_lucode[14] = 0.2
-        score_lucode[15] = 0.1
-        score_lucode[16] = 0.1
-        score_lucode[17] = 0.3
-        score_lucode[18] = 0.2
-        score_lucode[19] = 0.3
-        score_lucode[20] = 0
-        score_lucode[21] = 0.9
-        score_lucode[22] = 0.8
-        score_lucode[23] = 0.7
-        score_lucode[24] = 0.5
-        score_lucode[25] = 0.2
-        score_lucode[26] = 0.6
-        score_lucode[27] = 0.5
-        score_lucode[28] = 0.6
-        score_lucode[29] = 0.5
-        score_lucode[30] = 0.4
-        score_lucode[31] = 0.9
-        score_lucode[32] = 0
-        score_lucode[33] = 0
-        score_lucode[34] = 0.1
-        score_lucode[35] = 0
-        score_lucode[36] = 0
-        score_lucode[37] = 0.4
-        score_lucode[38] = 0.6
-        score_lucode[39] = 0.5
-        score_lucode[40] = 0.4
-        score_lucode[41] = 0.4
-        score_lucode[42] = 0.4
-        score_lucode[43] = 0.3
-        score_lucode[44] = 0.2
-        score_lucode[45] = 0.7
-        score_lucode[46] = 0
-        score_lucode[47] = 0
-        score_lucode[48] = 0.1
-        score_lucode[49] = 0.1
-        score_lucode[50] = 0
-        score_lucode[51] = 0
-        score_lucode[52] = 0
-        score_lucode[53] = 0.2
-        score_lucode[54] = 0.1
-        score_lucode[55] = 0
-        score_lucode[56] = 0.1
-        score_lucode[57] = 0.4
-        score_lucode[58] = 0.3
-        score_lucode[59] = 0.4
-        score_lucode[60] = 0
-        score_lucode[61] = 0.7
-        score_lucode[62] = 0.8
-        score_lucode[63] = 0.7
-        score_lucode[64] = 0.4
-        score_lucode[65] = 0.4
-        score_lucode[66] = 0
-        score_lucode[67] = 0
-        score_lucode[68] = 0.6
-        score_lucode[69] = 0.8
-        score_lucode[70] = 0.6
-        score_lucode[71] = 0.1
-        score_lucode[72] = 0
-        score_lucode[73] = 0.4
-        score_lucode[74] = 0.4
-        score_lucode[75] = 0.4
-        score_lucode[76] = 0.4
-        score_lucode[77] = 0
-        score_lucode[78] = 0.8
-        score_lucode[79] = 0.4
-        score_lucode[80] = 0
-        score_lucode[81] = 0
-        score_lucode[82] = 0.8
-        score_lucode[83] = 0.9
-        score_lucode[84] = 0.9
-        score_lucode[85] = 0.75
-        score_lucode[86] = 0.6
-        score_lucode[87] = 0.9
-
-        # Economic values of each lucode
-        value_lucode = {}
-        value_lucode[1] = 1.44
-        value_lucode[2] = 1.44
-        value_lucode[3] = 0
-        value_lucode[4] = 1.44
-        value_lucode[5] = 1.44
-        value_lucode[6] = 1.44
-        value_lucode[7] = 1.44
-        value_lucode[8] = 0
-        value_lucode[9] = 2.36
-        value_lucode[10] = 2.36
-        value_lucode[11] = 0
-        value_lucode[12] = 0
-        value_lucode[13] = 0
-        value_lucode[14] = 0
-        value_lucode[15] = 0
-        value_lucode[16] = 0
-        value_lucode[17] = 2.36
-        value_lucode[18] = 0
-        value_lucode[19] = 1.44
-        value_lucode[20] = 0
-        value_lucode[21] = 2.36
-        value_lucode[22] = 2.36
-        value_lucode[23] = 2.36
-        value_lucode[24] = 2.36
-        value_lucode[25] = 0
-        value_lucode[26] = 2.36
-        value_lucode[27] = 2.36
-        value_lucode[28] = 0
-        value_lucode[29] = 1.44
-        value_lucode[30] = 1.44
-        value_lucode[31] = 0
-        value_lucode[32] = 0
-        value_lucode[33] = 0
-        value_lucode[34] = 0
-        value_lucode[35] = 0
-        value_lucode[36] = 0
-        value_lucode[37] = 1.44
-        value_lucode[38] = 1.44
-        value_lucode[39] = 1.44
-        value_lucode[40] = 1.44
-        value_lucode[41] = 1.44
-        value_lucode[42] = 1.44
-        value_lucode[43] = 1.44
-        value_lucode[44] = 1.44
-        value_lucode[45] = 0
-        value_lucode[46] = 0
-        value_lucode[47] = 0
-        value_lucode[48] = 0
-        value_lucode[49] = 0
-        value_lucode[50] = 0
-        value_lucode[51] = 0
-        value_lucode[52] = 0
-        value_lucode[53] = 0
-        value_lucode[54] = 0
-        value_lucode[55] = 0
-        value_lucode[56] = 0
-        value_lucode[57] = 1.44
-        value_lucode[58] = 1.44
-        value_lucode[59] = 1.44
-        value_lucode[60] = 0
-        value_lucode[61] = 1.44
-        value_lucode[62] = 1.44
-        value_lucode[63] = 1.44
-        value_lucode[64] = 1.44
-        value_lucode[65] = 1.44
-        value_lucode[66] = 0
-        value_lucode[67] = 0
-        value_lucode[68] = 1.44
-        value_lucode[69] = 1.44
-        value_lucode[70] = 1.44
-        value_lucode[71] = 0
-        value_lucode[72] = 0
-        value_lucode[73] = 1.44
-        value_lucode[74] = 1.44
-        value_lucode[75] = 1.44
-        value_lucode[76] = 1.44
-        value_lucode[77] = 0
-        value_lucode[78] = 0
-        value_lucode[79] = 1.44
-        value_lucode[80] = 0
-        value_lucode[81] = 0
-        value_lucode[82] = 1.49
-        value_lucode[83] = 1.49
-        value_lucode[84] = 1.49
-        value_lucode[85] = 1.49
-        value_lucode[86] = 1.49
-        value_lucode[87] = 1.49
-
-        score_natural_aspects = np.array([0.9, 0.8, 0.8, 0.65, 0.7])
-
-        score_urban_green = [1, 0.9, 0.8, 0.7]
-
-        score_acc ={}
-        score_acc[11] = 0.9
-        score_acc[13] = 0.7
-        score_acc[3] = 0.7
-
-        score_fr = [0.9, 0.8, 0.7, 0.5, 0.4, 0.7]
-
-        [rows, cols] = arr_present.shape
-
-        # Compute total score natural aspects present
-        natural_aspects_norm_pres = np.sum(np.array(natural_aspects_bool_pres) * score_natural_aspects) / 2.95
-
-        # Compute total score urban green present
-        urban_green_norm_pres = np.sum(np.array(urban_green_bool_pres) * score_urban_green) / 1.7
-
-        # Compute total score fruibility present
-        fruibility_norm_pres = np.sum(np.array(fruibility_bool_pres) * score_fr) / 3.6
-
-        # Compute total score natural aspects future
-        natural_aspects_norm_fut = np.sum(np.array(natural_aspects_bool_fut) * score_natural_aspects) / 2.95
-
-        # Compute total score urban green future
-        urban_green_norm_fut = np.sum(np.array(urban_green_bool_fut) * score_urban_green) / 1.7
-
-        # Compute total score fruibility future
-        fruibility_norm_fut = np.sum(np.array(fruibility_bool_fut) * score_fr) / 3.6
-
-        # Value euro per squared meter
-        score_lucode_tot_present = 0
-        acc_score_tot = 0
-        ROS_present_array = np.zeros((rows, cols))
-        # Summing scores for each distinct lucode
-        for lucode in np.unique(arr_present):
-            try:
-                score_lucode_tot_present += score_lucode[lucode]
-                acc_score_tot += score_acc[lucode]
-                ROS_present_array[np.where(arr_present == lucode)] = 1
-            except:
-                pass
-        acc_score_tot = acc_score_tot / 2.3
-        PR_present = (score_lucode_tot_present + natural_aspects_norm_pres + urban_green_norm_pres) / 3
-        acc_fr_present = (acc_score_tot + fruibility_norm_pres) / 2
-        ROS_present = PR_present * 0.3 + (acc_fr_present * 0.7)
-        ROS_present_array = ROS_present_array * ROS_present
-        value_tot_present = 0
-        n_pixel_valid_present = 0
-        for lucode in np.unique(arr_present):
-            try:
-                area_lucode = np.sum(arr_present == lucode) * area_pixel
-                value_tot_present += area_lucode * ROS_present * value_lucode[lucode]
-                n_pixel_valid_present += np.sum(arr_present == lucode)
-            except:
-                pass
-
-        # Value euro per squared meter
-        score_lucode_tot_future = 0
-        acc_score_tot = 0
-        ROS_future_array = np.zeros((rows, cols))
-        for lucode in np.unique(arr_future):
-            try:
-                score_lucode_tot_future += score_lucode[lucode]
-                acc_score_tot += score_acc[lucode]
-                ROS_future_array[np.where(arr_future == lucode)] = 1
-            except:
-                pass
-        acc_score_tot = acc_score_tot / 2.3
-        PR_future = (score_lucode_tot_future + natural_aspects_norm_fut + urban_green_norm_fut) / 3
-        acc_fr_future = (acc_score_tot + fruibility_norm_fut) / 2
-        ROS_future = PR_future * 0.3 + (acc_fr_future * 0.7)
-        ROS_future_array = ROS_future_array * ROS_future
-        value_tot_future = 0
-        n_pixel_valid_future = 0
-        for lucode in np.unique(arr_future):
-            try:
-                area_lucode = np.sum(arr_future == lucode) * area_pixel
-                value_tot_future += area_lucode * ROS_future * value_lucode[lucode]
-                n_pixel_valid_future += np.sum(arr_future == lucode)
-            except:
-                pass
+        params_pres = BeneficiParameters(self.parameterAsInt(parameters, self.PIXEL_RES, context),
+                                         natural_aspects_bool_pres, urban_green_bool_pres, fruibility_bool_pres)
+        params_fut = BeneficiParameters(self.parameterAsInt(parameters, self.PIXEL_RES, context),
+                                        natural_aspects_bool_fut, urban_green_bool_fut, fruibility_bool_fut)
+        area_pixel = params_pres.area_pixel
+
+        # Entrance points of the two states, each state falls back to the other one
+        entrances = []
+        for layer in [self.ACCESSIP, self.ACCESSIF]:
+            vector_layer = self.parameterAsVectorLayer(parameters, layer, context)
+            entrances.append(vector_layer_source(vector_layer))
+        entrances_p = entrances[0] or entrances[1]
+        entrances_f = entrances[1] or entrances[0]
+        params_acc = AccessibilitaParameters(self.parameterAsInt(parameters, self.PIXEL_RES, context),
+                                             self.parameterAsDouble(parameters, self.TEMPO_MAX, context))
+
+        def compute_access(arr, ds, entrances_uri):
+            # Walking time from the entrance pixels over the land use friction
+            entrances_arr = rasterize_layer(entrances_uri, ds).GetRasterBand(1).ReadAsArray() > 0
+            time = accessibilita.travel_time(arr, entrances_arr, params_acc)
+            reachable = np.isfinite(time)
+            access = {
+                'time_mean': float(np.mean(time[reachable])) if np.any(reachable) else float('nan'),
+                'reachable': float(np.count_nonzero(reachable)) / time.size
+            }
+            return time, accessibilita.accessibility(time, params_acc), access
+
+        # Amenity layers of the two states, the future state falls back to the present one
+        amenities_p = []
+        amenities_f = []
+        for layer_p, layer_f in zip(self.AMENITIES_P, self.AMENITIES_F):
+            vector_layer_p = self.parameterAsVectorLayer(parameters, layer_p, context)
+            vector_layer_f = self.parameterAsVectorLayer(parameters, layer_f, context)
+            amenities_p.append(vector_layer_source(vector_layer_p))
+            amenities_f.append(vector_layer_source(vector_layer_f) if vector_layer_f is not None else amenities_p[-1])
+        fruibility_distance = self.parameterAsDouble(parameters, self.DISTANZA_FRUIBILITA, context)
+
+        def compute_fruibility(ds, shape, params, amenity_uris):
+            # Per-pixel fruibility from the distance to the nearest point of each amenity
+            points = [layer_points(uri, ds) if uri is not None else None for uri in amenity_uris]
+            return params.fruibility_pixels(shape, points, fruibility_distance)
+
+        def compute_state(state):
+            raster_uri, params, entrances_uri, amenity_uris = state
+            with_amenities = any(uri is not None for uri in amenity_uris)
+            if report_only and entrances_uri is None and not with_amenities:
+                # The report only needs the number of pixels of each lucode
+                ds, histogram = raster_histogram(raster_uri)
+                return ds, None, None, benefici.sociali_state_stats(histogram, params)
+            # Load raster
+            ds, arr = load_raster(raster_uri)
+            # Clean negative values
+            arr[arr < 0] = 0
+            if entrances_uri is None and not with_amenities:
+                stats = benefici.sociali_state_stats(LucodeHistogram(arr), params)
+                return ds, arr, benefici.sociali_state_arrays(arr, stats['ROS']), stats
+            # The accessibility and the fruibility of the area are the means over its valid pixels
+            valid = benefici.VALUE_TABLE.known_mask(benefici.VALUE_TABLE.indices(arr))
+            acc_mean = None
+            fruibility_mean = None
+            extra_arrays = {}
+            extra_stats = {}
+            if entrances_uri is not None:
+                extra_arrays['time'], acc, access = compute_access(arr, ds, entrances_uri)
+                acc_mean = float(np.mean(acc[valid])) if np.any(valid) else 0.0
+                extra_stats.update(access)
+            if with_amenities:
+                fruibility = compute_fruibility(ds, arr.shape, params, amenity_uris)
+                fruibility_mean = float(np.mean(fruibility[valid])) if np.any(valid) else 0.0
+                extra_arrays['fruibility'] = fruibility
+                extra_stats['fruibility_mean'] = fruibility_mean
+            stats = benefici.sociali_state_stats(LucodeHistogram(arr), params, acc_mean, fruibility_mean)
+            stats.update(extra_stats)
+            arrays = benefici.sociali_state_arrays(arr, stats['ROS'])
+            arrays.update(extra_arrays)
+            return ds, arr, arrays, stats
+
+        # Present and future states are independent, compute them concurrently
+        [(ds_present, arr_present, arrays_present, stats_present),
+         (ds_future, arr_future, arrays_future, stats_future)] = map_states(
+            compute_state, [(present_uri, params_pres, entrances_p, amenities_p),
+                            (future_uri, params_fut, entrances_f, amenities_f)])
+        if stats_present['unknown']:
+            feedback.pushInfo(self.tr('LUCODE non riconosciuti nello stato attuale: %s') % describe_unknown(stats_present['unknown']))
+        if stats_future['unknown']:
+            feedback.pushInfo(self.tr('LUCODE non riconosciuti nello stato di progetto: %s') % describe_unknown(stats_future['unknown']))
+        ROS_present = stats_present['ROS']
+        ROS_future = stats_future['ROS']
+        value_tot_present = stats_present['value']
+        value_tot_future = stats_future['value']
+        n_pixel_valid_present = stats_present['n_pixel_valid']
+        n_pixel_valid_future = stats_future['n_pixel_valid']
+
+        # Population served by the green areas, summed by blocks window by window
+        population_raster = self.parameterAsRasterLayer(parameters, self.POPOLAZIONE, context)
+        population_present = None
+        population_future = None
+        if population_raster is not None:
+            population_uri = population_raster.dataProvider().dataSourceUri()
+            params_pop = PopolazioneParameters(self.parameterAsInt(parameters, self.PIXEL_RES, context),
+                                               self.parameterAsDouble(parameters, self.DIMENSIONE_BLOCCHI, context),
+                                               self.parameterAsDouble(parameters, self.DISTANZA_SERVIZIO, context))
+
+            def compute_population(state):
+                raster_uri, ROS = state
+                # Datasets are opened by each thread
+                ds = gdal.Open(raster_uri)
+                ds_population = gdal.Open(population_uri)
+                if ds is None or ds_population is None:
+                    raise IOError('Unable to open the rasters %s, %s' % (raster_uri, population_uri))
+                if ds.RasterXSize != ds_population.RasterXSize or ds.RasterYSize != ds_population.RasterYSize:
+                    raise ValueError('The population raster must have the size of the land use rasters')
+                band = ds.GetRasterBand(1)
+                band_population = ds_population.GetRasterBand(1)
+                nodata = band_population.GetNoDataValue()
+                blocks = PopulationBlocks(ds.RasterYSize, ds.RasterXSize, params_pop)
+                for xoff, yoff, xsize, ysize in iter_windows(band):
+                    arr = band.ReadAsArray(xoff, yoff, xsize, ysize)
+                    arr[arr < 0] = 0
+                    population = band_population.ReadAsArray(xoff, yoff, xsize, ysize).astype(np.float64)
+                    if nodata is not None:
+                        population[population == nodata] = 0
+                    population[~np.isfinite(population) | (population < 0)] = 0
+                    blocks.update(arr, population, xoff, yoff)
+                return blocks.stats(ROS)
+
+            population_present, population_future = map_states(
+                compute_population, [(present_uri, ROS_present), (future_uri, ROS_future)])
+
+        def write_population(f, population, value_tot):
+            f.write("Popolazione totale (abitanti): %f \n" % (population['population']))
+            f.write("Popolazione servita da almeno un'area verde (abitanti): %f \n" % (population['served']))
+            if population['population'] > 0:
+                f.write("Valore dei benefici_sociali per abitante (€/abitante): %f \n" % (
+                    value_tot / population['population']))
+            f.write("Classe;Superficie (ha);Popolazione servita;Quota popolazione servita (%);Valore (€);"
+                    "Valore per abitante servito (€/abitante)\n")
+            for green_class in population['classes']:
+                f.write("%s;%f;%f;%f;%f;%f\n" % (
+                    green_class['name'], green_class['area'], green_class['served'],
+                    100 * green_class['served'] / population['population'] if population['population'] > 0 else 0,
+                    green_class['value'],
+                    green_class['value'] / green_class['served'] if green_class['served'] > 0 else 0))
         # Years
         present = self.parameterAsInt(parameters, self.INPUTPRE, context)
         future = self.parameterAsInt(parameters, self.INPUTFUT, context)
-        # Initialize and write on output raster present
-        path_output = self.parameterAsString(parameters, self.OUTPUT, context)
-        file_output = path_output + '/06_benefici_sociali_presente_ROS.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        outdata = driver.Create(file_output, cols, rows,  1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(ds_present.GetGeoTransform())  ##sets same geotransform as input
-        outdata.SetProjection(ds_present.GetProjection())  ##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(ROS_present_array)
-        outdata.FlushCache()
-        # Initialize and write on output raster future
-        path_output = self.parameterAsString(parameters, self.OUTPUT, context)
-        file_output = path_output + '/06_benefici_sociali_futuro_ROS.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        outdata = driver.Create(file_output, cols, rows,  1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(ds_present.GetGeoTransform())  ##sets same geotransform as input
-        outdata.SetProjection(ds_present.GetProjection())  ##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(ROS_future_array)
-        outdata.FlushCache()
-        # Initialize and write on output raster
         path_output = self.parameterAsString(parameters, self.OUTPUT, context)
-        file_output = path_output + '/SE_06_benefici_sociali_delta_euro.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        arr_output = np.zeros((rows, cols))
-        arr_output[np.where(arr_present < 88)] = value_tot_future - value_tot_present
-        outdata = driver.Create(file_output, cols, rows,  1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(ds_present.GetGeoTransform())  ##sets same geotransform as input
-        outdata.SetProjection(ds_present.GetProjection())  ##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(arr_output)
-        print(np.max(outdata.GetRasterBand(1).ReadAsArray()))
-        outdata.FlushCache()  ##saves to disk!!
-        outdata = None
-        band = None
-        ds = None
+        if not report_only:
+            # Initialize and write on output raster present
+            file_output = path_output + '/06_benefici_sociali_presente_ROS.tiff'
+            write_raster(file_output, arrays_present['ROS'], ds_present, profile)
+            # Initialize and write on output raster future
+            file_output = path_output + '/06_benefici_sociali_futuro_ROS.tiff'
+            write_raster(file_output, arrays_future['ROS'], ds_present, profile)
+            if 'time' in arrays_present:
+                # Initialize and write on output rasters of the walking times
+                file_output = path_output + '/06_benefici_sociali_presente_tempo_accesso.tiff'
+                write_raster(file_output, arrays_present['time'], ds_present, profile)
+                file_output = path_output + '/06_benefici_sociali_futuro_tempo_accesso.tiff'
+                write_raster(file_output, arrays_future['time'], ds_present, profile)
+            # Initialize and write on output rasters of the per-pixel fruibility
+            for arrays, state in [(arrays_present, 'presente'), (arrays_future, 'futuro')]:
+                if 'fruibility' in arrays:
+                    file_output = path_output + '/06_benefici_sociali_%s_fruibilita.tiff' % state
+                    write_raster(file_output, arrays['fruibility'], ds_present, profile)
+            # Initialize and write on output raster
+            file_output = path_output + '/SE_06_benefici_sociali_delta_euro.tiff'
+            # Constant on the valid pixels, written window by window
+            write_lucode_constant(file_output, value_tot_future - value_tot_present, present_uri, ds_present, profile)
         report_output = path_output + '/SE_benefici_sociali.txt'
         f = open(report_output, "w+")
         today = datetime.today().strftime('%Y-%m-%d-%H:%M:%S')
@@ -796,25 +775,43 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         f.write(
             "Valore ROS - Stato attuale : : %f \n" % (
                 ROS_present))
+        if 'fruibility_mean' in stats_present:
+            f.write("Fruibilità media dai punti dei servizi - Stato attuale (0-1): %f \n" % (stats_present['fruibility_mean']))
+        if 'time_mean' in stats_present:
+            f.write("Tempo medio di accesso a piedi - Stato attuale (min): %f \n" % (stats_present['time_mean']))
+            f.write("Quota di superficie raggiungibile dai punti di accesso - Stato attuale (%%): %f \n" % (
+                100 * stats_present['reachable']))
         f.write(
             "Valore ROS medio - Stato attuale : : %f \n" % (
-                np.sum(ROS_present_array) / n_pixel_valid_present))
+                stats_present['ROS_sum'] / n_pixel_valid_present))
         f.write(
             "Valore medio dei benefici_sociali per unità di superficie - Stato attuale (€/ha): : %f \n" % (
                 (value_tot_present / (n_pixel_valid_present * area_pixel)) * 10000))
         f.write("Valore totale dei SE culturali (€): %f \n\n\n" % value_tot_present)
+        if population_present is not None:
+            write_population(f, population_present, value_tot_present)
+            f.write("\n\n")
         f.write("Analisi stato di progetto\n\n")
         f.write("Anno progetto: %i \n" % future)
         f.write(
             "Valore ROS - Stato progetto : : %f \n" % (
                 ROS_future))
+        if 'fruibility_mean' in stats_future:
+            f.write("Fruibilità media dai punti dei servizi - Stato progetto (0-1): %f \n" % (stats_future['fruibility_mean']))
+        if 'time_mean' in stats_future:
+            f.write("Tempo medio di accesso a piedi - Stato progetto (min): %f \n" % (stats_future['time_mean']))
+            f.write("Quota di superficie raggiungibile dai punti di accesso - Stato progetto (%%): %f \n" % (
+                100 * stats_future['reachable']))
         f.write(
             "Valore ROS medio - Stato progetto : : %f \n" % (
-                np.sum(ROS_future_array) / n_pixel_valid_future))
+                stats_future['ROS_sum'] / n_pixel_valid_future))
         f.write(
             "Valore medio dei benefici_sociali per unità di superficie - Stato di progetto (€/ha): %f \n" % (
                     (value_tot_future / (n_pixel_valid_future * area_pixel)) * 10000))
         f.write("Valore totale del dei benefici_sociali (€): %f \n\n\n" % value_tot_future)
+        if population_future is not None:
+            write_population(f, population_future, value_tot_future)
+            f.write("\n\n")
         f.write("Differenze tra stato di progetto e stato attuale\n\n")
         f.write("Anno progetto: %i - %i\n" % (present, future))
         f.write("Differenza dei benefici_sociali per unità di superficie (€/ha): %f \n" % (
@@ -822,6 +819,11 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         f.write(
             "Differenza in termini economici dei benefici_sociali (stato di progetto – stato attuale) (€):%d \n" % (
                 (value_tot_future - value_tot_present)))
+        if population_present is not None and population_present['population'] > 0 and \
+                population_future['population'] > 0:
+            f.write("Differenza dei benefici_sociali per abitante (€/abitante): %f \n" % (
+                value_tot_future / population_future['population'] -
+                value_tot_present / population_present['population']))
 
         return {self.OUTPUT: 'Completed'}
 
@@ -21,12 +21,32 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterBoolean,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterVectorLayer,
                        QgsProcessingParameterFolderDestination)
 from qgis import processing
 import gdal
 import numpy as np
+import os
+import sys
 from datetime import datetime
 
+# The se_torino package is kept in the same folder as the scripts
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+from se_torino.raster import load_raster, raster_transitions, write_raster
+from se_torino.parameters import add_output_profile_parameters, output_profile, vector_layer_source
+from se_torino.lookup import describe_unknown
+from se_torino.parallel import map_states
+from se_torino.transition import TransitionMatrix, save_transition_delta
+from se_torino.kernels import biodiversita
+from se_torino.kernels.biodiversita import BiodiversitaParameters
+from se_torino.threats import DistanceCache, rasterize_layer
+from se_torino.kernels.biodiversita import DegradationParameters
+from se_torino.kernels import patches
+import pandas as pd
+
 class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     """
     This is an example algorithm that takes a vector layer and
@@ -70,6 +90,25 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     P8F = 'P8F'
     P9F = 'P9F'
     P10F = 'P10F'
+    THREATS_P = [P1P, P2P, P3P, P4P, P5P, P6P, P7P, P8P, P9P, P10P]
+    THREATS_F = [P1F, P2F, P3F, P4F, P5F, P6F, P7F, P8F, P9F, P10F]
+    # Values of the Raster column of the configurations CSV that ask for the rasters
+    SWEEP_TRUE = ('1', 'si', 'sì', 'true', 'yes')
+    # Optional threat layers, in the order of the threat options
+    LAYERS_P = ['L1P', 'L2P', 'L3P', 'L4P', 'L5P', 'L6P', 'L7P', 'L8P', 'L9P', 'L10P']
+    LAYERS_F = ['L1F', 'L2F', 'L3F', 'L4F', 'L5F', 'L6F', 'L7F', 'L8F', 'L9F', 'L10F']
+    THREAT_NAMES = ['EDIFICI RESIDENZIALI', 'EDIFICI INDUSTRIALI', 'ALTRI EDIFICI', 'AREA CIRCOLAZIONE VEICOLARE',
+                    'AREA DI CIRCOLAZIONE CICLABILE', 'AREA DI CIRCOLAZIONE PEDONALE', 'VIABILITA MISTA SECONDARIA',
+                    'AREA ATTREZZATA DEL SUOLO', 'AREA IN TRASFORMAZIONE', 'DISCARICA']
+    CACHE_MINACCE = 'CACHE_MINACCE'
+    MODALITA_MINACCE = 'MODALITA_MINACCE'
+    DECADIMENTO = 'DECADIMENTO'
+    SEMISATURAZIONE = 'SEMISATURAZIONE'
+    PARAMETRI_MINACCE = 'PARAMETRI_MINACCE'
+    SCENARI_MINACCE = 'SCENARI_MINACCE'
+    METRICHE_PATCH = 'METRICHE_PATCH'
+    SOGLIA_HABITAT = 'SOGLIA_HABITAT'
+    SOLO_REPORT = 'SOLO_REPORT'
     OUTPUT = 'OUTPUT'
 
     def tr(self, string):
@@ -121,7 +160,10 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         should provide a basic description about what the algorithm does and the
         parameters and outputs associated with it..
         """
-        return self.tr("Algoritmo per il calcolo della biodiversità, nell'ambito del calcolo dei Servizi Ecosistemici per la Città di Torino")
+        return self.tr("Algoritmo per il calcolo della biodiversità, nell'ambito del calcolo dei Servizi Ecosistemici per la Città di Torino. "
+                       "Il CSV delle configurazioni (separatore ;) ha una riga per configurazione: la colonna Configurazione "
+                       "è obbligatoria, le colonne P1P ... P10F mancanti prendono le opzioni scelte nei parametri e la colonna "
+                       "Raster (1, sì, true, yes) chiede i raster della configurazione.")
 
     def initAlgorithm(self, config=None):
         """
@@ -369,29 +411,119 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        # Threat layers: distances are computed per pixel and replace the option of the threat
+        for layers, state in [(self.LAYERS_P, 'stato attuale'), (self.LAYERS_F, 'stato di progetto')]:
+            for layer, threat_name in zip(layers, self.THREAT_NAMES):
+                self.addParameter(
+                    QgsProcessingParameterVectorLayer(
+                        layer,
+                        self.tr('Layer %s %s (opzionale, sostituisce la scelta della distanza)') % (threat_name, state),
+                        optional=True
+                    )
+                )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.MODALITA_MINACCE,
+                self.tr('Effetto dei layer delle minacce'),
+                [self.tr('Fasce di distanza'), self.tr('Degrado dell\'habitat (kernel di decadimento)')],
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.DECADIMENTO,
+                self.tr('Decadimento delle minacce con la distanza'),
+                [self.tr('Lineare'), self.tr('Esponenziale')],
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.SEMISATURAZIONE,
+            self.tr('Costante di semisaturazione del degrado'),
+            QgsProcessingParameterNumber.Double,
+            0.05
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.PARAMETRI_MINACCE,
+                self.tr('CSV parametri minacce (Minaccia;Distanza massima;Peso)'),
+                extension='csv',
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.SCENARI_MINACCE,
+                self.tr('CSV configurazioni delle minacce da confrontare (Configurazione;P1P...P10F;Raster)'),
+                extension='csv',
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.CACHE_MINACCE,
+                self.tr('Cartella cache delle distanze dalle minacce'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+            self.METRICHE_PATCH,
+            self.tr('Calcola le metriche delle patch di habitat'),
+            defaultValue=False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.SOGLIA_HABITAT,
+            self.tr('Soglia H_score delle classi di habitat (0-1)'),
+            QgsProcessingParameterNumber.Double,
+            0.5
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+            self.SOLO_REPORT,
+            self.tr('Solo report (nessun raster in output)'),
+            defaultValue=False
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterFolderDestination(
                 self.OUTPUT,
                 self.tr('Salva nella cartella')
             )
         )
+
+        add_output_profile_parameters(self)
         
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """
 
-        # Load present raster
-        present_raster = self.parameterAsRasterLayer(parameters, self.INPUT1, context)
-        ds_present = gdal.Open(present_raster.dataProvider().dataSourceUri())
-        arr_present = ds_present.GetRasterBand(1).ReadAsArray()
-        # Clean negative values
-        arr_present[arr_present < 0] = 0
+        # Output raster format
+        profile = output_profile(self, parameters, context)
+        report_only = self.parameterAsBool(parameters, self.SOLO_REPORT, context)
 
-        # Load future raster
+        # Present and future rasters
+        present_raster = self.parameterAsRasterLayer(parameters, self.INPUT1, context)
         future_raster = self.parameterAsRasterLayer(parameters, self.INPUT2, context)
-        ds_future = gdal.Open(future_raster.dataProvider().dataSourceUri())
-        arr_future = ds_future.GetRasterBand(1).ReadAsArray()
+        present_uri = present_raster.dataProvider().dataSourceUri()
+        future_uri = future_raster.dataProvider().dataSourceUri()
 
         # List of options
         edifici_residenziali = ['assenti o oltre i 400 m', 'tra i 200 e i 400 m', 'tra i 100 e i 200 m', 'entro i 100 m']
@@ -406,339 +538,192 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         discarica = ['assenti o oltre i 500m', 'tra i 250 e i 500 m', 'tra i 100 e i 250 m', 'entro i 100 m']
 
 
-        # Clean negative values
-        arr_future[arr_future < 0] = 0
-        values_p = [0, 1, 5, 10]
+        # Distance option of each threat, present and future
         p1p_id = self.parameterAsInt(parameters, self.P1P, context)
-        p1p = values_p[p1p_id]
         p2p_id = self.parameterAsInt(parameters, self.P2P, context)
-        p2p = values_p[p2p_id]
         p3p_id = self.parameterAsInt(parameters, self.P3P, context)
-        p3p = values_p[p3p_id]
         p4p_id = self.parameterAsInt(parameters, self.P4P, context)
-        p4p = values_p[p4p_id]
         p5p_id = self.parameterAsInt(parameters, self.P5P, context)
-        p5p = values_p[p5p_id]
         p6p_id = self.parameterAsInt(parameters, self.P6P, context)
-        p6p = values_p[p6p_id]
         p7p_id = self.parameterAsInt(parameters, self.P7P, context)
-        p7p = values_p[p7p_id]
         p8p_id = self.parameterAsInt(parameters, self.P8P, context)
-        p8p = values_p[p8p_id]
         p9p_id = self.parameterAsInt(parameters, self.P9P, context)
-        p9p = values_p[p9p_id]
         p10p_id = self.parameterAsInt(parameters, self.P10P, context)
-        p10p = values_p[p10p_id]
-        p_sum_p = p1p + p2p + p3p + p4p + p5p + p6p + p7p + p8p + p9p + p10p
+        params_p = BiodiversitaParameters(self.parameterAsInt(parameters, self.PIXEL_RES, context),
+                                          [p1p_id, p2p_id, p3p_id, p4p_id, p5p_id, p6p_id, p7p_id, p8p_id, p9p_id, p10p_id])
 
         p1f_id = self.parameterAsInt(parameters, self.P1F, context)
-        p1f = values_p[p1f_id]
         p2f_id = self.parameterAsInt(parameters, self.P2F, context)
-        p2f = values_p[p2f_id]
         p3f_id = self.parameterAsInt(parameters, self.P3F, context)
-        p3f = values_p[p3f_id]
         p4f_id = self.parameterAsInt(parameters, self.P4F, context)
-        p4f = values_p[p4f_id]
         p5f_id = self.parameterAsInt(parameters, self.P5F, context)
-        p5f = values_p[p5f_id]
         p6f_id = self.parameterAsInt(parameters, self.P6F, context)
-        p6f = values_p[p6f_id]
         p7f_id = self.parameterAsInt(parameters, self.P7F, context)
-        p7f = values_p[p7f_id]
         p8f_id = self.parameterAsInt(parameters, self.P8F, context)
-        p8f = values_p[p8f_id]
         p9f_id = self.parameterAsInt(parameters, self.P9F, context)
-        p9f = values_p[p9f_id]
         p10f_id = self.parameterAsInt(parameters, self.P10F, context)
-        p10f = values_p[p10f_id]
-        p_sum_f = p1f + p2f + p3f + p4f + p5f + p6f + p7f + p8f + p9f + p10f
-
-        area_pixel = self.parameterAsInt(parameters, self.PIXEL_RES, context) * self.parameterAsInt(
-            parameters, self.PIXEL_RES, context)
-
-        # Scores of single lucode
-        H_score_lucode = {}
-        H_score_lucode[1] = 0.4
-        H_score_lucode[2] = 0.4
-        H_score_lucode[3] = 0
-        H_score_lucode[4] = 0.5
-        H_score_lucode[5] = 0.5
-        H_score_lucode[6] = 0.5
-        H_score_lucode[7] = 0.1
-        H_score_lucode[8] = 0
-        H_score_lucode[9] = 0.15
-        H_score_lucode[10] = 0.05
-        H_score_lucode[11] = 0
-        H_score_lucode[12] = 0.05
-        H_score_lucode[13] = 0
-        H_score_lucode[14] = 0.05
-        H_score_lucode[15] = 0
-        H_score_lucode[16] = 0.05
-        H_score_lucode[17] = 0.15
-        H_score_lucode[18] = 0
-        H_score_lucode[19] = 0.1
-        H_score_lucode[20] = 0
-        H_score_lucode[21] = 1
-        H_score_lucode[22] = 0.85
-        H_score_lucode[23] = 0.6
-        H_score_lucode[24] = 0.25
-        H_score_lucode[25] = 0
-        H_score_lucode[26] = 0.15
-        H_score_lucode[27] = 0.1
-        H_score_lucode[28] = 0
-        H_score_lucode[29] = 0.5
-        H_score_lucode[30] = 0.4
-        H_score_lucode[31] = 1
-        H_score_lucode[32] = 0
-        H_score_lucode[33] = 0
-        H_score_lucode[34] = 0.1
-        H_score_lucode[35] = 0
-        H_score_lucode[36] = 0
-        H_score_lucode[37] = 0.5
-        H_score_lucode[38] = 0.75
-        H_score_lucode[39] = 0.5
-        H_score_lucode[40] = 0.4
-        H_score_lucode[41] = 0.4
-        H_score_lucode[42] = 0.4
-        H_score_lucode[43] = 0.5
-        H_score_lucode[44] = 0.3
-        H_score_lucode[45] = 0.5
-        H_score_lucode[46] = 0.15
-        H_score_lucode[47] = 0
-        H_score_lucode[48] = 0.35
-        H_score_lucode[49] = 0.1
-        H_score_lucode[50] = 0
-        H_score_lucode[51] = 0
-        H_score_lucode[52] = 0
-        H_score_lucode[53] = 0.15
-        H_score_lucode[54] = 0.05
-        H_score_lucode[55] = 0
-        H_score_lucode[56] = 0
-        H_score_lucode[57] = 0.45
-        H_score_lucode[58] = 0.4
-        H_score_lucode[59] = 0.4
-        H_score_lucode[60] = 0
-        H_score_lucode[61] = 0.45
-        H_score_lucode[62] = 0.65
-        H_score_lucode[63] = 0.55
-        H_score_lucode[64] = 0.4
-        H_score_lucode[65] = 0.4
-        H_score_lucode[66] = 0
-        H_score_lucode[67] = 0
-        H_score_lucode[68] = 0.5
-        H_score_lucode[69] = 0.65
-        H_score_lucode[70] = 0.55
-        H_score_lucode[71] = 0.05
-        H_score_lucode[72] = 0
-        H_score_lucode[73] = 0.4
-        H_score_lucode[74] = 0.5
-        H_score_lucode[75] = 0.4
-        H_score_lucode[76] = 0.4
-        H_score_lucode[77] = 0
-        H_score_lucode[78] = 0.7
-        H_score_lucode[79] = 0.55
-        H_score_lucode[80] = 0
-        H_score_lucode[81] = 0
-        H_score_lucode[82] = 0.9
-        H_score_lucode[83] = 1
-        H_score_lucode[84] = 1
-        H_score_lucode[85] = 0.75
-        H_score_lucode[86] = 0.6
-        H_score_lucode[87] = 1
-
-        [rows, cols] = arr_present.shape
-
-
-        # Assigning scores for each distinct lucode
-        Q_pres = np.zeros((rows, cols))
-        Q_fut = np.zeros((rows, cols))
-        for lucode in np.unique(np.concatenate((arr_present, arr_future))):
-            try:
-                if p_sum_p == 0:
-                    Q_pres[np.where(arr_present == lucode)] = H_score_lucode[lucode]
-                if p_sum_p == 1:
-                    Q_pres[np.where(arr_present == lucode)] = H_score_lucode[lucode] * 0.80
-                if p_sum_p == 2:
-                    Q_pres[np.where(arr_present == lucode)] = H_score_lucode[lucode] * 0.75
-                if p_sum_p == 3:
-                    Q_pres[np.where(arr_present == lucode)] = H_score_lucode[lucode] * 0.70
-                if p_sum_p == 4:
-                    Q_pres[np.where(arr_present == lucode)] = H_score_lucode[lucode] * 0.60
-                if p_sum_p == 5:
-                    Q_pres[np.where(arr_present == lucode)] = H_score_lucode[lucode] * 0.50
-                if p_sum_p == 6:
-                    Q_pres[np.where(arr_present == lucode)] = H_score_lucode[lucode] * 0.45
-                if p_sum_p == 7:
-                    Q_pres[np.where(arr_present == lucode)] = H_score_lucode[lucode] * 0.40
-                if p_sum_p == 8:
-                    Q_pres[np.where(arr_present == lucode)] = H_score_lucode[lucode] * 0.30
-                if p_sum_p == 9:
-                    Q_pres[np.where(arr_present == lucode)] = H_score_lucode[lucode] * 0.20
-                if p_sum_p >= 10:
-                    Q_pres[np.where(arr_present == lucode)] = H_score_lucode[lucode] * 0.10
-            except:
-                pass
-            try:
-                if p_sum_f == 0:
-                    Q_fut[np.where(arr_future == lucode)] = H_score_lucode[lucode]
-                if p_sum_f == 1:
-                    Q_fut[np.where(arr_future == lucode)] = H_score_lucode[lucode] * 0.80
-                if p_sum_f == 2:
-                    Q_fut[np.where(arr_future == lucode)] = H_score_lucode[lucode] * 0.75
-                if p_sum_f == 3:
-                    Q_fut[np.where(arr_future == lucode)] = H_score_lucode[lucode] * 0.70
-                if p_sum_f == 4:
-                    Q_fut[np.where(arr_future == lucode)] = H_score_lucode[lucode] * 0.60
-                if p_sum_f == 5:
-                    Q_fut[np.where(arr_future == lucode)] = H_score_lucode[lucode] * 0.50
-                if p_sum_f == 6:
-                    Q_fut[np.where(arr_future == lucode)] = H_score_lucode[lucode] * 0.45
-                if p_sum_f == 7:
-                    Q_fut[np.where(arr_future == lucode)] = H_score_lucode[lucode] * 0.40
-                if p_sum_f == 8:
-                    Q_fut[np.where(arr_future == lucode)] = H_score_lucode[lucode] * 0.30
-                if p_sum_f == 9:
-                    Q_fut[np.where(arr_future == lucode)] = H_score_lucode[lucode] * 0.20
-                if p_sum_f >= 10:
-                    Q_fut[np.where(arr_future == lucode)] = H_score_lucode[lucode] * 0.10
-            except:
-                pass
-
-        # Dictionary of economic value for each lucode
-        value_lucode = {}
-        value_lucode[1] = 0.16
-        value_lucode[2] = 0.16
-        value_lucode[3] = 0
-        value_lucode[4] = 0.16
-        value_lucode[5] = 0.16
-        value_lucode[6] = 0.16
-        value_lucode[7] = 0.03
-        value_lucode[8] = 0
-        value_lucode[9] = 0.23
-        value_lucode[10] = 0.23
-        value_lucode[11] = 0
-        value_lucode[12] = 0.01
-        value_lucode[13] = 0
-        value_lucode[14] = 0.01
-        value_lucode[15] = 0
-        value_lucode[16] = 0.01
-        value_lucode[17] = 0.23
-        value_lucode[18] = 0
-        value_lucode[19] = 0.03
-        value_lucode[20] = 0
-        value_lucode[21] = 0.23
-        value_lucode[22] = 0.23
-        value_lucode[23] = 0.03
-        value_lucode[24] = 0.01
-        value_lucode[25] = 0
-        value_lucode[26] = 0.03
-        value_lucode[27] = 0.01
-        value_lucode[28] = 0
-        value_lucode[29] = 0.16
-        value_lucode[30] = 0.16
-        value_lucode[31] = 0
-        value_lucode[32] = 0.03
-        value_lucode[33] = 0.01
-        value_lucode[34] = 0.01
-        value_lucode[35] = 0
-        value_lucode[36] = 0
-        value_lucode[37] = 0.16
-        value_lucode[38] = 0
-        value_lucode[39] = 0.16
-        value_lucode[40] = 0.16
-        value_lucode[41] = 0.16
-        value_lucode[42] = 0.16
-        value_lucode[43] = 0.03
-        value_lucode[44] = 0.03
-        value_lucode[45] = 0
-        value_lucode[46] = 0.03
-        value_lucode[47] = 0
-        value_lucode[48] = 0.03
-        value_lucode[49] = 0.01
-        value_lucode[50] = 0
-        value_lucode[51] = 0
-        value_lucode[52] = 0
-        value_lucode[53] = 0.03
-        value_lucode[54] = 0.01
-        value_lucode[55] = 0
-        value_lucode[56] = 0
-        value_lucode[57] = 0.16
-        value_lucode[58] = 0.16
-        value_lucode[59] = 0.16
-        value_lucode[60] = 0
-        value_lucode[61] = 0.16
-        value_lucode[62] = 0.16
-        value_lucode[63] = 0.16
-        value_lucode[64] = 0.16
-        value_lucode[65] = 0.16
-        value_lucode[66] = 0
-        value_lucode[67] = 0
-        value_lucode[68] = 0.16
-        value_lucode[69] = 0.16
-        value_lucode[70] = 0
-        value_lucode[71] = 0.03
-        value_lucode[72] = 0
-        value_lucode[73] = 0.16
-        value_lucode[74] = 0.16
-        value_lucode[75] = 0.16
-        value_lucode[76] = 0.16
-        value_lucode[77] = 0
-        value_lucode[78] = 0
-        value_lucode[79] = 0.16
-        value_lucode[80] = 0
-        value_lucode[81] = 0.91
-        value_lucode[82] = 0.91
-        value_lucode[83] = 0.91
-        value_lucode[84] = 0.91
-        value_lucode[85] = 0.91
-        value_lucode[86] = 0.91
-        value_lucode[87] = 0.91
-
-        value_pres = np.zeros((rows, cols))
-        value_fut = np.zeros((rows, cols))
-        for lucode in np.unique(np.concatenate((arr_present, arr_future))):
-            try:
-                value_pres[np.where(arr_present == lucode)] = value_lucode[lucode] * Q_pres[
-                    np.where(arr_present == lucode)] * area_pixel
-                value_fut[np.where(arr_future == lucode)] = value_lucode[lucode] * Q_fut[
-                    np.where(arr_future == lucode)] * area_pixel
-            except:
-                pass
+        params_f = BiodiversitaParameters(self.parameterAsInt(parameters, self.PIXEL_RES, context),
+                                          [p1f_id, p2f_id, p3f_id, p4f_id, p5f_id, p6f_id, p7f_id, p8f_id, p9f_id, p10f_id])
+
+        sweep_csv = self.parameterAsFile(parameters, self.SCENARI_MINACCE, context)
+        if sweep_csv:
+            return self.run_sweep(sweep_csv, present_uri, future_uri, params_p, params_f,
+                                  self.parameterAsString(parameters, self.OUTPUT, context), profile, feedback)
+
+        # Threat layers of each state, {threat: layer URI}
+        layers_p = {}
+        layers_f = {}
+        for layers, state_layers in [(self.LAYERS_P, layers_p), (self.LAYERS_F, layers_f)]:
+            for threat, layer in enumerate(layers):
+                vector_layer = self.parameterAsVectorLayer(parameters, layer, context)
+                if vector_layer is not None:
+                    state_layers[threat] = vector_layer_source(vector_layer)
+        distance_cache = DistanceCache(self.parameterAsFile(parameters, self.CACHE_MINACCE, context))
+        # Per-pixel threats need the rasters even for the report
+        per_pixel = bool(layers_p or layers_f)
+        degradation_mode = self.parameterAsEnum(parameters, self.MODALITA_MINACCE, context) == 1
+        max_distances = None
+        weights = None
+        threats_csv = self.parameterAsFile(parameters, self.PARAMETRI_MINACCE, context)
+        if threats_csv:
+            # One row for each threat, numbered from 1 in the order of the parameters
+            csv = pd.read_csv(threats_csv, sep=';').sort_values('Minaccia')
+            max_distances = list(csv['Distanza massima'])
+            weights = list(csv['Peso'])
+            if len(max_distances) != len(self.THREAT_NAMES):
+                raise QgsProcessingException(self.tr('Il CSV dei parametri delle minacce deve avere una riga per minaccia'))
+        params_degradation = DegradationParameters(
+            self.parameterAsInt(parameters, self.PIXEL_RES, context),
+            self.parameterAsEnum(parameters, self.DECADIMENTO, context),
+            self.parameterAsDouble(parameters, self.SEMISATURAZIONE, context),
+            max_distances, weights)
+
+        def compute_state(state):
+            raster_uri, params, state_layers = state
+            # Load raster
+            ds, arr = load_raster(raster_uri)
+            # Clean negative values
+            arr[arr < 0] = 0
+            layers = sorted(state_layers.items())
+            if degradation_mode:
+                # Threat rasters are convolved one at a time with their decay kernel
+                degradation = biodiversita.degradation(
+                    params_degradation, arr.shape,
+                    ((threat, rasterize_layer(uri, ds).GetRasterBand(1).ReadAsArray()) for threat, uri in layers))
+                if degradation is None:
+                    return ds, arr, biodiversita.state_arrays(arr, params), None
+                factors = biodiversita.degradation_factors(degradation, params_degradation) * \
+                    params.factor_without(state_layers)
+                arrays = biodiversita.state_arrays(arr, params, factors=factors)
+                arrays['D'] = degradation
+                return ds, arr, arrays, factors
+            # Distance rasters are read one at a time while the levels are summed
+            levels = biodiversita.threat_levels(
+                params, arr.shape, ((threat, distance_cache.distance(uri, ds)) for threat, uri in layers))
+            if levels is None:
+                return ds, arr, biodiversita.state_arrays(arr, params), None
+            return ds, arr, biodiversita.state_arrays(arr, params, levels), biodiversita.threat_factors(levels)
+
+        if report_only and not per_pixel:
+            # The report only needs the pixel counts, read both rasters by windows
+            ds_present, transitions = raster_transitions(present_uri, future_uri, feedback)
+        else:
+            # Present and future states are independent, compute them concurrently
+            [(ds_present, arr_present, arrays_pres, pixel_factors_pres),
+             (ds_future, arr_future, arrays_fut, pixel_factors_fut)] = map_states(
+                compute_state, [(present_uri, params_p, layers_p), (future_uri, params_f, layers_f)])
+            transitions = TransitionMatrix(arr_present, arr_future)
+        # Report totals from the lucode counts, or from the rasters for per-pixel threats
+        stats_pres = biodiversita.state_stats(transitions.present, params_p)
+        stats_fut = biodiversita.state_stats(transitions.future, params_f)
+        factors_pres = None
+        factors_fut = None
+        if per_pixel and pixel_factors_pres is not None:
+            stats_pres.update(biodiversita.pixel_state_stats(arrays_pres))
+            factors_pres = transitions.weighted(arr_present, arr_future, pixel_factors_pres)
+        if per_pixel and pixel_factors_fut is not None:
+            stats_fut.update(biodiversita.pixel_state_stats(arrays_fut))
+            factors_fut = transitions.weighted(arr_present, arr_future, pixel_factors_fut)
+        if stats_pres['unknown']:
+            feedback.pushInfo(self.tr('LUCODE non riconosciuti nello stato attuale: %s') % describe_unknown(stats_pres['unknown']))
+        if stats_fut['unknown']:
+            feedback.pushInfo(self.tr('LUCODE non riconosciuti nello stato di progetto: %s') % describe_unknown(stats_fut['unknown']))
         # Years
         present = self.parameterAsInt(parameters, self.INPUT3, context)
         future = self.parameterAsInt(parameters, self.INPUT4, context)
-        
-        # Initialize and write on output raster
-        path_output = self.parameterAsString(parameters, self.OUTPUT, context)
-        file_output = path_output + '/07_biodiversità_presente_Q.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        outdata = driver.Create(file_output, cols, rows, 1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(ds_present.GetGeoTransform())##sets same geotransform as input
-        outdata.SetProjection(ds_present.GetProjection())##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(Q_pres)
-
-        # Initialize and write on output raster
-        path_output = self.parameterAsString(parameters, self.OUTPUT, context)
-        file_output = path_output + '/07_biodiversità_futuro_Q.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        outdata = driver.Create(file_output, cols, rows, 1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(ds_present.GetGeoTransform())##sets same geotransform as input
-        outdata.SetProjection(ds_present.GetProjection())##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(Q_fut)
-
-        # Initialize and write on output raster
+
+        # Delta total from the present -> future lucode transitions, each state with its threat factor
+        delta = biodiversita.delta_transitions(transitions, params_p, params_f, factors_pres, factors_fut)
+
         path_output = self.parameterAsString(parameters, self.OUTPUT, context)
-        file_output = path_output + '/SE_07_biodiversità_delta_euro.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        outdata = driver.Create(file_output, cols, rows, 1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(ds_present.GetGeoTransform())##sets same geotransform as input
-        outdata.SetProjection(ds_present.GetProjection())##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(value_fut - value_pres)
-
-        outdata.FlushCache() ##saves to disk!!
-        outdata = None
-        band = None
-        ds = None
+        save_transition_delta(path_output + '/SE_07_biodiversità_delta_euro.tiff', delta['value'])
+        if not report_only:
+            # Initialize and write on output raster
+            file_output = path_output + '/07_biodiversità_presente_Q.tiff'
+            write_raster(file_output, arrays_pres['Q'], ds_present, profile)
+
+            # Initialize and write on output raster
+            file_output = path_output + '/07_biodiversità_futuro_Q.tiff'
+            write_raster(file_output, arrays_fut['Q'], ds_present, profile)
+
+            # Initialize and write on output raster
+            file_output = path_output + '/SE_07_biodiversità_delta_euro.tiff'
+            write_raster(file_output, arrays_fut['value'] - arrays_pres['value'], ds_present, profile)
+
+            # Habitat degradation of the states with threat layers
+            if 'D' in arrays_pres:
+                file_output = path_output + '/07_biodiversità_presente_degrado.tiff'
+                write_raster(file_output, arrays_pres['D'], ds_present, profile)
+            if 'D' in arrays_fut:
+                file_output = path_output + '/07_biodiversità_futuro_degrado.tiff'
+                write_raster(file_output, arrays_fut['D'], ds_present, profile)
+        # Habitat patches of both states, labeled tile by tile from the rasters
+        patch_metrics = None
+        if self.parameterAsBool(parameters, self.METRICHE_PATCH, context):
+            pixel_res = self.parameterAsInt(parameters, self.PIXEL_RES, context)
+            threshold = self.parameterAsDouble(parameters, self.SOGLIA_HABITAT, context)
+
+            def compute_patches(raster_uri):
+                ds = gdal.Open(raster_uri)
+                return patches.patch_metrics(ds.GetRasterBand(1).ReadAsArray, ds.RasterYSize, ds.RasterXSize,
+                                             lambda arr: biodiversita.habitat_mask(arr, threshold), pixel_res)
+
+            patch_metrics = map_states(compute_patches, [present_uri, future_uri])
+            if patch_metrics[0]['nearest_mean'] is None and patches.cKDTree is None:
+                feedback.pushInfo(self.tr('scipy non disponibile: distanza media tra le patch non calcolata'))
+
+        def write_patches(f, metrics):
+            f.write("Patch di habitat (H_score > %f)\n" % (threshold))
+            f.write("Numero di patch: %i \n" % (metrics['n_patches']))
+            f.write("Superficie totale dell'habitat (ha): %f \n" % (metrics['habitat_area']))
+            f.write("Superficie media delle patch (ha): %f \n" % (metrics['mean_area']))
+            f.write("Superficie mediana delle patch (ha): %f \n" % (metrics['median_area']))
+            f.write("Superficie delle patch, 90° percentile (ha): %f \n" % (metrics['p90_area']))
+            f.write("Numero di patch per superficie (<0.1, 0.1-1, 1-10, >10 ha): %s \n" % (
+                ', '.join(str(n) for n in metrics['area_classes'])))
+            f.write("Patch più grande (ha): %f \n" % (metrics['largest_area']))
+            f.write("Indice della patch più grande (%%): %f \n" % (metrics['largest_patch_index']))
+            f.write("Densità dei margini (m/ha): %f \n" % (metrics['edge_density']))
+            if metrics['nearest_mean'] is not None:
+                f.write("Distanza media dalla patch più vicina (m): %f \n" % (metrics['nearest_mean']))
+            f.write("\n\n")
+
+        report_threats = [('Edifici residenziali', edifici_residenziali), ('Edifici industriali', edifici_industriali),
+                          ('Edifici altri', edifici_altri), ('Viabilita pedonale', viabilita_pedonale),
+                          ('Viabilita ciclo', viabilita_ciclo), ('Viabilita veicolare', viabilita_veicolare),
+                          ('Viabilita secondaria', viabilita_secondaria), ('Attrezzata', attrezzata),
+                          ('Trasformazione', trasformazione), ('Discarica', discarica)]
+
+        def write_threats(f, params, state_layers):
+            for threat, (title, options) in enumerate(report_threats):
+                if threat in state_layers:
+                    if degradation_mode:
+                        f.write("%s: degrado dell'habitat dal layer %s \n" % (title, state_layers[threat]))
+                    else:
+                        f.write("%s: distanze per pixel dal layer %s \n" % (title, state_layers[threat]))
+                else:
+                    f.write("%s: %s \n" % (title, options[params.threats[threat]]))
+
         report_output = path_output + '/SE_biodiversità.txt'
         f = open(report_output, "w+")
         today = datetime.today().strftime('%Y-%m-%d-%H:%M:%S')
@@ -746,39 +731,98 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         f.write("Data: " + today +"\n\n\n")
         f.write("Analisi stato di fatto\n\n")
         f.write("Anno corrente: %i \n" % (present))
-        f.write("Edifici residenziali: %s \n" % (edifici_residenziali[p1p_id]))
-        f.write("Edifici industriali: %s \n" % (edifici_industriali[p2p_id]))
-        f.write("Edifici altri: %s \n" % (edifici_altri[p3p_id]))
-        f.write("Viabilita pedonale: %s \n" % (viabilita_pedonale[p4p_id]))
-        f.write("Viabilita ciclo: %s \n" % (viabilita_ciclo[p5p_id]))
-        f.write("Viabilita veicolare: %s \n" % (viabilita_veicolare[p6p_id]))
-        f.write("Viabilita secondaria: %s \n" % (viabilita_secondaria[p7p_id]))
-        f.write("Attrezzata: %s \n" % (attrezzata[p8p_id]))
-        f.write("Trasformazione: %s \n" % (trasformazione[p9p_id]))
-        f.write("Discarica: %s \n" % (discarica[p10p_id]))
+        write_threats(f, params_p, layers_p)
         f.write("\n\n")
-        f.write("Valore della biodiversità nello stato attuale (0-1): %f \n" % (np.mean(Q_pres)))
-        f.write("Valore totale della biodiversità (€): %f \n\n\n" % (np.sum(value_pres)))
+        f.write("Valore della biodiversità nello stato attuale (0-1): %f \n" % (stats_pres['Q_mean']))
+        f.write("Valore totale della biodiversità (€): %f \n\n\n" % (stats_pres['value']))
+        if patch_metrics is not None:
+            write_patches(f, patch_metrics[0])
         f.write("Analisi stato di progetto\n\n")
         f.write("Anno progetto: %i \n" % (future))
-        f.write("Edifici residenziali: %s \n" % (edifici_residenziali[p1f_id]))
-        f.write("Edifici industriali: %s \n" % (edifici_industriali[p2f_id]))
-        f.write("Edifici altri: %s \n" % (edifici_altri[p3f_id]))
-        f.write("Viabilita pedonale: %s \n" % (viabilita_pedonale[p4f_id]))
-        f.write("Viabilita ciclo: %s \n" % (viabilita_ciclo[p5f_id]))
-        f.write("Viabilita veicolare: %s \n" % (viabilita_veicolare[p6f_id]))
-        f.write("Viabilita secondaria: %s \n" % (viabilita_secondaria[p7f_id]))
-        f.write("Attrezzata: %s \n" % (attrezzata[p8f_id]))
-        f.write("Trasformazione: %s \n" % (trasformazione[p9f_id]))
-        f.write("Discarica: %s \n" % (discarica[p10f_id]))
+        write_threats(f, params_f, layers_f)
         f.write("\n\n")
-        f.write("Valore della biodiversità nello stato di progetto (0-1): %f \n" % (np.mean(Q_fut)))
-        f.write("Valore totale della biodiversità (€): %f \n\n\n" % (np.sum(value_fut)))
+        f.write("Valore della biodiversità nello stato di progetto (0-1): %f \n" % (stats_fut['Q_mean']))
+        f.write("Valore totale della biodiversità (€): %f \n\n\n" % (stats_fut['value']))
+        if patch_metrics is not None:
+            write_patches(f, patch_metrics[1])
         f.write("Differenze tra stato di progetto e stato attuale\n\n")
         f.write("Anno progetto: %i - %i\n" % (present, future))
-        f.write("Differenza di valore della biodiversità: %f \n" % (np.mean(Q_fut-Q_pres)))
+        f.write("Differenza di valore della biodiversità: %f \n" % (stats_fut['Q_mean'] - stats_pres['Q_mean']))
         f.write("Differenza in termini economici del SE di biodiversità (stato di progetto – stato attuale) (€):%d \n" % (
-            np.sum(value_fut - value_pres)))
+            np.sum(delta['value'])))
+        if patch_metrics is not None:
+            f.write("Differenza del numero di patch di habitat: %i \n" % (
+                patch_metrics[1]['n_patches'] - patch_metrics[0]['n_patches']))
+            f.write("Differenza della densità dei margini (m/ha): %f \n" % (
+                patch_metrics[1]['edge_density'] - patch_metrics[0]['edge_density']))
+        return {self.OUTPUT: 'completed'}
+
+    def run_sweep(self, sweep_csv, present_uri, future_uri, params_p, params_f, path_output, profile, feedback):
+        """
+        Evaluates all the threat configurations of the CSV from a single
+        read of the rasters and writes their table. Columns P1P ... P10F
+        missing from the CSV take the options chosen in the parameters.
+        """
+        # Cells are read as text, empty cells as empty strings
+        csv = pd.read_csv(sweep_csv, sep=';', dtype=str, keep_default_na=False)
+        if 'Configurazione' not in csv.columns:
+            raise QgsProcessingException(self.tr('Colonna Configurazione mancante nel file delle configurazioni'))
+        configurations = []
+        for _, row in csv.iterrows():
+            name = row['Configurazione'].strip()
+            threats = []
+            for columns, defaults in [(self.THREATS_P, params_p.threats), (self.THREATS_F, params_f.threats)]:
+                state_threats = []
+                for column, default in zip(columns, defaults):
+                    if column not in csv.columns:
+                        state_threats.append(default)
+                        continue
+                    try:
+                        option = int(row[column])
+                    except ValueError:
+                        option = None
+                    if option not in range(len(biodiversita.THREAT_VALUES)):
+                        raise QgsProcessingException(self.tr('Opzione delle minacce non valida nella configurazione %s, colonna %s: "%s"') % (
+                            name, column, row[column]))
+                    state_threats.append(option)
+                threats.append(state_threats)
+            rasters = 'Raster' in csv.columns and row['Raster'].strip().lower() in self.SWEEP_TRUE
+            configurations.append(biodiversita.ThreatConfiguration(name, threats[0], threats[1], rasters))
+
+        wanted = [configuration for configuration in configurations if configuration.rasters]
+        if wanted:
+            # Rasters are needed for some configurations, read them once
+            [(ds_present, arr_present), (ds_future, arr_future)] = map_states(load_raster, [present_uri, future_uri])
+            arr_present[arr_present < 0] = 0
+            arr_future[arr_future < 0] = 0
+            transitions = TransitionMatrix(arr_present, arr_future)
+        else:
+            # The table only needs the pixel counts, read both rasters by windows
+            ds_present, transitions = raster_transitions(present_uri, future_uri, feedback)
+        rows = biodiversita.sweep(transitions, configurations, params_p.pixel_res)
+
+        table_output = path_output + '/SE_07_biodiversità_configurazioni.csv'
+        f = open(table_output, "w+")
+        f.write("Configurazione;Punteggio minacce attuale;Punteggio minacce progetto;Fattore attuale;Fattore progetto;"
+                "Q medio attuale;Q medio progetto;Valore attuale (€);Valore progetto (€);Differenza (€)\n")
+        for row in rows:
+            f.write("%s;%i;%i;%f;%f;%f;%f;%f;%f;%f\n" % (
+                row['name'], row['score_present'], row['score_future'], row['factor_present'], row['factor_future'],
+                row['Q_mean_present'], row['Q_mean_future'], row['value_present'], row['value_future'], row['delta']))
+        f.close()
+
+        for configuration in wanted:
+            if feedback.isCanceled():
+                break
+            name = ''.join(char if char.isalnum() else '_' for char in configuration.name)
+            params_present, params_future = configuration.parameters(params_p.pixel_res)
+            arrays_pres = biodiversita.state_arrays(arr_present, params_present)
+            arrays_fut = biodiversita.state_arrays(arr_future, params_future)
+            write_raster(path_output + '/07_biodiversità_presente_Q_%s.tiff' % name, arrays_pres['Q'], ds_present, profile)
+            write_raster(path_output + '/07_biodiversità_futuro_Q_%s.tiff' % name, arrays_fut['Q'], ds_present, profile)
+            write_raster(path_output + '/SE_07_biodiversità_delta_euro_%s.tiff' % name,
+                         arrays_fut['value'] - arrays_pres['value'], ds_present, profile)
+        feedback.pushInfo(self.tr('Configurazioni delle minacce valutate: %i') % len(rows))
         return {self.OUTPUT: 'completed'}
 
         
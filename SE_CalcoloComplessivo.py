@@ -19,12 +19,23 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterFeatureSource,
                        QgsProcessingParameterNumber,
                        QgsProcessingParameterRasterLayer,
+                       QgsProcessingParameterBoolean,
                        QgsProcessingParameterFolderDestination)
 from qgis import processing
 import gdal
 import numpy as np
+import os
+import sys
 from datetime import datetime
 
+# The se_torino package is kept in the same folder as the scripts
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+from se_torino.raster import RasterWriter, sum_rasters
+from se_torino.parameters import add_output_profile_parameters, output_profile
+from se_torino.transition import TransitionMatrix, load_transition_delta, top_transitions, write_matrix_csv
+
 class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     """
     This is an example algorithm that takes a vector layer and
@@ -53,6 +64,7 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     INPUT8 = 'INPUT8'
     INPUT9 = 'INPUT9'
     PIXEL_RES = 'PIXEL_RES'
+    BLOCCHI = 'BLOCCHI'
     OUTPUT = 'OUTPUT'
 
     def tr(self, string):
@@ -194,80 +206,88 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
             )
         ) 
 
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+            self.BLOCCHI,
+            self.tr('Elaborazione a blocchi (memoria ridotta)'),
+            defaultValue=True
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterFolderDestination(
                 self.OUTPUT,
                 self.tr('Salva nella cartella')
             )
         )
+
+        add_output_profile_parameters(self)
         
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """
 
-        # Load all rasters
-        input1_raster = self.parameterAsRasterLayer(parameters, self.INPUT1, context)
-        ds_input1 = gdal.Open(input1_raster.dataProvider().dataSourceUri())
-        arr_input1 = ds_input1.GetRasterBand(1).ReadAsArray()
-
-        input2_raster = self.parameterAsRasterLayer(parameters, self.INPUT2, context)
-        ds_input2 = gdal.Open(input2_raster.dataProvider().dataSourceUri())
-        arr_input2 = ds_input2.GetRasterBand(1).ReadAsArray()
-
-        input3_raster = self.parameterAsRasterLayer(parameters, self.INPUT3, context)
-        ds_input3 = gdal.Open(input3_raster.dataProvider().dataSourceUri())
-        arr_input3 = ds_input3.GetRasterBand(1).ReadAsArray()
-
-        input4_raster = self.parameterAsRasterLayer(parameters, self.INPUT4, context)
-        ds_input4 = gdal.Open(input4_raster.dataProvider().dataSourceUri())
-        arr_input4 = ds_input4.GetRasterBand(1).ReadAsArray()
-
-        input5_raster = self.parameterAsRasterLayer(parameters, self.INPUT5, context)
-        ds_input5 = gdal.Open(input5_raster.dataProvider().dataSourceUri())
-        arr_input5 = ds_input5.GetRasterBand(1).ReadAsArray()
-
-        input6_raster = self.parameterAsRasterLayer(parameters, self.INPUT6, context)
-        ds_input6 = gdal.Open(input6_raster.dataProvider().dataSourceUri())
-        arr_input6 = ds_input6.GetRasterBand(1).ReadAsArray()
-
-        input7_raster = self.parameterAsRasterLayer(parameters, self.INPUT7, context)
-        ds_input7 = gdal.Open(input7_raster.dataProvider().dataSourceUri())
-        arr_input7 = ds_input7.GetRasterBand(1).ReadAsArray()
-
-        input8_raster = self.parameterAsRasterLayer(parameters, self.INPUT8, context)
-        ds_input8 = gdal.Open(input8_raster.dataProvider().dataSourceUri())
-        arr_input8 = ds_input8.GetRasterBand(1).ReadAsArray()
-
-        input9_raster = self.parameterAsRasterLayer(parameters, self.INPUT9, context)
-        ds_input9 = gdal.Open(input9_raster.dataProvider().dataSourceUri())
-        arr_input9 = ds_input9.GetRasterBand(1).ReadAsArray()
-
-        arr_total = arr_input1 + arr_input2 + arr_input3 + arr_input4 + arr_input5 + arr_input6 + arr_input7 + \
-                    arr_input8 + arr_input9
+        # Open all rasters, pixels are read block by block while summing
+        input_params = [self.INPUT1, self.INPUT2, self.INPUT3, self.INPUT4, self.INPUT5, self.INPUT6,
+                        self.INPUT7, self.INPUT8, self.INPUT9]
+        ds_inputs = []
+        input_uris = []
+        for input_param in input_params:
+            input_raster = self.parameterAsRasterLayer(parameters, input_param, context)
+            input_uris.append(input_raster.dataProvider().dataSourceUri())
+            ds_inputs.append(gdal.Open(input_uris[-1]))
+        ds_input1 = ds_inputs[0]
+        cols = ds_input1.RasterXSize
+        rows = ds_input1.RasterYSize
+        for ds_input in ds_inputs:
+            if ds_input.RasterXSize != cols or ds_input.RasterYSize != rows:
+                raise QgsProcessingException(self.tr('I raster in input devono avere le stesse dimensioni'))
 
         # Initialize and write on output raster
         path_output = self.parameterAsString(parameters, self.OUTPUT, context)
         file_output = path_output + '/SE_10_SE_total.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        [rows, cols] = arr_total.shape
         area_pixel = self.parameterAsInt(parameters, self.PIXEL_RES, context) * self.parameterAsInt(
             parameters, self.PIXEL_RES, context)
-        total_area = np.sum(arr_total) / (cols * rows * area_pixel)
-        outdata = driver.Create(file_output, cols, rows,  1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(ds_input1.GetGeoTransform())##sets same geotransform as input
-        outdata.SetProjection(ds_input1.GetProjection())##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(arr_total)
-        outdata.FlushCache() ##saves to disk!!
+        outdata = RasterWriter(file_output, cols, rows, ds_input1, output_profile(self, parameters, context))
+        windowed = self.parameterAsBool(parameters, self.BLOCCHI, context)
+        total_value = sum_rasters(ds_inputs, outdata.band, windowed, feedback)
+        total_area = total_value / (cols * rows * area_pixel)
+        outdata.close()
+
+        # Per-transition deltas written by the SE algorithms next to their delta rasters
+        delta_transitions = None
+        n_explained = 0
+        for input_uri in input_uris:
+            try:
+                delta = load_transition_delta(input_uri)
+            except ValueError as e:
+                feedback.pushInfo(self.tr('Matrice delle transizioni ignorata: %s') % e)
+                continue
+            if delta is None:
+                continue
+            if delta_transitions is None:
+                delta_transitions = np.zeros_like(delta)
+            delta_transitions += delta
+            n_explained += 1
+        if delta_transitions is not None:
+            labels = TransitionMatrix(n_lucodes=len(delta_transitions) - 1).labels()
+            write_matrix_csv(path_output + '/SE_10_SE_total_transizioni.csv', delta_transitions, labels)
         report_output = path_output + '/SE_totale.txt'
         f = open(report_output, "w+")
         today = datetime.today().strftime('%Y-%m-%d-%H:%M:%S')
         f.write("Sommario dell'analisi dei servizi ecosistemici\n")
         f.write("Data: " + today +"\n\n\n")
         f.write("Differenze tra stato di progetto e stato attuale\n\n")
-        f.write("Differenza di valore totale (€): %f \n" % (np.sum(arr_total)))
+        f.write("Differenza di valore totale (€): %f \n" % (total_value))
         f.write("Differenza per unità di superficie (€/ha): %f \n" % (
             total_area * 10000))
+        if delta_transitions is not None:
+            f.write("\n\nTransizioni dell'uso del suolo (%i servizi su %i)\n\n" % (n_explained, len(input_uris)))
+            f.write("Differenza di valore spiegata dalle transizioni (€): %f \n" % (np.sum(delta_transitions)))
+            f.write("Principali transizioni (LUCODE attuale -> LUCODE di progetto: €)\n")
+            for present_lucode, future_lucode, delta in top_transitions(delta_transitions, labels):
+                f.write("%s -> %s: %f \n" % (present_lucode, future_lucode, delta))
         return {self.OUTPUT: total_area}
 
         
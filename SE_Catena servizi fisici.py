@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessing,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterRasterLayer,
+                       QgsProcessingParameterFolderDestination)
+from qgis import processing
+import json
+import os
+import sys
+
+# The se_torino package is kept in the same folder as the scripts
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+from se_torino.parameters import add_output_profile_parameters, output_profile_values
+from se_torino.raster import release_raster
+
+# Physical services: stage algorithm, its phase parameter, the stage outputs
+# with the (present, future) inputs of the SE algorithm they feed, the SE
+# algorithm and its (present, future) years parameters
+CHAINS = [
+    ('script:Calcolo Carbonio', 'FASE', [('CARBONIO', 'INPUT1', 'INPUT2')],
+     'script:SE Sequesto Carbonio', ('INPUT3', 'INPUT4')),
+    ('script:Calcolo Infiltrazione', 'FASE', [('INFILTRAZIONE', 'INPUTRP', 'INPUTRF')],
+     'script:SE Infiltrazione', ('INPUTPRE', 'INPUTFUT')),
+    ('script:Calcolo Rimozione Inquinanti', 'STATO', [('OZONO', 'INPUTOP', 'INPUTOF'),
+                                                     ('PM10', 'INPUTPP', 'INPUTPF'),
+                                                     ('NO2', 'INPUTNP', 'INPUTNF')],
+     'script:SE Rimozione Inquinanti', ('INPUTPRE', 'INPUTFUT')),
+]
+
+class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
+    """
+    This is an example algorithm that takes a vector layer and
+    creates a new identical one.
+
+    It is meant to be used as an example of how to create your own
+    algorithms and explain methods and variables used to do it. An
+    algorithm like this will be available in all elements, and there
+    is not need for additional work.
+
+    All Processing algorithms should extend the QgsProcessingAlgorithm
+    class.
+    """
+
+    # Constants used to refer to parameters and outputs. They will be
+    # used when calling the algorithm from another algorithm, or when
+    # calling from the QGIS console.
+
+    SERVIZIO = 'SERVIZIO'
+    INPUTRP = 'INPUTRP'
+    INPUTPRE = 'INPUTPRE'
+    INPUTRF = 'INPUTRF'
+    INPUTFUT = 'INPUTFUT'
+    PIXEL_RES = 'PIXEL_RES'
+    PARAMETRI = 'PARAMETRI'
+    SALVA_INTERMEDI = 'SALVA_INTERMEDI'
+    OUTPUT = 'OUTPUT'
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return ExampleProcessingAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'SE Catena servizi fisici'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr('SE Catena servizi fisici')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr('SE Torino')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'examplescripts'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it..
+        """
+        return self.tr("Algoritmo che esegue il calcolo di un servizio fisico (carbonio, infiltrazione, rimozione "
+                       "inquinanti) per lo stato attuale e di progetto e la relativa valutazione economica, "
+                       "passando i raster intermedi in memoria. I parametri specifici sono letti da un file JSON "
+                       "con le sezioni \"presente\", \"futuro\" e \"valutazione\", ad esempio "
+                       "{\"presente\": {\"ESEMPL1\": 10}, \"valutazione\": {\"INPUT5\": 100}}")
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.SERVIZIO,
+                self.tr('Servizio'),
+                options=[self.tr('Sequestro di carbonio'), self.tr('Infiltrazione'),
+                         self.tr('Rimozione inquinanti')],
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUTRP,
+                self.tr('Raster Uso suolo Stato attuale'),
+                [QgsProcessing.TypeRaster]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.INPUTPRE,
+            self.tr('Anno attuale'),
+            QgsProcessingParameterNumber.Integer,
+            2021
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUTRF,
+                self.tr('Raster Uso suolo Stato di progetto'),
+                [QgsProcessing.TypeRaster]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.INPUTFUT,
+            self.tr('Anno progetto'),
+            QgsProcessingParameterNumber.Integer,
+            2030
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.PIXEL_RES,
+            self.tr('Risoluzione spaziale raster (m)'),
+            QgsProcessingParameterNumber.Integer,
+            2
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.PARAMETRI,
+                self.tr('Parametri specifici (JSON)'),
+                extension='json',
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+            self.SALVA_INTERMEDI,
+            self.tr('Salva i raster intermedi su disco'),
+            defaultValue=False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT,
+                self.tr('Salva nella cartella')
+            )
+        )
+
+        add_output_profile_parameters(self)
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        stage_id, phase_param, stage_outputs, se_id, years = CHAINS[
+            self.parameterAsEnum(parameters, self.SERVIZIO, context)]
+
+        # Specific parameters of the stage and of the SE algorithm
+        specific_parameters = {}
+        parameters_path = self.parameterAsFile(parameters, self.PARAMETRI, context)
+        if parameters_path:
+            with open(parameters_path) as f:
+                specific_parameters = json.load(f)
+        for key in specific_parameters.keys():
+            if key not in ['presente', 'futuro', 'valutazione']:
+                raise QgsProcessingException(self.tr('Sezione sconosciuta nel file dei parametri: %s') % key)
+
+        present_raster = self.parameterAsRasterLayer(parameters, self.INPUTRP, context)
+        future_raster = self.parameterAsRasterLayer(parameters, self.INPUTRF, context)
+        pixel_res = self.parameterAsInt(parameters, self.PIXEL_RES, context)
+        save_intermediates = self.parameterAsBool(parameters, self.SALVA_INTERMEDI, context)
+        profile_values = output_profile_values(self, parameters, context)
+        path_output = self.parameterAsString(parameters, self.OUTPUT, context)
+
+        se_parameters = {
+            self.PIXEL_RES: pixel_res,
+            years[0]: self.parameterAsInt(parameters, self.INPUTPRE, context),
+            years[1]: self.parameterAsInt(parameters, self.INPUTFUT, context),
+            self.OUTPUT: path_output
+        }
+        intermediates = []
+        try:
+            for phase, (lulc_raster, section) in enumerate([(present_raster, 'presente'), (future_raster, 'futuro')]):
+                if feedback.isCanceled():
+                    return {}
+                stage_parameters = {
+                    'INPUT': lulc_raster.dataProvider().dataSourceUri(),
+                    phase_param: phase,
+                    self.PIXEL_RES: pixel_res,
+                    self.SALVA_INTERMEDI: save_intermediates,
+                    self.OUTPUT: path_output
+                }
+                stage_parameters.update(profile_values)
+                stage_parameters.update(specific_parameters.get(section, {}))
+                stage_result = processing.run(stage_id, stage_parameters, context=context, feedback=feedback,
+                                              is_child_algorithm=True)
+                # Stage outputs are handed to the SE algorithm by path, in /vsimem/ when not saved
+                for output_name, present_input, future_input in stage_outputs:
+                    se_parameters[[present_input, future_input][phase]] = stage_result[output_name]
+                    intermediates.append(stage_result[output_name])
+            se_parameters.update(profile_values)
+            se_parameters.update(specific_parameters.get('valutazione', {}))
+            processing.run(se_id, se_parameters, context=context, feedback=feedback, is_child_algorithm=True)
+        finally:
+            for intermediate in intermediates:
+                release_raster(intermediate)
+        return {self.OUTPUT: path_output}
+
+
+        # -----------------------------------------------------------------------------------
+        # Copyright (c) 2021 Città di Torino.
+        #
+        # This material is free software: you can redistribute it and/or modify
+        # it under the terms of the GNU General Public License as published by
+        # the Free Software Foundation, either version 2 of the License, or
+        # (at your option) any later version.
+        #
+        # This program is distributed in the hope that it will be useful,
+        # but WITHOUT ANY WARRANTY; without even the implied warranty of
+        # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+        # GNU General Public License for more details.
+        #
+        # You should have received a copy of the GNU General Public License
+        # along with this program. If not, see http://www.gnu.org/licenses.
+        # -----------------------------------------------------------------------------------
+
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessing,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterRasterLayer,
+                       QgsProcessingParameterFolderDestination)
+import os
+import sys
+from datetime import datetime
+
+# The se_torino package is kept in the same folder as the scripts
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+from se_torino.raster import load_raster, write_raster
+from se_torino.parameters import add_output_profile_parameters, output_profile
+from se_torino.parallel import map_states
+from se_torino.kernels import connettivita
+from se_torino.kernels.connettivita import ConnettivitaParameters
+
+class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
+    """
+    This is an example algorithm that takes a vector layer and
+    creates a new identical one.
+
+    It is meant to be used as an example of how to create your own
+    algorithms and explain methods and variables used to do it. An
+    algorithm like this will be available in all elements, and there
+    is not need for additional work.
+
+    All Processing algorithms should extend the QgsProcessingAlgorithm
+    class.
+    """
+
+    # Constants used to refer to parameters and outputs. They will be
+    # used when calling the algorithm from another algorithm, or when
+    # calling from the QGIS console.
+    INPUTRP = 'INPUTRP'
+    INPUTPRE = 'INPUTPRE'
+    INPUTRF = 'INPUTRF'
+    INPUTFUT = 'INPUTFUT'
+    PIXEL_RES = 'PIXEL_RES'
+    RESISTENZA_MAX = 'RESISTENZA_MAX'
+    SOGLIA_HABITAT = 'SOGLIA_HABITAT'
+    AREA_MINIMA = 'AREA_MINIMA'
+    NUMERO_PATCH = 'NUMERO_PATCH'
+    AGGREGAZIONE = 'AGGREGAZIONE'
+    TOLLERANZA = 'TOLLERANZA'
+    OUTPUT = 'OUTPUT'
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return ExampleProcessingAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'SE Connettivita ecologica'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr('SE Connettivita ecologica')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr('SE Torino')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'examplescripts'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it..
+        """
+        return self.tr("Algoritmo per il calcolo della connettività ecologica tra le patch di habitat con la teoria dei circuiti "
+                       "(resistenza dei pixel da H_score), nell'ambito del calcolo dei Servizi Ecosistemici per la Città di Torino")
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUTRP,
+                self.tr('Raster Uso suolo Stato attuale'),
+                [QgsProcessing.TypeRaster]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.INPUTPRE,
+            self.tr('Anno attuale'),
+            QgsProcessingParameterNumber.Integer,
+            2021
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUTRF,
+                self.tr('Raster Uso suolo Stato di progetto'),
+                [QgsProcessing.TypeRaster]
+            )
+        )
+        
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.INPUTFUT,
+            self.tr('Anno progetto'),
+            QgsProcessingParameterNumber.Integer,
+            2030
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.PIXEL_RES,
+            self.tr('Risoluzione spaziale raster (m)'),
+            QgsProcessingParameterNumber.Integer,
+            2
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.RESISTENZA_MAX,
+            self.tr('Resistenza dei pixel con H_score 0 (1 con H_score 1)'),
+            QgsProcessingParameterNumber.Double,
+            100
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.SOGLIA_HABITAT,
+            self.tr('Soglia H_score delle patch di habitat (0-1)'),
+            QgsProcessingParameterNumber.Double,
+            0.5
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.AREA_MINIMA,
+            self.tr('Superficie minima delle patch sorgente (ha)'),
+            QgsProcessingParameterNumber.Double,
+            1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.NUMERO_PATCH,
+            self.tr('Numero massimo di patch sorgente (le più grandi)'),
+            QgsProcessingParameterNumber.Integer,
+            20
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.AGGREGAZIONE,
+            self.tr('Aggregazione dei pixel (lato delle celle in pixel)'),
+            QgsProcessingParameterNumber.Integer,
+            5
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.TOLLERANZA,
+            self.tr('Tolleranza del risolutore'),
+            QgsProcessingParameterNumber.Double,
+            1e-6
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT,
+                self.tr('Salva nella cartella')
+            )
+        )
+
+        add_output_profile_parameters(self)
+
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        if connettivita.sparse is None:
+            raise QgsProcessingException(self.tr('Il calcolo della connettività richiede scipy'))
+        if connettivita.pyamg is None:
+            feedback.pushInfo(self.tr('pyamg non disponibile: gradiente coniugato con precondizionatore di Jacobi'))
+
+        # Output raster format
+        profile = output_profile(self, parameters, context)
+
+        # Present and future rasters
+        present_raster = self.parameterAsRasterLayer(parameters, self.INPUTRP, context)
+        future_raster = self.parameterAsRasterLayer(parameters, self.INPUTRF, context)
+        present_uri = present_raster.dataProvider().dataSourceUri()
+        future_uri = future_raster.dataProvider().dataSourceUri()
+        params = ConnettivitaParameters(
+            self.parameterAsInt(parameters, self.PIXEL_RES, context),
+            self.parameterAsDouble(parameters, self.RESISTENZA_MAX, context),
+            self.parameterAsInt(parameters, self.AGGREGAZIONE, context),
+            self.parameterAsDouble(parameters, self.SOGLIA_HABITAT, context),
+            self.parameterAsDouble(parameters, self.AREA_MINIMA, context),
+            self.parameterAsInt(parameters, self.NUMERO_PATCH, context),
+            self.parameterAsDouble(parameters, self.TOLLERANZA, context))
+
+        def compute_state(raster_uri):
+            # Load raster
+            ds, arr = load_raster(raster_uri)
+            # Clean negative values
+            arr[arr < 0] = 0
+            current, stats = connettivita.current_density(arr, params)
+            return ds, current, stats
+
+        # Present and future states are independent, compute them concurrently
+        [(ds_present, current_present, stats_present),
+         (ds_future, current_future, stats_future)] = map_states(compute_state, [present_uri, future_uri])
+        for title, stats in [('stato attuale', stats_present), ('stato di progetto', stats_future)]:
+            if stats['n_sources'] < 2:
+                feedback.pushInfo(self.tr('Meno di due patch sorgente nello %s: corrente nulla') % title)
+            if stats['not_converged']:
+                feedback.pushInfo(self.tr('Soluzioni non convergenti nello %s: %i') % (title, stats['not_converged']))
+
+        path_output = self.parameterAsString(parameters, self.OUTPUT, context)
+        # Initialize and write on output raster
+        file_output = path_output + '/07_connettività_presente_corrente.tiff'
+        write_raster(file_output, current_present, ds_present, profile)
+        # Initialize and write on output raster
+        file_output = path_output + '/07_connettività_futuro_corrente.tiff'
+        write_raster(file_output, current_future, ds_present, profile)
+        # Initialize and write on output raster
+        file_output = path_output + '/07_connettività_differenza_corrente.tiff'
+        write_raster(file_output, current_future - current_present, ds_present, profile)
+        # Years
+        present = self.parameterAsInt(parameters, self.INPUTPRE, context)
+        future = self.parameterAsInt(parameters, self.INPUTFUT, context)
+        report_output = path_output + '/SE_connettività.txt'
+        f = open(report_output, "w+")
+        today = datetime.today().strftime('%Y-%m-%d-%H:%M:%S')
+        f.write("Sommario dell'analisi della connettività ecologica\n")
+        f.write("Data: " + today +"\n\n\n")
+        f.write("Lato delle celle di calcolo (m): %f \n" % (params.cell_size))
+        f.write("Resistenza dei pixel con H_score 0: %f \n" % (params.max_resistance))
+        f.write("Soglia H_score delle patch di habitat: %f \n\n\n" % (params.threshold))
+        f.write("Analisi stato di fatto\n\n")
+        f.write("Anno corrente: %i \n" % (present))
+        f.write("Numero di patch di habitat: %i \n" % (stats_present['n_patches']))
+        f.write("Numero di patch sorgente: %i \n" % (stats_present['n_sources']))
+        f.write("Superficie delle patch sorgente (ha): %f \n" % (stats_present['source_area']))
+        f.write("Corrente cumulativa media per cella (A): %f \n" % (stats_present['current_mean']))
+        f.write("Corrente cumulativa massima per cella (A): %f \n\n\n" % (stats_present['current_max']))
+        f.write("Analisi stato di progetto\n\n")
+        f.write("Anno progetto: %i \n" % (future))
+        f.write("Numero di patch di habitat: %i \n" % (stats_future['n_patches']))
+        f.write("Numero di patch sorgente: %i \n" % (stats_future['n_sources']))
+        f.write("Superficie delle patch sorgente (ha): %f \n" % (stats_future['source_area']))
+        f.write("Corrente cumulativa media per cella (A): %f \n" % (stats_future['current_mean']))
+        f.write("Corrente cumulativa massima per cella (A): %f \n\n\n" % (stats_future['current_max']))
+        f.write("Differenze tra stato di progetto e stato attuale\n\n")
+        f.write("Anno progetto: %i - %i\n" % (present, future))
+        f.write("Differenza della corrente cumulativa media per cella (A): %f \n" % (
+            stats_future['current_mean'] - stats_present['current_mean']))
+        return {self.OUTPUT: 'Completed'}
+
+        
+        # -----------------------------------------------------------------------------------  
+        # Copyright (c) 2021 Città di Torino.
+        # 
+        # This material is free software: you can redistribute it and/or modify
+        # it under the terms of the GNU General Public License as published by
+        # the Free Software Foundation, either version 2 of the License, or
+        # (at your option) any later version.
+        # 
+        # This program is distributed in the hope that it will be useful,
+        # but WITHOUT ANY WARRANTY; without even the implied warranty of
+        # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+        # GNU General Public License for more details.
+        # 
+        # You should have received a copy of the GNU General Public License
+        # along with this program. If not, see http://www.gnu.org/licenses.
+        # -----------------------------------------------------------------------------------  
+
+
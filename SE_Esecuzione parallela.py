@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsApplication,
+                       QgsProcessing,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterFile,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterRasterLayer,
+                       QgsProcessingParameterString,
+                       QgsProcessingParameterFolderDestination)
+from qgis import processing
+import json
+import os
+import sys
+from datetime import datetime
+
+# The se_torino package is kept in the same folder as the scripts
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+from se_torino.parameters import add_output_profile_parameters, output_profile_values
+from se_torino.runner import SE_MODULES, find_qgis_process, missing_inputs, run_modules
+
+class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
+    """
+    This is an example algorithm that takes a vector layer and
+    creates a new identical one.
+
+    It is meant to be used as an example of how to create your own
+    algorithms and explain methods and variables used to do it. An
+    algorithm like this will be available in all elements, and there
+    is not need for additional work.
+
+    All Processing algorithms should extend the QgsProcessingAlgorithm
+    class.
+    """
+
+    # Constants used to refer to parameters and outputs. They will be
+    # used when calling the algorithm from another algorithm, or when
+    # calling from the QGIS console.
+
+    INPUTRP = 'INPUTRP'
+    INPUTPRE = 'INPUTPRE'
+    INPUTRF = 'INPUTRF'
+    INPUTFUT = 'INPUTFUT'
+    PIXEL_RES = 'PIXEL_RES'
+    PARAMETRI = 'PARAMETRI'
+    PROCESSI = 'PROCESSI'
+    QGIS_PROCESS = 'QGIS_PROCESS'
+    OUTPUT = 'OUTPUT'
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return ExampleProcessingAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'SE Esecuzione parallela'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr('SE Esecuzione parallela')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr('SE Torino')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'examplescripts'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it..
+        """
+        return self.tr("Algoritmo per l'esecuzione in parallelo dei nove Servizi Ecosistemici e del calcolo "
+                       "complessivo. I parametri specifici di ogni servizio sono letti da un file JSON con una "
+                       "sezione per servizio (sequestro_carbonio, rimozione_inquinanti, regolazione_temperatura, "
+                       "protezione_idrogeologica, infiltrazione, benefici_culturali, biodiversita, "
+                       "produzione_agricola, impollinazione), ad esempio "
+                       "{\"protezione_idrogeologica\": {\"INPUTP\": 50, \"GRUPPO\": 1}}. "
+                       "Sequestro carbonio (INPUT1, INPUT2), rimozione inquinanti (INPUTNP, INPUTPP, INPUTOP, "
+                       "INPUTNF, INPUTPF, INPUTOF) e infiltrazione (INPUTRP, INPUTRF) leggono i raster prodotti "
+                       "dagli algoritmi di calcolo, che vanno indicati nel file dei parametri: l'esecuzione non "
+                       "parte se mancano.")
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUTRP,
+                self.tr('Raster Uso suolo Stato attuale'),
+                [QgsProcessing.TypeRaster]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.INPUTPRE,
+            self.tr('Anno attuale'),
+            QgsProcessingParameterNumber.Integer,
+            2021
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUTRF,
+                self.tr('Raster Uso suolo Stato di progetto'),
+                [QgsProcessing.TypeRaster]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.INPUTFUT,
+            self.tr('Anno progetto'),
+            QgsProcessingParameterNumber.Integer,
+            2030
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.PIXEL_RES,
+            self.tr('Risoluzione spaziale raster (m)'),
+            QgsProcessingParameterNumber.Integer,
+            2
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.PARAMETRI,
+                self.tr('Parametri specifici dei servizi (JSON)'),
+                extension='json',
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.PROCESSI,
+            self.tr('Numero di processi in parallelo'),
+            QgsProcessingParameterNumber.Integer,
+            min(len(SE_MODULES), os.cpu_count() or 1),
+            minValue=1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.QGIS_PROCESS,
+                self.tr('Percorso di qgis_process (vuoto per la ricerca automatica)'),
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT,
+                self.tr('Salva nella cartella')
+            )
+        )
+
+        add_output_profile_parameters(self)
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        qgis_process = self.parameterAsString(parameters, self.QGIS_PROCESS, context)
+        if not qgis_process:
+            qgis_process = find_qgis_process(QgsApplication.prefixPath())
+        if not qgis_process:
+            raise QgsProcessingException(self.tr('Eseguibile qgis_process non trovato'))
+
+        # Module specific parameters
+        module_parameters = {}
+        parameters_path = self.parameterAsFile(parameters, self.PARAMETRI, context)
+        if parameters_path:
+            with open(parameters_path) as f:
+                module_parameters = json.load(f)
+        module_keys = [module.key for module in SE_MODULES]
+        for key in module_parameters.keys():
+            if key not in module_keys:
+                raise QgsProcessingException(self.tr('Servizio sconosciuto nel file dei parametri: %s') % key)
+        missing = missing_inputs(module_parameters)
+        if missing:
+            raise QgsProcessingException(self.tr('Input mancanti nel file dei parametri: %s') % '; '.join(
+                '%s (%s)' % (module.key, ', '.join(names)) for module, names in missing))
+
+        present_raster = self.parameterAsRasterLayer(parameters, self.INPUTRP, context)
+        future_raster = self.parameterAsRasterLayer(parameters, self.INPUTRF, context)
+        present = self.parameterAsInt(parameters, self.INPUTPRE, context)
+        future = self.parameterAsInt(parameters, self.INPUTFUT, context)
+        pixel_res = self.parameterAsInt(parameters, self.PIXEL_RES, context)
+        profile_values = output_profile_values(self, parameters, context)
+        path_output = self.parameterAsString(parameters, self.OUTPUT, context)
+
+        jobs = []
+        for module in SE_MODULES:
+            params = {self.PIXEL_RES: pixel_res, module.years[0]: present, module.years[1]: future}
+            if module.lulc is not None:
+                params[module.lulc[0]] = present_raster.dataProvider().dataSourceUri()
+                params[module.lulc[1]] = future_raster.dataProvider().dataSourceUri()
+            params.update(profile_values)
+            params.update(module_parameters.get(module.key, {}))
+            params[self.OUTPUT] = os.path.join(path_output, module.key)
+            jobs.append((module, params, params[self.OUTPUT]))
+
+        workers = self.parameterAsInt(parameters, self.PROCESSI, context)
+        feedback.pushInfo(self.tr('Esecuzione di %i servizi con %i processi') % (len(jobs), workers))
+        results = run_modules(qgis_process, jobs, workers, feedback)
+
+        report_output = path_output + '/SE_esecuzione_parallela.txt'
+        f = open(report_output, "w+")
+        today = datetime.today().strftime('%Y-%m-%d-%H:%M:%S')
+        f.write("Sommario dell'esecuzione parallela dei servizi ecosistemici\n")
+        f.write("Data: " + today + "\n")
+        f.write("Processi in parallelo: %i \n\n\n" % (workers))
+        for result in results:
+            f.write("%s\n" % (result.module.name))
+            if result.ok:
+                f.write("Stato: completato \n")
+            else:
+                f.write("Stato: errore (codice %i), vedere %s \n" % (result.returncode, result.log_path))
+            f.write("Tempo di esecuzione (s): %f \n" % (result.wall_time))
+            if result.peak_rss is not None:
+                f.write("Memoria di picco (MB): %f \n" % (result.peak_rss))
+            for output in result.outputs:
+                f.write("Output: %s \n" % (output))
+            f.write("\n")
+            if result.peak_rss is not None:
+                feedback.pushInfo(self.tr('%s: %.1f s, %.1f MB') % (result.module.name, result.wall_time,
+                                                                    result.peak_rss))
+            else:
+                feedback.pushInfo(self.tr('%s: %.1f s') % (result.module.name, result.wall_time))
+        f.close()
+
+        failed = [result.module.name for result in results if not result.ok or result.delta_path is None]
+        if failed:
+            raise QgsProcessingException(self.tr('Servizi non completati: %s. Vedere %s') % (
+                ', '.join(failed), report_output))
+
+        # Sum of the nine delta rasters
+        complessivo_parameters = {self.PIXEL_RES: pixel_res, 'BLOCCHI': True, self.OUTPUT: path_output}
+        for result in results:
+            complessivo_parameters[result.module.complessivo] = result.delta_path
+        complessivo_parameters.update(profile_values)
+        processing.run('script:SE Calcolo Complessivo', complessivo_parameters, context=context,
+                       feedback=feedback, is_child_algorithm=True)
+        return {self.OUTPUT: path_output}
+
+
+        # -----------------------------------------------------------------------------------
+        # Copyright (c) 2021 Città di Torino.
+        #
+        # This material is free software: you can redistribute it and/or modify
+        # it under the terms of the GNU General Public License as published by
+        # the Free Software Foundation, either version 2 of the License, or
+        # (at your option) any later version.
+        #
+        # This program is distributed in the hope that it will be useful,
+        # but WITHOUT ANY WARRANTY; without even the implied warranty of
+        # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+        # GNU General Public License for more details.
+        #
+        # You should have received a copy of the GNU General Public License
+        # along with this program. If not, see http://www.gnu.org/licenses.
+        # -----------------------------------------------------------------------------------
+
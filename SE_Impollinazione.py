@@ -17,14 +17,28 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingException,
                        QgsProcessingAlgorithm,
                        QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterBoolean,
                        QgsProcessingParameterNumber,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterFolderDestination)
 from qgis import processing
-import gdal
 import numpy as np
+import os
+import sys
 from datetime import datetime
 
+# The se_torino package is kept in the same folder as the scripts
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+from se_torino.raster import load_raster, raster_transitions, write_raster
+from se_torino.parameters import add_output_profile_parameters, output_profile
+from se_torino.lookup import describe_unknown
+from se_torino.parallel import map_states
+from se_torino.transition import TransitionMatrix, save_transition_delta
+from se_torino.kernels import impollinazione
+from se_torino.kernels.impollinazione import ImpollinazioneParameters
+
 class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     """
     This is an example algorithm that takes a vector layer and
@@ -48,6 +62,7 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     INPUTRF = 'INPUTRF'
     INPUTFUT = 'INPUTFUT'
     PIXEL_RES = 'PIXEL_RES'
+    SOLO_REPORT = 'SOLO_REPORT'
     OUTPUT = 'OUTPUT'
 
     def tr(self, string):
@@ -153,6 +168,14 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         )
     
 
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+            self.SOLO_REPORT,
+            self.tr('Solo report (nessun raster in output)'),
+            defaultValue=False
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterFolderDestination(
                 self.OUTPUT,
@@ -160,143 +183,57 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        add_output_profile_parameters(self)
+
 
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """
 
-        # Load present raster
-        present_raster = self.parameterAsRasterLayer(parameters, self.INPUTRP, context)
-        ds_present = gdal.Open(present_raster.dataProvider().dataSourceUri())
-        arr_present = ds_present.GetRasterBand(1).ReadAsArray()
-        # Clean negative values
-        arr_present[arr_present < 0] = 0
+        # Output raster format
+        profile = output_profile(self, parameters, context)
+        report_only = self.parameterAsBool(parameters, self.SOLO_REPORT, context)
 
-        # Load future raster
+        # Present and future rasters
+        present_raster = self.parameterAsRasterLayer(parameters, self.INPUTRP, context)
         future_raster = self.parameterAsRasterLayer(parameters, self.INPUTRF, context)
-        ds_future = gdal.Open(future_raster.dataProvider().dataSourceUri())
-        arr_future = ds_future.GetRasterBand(1).ReadAsArray()
-
-        area_pixel = self.parameterAsInt(parameters, self.PIXEL_RES, context) * self.parameterAsInt(
-            parameters, self.PIXEL_RES, context)
-
-        # Clean negative values
-        arr_future[arr_future < 0] = 0
-        # SE valore impollinazione per lucode
-        value_lucode = {}
-        value_lucode[1] = 0
-        value_lucode[2] = 0
-        value_lucode[3] = 0
-        value_lucode[4] = 0.0161
-        value_lucode[5] = 0
-        value_lucode[6] = 0.0161
-        value_lucode[7] = 0.0187
-        value_lucode[8] = 0
-        value_lucode[9] = 0.0187
-        value_lucode[10] = 0.0187
-        value_lucode[11] = 0
-        value_lucode[12] = 0.0161
-        value_lucode[13] = 0
-        value_lucode[14] = 0.0161
-        value_lucode[15] = 0
-        value_lucode[16] = 0.0161
-        value_lucode[17] = 0.0187
-        value_lucode[18] = 0
-        value_lucode[19] = 0.0187
-        value_lucode[20] = 0
-        value_lucode[21] = 0.0187
-        value_lucode[22] = 0.0187
-        value_lucode[23] = 0.0187
-        value_lucode[24] = 0.0161
-        value_lucode[25] = 0
-        value_lucode[26] = 0.0187
-        value_lucode[27] = 0.0161
-        value_lucode[28] = 0
-        value_lucode[29] = 0.0187
-        value_lucode[30] = 0.0161
-        value_lucode[31] = 0
-        value_lucode[32] = 0.0187
-        value_lucode[33] = 0.0161
-        value_lucode[34] = 0.0161
-        value_lucode[35] = 0
-        value_lucode[36] = 0
-        value_lucode[37] = 0.02
-        value_lucode[38] = 0.0187
-        value_lucode[39] = 0.0161
-        value_lucode[40] = 0
-        value_lucode[41] = 0
-        value_lucode[42] = 0
-        value_lucode[43] = 0.0187
-        value_lucode[44] = 0.0187
-        value_lucode[45] = 0
-        value_lucode[46] = 0.0187
-        value_lucode[47] = 0
-        value_lucode[48] = 0.0187
-        value_lucode[49] = 0.0187
-        value_lucode[50] = 0
-        value_lucode[51] = 0
-        value_lucode[52] = 0
-        value_lucode[53] = 0.0187
-        value_lucode[54] = 0
-        value_lucode[55] = 0
-        value_lucode[56] = 0
-        value_lucode[57] = 0.0187
-        value_lucode[58] = 0.0196
-        value_lucode[59] = 0
-        value_lucode[60] = 0
-        value_lucode[61] = 0.0161
-        value_lucode[62] = 0.0187
-        value_lucode[63] = 0.0161
-        value_lucode[64] = 0.0161
-        value_lucode[65] = 0
-        value_lucode[66] = 0
-        value_lucode[67] = 0
-        value_lucode[68] = 0.0161
-        value_lucode[69] = 0.0187
-        value_lucode[70] = 0.0161
-        value_lucode[71] = 0.0161
-        value_lucode[72] = 0
-        value_lucode[73] = 0
-        value_lucode[74] = 0.0187
-        value_lucode[75] = 0
-        value_lucode[76] = 0
-        value_lucode[77] = 0
-        value_lucode[78] = 0
-        value_lucode[79] = 0.0161
-        value_lucode[80] = 0
-        value_lucode[81] = 0
-        value_lucode[82] = 0.0187
-        value_lucode[83] = 0.0187
-        value_lucode[84] = 0.0187
-        value_lucode[85] = 0.0187
-        value_lucode[86] = 0.0187
-        value_lucode[87] = 0.0187
-        [rows, cols] = arr_present.shape
-        arr_value_present = np.zeros((rows, cols))
-        for lucode in np.unique(arr_present):
-            try:
-                arr_value_present[np.where(arr_present == lucode)] = value_lucode[lucode] * area_pixel
-            except:
-                pass
-        arr_value_future = np.zeros((rows, cols))
-        for lucode in np.unique(arr_future):
-            try:
-                arr_value_future[np.where(arr_future == lucode)] = value_lucode[lucode] * area_pixel
-            except:
-                pass
+        present_uri = present_raster.dataProvider().dataSourceUri()
+        future_uri = future_raster.dataProvider().dataSourceUri()
+
+        params = ImpollinazioneParameters(self.parameterAsInt(parameters, self.PIXEL_RES, context))
+
+        def compute_state(raster_uri):
+            # Load raster
+            ds, arr = load_raster(raster_uri)
+            # Clean negative values
+            arr[arr < 0] = 0
+            return ds, arr, impollinazione.state_arrays(arr, params)
+
+        if report_only:
+            # The report only needs the pixel counts, read both rasters by windows
+            ds_present, transitions = raster_transitions(present_uri, future_uri, feedback)
+        else:
+            # Present and future states are independent, compute them concurrently
+            [(ds_present, arr_present, arrays_present),
+             (ds_future, arr_future, arrays_future)] = map_states(compute_state, [present_uri, future_uri])
+            transitions = TransitionMatrix(arr_present, arr_future)
+        # Report totals from the lucode counts
+        stats_present = impollinazione.state_stats(transitions.present, params)
+        stats_future = impollinazione.state_stats(transitions.future, params)
+        if stats_present['unknown']:
+            feedback.pushInfo(self.tr('LUCODE non riconosciuti nello stato attuale: %s') % describe_unknown(stats_present['unknown']))
+        if stats_future['unknown']:
+            feedback.pushInfo(self.tr('LUCODE non riconosciuti nello stato di progetto: %s') % describe_unknown(stats_future['unknown']))
         # Initialize and write on output raster
         path_output = self.parameterAsString(parameters, self.OUTPUT, context)
-        file_output = path_output + '/SE_09_impollinazione_delta_euro.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        arr_diff_tot = arr_value_future - arr_value_present
-        outdata = driver.Create(file_output, cols, rows, 1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(ds_present.GetGeoTransform())  ##sets same geotransform as input
-        outdata.SetProjection(ds_present.GetProjection())  ##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(arr_diff_tot)
-        print(np.max(outdata.GetRasterBand(1).ReadAsArray()))
-        outdata.FlushCache()
-        print(path_output)
+        if not report_only:
+            file_output = path_output + '/SE_09_impollinazione_delta_euro.tiff'
+            arr_diff_tot = arrays_future['value'] - arrays_present['value']
+            write_raster(file_output, arr_diff_tot, ds_present, profile)
+        # Delta total from the present -> future lucode transitions
+        delta = impollinazione.delta_transitions(transitions, params)
+        save_transition_delta(path_output + '/SE_09_impollinazione_delta_euro.tiff', delta['value'])
         # Years
         present = self.parameterAsInt(parameters, self.INPUTPRE, context)
         future = self.parameterAsInt(parameters, self.INPUTFUT, context)
@@ -306,9 +243,9 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         f.write("Report dell'analisi dell'impollinazione del " + today + "\n")
         f.write("Anno corrente: %i \n" % (present))
         f.write("Anno progetto: %i \n" % (future))
-        f.write("Variazione valore totale dell'impollinazione (€): %d \n" % (np.sum(arr_diff_tot)))
-        f.write("Impollinazione Stato attuale (€): %f \n" % (np.sum(arr_value_present)))
-        f.write("Impollinazione Stato di progetto (€): %f \n" % (np.sum(arr_value_future)))
+        f.write("Variazione valore totale dell'impollinazione (€): %d \n" % (np.sum(delta['value'])))
+        f.write("Impollinazione Stato attuale (€): %f \n" % (stats_present['value']))
+        f.write("Impollinazione Stato di progetto (€): %f \n" % (stats_future['value']))
         return {self.OUTPUT: 'Completed'}
 
         
@@ -21,10 +21,20 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterFolderDestination)
 from qgis import processing
-import gdal
-import numpy as np
+import os
+import sys
 from datetime import datetime
 
+# The se_torino package is kept in the same folder as the scripts
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+from se_torino.raster import load_raster, write_raster
+from se_torino.parallel import map_states
+from se_torino.parameters import add_output_profile_parameters, output_profile
+from se_torino.kernels import infiltrazione
+from se_torino.kernels.infiltrazione import InfiltrazioneParameters
+
 class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     """
     This is an example algorithm that takes a vector layer and
@@ -159,45 +169,30 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
                 self.tr('Salva nella cartella')
             )
         )
+
+        add_output_profile_parameters(self)
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """
-        # Load present raster
-        present_raster = self.parameterAsRasterLayer(parameters, self.INPUTRP, context)
-        ds_present = gdal.Open(present_raster.dataProvider().dataSourceUri())
-        arr_present = ds_present.GetRasterBand(1).ReadAsArray()
-        # Clean negative values
-        arr_present[arr_present < 0] = 0
 
-        # Load future raster
+        # Output raster format
+        profile = output_profile(self, parameters, context)
+        # Load present and future rasters concurrently
+        present_raster = self.parameterAsRasterLayer(parameters, self.INPUTRP, context)
         future_raster = self.parameterAsRasterLayer(parameters, self.INPUTRF, context)
-        ds_future = gdal.Open(future_raster.dataProvider().dataSourceUri())
-        arr_future = ds_future.GetRasterBand(1).ReadAsArray()
+        [(ds_present, arr_present), (ds_future, arr_future)] = map_states(
+            load_raster, [present_raster.dataProvider().dataSourceUri(), future_raster.dataProvider().dataSourceUri()])
         # Clean negative values
+        arr_present[arr_present < 0] = 0
         arr_future[arr_future < 0] = 0
 
-        [rows, cols] = arr_present.shape
-
-        area_pixel = self.parameterAsInt(parameters, self.PIXEL_RES, context) * self.parameterAsInt(
-            parameters, self.PIXEL_RES, context)
-        # Value euro per cubic meter
-        value_coeff = 300
-        # Convert to squared meters and assign value
-        arr_value_present = value_coeff * (arr_present / 1000) * area_pixel
-        arr_value_future = value_coeff * (arr_future / 1000) * area_pixel
+        params = InfiltrazioneParameters(self.parameterAsInt(parameters, self.PIXEL_RES, context))
+        arrays, stats = infiltrazione.infiltrazione(arr_present, arr_future, params)
         # Initialize and write on output raster
         path_output = self.parameterAsString(parameters, self.OUTPUT, context)
         file_output = path_output + '/SE_05_infiltrazione_delta_euro.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        arr_diff_tot = arr_value_future - arr_value_present
-        outdata = driver.Create(file_output, cols, rows, 1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(ds_present.GetGeoTransform())  ##sets same geotransform as input
-        outdata.SetProjection(ds_present.GetProjection())  ##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(arr_diff_tot)
-        print(np.max(outdata.GetRasterBand(1).ReadAsArray()))
-        outdata.FlushCache()
-        print(path_output)
+        write_raster(file_output, arrays['value'], ds_present, profile)
         # Years
         present = self.parameterAsInt(parameters, self.INPUTPRE, context)
         future = self.parameterAsInt(parameters, self.INPUTFUT, context)
@@ -208,26 +203,22 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         f.write("Data: " + today +"\n\n\n")
         f.write("Analisi stato di fatto\n\n")
         f.write("Anno corrente: %i \n" % present)
-        f.write("Infiltrazione stato attuale (mm): %f \n" % (np.sum(arr_present)))
-        f.write("Infiltrazione sulla superficie totale - Stato attuale (mc): %f \n" % (
-                np.sum((arr_present / 1000) * area_pixel)))
-        f.write("Valore totale dell'infiltrazione (€/anno): %f \n\n" % (np.sum(arr_value_present)))
+        f.write("Infiltrazione stato attuale (mm): %f \n" % (stats['present']))
+        f.write("Infiltrazione sulla superficie totale - Stato attuale (mc): %f \n" % (stats['present_volume']))
+        f.write("Valore totale dell'infiltrazione (€/anno): %f \n\n" % (stats['present_value']))
         f.write("RIEPILOGO DATI INPUT stato di fatto\n")
         f.write("Analisi stato di progetto\n\n")
         f.write("Anno progetto: %i \n" % future)
-        f.write("Infiltrazione stato di progetto (mm): %f \n" % (np.sum(arr_future)))
-        f.write("Infiltrazione sulla superficie totale - Stato di progetto (mc): %f \n" % (
-                np.sum((arr_future / 1000) * area_pixel)))
-        f.write("Valore totale della infiltrazione (€/anno): %f \n\n" % (np.sum(arr_value_future)))
+        f.write("Infiltrazione stato di progetto (mm): %f \n" % (stats['future']))
+        f.write("Infiltrazione sulla superficie totale - Stato di progetto (mc): %f \n" % (stats['future_volume']))
+        f.write("Valore totale della infiltrazione (€/anno): %f \n\n" % (stats['future_value']))
         f.write("RIEPILOGO DATI INPUT stato di progetto\n")
         f.write("Differenze tra stato di progetto e stato attuale\n\n")
         f.write("Anno progetto: %i - %i\n" % (present, future))
-        f.write("Differenza della infiltrazione (mm): %f \n" % (np.sum(
-            arr_future - arr_present)))
-        f.write("Differenza della infiltrazione sulla superficie totale (mc): %f \n" % (
-            np.sum((arr_future - arr_present) / 1000 * area_pixel)))
+        f.write("Differenza della infiltrazione (mm): %f \n" % (stats['difference']))
+        f.write("Differenza della infiltrazione sulla superficie totale (mc): %f \n" % (stats['difference_volume']))
         f.write("Differenza in termini economici del SE di infiltrazione (stato di progetto – stato attuale) (€):%d \n" % (
-            np.sum(arr_diff_tot)))
+            stats['value']))
         return {self.OUTPUT: 'Completed'}
 
         
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessing,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterRasterLayer,
+                       QgsProcessingParameterFolderDestination)
+import os
+import sys
+from datetime import datetime
+
+# The se_torino package is kept in the same folder as the scripts
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+from se_torino.raster import raster_transitions
+from se_torino.transition import top_transitions
+
+class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
+    """
+    This is an example algorithm that takes a vector layer and
+    creates a new identical one.
+
+    It is meant to be used as an example of how to create your own
+    algorithms and explain methods and variables used to do it. An
+    algorithm like this will be available in all elements, and there
+    is not need for additional work.
+
+    All Processing algorithms should extend the QgsProcessingAlgorithm
+    class.
+    """
+
+    # Constants used to refer to parameters and outputs. They will be
+    # used when calling the algorithm from another algorithm, or when
+    # calling from the QGIS console.
+
+    INPUTRP = 'INPUTRP'
+    INPUTRF = 'INPUTRF'
+    OUTPUT = 'OUTPUT'
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return ExampleProcessingAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'SE Matrice di transizione'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr('SE Matrice di transizione')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr('SE Torino')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'examplescripts'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it..
+        """
+        return self.tr("Algoritmo che calcola la matrice di transizione tra gli usi del suolo dello stato attuale "
+                       "(righe) e dello stato di progetto (colonne), cioè il numero di pixel per ogni coppia di "
+                       "LUCODE. La matrice è salvata in formato CSV e NPY.")
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUTRP,
+                self.tr('Raster Uso suolo Stato attuale'),
+                [QgsProcessing.TypeRaster]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUTRF,
+                self.tr('Raster Uso suolo Stato di progetto'),
+                [QgsProcessing.TypeRaster]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT,
+                self.tr('Salva nella cartella')
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        present_raster = self.parameterAsRasterLayer(parameters, self.INPUTRP, context)
+        future_raster = self.parameterAsRasterLayer(parameters, self.INPUTRF, context)
+        ds_present, transitions = raster_transitions(present_raster.dataProvider().dataSourceUri(),
+                                                     future_raster.dataProvider().dataSourceUri(), feedback)
+        if feedback.isCanceled():
+            return {}
+
+        path_output = self.parameterAsString(parameters, self.OUTPUT, context)
+        transitions.save_csv(path_output + '/matrice_transizione.csv')
+        transitions.save_npy(path_output + '/matrice_transizione.npy')
+        n_pixel = transitions.present.n_pixel
+        feedback.pushInfo(self.tr('Pixel con uso del suolo modificato: %i su %i') % (transitions.n_changed, n_pixel))
+
+        report_output = path_output + '/SE_matrice_transizione.txt'
+        f = open(report_output, "w+")
+        today = datetime.today().strftime('%Y-%m-%d-%H:%M:%S')
+        f.write("Sommario della matrice di transizione dell'uso del suolo\n")
+        f.write("Data: " + today + "\n\n\n")
+        f.write("Numero di pixel: %i \n" % (n_pixel))
+        f.write("Numero di pixel con uso del suolo modificato: %i \n\n" % (transitions.n_changed))
+        f.write("Principali transizioni (LUCODE attuale -> LUCODE di progetto: pixel)\n")
+        for present_lucode, future_lucode, n_transition in top_transitions(transitions.counts, transitions.labels()):
+            f.write("%s -> %s: %i \n" % (present_lucode, future_lucode, n_transition))
+        f.close()
+        return {self.OUTPUT: path_output}
+
+
+        # -----------------------------------------------------------------------------------
+        # Copyright (c) 2021 Città di Torino.
+        #
+        # This material is free software: you can redistribute it and/or modify
+        # it under the terms of the GNU General Public License as published by
+        # the Free Software Foundation, either version 2 of the License, or
+        # (at your option) any later version.
+        #
+        # This program is distributed in the hope that it will be useful,
+        # but WITHOUT ANY WARRANTY; without even the implied warranty of
+        # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+        # GNU General Public License for more details.
+        #
+        # You should have received a copy of the GNU General Public License
+        # along with this program. If not, see http://www.gnu.org/licenses.
+        # -----------------------------------------------------------------------------------
+
@@ -17,13 +17,27 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingException,
                        QgsProcessingAlgorithm,
                        QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterBoolean,
                        QgsProcessingParameterNumber,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterFolderDestination)
 from qgis import processing
-import gdal
 import numpy as np
+import os
+import sys
 from datetime import datetime
+
+# The se_torino package is kept in the same folder as the scripts
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+from se_torino.raster import load_raster, raster_transitions, write_raster
+from se_torino.parameters import add_output_profile_parameters, output_profile
+from se_torino.lookup import describe_unknown
+from se_torino.parallel import map_states
+from se_torino.transition import TransitionMatrix, save_transition_delta
+from se_torino.kernels import produzione
+from se_torino.kernels.produzione import ProduzioneParameters
 import pandas as pd
 
 class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
@@ -49,6 +63,7 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     INPUTRF = 'INPUTRF'
     INPUTFUT = 'INPUTFUT'
     PIXEL_RES = 'PIXEL_RES'
+    SOLO_REPORT = 'SOLO_REPORT'
     OUTPUT = 'OUTPUT'
 
     def tr(self, string):
@@ -160,6 +175,14 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+            self.SOLO_REPORT,
+            self.tr('Solo report (nessun raster in output)'),
+            defaultValue=False
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterFolderDestination(
                 self.OUTPUT,
@@ -167,172 +190,70 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        add_output_profile_parameters(self)
+
 
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """
 
-        # Load present raster
-        present_raster = self.parameterAsRasterLayer(parameters, self.INPUTRP, context)
-        ds_present = gdal.Open(present_raster.dataProvider().dataSourceUri())
-        arr_present = ds_present.GetRasterBand(1).ReadAsArray()
-        # Clean negative values
-        arr_present[arr_present < 0] = 0
+        # Output raster format
+        profile = output_profile(self, parameters, context)
+        report_only = self.parameterAsBool(parameters, self.SOLO_REPORT, context)
 
-        # Load future raster
+        # Present and future rasters
+        present_raster = self.parameterAsRasterLayer(parameters, self.INPUTRP, context)
         future_raster = self.parameterAsRasterLayer(parameters, self.INPUTRF, context)
-        ds_future = gdal.Open(future_raster.dataProvider().dataSourceUri())
-        arr_future = ds_future.GetRasterBand(1).ReadAsArray()
-        # Clean negative values
-        arr_future[arr_future < 0] = 0
-
-        area_pixel = self.parameterAsInt(parameters, self.PIXEL_RES, context) * self.parameterAsInt(
-            parameters, self.PIXEL_RES, context)
-
-        # SE valore produzione agricola per lucode
-        production_lucode = {}
-        production_lucode[1] = 0
-        production_lucode[2] = 0.001053
-        production_lucode[3] = 0
-        production_lucode[4] = 0.003
-        production_lucode[5] = 0.003
-        production_lucode[6] = 0.002154
-        production_lucode[7] = 0
-        production_lucode[8] = 0
-        production_lucode[9] = 0
-        production_lucode[10] = 0
-        production_lucode[11] = 0
-        production_lucode[12] = 0
-        production_lucode[13] = 0
-        production_lucode[14] = 0
-        production_lucode[15] = 0
-        production_lucode[16] = 0
-        production_lucode[17] = 0
-        production_lucode[18] = 0
-        production_lucode[19] = 0
-        production_lucode[20] = 0
-        production_lucode[21] = 0
-        production_lucode[22] = 0
-        production_lucode[23] = 0
-        production_lucode[24] = 0
-        production_lucode[25] = 0
-        production_lucode[26] = 0
-        production_lucode[27] = 0
-        production_lucode[28] = 0
-        production_lucode[29] = 0.001053
-        production_lucode[30] = 0.001053
-        production_lucode[31] = 0
-        production_lucode[32] = 0
-        production_lucode[33] = 0
-        production_lucode[34] = 0
-        production_lucode[35] = 0
-        production_lucode[36] = 0
-        production_lucode[37] = 0.00245
-        production_lucode[38] = 0
-        production_lucode[39] = 0
-        production_lucode[40] = 0.00055
-        production_lucode[41] = 0.0012
-        production_lucode[42] = 0.004465
-        production_lucode[43] = 0
-        production_lucode[44] = 0
-        production_lucode[45] = 0
-        production_lucode[46] = 0
-        production_lucode[47] = 0
-        production_lucode[48] = 0
-        production_lucode[49] = 0
-        production_lucode[50] = 0
-        production_lucode[51] = 0
-        production_lucode[52] = 0
-        production_lucode[53] = 0
-        production_lucode[54] = 0
-        production_lucode[55] = 0
-        production_lucode[56] = 0
-        production_lucode[57] = 0.002318
-        production_lucode[58] = 0.002318
-        production_lucode[59] = 0.00051
-        production_lucode[60] = 0
-        production_lucode[61] = 0
-        production_lucode[62] = 0
-        production_lucode[63] = 0
-        production_lucode[64] = 0.0025
-        production_lucode[65] = 0.000273
-        production_lucode[66] = 0
-        production_lucode[67] = 0
-        production_lucode[68] = 0.0011
-        production_lucode[69] = 0.0011
-        production_lucode[70] = 0.0011
-        production_lucode[71] = 0
-        production_lucode[72] = 0
-        production_lucode[73] = 0.000246
-        production_lucode[74] = 0.001053
-        production_lucode[75] = 0.001053
-        production_lucode[76] = 0.0007
-        production_lucode[77] = 0
-        production_lucode[78] = 0
-        production_lucode[79] = 0
-        production_lucode[80] = 0
-        production_lucode[81] = 0.002318
-        production_lucode[82] = 0
-        production_lucode[83] = 0
-        production_lucode[84] = 0
-        production_lucode[85] = 0
-        production_lucode[86] = 0
-        production_lucode[87] = 0
-
-        [rows, cols] = arr_present.shape
-        n_valid_pixel = 0
-        arr_value_present = np.zeros((rows, cols))
-        arr_production_present = np.zeros((rows, cols))
+        present_uri = present_raster.dataProvider().dataSourceUri()
+        future_uri = future_raster.dataProvider().dataSourceUri()
+
         # Load input csv
         csv_path = self.parameterAsString(parameters, self.CSV, context)
         csv = pd.read_csv(csv_path, sep=';')
-        for lucode in np.unique(arr_present):
-            print(lucode)
-            if lucode in production_lucode.keys():
-                print(lucode)
-
-                arr_value_present[np.where(arr_present == lucode)] = csv[
-                    csv['Lucode'] == lucode]['Produzione agricola €_ton'] * production_lucode[lucode] * area_pixel
-                n_valid_pixel += np.sum(arr_present == lucode)
-                arr_production_present[np.where(arr_present == lucode)] = production_lucode[lucode] * area_pixel
-        arr_value_future = np.zeros((rows, cols))
-        arr_production_future = np.zeros((rows, cols))
-        for lucode in np.unique(arr_future):
-            try:
-                arr_value_future[np.where(arr_future == lucode)] = csv[
-                    csv['Lucode'] == lucode]['Produzione agricola €_ton'] * production_lucode[lucode] * area_pixel
-                arr_production_future[np.where(arr_future == lucode)] = production_lucode[lucode] * area_pixel
-            except:
-                pass
-        # Initialize and write on output raster
-        path_output = self.parameterAsString(parameters, self.OUTPUT, context)
-        file_output = path_output + '/08_produzione_agricola_presente_ton.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        outdata = driver.Create(file_output, cols, rows, 1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(ds_present.GetGeoTransform())  ##sets same geotransform as input
-        outdata.SetProjection(ds_present.GetProjection())  ##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(arr_production_present)
-        outdata.FlushCache()
-        # Initialize and write on output raster
-        path_output = self.parameterAsString(parameters, self.OUTPUT, context)
-        file_output = path_output + '/08_produzione_agricola_futuro_ton.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        outdata = driver.Create(file_output, cols, rows, 1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(ds_present.GetGeoTransform())  ##sets same geotransform as input
-        outdata.SetProjection(ds_present.GetProjection())  ##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(arr_production_future)
-        outdata.FlushCache()
-        # Initialize and write on output raster
+        price_lucode = dict(zip(csv['Lucode'], csv['Produzione agricola €_ton']))
+        params = ProduzioneParameters(self.parameterAsInt(parameters, self.PIXEL_RES, context), price_lucode)
+        area_pixel = params.area_pixel
+
+        def compute_state(raster_uri):
+            # Load raster
+            ds, arr = load_raster(raster_uri)
+            # Clean negative values
+            arr[arr < 0] = 0
+            return ds, arr, produzione.state_arrays(arr, params)
+
+        if report_only:
+            # The report only needs the pixel counts, read both rasters by windows
+            ds_present, transitions = raster_transitions(present_uri, future_uri, feedback)
+        else:
+            # Present and future states are independent, compute them concurrently
+            [(ds_present, arr_present, arrays_present),
+             (ds_future, arr_future, arrays_future)] = map_states(compute_state, [present_uri, future_uri])
+            transitions = TransitionMatrix(arr_present, arr_future)
+        # Report totals from the lucode counts
+        stats_present = produzione.state_stats(transitions.present, params)
+        stats_future = produzione.state_stats(transitions.future, params)
+        if stats_present['unknown']:
+            feedback.pushInfo(self.tr('LUCODE non riconosciuti nello stato attuale: %s') % describe_unknown(stats_present['unknown']))
+        if stats_future['unknown']:
+            feedback.pushInfo(self.tr('LUCODE non riconosciuti nello stato di progetto: %s') % describe_unknown(stats_future['unknown']))
+        n_valid_pixel = stats_present['n_valid_pixel']
+        # Delta totals from the present -> future lucode transitions
+        delta = produzione.delta_transitions(transitions, params)
+
         path_output = self.parameterAsString(parameters, self.OUTPUT, context)
-        file_output = path_output + '/SE_08_produzione_agricola_delta_euro.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        arr_diff_tot = arr_value_future - arr_value_present
-        outdata = driver.Create(file_output, cols, rows, 1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(ds_present.GetGeoTransform())  ##sets same geotransform as input
-        outdata.SetProjection(ds_present.GetProjection())  ##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(arr_diff_tot)
-        outdata.FlushCache()
+        save_transition_delta(path_output + '/SE_08_produzione_agricola_delta_euro.tiff', delta['value'])
+        if not report_only:
+            # Initialize and write on output raster
+            file_output = path_output + '/08_produzione_agricola_presente_ton.tiff'
+            write_raster(file_output, arrays_present['production'], ds_present, profile)
+            # Initialize and write on output raster
+            file_output = path_output + '/08_produzione_agricola_futuro_ton.tiff'
+            write_raster(file_output, arrays_future['production'], ds_present, profile)
+            # Initialize and write on output raster
+            file_output = path_output + '/SE_08_produzione_agricola_delta_euro.tiff'
+            arr_diff_tot = arrays_future['value'] - arrays_present['value']
+            write_raster(file_output, arr_diff_tot, ds_present, profile)
         # Years
         present = self.parameterAsInt(parameters, self.INPUTPRE, context)
         future = self.parameterAsInt(parameters, self.INPUTFUT, context)
@@ -343,28 +264,28 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         f.write("Data: " + today +"\n\n\n")
         f.write("Analisi stato di fatto\n\n")
         f.write("Anno corrente: %i \n" % (present))
-        f.write("Produzione agricola stato attuale (ton/anno): %f \n" % (np.sum(arr_production_present)))
+        f.write("Produzione agricola stato attuale (ton/anno): %f \n" % (stats_present['production']))
         f.write("Produzione agricola per unità di superficie - Stato attuale (ton/mq * anno): %f \n" % (
-                np.sum(arr_production_present) / (n_valid_pixel * area_pixel)))
-        f.write("Valore totale della produzione agricola (€/anno): %f \n\n" % (np.sum(arr_value_present)))
+                stats_present['production'] / (n_valid_pixel * area_pixel)))
+        f.write("Valore totale della produzione agricola (€/anno): %f \n\n" % (stats_present['value']))
         f.write("RIEPILOGO DATI INPUT stato di fatto\n")
-        f.write("Elenco LuCode area in esame: %s \n\n\n" % (np.unique(arr_present)))
+        f.write("Elenco LuCode area in esame: %s \n\n\n" % (stats_present['lucodes']))
         f.write("Analisi stato di progetto\n\n")
         f.write("Anno progetto: %i \n" % (future))
-        f.write("Produzione agricola stato di progetto (ton/anno): %f \n" % (np.sum(arr_production_future)))
+        f.write("Produzione agricola stato di progetto (ton/anno): %f \n" % (stats_future['production']))
         f.write("Produzione agricola per unità di superficie - Stato di progetto (ton/mq * anno): %f \n" % (
-                np.sum(arr_production_future) / (n_valid_pixel * area_pixel)))
-        f.write("Valore totale della produzione agricola (€/anno): %f \n\n" % (np.sum(arr_value_future)))
+                stats_future['production'] / (n_valid_pixel * area_pixel)))
+        f.write("Valore totale della produzione agricola (€/anno): %f \n\n" % (stats_future['value']))
         f.write("RIEPILOGO DATI INPUT stato di progetto\n")
-        f.write("Elenco LuCode area in esame: %s \n\n\n" % (np.unique(arr_future)))
+        f.write("Elenco LuCode area in esame: %s \n\n\n" % (stats_future['lucodes']))
         f.write("Differenze tra stato di progetto e stato attuale\n\n")
         f.write("Anno progetto: %i - %i\n" % (present, future))
-        f.write("Differenza della produzione agricola (ton/anno):: %f \n" % (np.sum(
-            arr_production_future - arr_production_present)))
+        f.write("Differenza della produzione agricola (ton/anno):: %f \n" % (
+            np.sum(delta['production'])))
         f.write("Differenza della produzione agricola per unità di superficie (ton/mq * anno): %f \n" % (
-            np.sum((arr_production_future - arr_production_present) / (n_valid_pixel * area_pixel))))
+            np.sum(delta['production']) / (n_valid_pixel * area_pixel)))
         f.write("Differenza in termini economici del SE di produzione agricola (stato di progetto – stato attuale) (€):%d \n" % (
-            np.sum(arr_diff_tot)))
+            np.sum(delta['value'])))
         return {self.OUTPUT: 'Completed'}
 
         
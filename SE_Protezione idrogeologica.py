@@ -22,10 +22,23 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterFolderDestination)
 from qgis import processing
-import gdal
 import numpy as np
+import os
+import sys
 from datetime import datetime
 
+# The se_torino package is kept in the same folder as the scripts
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+from se_torino.raster import load_raster, write_raster
+from se_torino.parameters import add_output_profile_parameters, output_profile
+from se_torino.lookup import LucodeHistogram, describe_unknown
+from se_torino.parallel import map_states
+from se_torino.transition import TransitionMatrix, save_transition_delta
+from se_torino.kernels import protezione
+from se_torino.kernels.protezione import ProtezioneParameters
+
 class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     """
     This is an example algorithm that takes a vector layer and
@@ -182,186 +195,55 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
                 self.tr('Salva nella cartella')
             )
         )
+
+        add_output_profile_parameters(self)
         
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """
+
+        # Output raster format
+        profile = output_profile(self, parameters, context)
         gruppi = ['1', '2', '3', '4']
         gruppo_id = self.parameterAsInt(parameters, self.GRUPPO, context)
         rain_tot = self.parameterAsDouble(parameters, self.INPUTP, context)
-        # Load present raster
+        # Present and future rasters
         present_raster = self.parameterAsRasterLayer(parameters, self.INPUTRP, context)
-        ds_present = gdal.Open(present_raster.dataProvider().dataSourceUri())
-        arr_present = ds_present.GetRasterBand(1).ReadAsArray()
-        # Clean negative values
-        arr_present[arr_present < 0] = 0
-
-        # Load future raster
         future_raster = self.parameterAsRasterLayer(parameters, self.INPUTRF, context)
-        ds_future = gdal.Open(future_raster.dataProvider().dataSourceUri())
-        arr_future = ds_future.GetRasterBand(1).ReadAsArray()
-        # Clean negative values
-        arr_future[arr_future < 0] = 0
+        present_uri = present_raster.dataProvider().dataSourceUri()
+        future_uri = future_raster.dataProvider().dataSourceUri()
 
-        area_pixel = self.parameterAsInt(parameters, self.PIXEL_RES, context) * self.parameterAsInt(
-            parameters, self.PIXEL_RES, context)
+        params = ProtezioneParameters(self.parameterAsInt(parameters, self.PIXEL_RES, context), rain_tot, gruppo_id)
 
-        # SE valore protezione idrogeologica per lucode
-        cn_lucode = {}
-        cn_lucode[1] = [64, 76, 84, 88]
-        cn_lucode[2] = [64, 76, 84, 88]
-        cn_lucode[3] = [71, 81, 87, 90]
-        cn_lucode[4] = [57, 70, 78, 82]
-        cn_lucode[5] = [57, 70, 78, 82]
-        cn_lucode[6] = [30, 58, 70, 77]
-        cn_lucode[7] = [83, 89, 92, 93]
-        cn_lucode[8] = [98, 98, 98, 98]
-        cn_lucode[9] = [43, 65, 76, 82]
-        cn_lucode[10] = [43, 65, 76, 82]
-        cn_lucode[11] = [98, 98, 98, 98]
-        cn_lucode[12] = [72, 82, 87, 89]
-        cn_lucode[13] = [98, 98, 98, 98]
-        cn_lucode[14] = [72, 82, 87, 89]
-        cn_lucode[15] = [98, 98, 98, 98]
-        cn_lucode[16] = [72, 82, 87, 89]
-        cn_lucode[17] = [43, 65, 76, 82]
-        cn_lucode[18] = [98, 98, 98, 98]
-        cn_lucode[19] = [77, 86, 91, 94]
-        cn_lucode[20] = [98, 98, 98, 98]
-        cn_lucode[21] = [43, 61, 76, 82]
-        cn_lucode[22] = [43, 61, 76, 82]
-        cn_lucode[23] = [74, 84, 88, 90]
-        cn_lucode[24] = [74, 84, 88, 90]
-        cn_lucode[25] = [98, 98, 98, 98]
-        cn_lucode[26] = [49, 69, 79, 84]
-        cn_lucode[27] = [49, 69, 79, 84]
-        cn_lucode[28] = [100, 100, 100, 100]
-        cn_lucode[29] = [60, 72, 81, 84]
-        cn_lucode[30] = [60, 72, 81, 84]
-        cn_lucode[31] = [100, 100, 100, 100]
-        cn_lucode[32] = [68, 79, 86, 89]
-        cn_lucode[33] = [68, 79, 86, 89]
-        cn_lucode[34] = [50, 70, 80, 85]
-        cn_lucode[35] = [81, 88, 91, 93]
-        cn_lucode[36] = [60, 74, 83, 87]
-        cn_lucode[37] = [57, 70, 78, 82]
-        cn_lucode[38] = [73, 83, 88, 91]
-        cn_lucode[39] = [73, 83, 88, 91]
-        cn_lucode[40] = [64, 76, 84, 88]
-        cn_lucode[41] = [64, 76, 84, 88]
-        cn_lucode[42] = [64, 76, 84, 88]
-        cn_lucode[43] = [77, 85, 90, 92]
-        cn_lucode[44] = [98, 98, 98, 98]
-        cn_lucode[45] = [100, 100, 100, 100]
-        cn_lucode[46] = [98, 98, 98, 98]
-        cn_lucode[47] = [98, 98, 98, 98]
-        cn_lucode[48] = [77, 85, 90, 92]
-        cn_lucode[49] = [77, 85, 90, 92]
-        cn_lucode[50] = [98, 98, 98, 98]
-        cn_lucode[51] = [98, 98, 98, 98]
-        cn_lucode[52] = [98, 98, 98, 98]
-        cn_lucode[53] = [77, 85, 90, 92]
-        cn_lucode[54] = [77, 85, 90, 92]
-        cn_lucode[55] = [98, 98, 98, 98]
-        cn_lucode[56] = [98, 98, 98, 98]
-        cn_lucode[57] = [0, 72, 81, 84]
-        cn_lucode[58] = [0, 72, 81, 84]
-        cn_lucode[59] = [64, 76, 84, 88]
-        cn_lucode[60] = [98, 98, 98, 98]
-        cn_lucode[61] = [35, 56, 70, 77]
-        cn_lucode[62] = [35, 56, 70, 77]
-        cn_lucode[63] = [35, 56, 70, 77]
-        cn_lucode[64] = [60, 72, 81, 84]
-        cn_lucode[65] = [60, 72, 81, 84]
-        cn_lucode[66] = [98, 98, 98, 98]
-        cn_lucode[67] = [98, 98, 98, 98]
-        cn_lucode[68] = [30, 58, 70, 77]
-        cn_lucode[69] = [35, 56, 70, 77]
-        cn_lucode[70] = [35, 56, 70, 77]
-        cn_lucode[71] = [77, 85, 90, 92]
-        cn_lucode[72] = [98, 98, 98, 98]
-        cn_lucode[73] = [64, 76, 84, 88]
-        cn_lucode[74] = [64, 76, 84, 88]
-        cn_lucode[75] = [64, 76, 84, 88]
-        cn_lucode[76] = [64, 76, 84, 88]
-        cn_lucode[77] = [98, 98, 98, 98]
-        cn_lucode[78] = [100, 100, 100, 100]
-        cn_lucode[79] = [77, 86, 91, 94]
-        cn_lucode[80] = [92, 92, 92, 92]
-        cn_lucode[81] = [92, 92, 92, 92]
-        cn_lucode[82] = [40, 63, 75, 81]
-        cn_lucode[83] = [36, 60, 73, 79]
-        cn_lucode[84] = [36, 60, 73, 79]
-        cn_lucode[85] = [45, 66, 77, 83]
-        cn_lucode[86] = [45, 66, 77, 83]
-        cn_lucode[87] = [36, 60, 73, 79]
+        def compute_state(raster_uri):
+            # Load raster
+            ds, arr = load_raster(raster_uri)
+            # Clean negative values
+            arr[arr < 0] = 0
+            return ds, arr, protezione.state_arrays(arr, params), protezione.state_stats(LucodeHistogram(arr), params)
 
-        [rows, cols] = arr_present.shape
-        # Value euro per cubic meter
-        value_coeff = 300
-        arr_Pe_present = np.zeros((rows, cols))
-        arr_Pn_present = np.zeros((rows, cols))
-        for lucode in np.unique(arr_present):
-            try:
-                S = (25400 / cn_lucode[lucode][gruppo_id]) - 254
-                IA = S / 10
-                if (IA < rain_tot):
-                    Pn = rain_tot - IA
-                else:
-                    Pn = 0
-                Pn = rain_tot - IA
-                arr_Pn_present[np.where(arr_present == lucode)] = Pn
-                arr_Pe_present[np.where(arr_present == lucode)] = (Pn ** 2) / (Pn + S)
-            except:
-                pass
-        arr_Pe_future = np.zeros((rows, cols))
-        arr_Pn_future = np.zeros((rows, cols))
-        for lucode in np.unique(arr_future):
-            try:
-                S = (25400 / cn_lucode[lucode][gruppo_id]) - 254
-                IA = S / 10
-                if (IA < rain_tot):
-                    Pn = rain_tot - IA
-                else:
-                    Pn = 0
-                Pn = rain_tot - IA
-                arr_Pn_future[np.where(arr_future == lucode)] = Pn
-                arr_Pe_future[np.where(arr_future == lucode)] = (Pn ** 2) / (Pn + S)
-            except:
-                pass
-        # Convert to squared meters and assign value
-        arr_value_present = value_coeff * ((arr_Pn_present - arr_Pe_present) / 1000) * area_pixel
-        arr_value_future = value_coeff * ((arr_Pn_future - arr_Pe_future) / 1000) * area_pixel
+        # Present and future states are independent, compute them concurrently
+        [(ds_present, arr_present, arrays_present, stats_present),
+         (ds_future, arr_future, arrays_future, stats_future)] = map_states(compute_state, [present_uri, future_uri])
+        # Delta totals from the present -> future lucode transitions
+        delta = protezione.delta_transitions(TransitionMatrix(arr_present, arr_future), params)
+        if stats_present['unknown']:
+            feedback.pushInfo(self.tr('LUCODE non riconosciuti nello stato attuale: %s') % describe_unknown(stats_present['unknown']))
+        if stats_future['unknown']:
+            feedback.pushInfo(self.tr('LUCODE non riconosciuti nello stato di progetto: %s') % describe_unknown(stats_future['unknown']))
         # Initialize and write on output raster
         path_output = self.parameterAsString(parameters, self.OUTPUT, context)
         file_output = path_output + '/04_protezione_idrogeologica_presente_mm.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        outdata = driver.Create(file_output, cols, rows, 1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(ds_present.GetGeoTransform())  ##sets same geotransform as input
-        outdata.SetProjection(ds_present.GetProjection())  ##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(arr_Pe_present)
-        outdata.FlushCache()
+        write_raster(file_output, arrays_present['Pe'], ds_present, profile)
         # Initialize and write on output raster
-        path_output = self.parameterAsString(parameters, self.OUTPUT, context)
         file_output = path_output + '/04_protezione_idrogeologica_futura_mm.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        arr_diff_tot = arr_value_future - arr_value_present
-        outdata = driver.Create(file_output, cols, rows, 1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(ds_present.GetGeoTransform())  ##sets same geotransform as input
-        outdata.SetProjection(ds_present.GetProjection())  ##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(arr_Pe_future)
-        outdata.FlushCache()
+        write_raster(file_output, arrays_future['Pe'], ds_present, profile)
         # Initialize and write on output raster
-        path_output = self.parameterAsString(parameters, self.OUTPUT, context)
         file_output = path_output + '/SE_04_protezione_idrogeologica_delta_euro.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        arr_diff_tot = arr_value_future - arr_value_present
-        outdata = driver.Create(file_output, cols, rows, 1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(ds_present.GetGeoTransform())  ##sets same geotransform as input
-        outdata.SetProjection(ds_present.GetProjection())  ##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(arr_diff_tot)
-        outdata.FlushCache()
+        arr_diff_tot = arrays_future['value'] - arrays_present['value']
+        write_raster(file_output, arr_diff_tot, ds_present, profile)
+        save_transition_delta(file_output, delta['value'])
         # Years
         present = self.parameterAsInt(parameters, self.INPUTPRE, context)
         future = self.parameterAsInt(parameters, self.INPUTFUT, context)
@@ -372,26 +254,26 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         f.write("Data: " + today +"\n\n\n")
         f.write("Analisi stato di fatto\n\n")
         f.write("Anno corrente: %i \n" %present)
-        f.write("Protezione idrogeologica stato attuale (mm): %f \n" % (np.sum(arr_Pn_present - arr_Pe_present)))
+        f.write("Protezione idrogeologica stato attuale (mm): %f \n" % (stats_present['retained']))
         f.write("Protezione idrogeologica sulla superficie totale - Stato attuale (mc): %f \n" % (
-                np.sum(((arr_Pn_present - arr_Pe_present) / 1000) * area_pixel)))
-        f.write("Valore totale della protezione idrogeologica (€/anno): %f \n\n" % (np.sum(arr_value_present)))
+                stats_present['volume']))
+        f.write("Valore totale della protezione idrogeologica (€/anno): %f \n\n" % (stats_present['value']))
         f.write("RIEPILOGO DATI INPUT stato di fatto\n")
-        f.write("Elenco LuCode area in esame: %s \n\n\n" % (np.unique(arr_present)))
+        f.write("Elenco LuCode area in esame: %s \n\n\n" % (stats_present['lucodes']))
         f.write("Analisi stato di progetto\n\n")
         f.write("Anno progetto: %i \n" % (future))
-        f.write("Protezione idrogeologica stato di progetto (mm): %f \n" % (np.sum(arr_Pn_future - arr_Pe_future)))
+        f.write("Protezione idrogeologica stato di progetto (mm): %f \n" % (stats_future['retained']))
         f.write("Protezione idrogeologica sulla superficie totale - Stato di progetto (mc): %f \n" % (
-                np.sum(((arr_Pn_future - arr_Pe_future) / 1000) * area_pixel)))
-        f.write("Valore totale della protezione idrogeologica (€/anno): %f \n\n" % (np.sum(arr_value_future)))
+                stats_future['volume']))
+        f.write("Valore totale della protezione idrogeologica (€/anno): %f \n\n" % (stats_future['value']))
         f.write("RIEPILOGO DATI INPUT stato di progetto\n")
-        f.write("Elenco LuCode area in esame: %s \n\n\n" % (np.unique(arr_future)))
+        f.write("Elenco LuCode area in esame: %s \n\n\n" % (stats_future['lucodes']))
         f.write("Differenze tra stato di progetto e stato attuale\n\n")
         f.write("Anno progetto: %i - %i\n" % (present, future))
-        f.write("Differenza della protezione idrogeologica (mm): %f \n" % (np.sum(
-            (arr_Pn_future - arr_Pe_future) - (arr_Pn_present - arr_Pe_present))))
+        f.write("Differenza della protezione idrogeologica (mm): %f \n" % (
+            stats_future['retained'] - stats_present['retained']))
         f.write("Differenza della protezione idrogeologica sulla superficie totale (mc): %f \n" % (
-            np.sum((arr_Pn_future - arr_Pe_future) - (arr_Pn_present - arr_Pe_present))/1000 * area_pixel))
+            stats_future['volume'] - stats_present['volume']))
         f.write("Differenza in termini economici del SE di protezione idrogeologica (stato di progetto – stato attuale) (€):%d \n" % (
             np.sum(arr_diff_tot)))
         return {self.OUTPUT: 'Completed'}
@@ -17,15 +17,29 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingException,
                        QgsProcessingAlgorithm,
                        QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterBoolean,
                        QgsProcessingParameterNumber,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterFolderDestination)
 from qgis import processing
-import gdal
 import numpy as np
+import os
+import sys
 from datetime import datetime
 
+# The se_torino package is kept in the same folder as the scripts
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+from se_torino.raster import load_raster, raster_transitions, write_raster
+from se_torino.parameters import add_output_profile_parameters, output_profile
+from se_torino.lookup import describe_unknown
+from se_torino.parallel import map_states
+from se_torino.transition import TransitionMatrix, save_transition_delta
+from se_torino.kernels import temperatura
+from se_torino.kernels.temperatura import TemperaturaParameters
+
 class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     """
     This is an example algorithm that takes a vector layer and
@@ -48,6 +62,7 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     INPUTRP = 'INPUTRP'
     INPUTRF = 'INPUTRF'
     PIXEL_RES = 'PIXEL_RES'
+    SOLO_REPORT = 'SOLO_REPORT'
     OUTPUT = 'OUTPUT'
 
     def tr(self, string):
@@ -154,179 +169,78 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+            self.SOLO_REPORT,
+            self.tr('Solo report (nessun raster in output)'),
+            defaultValue=False
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterFolderDestination(
                 self.OUTPUT,
                 self.tr('Salva nella cartella')
             )
         )
+
+        add_output_profile_parameters(self)
         
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """
-        # Load present raster
-        present_raster = self.parameterAsRasterLayer(parameters, self.INPUTRP, context)
-        ds_present = gdal.Open(present_raster.dataProvider().dataSourceUri())
-        arr_present = ds_present.GetRasterBand(1).ReadAsArray()
-        # Clean negative values
-        arr_present[arr_present<0] = 0
 
-        # Load future raster
+        # Output raster format
+        profile = output_profile(self, parameters, context)
+        report_only = self.parameterAsBool(parameters, self.SOLO_REPORT, context)
+        # Present and future rasters
+        present_raster = self.parameterAsRasterLayer(parameters, self.INPUTRP, context)
         future_raster = self.parameterAsRasterLayer(parameters, self.INPUTRF, context)
-        ds_future = gdal.Open(future_raster.dataProvider().dataSourceUri())
-        arr_future = ds_future.GetRasterBand(1).ReadAsArray()
-        # Clean negative values
-        arr_future[arr_future<0] = 0
-
-        area_pixel = self.parameterAsInt(parameters, self.PIXEL_RES, context) * self.parameterAsInt(
-            parameters, self.PIXEL_RES, context)
+        present_uri = present_raster.dataProvider().dataSourceUri()
+        future_uri = future_raster.dataProvider().dataSourceUri()
 
-        # HM dictionary
-        HM_lucode = {}
-        HM_lucode[1] = 4.62718336
-        HM_lucode[2] = 3.83420036
-        HM_lucode[3] = 0.4823722
-        HM_lucode[4] = 4.42937216
-        HM_lucode[5] = 4.93675407
-        HM_lucode[6] = 4.15857601
-        HM_lucode[7] = 3.03540913
-        HM_lucode[8] = 0.86425104
-        HM_lucode[9] = 2.82585889
-        HM_lucode[10] = 1.91524496
-        HM_lucode[11] = 0.67386976
-        HM_lucode[12] = 1.85691874
-        HM_lucode[13] = 0.57390328
-        HM_lucode[14] = 2.44235093
-        HM_lucode[15] = 0.78460174
-        HM_lucode[16] = 2.25657445
-        HM_lucode[17] = 2.00661297
-        HM_lucode[18] = 1.11856046
-        HM_lucode[19] = 2.96848245
-        HM_lucode[20] = 0.51584438
-        HM_lucode[21] = 3.66727253
-        HM_lucode[22] = 2.15298825
-        HM_lucode[23] = 2.79566511
-        HM_lucode[24] = 3.28726693
-        HM_lucode[25] = 1.11711756
-        HM_lucode[26] = 2.74429667
-        HM_lucode[27] = 2.11703174
-        HM_lucode[28] = 3.31600525
-        HM_lucode[29] = 4.1666852
-        HM_lucode[30] = 4.14721283
-        HM_lucode[31] = 2.22970933
-        HM_lucode[32] = 0.8684379
-        HM_lucode[33] = 0.95477925
-        HM_lucode[34] = 3.57055523
-        HM_lucode[35] = 0.21495761
-        HM_lucode[36] = 0.38677367
-        HM_lucode[37] = 5.20694318
-        HM_lucode[38] = 3.81729612
-        HM_lucode[39] = 3.3219752
-        HM_lucode[40] = 4.45037633
-        HM_lucode[41] = 4.73611724
-        HM_lucode[42] = 4.30607209
-        HM_lucode[43] = 2.13796834
-        HM_lucode[44] = 1.81924634
-        HM_lucode[45] = 2.48564168
-        HM_lucode[46] = 1.07186001
-        HM_lucode[47] = 0.53461912
-        HM_lucode[48] = 1.95442937
-        HM_lucode[49] = 1.11875979
-        HM_lucode[50] = 1.1334159
-        HM_lucode[51] = 0.91150442
-        HM_lucode[52] = 1.95317116
-        HM_lucode[53] = 3.5382051
-        HM_lucode[54] = 3.30428226
-        HM_lucode[55] = 1.92616705
-        HM_lucode[56] = 0.39094275
-        HM_lucode[57] = 2.41044505
-        HM_lucode[58] = 3.20739734
-        HM_lucode[59] = 4.38517119
-        HM_lucode[60] = 0.64614399
-        HM_lucode[61] = 4.16470902
-        HM_lucode[62] = 4.29626227
-        HM_lucode[63] = 4.28313385
-        HM_lucode[64] = 4.45815007
-        HM_lucode[65] = 3.35787101
-        HM_lucode[66] = 1.57321618
-        HM_lucode[67] = 1.99595624
-        HM_lucode[68] = 3.06093165
-        HM_lucode[69] = 4.0867662
-        HM_lucode[70] = 4.37100281
-        HM_lucode[71] = 2.09081137
-        HM_lucode[72] = 0.84961896
-        HM_lucode[73] = 4.6212141
-        HM_lucode[74] = 4.92998582
-        HM_lucode[75] = 3.88542519
-        HM_lucode[76] = 5.09573919
-        HM_lucode[77] = 2.57326408
-        HM_lucode[78] = 2.31943221
-        HM_lucode[79] = 2.1070807
-        HM_lucode[80] = 4.42278093
-        HM_lucode[81] = 3.59365177
-        HM_lucode[82] = 4.43509066
-        HM_lucode[83] = 5.37128195
-        HM_lucode[84] = 5.01703229
-        HM_lucode[85] = 5.24431647
-        HM_lucode[86] = 5.16957513
-        HM_lucode[87] = 4.71936258
+        params = TemperaturaParameters(self.parameterAsInt(parameters, self.PIXEL_RES, context))
 
-        [rows, cols] = arr_present.shape
+        def compute_state(raster_uri):
+            # Load raster
+            ds, arr = load_raster(raster_uri)
+            # Clean negative values
+            arr[arr<0] = 0
+            return ds, arr, temperatura.state_arrays(arr, params)
 
-        # Assigning scores for each distinct lucode
-        arr_HM_pres = np.zeros((rows, cols))
-        arr_HM_fut = np.zeros((rows, cols))
-        for lucode in np.unique(arr_present):
-            if lucode in HM_lucode.keys():
-                arr_HM_pres[np.where(arr_present == lucode)] = HM_lucode[lucode] * area_pixel
-        value_pres = arr_HM_pres * 1.6 * 0.1
-        for lucode in np.unique(arr_future):
-            if lucode in HM_lucode.keys():
-                arr_HM_fut[np.where(arr_future == lucode)] = HM_lucode[lucode] * area_pixel
-        value_fut = arr_HM_fut * 1.6 * 0.1
-        delta_value = value_fut - value_pres
+        if report_only:
+            # The report only needs the pixel counts, read both rasters by windows
+            ds_present, transitions = raster_transitions(present_uri, future_uri, feedback)
+        else:
+            # Present and future states are independent, compute them concurrently
+            [(ds_present, arr_pres, arrays_pres),
+             (ds_future, arr_fut, arrays_fut)] = map_states(compute_state, [present_uri, future_uri])
+            transitions = TransitionMatrix(arr_pres, arr_fut)
+        # Report totals from the lucode counts
+        stats_pres = temperatura.state_stats(transitions.present, params)
+        stats_fut = temperatura.state_stats(transitions.future, params)
+        if stats_pres['unknown']:
+            feedback.pushInfo(self.tr('LUCODE non riconosciuti nello stato attuale: %s') % describe_unknown(stats_pres['unknown']))
+        if stats_fut['unknown']:
+            feedback.pushInfo(self.tr('LUCODE non riconosciuti nello stato di progetto: %s') % describe_unknown(stats_fut['unknown']))
+        # Delta totals from the present -> future lucode transitions
+        delta = temperatura.delta_transitions(transitions, params)
         # Initialize and write on output raster
         path_output = self.parameterAsString(parameters, self.OUTPUT, context)
-        area_pixel = self.parameterAsInt(parameters, self.PIXEL_RES, context) * self.parameterAsInt(
-            parameters, self.PIXEL_RES, context)
         # Years
         present = self.parameterAsInt(parameters, self.INPUTPRE, context)
         future = self.parameterAsInt(parameters, self.INPUTFUT, context)
-        # Store raster present
-        file_output = path_output + '/03_regolazione_temperatura_presente.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        outdata = driver.Create(file_output,  cols, rows, 1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(ds_present.GetGeoTransform())##sets same geotransform as input
-        outdata.SetProjection(ds_present.GetProjection())##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(arr_HM_pres)
-        print(np.max(outdata.GetRasterBand(1).ReadAsArray()))
-        outdata.FlushCache() ##saves to disk!!
-        outdata = None
-        band = None
-        ds = None
-        file_output = path_output + '/03_regolazione_temperatura_futuro.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        outdata = driver.Create(file_output,  cols, rows, 1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(ds_present.GetGeoTransform())##sets same geotransform as input
-        outdata.SetProjection(ds_present.GetProjection())##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(arr_HM_fut)
-        print(np.max(outdata.GetRasterBand(1).ReadAsArray()))
-        outdata.FlushCache() ##saves to disk!!
-        outdata = None
-        band = None
-        ds = None
-        file_output = path_output + '/SE_03_regolazione_temperatura_delta_euro.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        outdata = driver.Create(file_output,  cols, rows, 1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(ds_present.GetGeoTransform())##sets same geotransform as input
-        outdata.SetProjection(ds_present.GetProjection())##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(delta_value)
-        print(np.max(outdata.GetRasterBand(1).ReadAsArray()))
-        outdata.FlushCache() ##saves to disk!!
-        outdata = None
-        band = None
-        ds = None
+        if not report_only:
+            delta_value = arrays_fut['value'] - arrays_pres['value']
+            # Store raster present
+            file_output = path_output + '/03_regolazione_temperatura_presente.tiff'
+            write_raster(file_output, arrays_pres['HM'], ds_present, profile)
+            file_output = path_output + '/03_regolazione_temperatura_futuro.tiff'
+            write_raster(file_output, arrays_fut['HM'], ds_present, profile)
+            file_output = path_output + '/SE_03_regolazione_temperatura_delta_euro.tiff'
+            write_raster(file_output, delta_value, ds_present, profile)
+        save_transition_delta(path_output + '/SE_03_regolazione_temperatura_delta_euro.tiff', delta['value'])
         report_output = path_output + '/SE_regolazione_temperatura.txt'
         f = open(report_output, "w+")
         today = datetime.today().strftime('%Y-%m-%d-%H:%M:%S')
@@ -334,17 +248,19 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         f.write("Data: " + today +"\n\n\n")
         f.write("Analisi stato di fatto\n\n")
         f.write("Anno corrente: %i \n" % (present))
-        f.write("Regolazione della temperatura Stato attuale: %f \n" % (np.sum(arr_HM_pres)))
-        f.write("Valore totale della regolazione della temperatura (€): %f \n\n\n" % ((np.sum(value_pres))))
+        f.write("Regolazione della temperatura Stato attuale: %f \n" % (stats_pres['HM']))
+        f.write("Valore totale della regolazione della temperatura (€): %f \n\n\n" % ((stats_pres['value'])))
         f.write("Analisi stato di progetto\n\n")
         f.write("Anno progetto: %i \n" % (future))
-        f.write("Regolazione della temperatura Stato di progetto: %f \n" % (np.sum(arr_HM_fut)))
-        f.write("Valore totale della regolazione della temperatura (€): %f \n\n\n" % ((np.sum(value_fut))))
+        f.write("Regolazione della temperatura Stato di progetto: %f \n" % (stats_fut['HM']))
+        f.write("Valore totale della regolazione della temperatura (€): %f \n\n\n" % ((stats_fut['value'])))
         f.write("Differenze tra stato di progetto e stato attuale\n\n")
         f.write("Anno progetto: %i - %i\n" % (present, future))
-        f.write("Differenza di regolazione della temperatura: %f \n" % (np.sum(arr_HM_fut - arr_HM_pres)))
+        f.write("Differenza di regolazione della temperatura: %f \n" % (np.sum(delta['HM'])))
         f.write("Differenza in termini economici del SE di regolazione della temperatura (stato di progetto – stato attuale) (€):%d \n" % (
-            np.sum(delta_value)))
+            np.sum(delta['value'])))
+        if report_only:
+            return {self.OUTPUT: path_output}
         return {self.OUTPUT: delta_value}
         
         # -----------------------------------------------------------------------------------  
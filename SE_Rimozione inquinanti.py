@@ -21,10 +21,20 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterFolderDestination)
 from qgis import processing
-import gdal
-import numpy as np
+import os
+import sys
 from datetime import datetime
 
+# The se_torino package is kept in the same folder as the scripts
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+from se_torino.raster import load_raster, write_raster
+from se_torino.parallel import map_states
+from se_torino.parameters import add_output_profile_parameters, output_profile
+from se_torino.kernels import inquinanti
+from se_torino.kernels.inquinanti import InquinantiParameters
+
 class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     """
     This is an example algorithm that takes a vector layer and
@@ -192,73 +202,39 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        add_output_profile_parameters(self)
+
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """
-        NO2_present_raster = self.parameterAsRasterLayer(parameters, self.INPUTNP, context)
-        NO2_present_data_source = gdal.Open(NO2_present_raster.dataProvider().dataSourceUri())
-        arr_NO2_present = NO2_present_data_source.GetRasterBand(1).ReadAsArray()
-
-        PM10_present_raster = self.parameterAsRasterLayer(parameters, self.INPUTPP, context)
-        PM10_present_data_source = gdal.Open(PM10_present_raster.dataProvider().dataSourceUri())
-        arr_PM10_present = PM10_present_data_source.GetRasterBand(1).ReadAsArray()
-
-        ozono_present_raster = self.parameterAsRasterLayer(parameters, self.INPUTOP, context)
-        ozono_present_data_source = gdal.Open(ozono_present_raster.dataProvider().dataSourceUri())
-        arr_ozono_present = ozono_present_data_source.GetRasterBand(1).ReadAsArray()
-
-        arr_present = arr_ozono_present + arr_PM10_present + arr_NO2_present
-
-        NO2_future_raster = self.parameterAsRasterLayer(parameters, self.INPUTNF, context)
-        NO2_future_data_source = gdal.Open(NO2_future_raster.dataProvider().dataSourceUri())
-        arr_NO2_future = NO2_future_data_source.GetRasterBand(1).ReadAsArray()
-
-        PM10_future_raster = self.parameterAsRasterLayer(parameters, self.INPUTPF, context)
-        PM10_future_data_source = gdal.Open(PM10_future_raster.dataProvider().dataSourceUri())
-        arr_PM10_future = PM10_future_data_source.GetRasterBand(1).ReadAsArray()
-
-        ozono_future_raster = self.parameterAsRasterLayer(parameters, self.INPUTOF, context)
-        ozono_future_data_source = gdal.Open(ozono_future_raster.dataProvider().dataSourceUri())
-        arr_ozono_future = ozono_future_data_source.GetRasterBand(1).ReadAsArray()
-
-        arr_future = arr_ozono_future + arr_PM10_future + arr_NO2_future
-
-        area_pixel = self.parameterAsInt(parameters, self.PIXEL_RES, context) * self.parameterAsInt(
-            parameters, self.PIXEL_RES, context)
-
-        NO2_euro_coeff = 77641.89
-        ozono_euro_coeff = 14658.11
-        PM10_euro_coeff = 17132.56
-
-        arr_euro_present_NO2 = arr_NO2_present * NO2_euro_coeff
-        arr_euro_present_ozono = arr_ozono_present * ozono_euro_coeff
-        arr_euro_present_PM10 = arr_PM10_present * PM10_euro_coeff
-        arr_value_present = arr_euro_present_PM10 + arr_euro_present_ozono + arr_euro_present_NO2
-
-        arr_euro_future_NO2 = arr_NO2_future * NO2_euro_coeff
-        arr_euro_future_ozono = arr_ozono_future * ozono_euro_coeff
-        arr_euro_future_PM10 = arr_PM10_future * PM10_euro_coeff
-        arr_value_future = arr_euro_future_PM10 + arr_euro_future_ozono + arr_euro_future_NO2
-
-        arr_diff_NO2 = arr_euro_future_NO2 - arr_euro_present_NO2
-        arr_diff_PM10 = arr_euro_future_PM10 - arr_euro_present_PM10
-        arr_diff_ozono = arr_euro_future_ozono - arr_euro_present_ozono
 
-        arr_diff_tot = arr_diff_NO2 + arr_diff_PM10 + arr_diff_ozono
+        # Output raster format
+        profile = output_profile(self, parameters, context)
+        # Load the six rasters concurrently
+        input_params = [self.INPUTNP, self.INPUTPP, self.INPUTOP, self.INPUTNF, self.INPUTPF, self.INPUTOF]
+        input_uris = []
+        for input_param in input_params:
+            input_raster = self.parameterAsRasterLayer(parameters, input_param, context)
+            input_uris.append(input_raster.dataProvider().dataSourceUri())
+        [(NO2_present_data_source, arr_NO2_present),
+         (PM10_present_data_source, arr_PM10_present),
+         (ozono_present_data_source, arr_ozono_present),
+         (NO2_future_data_source, arr_NO2_future),
+         (PM10_future_data_source, arr_PM10_future),
+         (ozono_future_data_source, arr_ozono_future)] = map_states(load_raster, input_uris)
+
+        params = InquinantiParameters(self.parameterAsInt(parameters, self.PIXEL_RES, context))
+        arrays, stats = inquinanti.rimozione(
+            {'NO2': arr_NO2_present, 'PM10': arr_PM10_present, 'ozono': arr_ozono_present},
+            {'NO2': arr_NO2_future, 'PM10': arr_PM10_future, 'ozono': arr_ozono_future},
+            params)
+        arr_diff_tot = arrays['value']
 
         # Initialize and write on output raster
         path_output = self.parameterAsString(parameters, self.OUTPUT, context)
         file_output = path_output + '/SE_02_rimozione_inquinanti_delta_euro.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        [cols, rows] = arr_NO2_present.shape
-        diff_tot = np.sum(arr_diff_tot) / (cols * rows )
-        outdata = driver.Create(file_output, rows, cols, 1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(NO2_present_data_source.GetGeoTransform())  ##sets same geotransform as input
-        outdata.SetProjection(NO2_present_data_source.GetProjection())  ##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(arr_diff_tot)
-        print(np.max(outdata.GetRasterBand(1).ReadAsArray()))
-        outdata.FlushCache()
+        write_raster(file_output, arr_diff_tot, NO2_present_data_source, profile)
 
         # Years
         present = self.parameterAsInt(parameters, self.INPUTPRE, context)
@@ -270,23 +246,23 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         f.write("Data: " + today +"\n\n\n")
         f.write("Analisi stato di fatto\n\n")
         f.write("Anno corrente: %i \n" % (present))
-        f.write("Rimozione NO2 Stato attuale (ton): %f \n" % (np.sum(arr_NO2_present)))
-        f.write("Rimozione PM10 Stato attuale (ton): %f \n" % (np.sum(arr_PM10_present)))
-        f.write("Rimozione ozono Stato attuale (ton): %f \n" % (np.sum(arr_ozono_present)))
-        f.write("Valore totale della rimozione inquinanti (€): %f \n\n\n" % (np.sum(arr_value_present)))
+        f.write("Rimozione NO2 Stato attuale (ton): %f \n" % (stats['present']['NO2']))
+        f.write("Rimozione PM10 Stato attuale (ton): %f \n" % (stats['present']['PM10']))
+        f.write("Rimozione ozono Stato attuale (ton): %f \n" % (stats['present']['ozono']))
+        f.write("Valore totale della rimozione inquinanti (€): %f \n\n\n" % (stats['present_value']))
         f.write("Analisi stato di progetto\n\n")
         f.write("Anno progetto: %i \n" % (future))
-        f.write("Rimozione NO2 Stato di progetto (ton): %f \n" % (np.sum(arr_NO2_future)))
-        f.write("Rimozione PM10 Stato di progetto (ton): %f \n" % (np.sum(arr_PM10_future)))
-        f.write("Rimozione ozono Stato di progetto (ton): %f \n" % (np.sum(arr_ozono_future)))
-        f.write("Valore totale della rimozione inquinanti (€): %f \n\n\n" % (np.sum(arr_value_future)))
+        f.write("Rimozione NO2 Stato di progetto (ton): %f \n" % (stats['future']['NO2']))
+        f.write("Rimozione PM10 Stato di progetto (ton): %f \n" % (stats['future']['PM10']))
+        f.write("Rimozione ozono Stato di progetto (ton): %f \n" % (stats['future']['ozono']))
+        f.write("Valore totale della rimozione inquinanti (€): %f \n\n\n" % (stats['future_value']))
         f.write("Differenze tra stato di progetto e stato attuale\n\n")
         f.write("Anno progetto: %i - %i\n" % (present, future))
-        f.write("Differenza della rimozione inquinanti (ton):: %f \n" % (np.sum(arr_future - arr_present)))
+        f.write("Differenza della rimozione inquinanti (ton):: %f \n" % (stats['difference']))
         f.write("Differenza sequestro inquinanti per unità di superficie (ton/ha): %f \n" % (
-             np.sum(arr_future - arr_present) / (cols * rows * area_pixel) * 10000))
+             stats['difference'] / stats['total_area'] * 10000))
         f.write("Differenza in termini economici del SE Rimozione inquinanti (stato di progetto – stato attuale) (€):%d \n" % (
-            np.sum(arr_diff_tot)))     
+            stats['value']))
         return {self.OUTPUT: 'Completed'}
 
         
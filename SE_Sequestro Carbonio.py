@@ -21,10 +21,20 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterFolderDestination)
 from qgis import processing
-import gdal
-import numpy as np
+import os
+import sys
 from datetime import datetime
 
+# The se_torino package is kept in the same folder as the scripts
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+from se_torino.raster import load_raster, write_raster
+from se_torino.parallel import map_states
+from se_torino.kernels import carbonio
+from se_torino.kernels.carbonio import SequestroParameters
+from se_torino.parameters import add_output_profile_parameters, output_profile
+
 class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     """
     This is an example algorithm that takes a vector layer and
@@ -48,6 +58,8 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
     INPUT3 = 'INPUT3'
     INPUT4 = 'INPUT4'
     INPUT5 = 'INPUT5'
+    TASSO_SCONTO = 'TASSO_SCONTO'
+    VARIAZIONE_PREZZO = 'VARIAZIONE_PREZZO'
     PIXEL_RES = 'PIXEL_RES'
     OUTPUT = 'OUTPUT'
 
@@ -164,6 +176,24 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         )
         double_param.setMetadata( {'widget_wrapper': { 'decimals': 2 }} )
         self.addParameter(double_param)
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.TASSO_SCONTO,
+            self.tr('Tasso di sconto (%)'),
+            QgsProcessingParameterNumber.Double,
+            0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.VARIAZIONE_PREZZO,
+            self.tr('Tasso di variazione del prezzo del carbonio (%)'),
+            QgsProcessingParameterNumber.Double,
+            3
+            )
+        )
         
         
         self.addParameter(
@@ -172,64 +202,41 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
                 self.tr('Salva nella cartella')
             )
         )
+
+        add_output_profile_parameters(self)
         
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """
 
-        # Load present raster
-        present_raster = self.parameterAsRasterLayer(parameters, self.INPUT1, context)
-        ds_present = gdal.Open(present_raster.dataProvider().dataSourceUri())
-        arr_present = ds_present.GetRasterBand(1).ReadAsArray()
-        # Clean negative values
-        arr_present[arr_present<0] = 0
+        # Output raster format
+        profile = output_profile(self, parameters, context)
 
-        # Load future raster
+        # Load present and future rasters concurrently
+        present_raster = self.parameterAsRasterLayer(parameters, self.INPUT1, context)
         future_raster = self.parameterAsRasterLayer(parameters, self.INPUT2, context)
-        ds_future = gdal.Open(future_raster.dataProvider().dataSourceUri())
-        arr_future = ds_future.GetRasterBand(1).ReadAsArray()
+        [(ds_present, arr_present), (ds_future, arr_future)] = map_states(
+            load_raster, [present_raster.dataProvider().dataSourceUri(), future_raster.dataProvider().dataSourceUri()])
         # Clean negative values
+        arr_present[arr_present<0] = 0
         arr_future[arr_future<0] = 0
 
-        print(arr_future)
-        print(np.unique(arr_future))
-        # Parameters
-        V = self.parameterAsDouble(parameters, self.INPUT5, context)
-
-        r = 0
-
-        c = 3
-
-        area_pixel = self.parameterAsInt(parameters, self.PIXEL_RES, context) * self.parameterAsInt(
-            parameters, self.PIXEL_RES, context)
         # Years
         present = self.parameterAsInt(parameters, self.INPUT3, context)
         future = self.parameterAsInt(parameters, self.INPUT4, context)
+        params = SequestroParameters(self.parameterAsInt(parameters, self.PIXEL_RES, context),
+                                     self.parameterAsDouble(parameters, self.INPUT5, context), present, future,
+                                     self.parameterAsDouble(parameters, self.TASSO_SCONTO, context),
+                                     self.parameterAsDouble(parameters, self.VARIAZIONE_PREZZO, context))
 
-        # Calculate coeff sequestration
-        arr_diff = arr_future - arr_present
-        arr_diff_norm = arr_diff / float((future - present))
-        arr_years = np.array(range(0, future - present))
-        coeff = sum(1 / ((1 + r / 100) ** arr_years * ((1 + c / 100) ** arr_years)))
-        carbon_sequestration_value = V * arr_diff_norm * coeff
-        carbon_sequestration_difference = arr_future - arr_present
+        arrays, stats = carbonio.sequestro(arr_present, arr_future, params)
+        carbon_sequestration_value = arrays['value']
         # Initialize and write on output raster
         path_output = self.parameterAsString(parameters, self.OUTPUT, context)
         file_output = path_output + '/SE_01_carbon_sequestration_delta_euro.tiff'
-        driver = gdal.GetDriverByName("GTiff")
-        [cols, rows] = carbon_sequestration_value.shape
-        carbon_sequestration_difference_area = np.sum(carbon_sequestration_difference) / (cols * rows * area_pixel)
-        outdata = driver.Create(file_output, rows, cols, 1, gdal.GDT_Float64)
-        outdata.SetGeoTransform(ds_present.GetGeoTransform())##sets same geotransform as input
-        outdata.SetProjection(ds_present.GetProjection())##sets same projection as input
-        outdata.GetRasterBand(1).WriteArray(carbon_sequestration_value)
-        print(np.max(outdata.GetRasterBand(1).ReadAsArray()))
-        outdata.FlushCache() ##saves to disk!!
-        outdata = None
-        band = None
-        ds = None
-        print(np.sum(arr_present))
+        carbon_sequestration_difference_area = stats['difference'] / stats['total_area']
+        write_raster(file_output, carbon_sequestration_value, ds_present, profile)
         report_output = path_output + '/SE_sequestro_carbonio.txt'
         f = open(report_output, "w+")
         today = datetime.today().strftime('%Y-%m-%d-%H:%M:%S')
@@ -237,23 +244,23 @@ class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
         f.write("Data: " + today +"\n\n\n")
         f.write("Analisi stato di fatto\n\n")
         f.write("Anno corrente: %i \n" % (present))
-        f.write("Sequestro carbonio Stato attuale (ton Corg): %f \n" % (np.sum(arr_present)))
+        f.write("Sequestro carbonio Stato attuale (ton Corg): %f \n" % (stats['present']))
         f.write("Valore medio del carbonio sequestrato per unità di superficie - Stato attuale (ton Corg/ha): : %f \n" % (
-                np.sum(arr_present) / (cols * rows * area_pixel) * 10000))
-        f.write("Valore totale del sequestro di carbonio (€): %f \n\n\n" % ((np.sum(arr_present)*V*coeff)/ float((future - present))))
+                stats['present'] / stats['total_area'] * 10000))
+        f.write("Valore totale del sequestro di carbonio (€): %f \n\n\n" % (stats['present_value']))
         f.write("Analisi stato di progetto\n\n")
         f.write("Anno progetto: %i \n" % (future))
-        f.write("Sequestro carbonio Stato di progetto (ton Corg): %f \n" % (np.sum(arr_future)))
+        f.write("Sequestro carbonio Stato di progetto (ton Corg): %f \n" % (stats['future']))
         f.write("Valore medio del carbonio sequestrato per unità di superficie - Stato di progetto (ton Corg/ha): %f \n" % (
-                np.sum(arr_future) / (cols * rows * area_pixel) * 10000))
-        f.write("Valore totale del sequestro di carbonio (€): %f \n\n\n" % ((np.sum(arr_future)*V*coeff) / float((future - present))))
+                stats['future'] / stats['total_area'] * 10000))
+        f.write("Valore totale del sequestro di carbonio (€): %f \n\n\n" % (stats['future_value']))
         f.write("Differenze tra stato di progetto e stato attuale\n\n")
         f.write("Periodo di analisi: %i - %i\n" % (present, future))
-        f.write("Differenza di sequestro carbonio (ton Corg): %f \n" % (np.sum(arr_diff)))
+        f.write("Differenza di sequestro carbonio (ton Corg): %f \n" % (stats['difference']))
         f.write("Differenza carbonio sequestrato per unità di superficie (ton Corg/ha): %f \n" % (
             carbon_sequestration_difference_area * 10000))
         f.write("Differenza in termini economici del SE di sequestro di carbonio (stato di progetto – stato attuale) (€):%d \n" % (
-            np.sum(carbon_sequestration_value)))
+            stats['value']))
         return {self.OUTPUT: carbon_sequestration_value}
 
         
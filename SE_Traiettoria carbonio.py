@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessing,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterRasterLayer,
+                       QgsProcessingParameterFolderDestination)
+import os
+import sys
+from datetime import datetime
+
+# The se_torino package is kept in the same folder as the scripts
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+from se_torino.raster import RasterWriter, load_raster, write_raster
+from se_torino.parallel import map_states
+from se_torino.kernels import carbonio
+from se_torino.kernels.carbonio import DEFAULT_MATURITY, GROWTH_SHAPE, SOIL_TRANSITION_YEARS, TraiettoriaParameters
+from se_torino.parameters import add_output_profile_parameters, output_profile
+
+class ExampleProcessingAlgorithm(QgsProcessingAlgorithm):
+    """
+    This is an example algorithm that takes a vector layer and
+    creates a new identical one.
+
+    It is meant to be used as an example of how to create your own
+    algorithms and explain methods and variables used to do it. An
+    algorithm like this will be available in all elements, and there
+    is not need for additional work.
+
+    All Processing algorithms should extend the QgsProcessingAlgorithm
+    class.
+    """
+
+    # Constants used to refer to parameters and outputs. They will be
+    # used when calling the algorithm from another algorithm, or when
+    # calling from the QGIS console.
+
+    INPUTRP = 'INPUTRP'
+    INPUTPRE = 'INPUTPRE'
+    INPUTRF = 'INPUTRF'
+    INPUTFUT = 'INPUTFUT'
+    PIXEL_RES = 'PIXEL_RES'
+    VALORE = 'VALORE'
+    TASSO_SCONTO = 'TASSO_SCONTO'
+    VARIAZIONE_PREZZO = 'VARIAZIONE_PREZZO'
+    MATURITA = 'MATURITA'
+    ETA_IMPIANTO = 'ETA_IMPIANTO'
+    FORMA_CRESCITA = 'FORMA_CRESCITA'
+    ANNI_SUOLO = 'ANNI_SUOLO'
+    OUTPUT = 'OUTPUT'
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return ExampleProcessingAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'SE Traiettoria Carbonio'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr('SE Traiettoria Carbonio')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr('SE Torino')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'examplescripts'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it..
+        """
+        return self.tr("Algoritmo per la simulazione anno per anno dello stock di carbonio tra lo stato attuale e lo "
+                       "stato di progetto: il carbonio epigeo perso dalle trasformazioni è perso nel primo anno, "
+                       "quello guadagnato cresce secondo una curva di Chapman-Richards (1 - exp(-k t))^forma e il "
+                       "carbonio del suolo raggiunge quello del nuovo LUCODE in un numero di anni dato. Gli anni di "
+                       "crescita (predefinito 30, età alla quale la curva raggiunge il 95% del valore maturo) e "
+                       "l'esponente della curva (predefinito 3) sono ipotesi da calibrare sulle specie piantate, "
+                       "non valori misurati. Produce un raster multibanda dello stock (una banda per anno) e la "
+                       "valutazione economica scontata")
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUTRP,
+                self.tr('Raster Uso suolo Stato attuale'),
+                [QgsProcessing.TypeRaster]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.INPUTPRE,
+            self.tr('Anno attuale'),
+            QgsProcessingParameterNumber.Integer,
+            2021
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUTRF,
+                self.tr('Raster Uso suolo Stato di progetto'),
+                [QgsProcessing.TypeRaster]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.INPUTFUT,
+            self.tr('Anno progetto'),
+            QgsProcessingParameterNumber.Integer,
+            2030
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.PIXEL_RES,
+            self.tr('Risoluzione spaziale raster (m)'),
+            QgsProcessingParameterNumber.Integer,
+            2
+            )
+        )
+
+        double_param = QgsProcessingParameterNumber(
+            self.VALORE,
+            self.tr('Carbonio in Euro'),
+            QgsProcessingParameterNumber.Double,
+            81.84
+        )
+        double_param.setMetadata( {'widget_wrapper': { 'decimals': 2 }} )
+        self.addParameter(double_param)
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.TASSO_SCONTO,
+            self.tr('Tasso di sconto (%)'),
+            QgsProcessingParameterNumber.Double,
+            0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.VARIAZIONE_PREZZO,
+            self.tr('Tasso di variazione del prezzo del carbonio (%)'),
+            QgsProcessingParameterNumber.Double,
+            3
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.MATURITA,
+            self.tr('Anni di crescita degli alberi piantati'),
+            QgsProcessingParameterNumber.Integer,
+            DEFAULT_MATURITY,
+            minValue=1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.ETA_IMPIANTO,
+            self.tr('Età degli alberi piantati (anni)'),
+            QgsProcessingParameterNumber.Integer,
+            0,
+            minValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+            self.ANNI_SUOLO,
+            self.tr('Anni di transizione del carbonio del suolo'),
+            QgsProcessingParameterNumber.Integer,
+            SOIL_TRANSITION_YEARS,
+            minValue=0
+            )
+        )
+
+        double_param = QgsProcessingParameterNumber(
+            self.FORMA_CRESCITA,
+            self.tr('Esponente della curva di crescita degli alberi piantati'),
+            QgsProcessingParameterNumber.Double,
+            GROWTH_SHAPE,
+            minValue=0.1
+            )
+        double_param.setMetadata( {'widget_wrapper': { 'decimals': 2 }} )
+        self.addParameter(double_param)
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT,
+                self.tr('Salva nella cartella')
+            )
+        )
+
+        add_output_profile_parameters(self)
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        # Output raster format
+        profile = output_profile(self, parameters, context)
+
+        # Load present and future rasters concurrently
+        present_raster = self.parameterAsRasterLayer(parameters, self.INPUTRP, context)
+        future_raster = self.parameterAsRasterLayer(parameters, self.INPUTRF, context)
+        [(ds_present, arr_present), (ds_future, arr_future)] = map_states(
+            load_raster, [present_raster.dataProvider().dataSourceUri(), future_raster.dataProvider().dataSourceUri()])
+        # Clean negative values
+        arr_present[arr_present < 0] = 0
+        arr_future[arr_future < 0] = 0
+
+        # Years
+        present = self.parameterAsInt(parameters, self.INPUTPRE, context)
+        future = self.parameterAsInt(parameters, self.INPUTFUT, context)
+        if future <= present:
+            raise QgsProcessingException(self.tr("L'anno di progetto deve essere successivo all'anno attuale"))
+        params = TraiettoriaParameters(self.parameterAsInt(parameters, self.PIXEL_RES, context),
+                                       self.parameterAsDouble(parameters, self.VALORE, context), present, future,
+                                       self.parameterAsDouble(parameters, self.TASSO_SCONTO, context),
+                                       self.parameterAsDouble(parameters, self.VARIAZIONE_PREZZO, context),
+                                       self.parameterAsInt(parameters, self.MATURITA, context),
+                                       self.parameterAsInt(parameters, self.ETA_IMPIANTO, context),
+                                       self.parameterAsInt(parameters, self.ANNI_SUOLO, context),
+                                       self.parameterAsDouble(parameters, self.FORMA_CRESCITA, context))
+
+        classes, stocks, values, stats = carbonio.traiettoria(arr_present, arr_future, params)
+
+        path_output = self.parameterAsString(parameters, self.OUTPUT, context)
+        # One band per year, each one a gather of the stocks of the year on the classes
+        [rows, cols] = classes.shape
+        file_output = path_output + '/01_carbonio_traiettoria_ton.tiff'
+        writer = RasterWriter(file_output, cols, rows, ds_present, profile, bands=len(stats['years']))
+        for band, year in enumerate(stats['years']):
+            if feedback.isCanceled():
+                break
+            writer.write(stocks[band][classes], band=band + 1)
+            writer.set_description(band + 1, str(year))
+            feedback.setProgress(100.0 * (band + 1) / len(stats['years']))
+        writer.close()
+        file_output = path_output + '/SE_01_carbonio_traiettoria_delta_euro.tiff'
+        write_raster(file_output, values[classes], ds_present, profile)
+
+        report_output = path_output + '/SE_traiettoria_carbonio.txt'
+        f = open(report_output, "w+")
+        today = datetime.today().strftime('%Y-%m-%d-%H:%M:%S')
+        f.write("Sommario dell'analisi della traiettoria dello stock di carbonio\n")
+        f.write("Data: " + today + "\n\n\n")
+        f.write("Periodo di analisi: %i - %i\n" % (present, future))
+        f.write("Tasso di sconto (%%): %f \n" % (params.r))
+        f.write("Tasso di variazione del prezzo del carbonio (%%): %f \n" % (params.c))
+        f.write("Anni di crescita degli alberi piantati: %i \n" % (params.maturity))
+        f.write("Esponente della curva di crescita: %f \n" % (params.shape))
+        f.write("Anni di transizione del carbonio del suolo: %i \n\n" % (params.soil_years))
+        f.write("Anno;Stock carbonio (ton Corg);Sequestro nell'anno (ton Corg);Valore scontato (€)\n")
+        f.write("%i;%f;%f;%f\n" % (stats['years'][0], stats['stock'][0], 0, 0))
+        for year, stock, sequestration, value in zip(stats['years'][1:], stats['stock'][1:],
+                                                      stats['sequestration'], stats['year_value']):
+            f.write("%i;%f;%f;%f\n" % (year, stock, sequestration, value))
+        f.write("\n")
+        f.write("Differenza di stock carbonio (ton Corg): %f \n" % (stats['stock'][-1] - stats['stock'][0]))
+        f.write("Differenza carbonio per unità di superficie (ton Corg/ha): %f \n" % (
+            (stats['stock'][-1] - stats['stock'][0]) / stats['total_area'] * 10000))
+        f.write("Valore scontato del sequestro di carbonio nel periodo (€): %f \n" % (stats['value']))
+        return {self.OUTPUT: 'Completed'}
+
+
+        # -----------------------------------------------------------------------------------
+        # Copyright (c) 2021 Città di Torino.
+        #
+        # This material is free software: you can redistribute it and/or modify
+        # it under the terms of the GNU General Public License as published by
+        # the Free Software Foundation, either version 2 of the License, or
+        # (at your option) any later version.
+        #
+        # This program is distributed in the hope that it will be useful,
+        # but WITHOUT ANY WARRANTY; without even the implied warranty of
+        # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+        # GNU General Public License for more details.
+        #
+        # You should have received a copy of the GNU General Public License
+        # along with this program. If not, see http://www.gnu.org/licenses.
+        # -----------------------------------------------------------------------------------
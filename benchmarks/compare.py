@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Comparison of two result files of run_benchmarks.py: times and peak
+memory of the cases found in both, with the new / old ratio.
+"""
+
+import argparse
+import json
+import sys
+
+
+def load_results(path):
+    with open(path) as f:
+        report = json.load(f)
+    return report, dict(((result['service'], result['mode'], result['size']), result)
+                        for result in report['results'])
+
+
+def ratio(new, old):
+    if not old:
+        return float('nan')
+    return new / old
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compares two SE Torino benchmark result files')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--metric', default='total_time',
+                        choices=['total_time', 'compute_time', 'io_time', 'peak_memory'])
+    args = parser.parse_args(argv)
+
+    old_report, old_results = load_results(args.old)
+    new_report, new_results = load_results(args.new)
+    print('old: %s %s' % (old_report['machine'].get('version'), old_report['machine']['platform']))
+    print('new: %s %s' % (new_report['machine'].get('version'), new_report['machine']['platform']))
+    print('%-26s %-6s %6s %12s %12s %7s' % ('service', 'mode', 'size', 'old', 'new', 'ratio'))
+    for key in sorted(set(old_results.keys()) & set(new_results.keys())):
+        old = old_results[key].get(args.metric)
+        new = new_results[key].get(args.metric)
+        if old is None or new is None:
+            continue
+        print('%-26s %-6s %6i %12.3f %12.3f %7.2f' % (key[0], key[1], key[2], old, new, ratio(new, old)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Minimal stand-in for the qgis modules, so that the Processing scripts can
+be imported and their processAlgorithm run on a machine without QGIS.
+
+Only what the SE scripts use is provided: the parameter definitions keep
+their default value, parameterAs*() read the parameters dict (or the
+default), raster and vector layers only know their source URI and
+feature sources are read with OGR. processing.run() is not available, so
+the algorithms that call other algorithms cannot be run.
+"""
+
+import importlib.util
+import sys
+import types
+
+
+class _Constants(type):
+    # Enum members such as QgsProcessing.TypeRaster are only passed along
+    def __getattr__(cls, name):
+        return 0
+
+
+class _Stub(object, metaclass=_Constants):
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+class QCoreApplication(_Stub):
+    @staticmethod
+    def translate(context, string):
+        return string
+
+
+class QgsProcessingException(Exception):
+    pass
+
+
+class QgsProcessingParameterDefinition(_Stub):
+    FlagAdvanced = 2
+    # Position of the default value among the positional arguments
+    DEFAULT_POSITION = None
+
+    def __init__(self, name, description='', *args, **kwargs):
+        self._name = name
+        self._flags = 0
+        self._default = kwargs.get('defaultValue')
+        if self.DEFAULT_POSITION is not None and len(args) > self.DEFAULT_POSITION:
+            self._default = args[self.DEFAULT_POSITION]
+
+    def name(self):
+        return self._name
+
+    def defaultValue(self):
+        return self._default
+
+    def flags(self):
+        return self._flags
+
+    def setFlags(self, flags):
+        self._flags = flags
+
+
+class QgsProcessingParameterNumber(QgsProcessingParameterDefinition):
+    Integer = 0
+    Double = 1
+    DEFAULT_POSITION = 1
+
+
+class QgsProcessingParameterBoolean(QgsProcessingParameterDefinition):
+    DEFAULT_POSITION = 0
+
+
+class QgsProcessingParameterEnum(QgsProcessingParameterDefinition):
+    DEFAULT_POSITION = 2
+
+
+class QgsProcessingParameterString(QgsProcessingParameterDefinition):
+    DEFAULT_POSITION = 0
+
+
+class QgsMapLayer(object):
+    def __init__(self, uri):
+        self._uri = uri
+
+    def dataProvider(self):
+        return self
+
+    def dataSourceUri(self):
+        return self._uri
+
+    def source(self):
+        return self._uri
+
+
+class QgsRasterLayer(QgsMapLayer):
+    pass
+
+
+class QgsVectorLayer(QgsMapLayer):
+    # Every layer is a file that OGR opens as it is
+    def providerType(self):
+        return 'ogr'
+
+    def subsetString(self):
+        return ''
+
+
+class QgsFields(object):
+    def __init__(self, names):
+        self._names = names
+
+    def names(self):
+        return list(self._names)
+
+
+class QgsProcessingFeatureSource(object):
+    """
+    Features of the first layer of a file, read with OGR. The OGR
+    features are indexed by field name as the QGIS ones.
+    """
+
+    def __init__(self, uri):
+        from osgeo import ogr
+        self._ds = ogr.Open(uri)
+        if self._ds is None:
+            raise QgsProcessingException('Cannot open %s' % uri)
+        self._layer = self._ds.GetLayer(0)
+
+    def fields(self):
+        definition = self._layer.GetLayerDefn()
+        return QgsFields([definition.GetFieldDefn(i).GetName() for i in range(definition.GetFieldCount())])
+
+    def getFeatures(self):
+        self._layer.ResetReading()
+        return iter(self._layer)
+
+
+class QgsProcessingFeedback(object):
+    """
+    Feedback collecting the messages of the algorithm.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.progress = 0.0
+
+    def isCanceled(self):
+        return False
+
+    def pushInfo(self, message):
+        self.messages.append(message)
+
+    reportError = pushInfo
+
+    def setProgress(self, progress):
+        self.progress = progress
+
+
+class QgsProcessingAlgorithm(object):
+    def __init__(self):
+        self._definitions = {}
+
+    def addParameter(self, parameter, createOutput=True):
+        self._definitions[parameter.name()] = parameter
+        return True
+
+    def parameterDefinitions(self):
+        return list(self._definitions.values())
+
+    def _value(self, parameters, name):
+        if name in parameters:
+            return parameters[name]
+        if name in self._definitions:
+            return self._definitions[name].defaultValue()
+        return None
+
+    def parameterAsBool(self, parameters, name, context):
+        return bool(self._value(parameters, name))
+
+    def parameterAsInt(self, parameters, name, context):
+        return int(self._value(parameters, name) or 0)
+
+    parameterAsEnum = parameterAsInt
+
+    def parameterAsDouble(self, parameters, name, context):
+        return float(self._value(parameters, name) or 0)
+
+    def parameterAsString(self, parameters, name, context):
+        value = self._value(parameters, name)
+        return '' if value is None else str(value)
+
+    parameterAsFile = parameterAsString
+
+    def parameterAsRasterLayer(self, parameters, name, context):
+        value = self._value(parameters, name)
+        return None if value is None else QgsRasterLayer(str(value))
+
+    def parameterAsVectorLayer(self, parameters, name, context):
+        value = self._value(parameters, name)
+        return None if value is None else QgsVectorLayer(str(value))
+
+    def parameterAsSource(self, parameters, name, context):
+        value = self._value(parameters, name)
+        return None if value is None else QgsProcessingFeatureSource(str(value))
+
+
+def _run(*args, **kwargs):
+    raise RuntimeError('processing.run() is not available without QGIS')
+
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    return module
+
+
+def install():
+    """
+    Registers the stub modules as qgis, qgis.core, qgis.PyQt.QtCore and
+    qgis.processing, unless the real QGIS is importable. The scripts also
+    import the old top level gdal module, which is mapped to osgeo.gdal.
+    Returns True when the stub is in use.
+    """
+    if importlib.util.find_spec('qgis') is not None:
+        return False
+    core = _module('qgis.core', **dict((name, value) for name, value in globals().items()
+                                       if name.startswith('Qgs')))
+    # The other parameter types only need a name and a default value, any
+    # other Qgs class is only referenced by the scripts
+    core.__getattr__ = lambda name: (QgsProcessingParameterDefinition if name.startswith('QgsProcessingParameter')
+                                     else _Stub)
+    qtcore = _module('qgis.PyQt.QtCore', QCoreApplication=QCoreApplication)
+    processing = _module('qgis.processing', run=_run)
+    pyqt = _module('qgis.PyQt', QtCore=qtcore)
+    package = _module('qgis', core=core, PyQt=pyqt, processing=processing)
+    package.__path__ = []
+    sys.modules.update({'qgis': package, 'qgis.core': core, 'qgis.PyQt': pyqt, 'qgis.PyQt.QtCore': qtcore,
+                        'qgis.processing': processing})
+    if 'gdal' not in sys.modules:
+        try:
+            import gdal
+        except ImportError:
+            from osgeo import gdal
+            sys.modules['gdal'] = gdal
+    return True
+
+
+def load_algorithm(path):
+    """
+    Imports the Processing script at path and returns its algorithm, with
+    the parameters defined.
+    """
+    spec = importlib.util.spec_from_file_location('se_script_%i' % abs(hash(path)), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    algorithm = module.ExampleProcessingAlgorithm()
+    algorithm.initAlgorithm()
+    return algorithm
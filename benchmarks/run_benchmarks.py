@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Benchmarks of the SE algorithms on synthetic land use rasters.
+
+For every raster size and every SE algorithm the I/O phase (reading the
+inputs and writing the output rasters) and the compute phase (the kernel
+calls) are timed separately, with the peak of the memory allocated by
+NumPy during the run. With --scripts the Processing scripts of the land
+use algorithms are also run end to end, through the qgis stub. Results are
+written as JSON, to be compared with compare.py:
+
+    python benchmarks/run_benchmarks.py --sizes 1000 5000 --output bench.json
+    python benchmarks/compare.py bench_old.json bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.dirname(BENCHMARKS_DIR)
+for path in [BENCHMARKS_DIR, SCRIPTS_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+import numpy as np
+try:
+    from osgeo import gdal
+except ImportError:
+    import gdal
+
+import qgis_stub
+from se_torino.raster import OutputProfile, load_raster, write_raster
+from se_torino.runner import SE_MODULES
+from services import SERVICES
+from synthetic import N_CLASSES, SyntheticDataset
+
+# Processing scripts of the land use algorithms, run with --scripts
+SCRIPT_FILES = {
+    'regolazione_temperatura': 'SE_Regolazione temperatura.py',
+    'protezione_idrogeologica': 'SE_Protezione idrogeologica.py',
+    'benefici_culturali': 'SE_Benefici culturali.py',
+    'biodiversita': 'SE_Biodiversita.py',
+    'produzione_agricola': 'SE_Produzione agricola.py',
+    'impollinazione': 'SE_Impollinazione.py',
+}
+# Parameters without a usable default
+SCRIPT_PARAMETERS = {
+    'produzione_agricola': {'CSV': os.path.join(SCRIPTS_DIR, 'produzione_agricola.csv')},
+}
+
+MB = 1024.0 * 1024.0
+
+
+def max_rss():
+    """
+    Returns the peak resident memory of the process in MB, None where the
+    platform does not report it.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return usage / MB
+    return usage / 1024.0
+
+
+def machine_info():
+    info = {
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'gdal': gdal.__version__,
+        'version': None
+    }
+    try:
+        info['version'] = subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=SCRIPTS_DIR,
+                                                  stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return info
+
+
+def run_case(case, dataset, output_folder, profile):
+    """
+    Runs one SE algorithm on dataset and returns its timings (s) and peak
+    memory (MB).
+    """
+    inputs = case.inputs(dataset)
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        datasets = [load_raster(path) for path in inputs]
+        read_time = time.perf_counter() - start
+        reference = datasets[0][0]
+        arrays = [arr for _, arr in datasets]
+
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        outputs = case.compute(arrays, dataset.pixel_res)
+        compute_time = time.perf_counter() - start
+        _, compute_peak = tracemalloc.get_traced_memory()
+
+        start = time.perf_counter()
+        for name, arr in outputs.items():
+            write_raster(os.path.join(output_folder, '%s_%s.tif' % (case.key, name)), arr, reference, profile)
+        write_time = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'read_time': read_time,
+        'compute_time': compute_time,
+        'write_time': write_time,
+        'io_time': read_time + write_time,
+        'total_time': read_time + compute_time + write_time,
+        'compute_peak_memory': compute_peak / MB,
+        'peak_memory': max(peak, compute_peak) / MB,
+        'max_rss': max_rss()
+    }
+
+
+def run_script(key, dataset, output_folder):
+    """
+    Runs the Processing script of a land use SE algorithm end to end and
+    returns its timing (s) and peak memory (MB).
+    """
+    module = [module for module in SE_MODULES if module.key == key][0]
+    algorithm = qgis_stub.load_algorithm(os.path.join(SCRIPTS_DIR, SCRIPT_FILES[key]))
+    parameters = {
+        module.lulc[0]: dataset.present_path,
+        module.lulc[1]: dataset.future_path,
+        'PIXEL_RES': dataset.pixel_res,
+        'OUTPUT': output_folder
+    }
+    parameters.update(SCRIPT_PARAMETERS.get(key, {}))
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        algorithm.processAlgorithm(parameters, None, qgis_stub.QgsProcessingFeedback())
+        total_time = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'total_time': total_time, 'peak_memory': peak / MB, 'max_rss': max_rss()}
+
+
+def best(runs):
+    """
+    Returns the run with the shortest total time, with the total times of
+    all the runs.
+    """
+    result = dict(min(runs, key=lambda run: run['total_time']))
+    result['total_times'] = [run['total_time'] for run in runs]
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the SE Torino algorithms on synthetic rasters')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 2000, 5000],
+                        help='side of the square rasters in pixels (up to 40000)')
+    parser.add_argument('--change-fraction', type=float, default=0.1,
+                        help='fraction of the patches whose lucode changes in the future raster')
+    parser.add_argument('--classes', type=int, default=N_CLASSES, help='number of lucodes')
+    parser.add_argument('--patch-size', type=int, default=32, help='side of the land use patches in pixels')
+    parser.add_argument('--pixel-res', type=int, default=2, help='spatial resolution of the rasters (m)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--services', nargs='+', choices=[case.key for case in SERVICES],
+                        help='SE algorithms to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of every case, the fastest is kept')
+    parser.add_argument('--scripts', action='store_true',
+                        help='also run the Processing scripts of the land use algorithms end to end')
+    parser.add_argument('--data', default=os.path.join(tempfile.gettempdir(), 'se_torino_benchmarks'),
+                        help='folder of the synthetic rasters, reused between runs')
+    parser.add_argument('--output', default='benchmarks.json', help='JSON file of the results')
+    args = parser.parse_args(argv)
+
+    if qgis_stub.install():
+        print('QGIS not found, using the qgis stub')
+    services = [case for case in SERVICES if args.services is None or case.key in args.services]
+    profile = OutputProfile()
+    results = []
+    for size in args.sizes:
+        dataset = SyntheticDataset(args.data, size, args.change_fraction, args.classes, args.patch_size,
+                                   args.pixel_res, args.seed)
+        print('Creating %s' % dataset.name)
+        dataset.create()
+        for case in services:
+            output_folder = tempfile.mkdtemp(prefix='se_torino_bench_')
+            try:
+                runs = [run_case(case, dataset, output_folder, profile) for _ in range(max(1, args.repeat))]
+                result = best(runs)
+                result.update({'service': case.key, 'mode': 'kernel', 'size': size, 'pixels': size * size})
+                results.append(result)
+                print('%-26s %6i  io %8.3f s  compute %8.3f s  peak %9.1f MB' % (
+                    case.key, size, result['io_time'], result['compute_time'], result['peak_memory']))
+                if args.scripts and case.key in SCRIPT_FILES:
+                    runs = [run_script(case.key, dataset, output_folder) for _ in range(max(1, args.repeat))]
+                    result = best(runs)
+                    result.update({'service': case.key, 'mode': 'script', 'size': size, 'pixels': size * size})
+                    results.append(result)
+                    print('%-26s %6i  script %8.3f s  peak %9.1f MB' % (
+                        case.key, size, result['total_time'], result['peak_memory']))
+            finally:
+                shutil.rmtree(output_folder, ignore_errors=True)
+
+    report = {
+        'date': datetime.today().strftime('%Y-%m-%d-%H:%M:%S'),
+        'machine': machine_info(),
+        'settings': {
+            'change_fraction': args.change_fraction,
+            'classes': args.classes,
+            'patch_size': args.patch_size,
+            'pixel_res': args.pixel_res,
+            'seed': args.seed,
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Results written to %s' % args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
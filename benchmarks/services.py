@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+The SE algorithms as benchmark cases: the input rasters they read, the
+kernel calls of their processAlgorithm and the rasters they write.
+"""
+
+import numpy as np
+
+from se_torino.transition import TransitionMatrix
+from se_torino.kernels import (benefici, biodiversita, carbonio, impollinazione, infiltrazione, inquinanti,
+                               produzione, protezione, temperatura)
+from se_torino.kernels.benefici import BeneficiParameters
+from se_torino.kernels.biodiversita import BiodiversitaParameters
+from se_torino.kernels.carbonio import SequestroParameters
+from se_torino.kernels.impollinazione import ImpollinazioneParameters
+from se_torino.kernels.infiltrazione import InfiltrazioneParameters
+from se_torino.kernels.inquinanti import InquinantiParameters, POLLUTANTS
+from se_torino.kernels.produzione import ProduzioneParameters
+from se_torino.kernels.protezione import ProtezioneParameters
+from se_torino.kernels.temperatura import TemperaturaParameters
+
+from synthetic import class_values
+
+
+class ServiceCase(object):
+    """
+    One SE algorithm. inputs(dataset) returns the paths of the rasters it
+    reads; compute(arrays, pixel_res) takes them as arrays, in the same
+    order, and returns the dict of the rasters it writes.
+    """
+
+    def __init__(self, key, inputs, compute):
+        self.key = key
+        self.inputs = inputs
+        self.compute = compute
+
+
+def _lulc(dataset):
+    return [dataset.present_path, dataset.future_path]
+
+
+def _clean(arrays):
+    for arr in arrays:
+        arr[arr < 0] = 0
+    return arrays
+
+
+def _temperatura(arrays, pixel_res):
+    arr_present, arr_future = _clean(arrays)
+    params = TemperaturaParameters(pixel_res)
+    arrays_present = temperatura.state_arrays(arr_present, params)
+    arrays_future = temperatura.state_arrays(arr_future, params)
+    transitions = TransitionMatrix(arr_present, arr_future)
+    temperatura.state_stats(transitions.present, params)
+    temperatura.state_stats(transitions.future, params)
+    temperatura.delta_transitions(transitions, params)
+    return {'HM_presente': arrays_present['HM'], 'HM_futuro': arrays_future['HM'],
+            'delta': arrays_future['value'] - arrays_present['value']}
+
+
+def _impollinazione(arrays, pixel_res):
+    arr_present, arr_future = _clean(arrays)
+    params = ImpollinazioneParameters(pixel_res)
+    arrays_present = impollinazione.state_arrays(arr_present, params)
+    arrays_future = impollinazione.state_arrays(arr_future, params)
+    transitions = TransitionMatrix(arr_present, arr_future)
+    impollinazione.state_stats(transitions.present, params)
+    impollinazione.state_stats(transitions.future, params)
+    impollinazione.delta_transitions(transitions, params)
+    return {'delta': arrays_future['value'] - arrays_present['value']}
+
+
+def _produzione(arrays, pixel_res):
+    arr_present, arr_future = _clean(arrays)
+    params = ProduzioneParameters(pixel_res, dict((lucode, 100.0) for lucode in range(1, 88)))
+    arrays_present = produzione.state_arrays(arr_present, params)
+    arrays_future = produzione.state_arrays(arr_future, params)
+    transitions = TransitionMatrix(arr_present, arr_future)
+    produzione.state_stats(transitions.present, params)
+    produzione.state_stats(transitions.future, params)
+    produzione.delta_transitions(transitions, params)
+    return {'presente': arrays_present['production'], 'futuro': arrays_future['production'],
+            'delta': arrays_future['value'] - arrays_present['value']}
+
+
+def _protezione(arrays, pixel_res):
+    arr_present, arr_future = _clean(arrays)
+    params = ProtezioneParameters(pixel_res)
+    arrays_present = protezione.state_arrays(arr_present, params)
+    arrays_future = protezione.state_arrays(arr_future, params)
+    transitions = TransitionMatrix(arr_present, arr_future)
+    protezione.state_stats(transitions.present, params)
+    protezione.state_stats(transitions.future, params)
+    protezione.delta_transitions(transitions, params)
+    return {'Pe_presente': arrays_present['Pe'], 'Pe_futuro': arrays_future['Pe'],
+            'delta': arrays_future['value'] - arrays_present['value']}
+
+
+def _biodiversita(arrays, pixel_res):
+    arr_present, arr_future = _clean(arrays)
+    params_present = BiodiversitaParameters(pixel_res, [1, 1, 0, 2, 0, 0, 1, 0, 0, 0])
+    params_future = BiodiversitaParameters(pixel_res, [1, 0, 0, 1, 0, 0, 1, 0, 0, 0])
+    arrays_present = biodiversita.state_arrays(arr_present, params_present)
+    arrays_future = biodiversita.state_arrays(arr_future, params_future)
+    transitions = TransitionMatrix(arr_present, arr_future)
+    biodiversita.state_stats(transitions.present, params_present)
+    biodiversita.state_stats(transitions.future, params_future)
+    biodiversita.delta_transitions(transitions, params_present, params_future)
+    return {'Q_presente': arrays_present['Q'], 'Q_futuro': arrays_future['Q'],
+            'delta': arrays_future['value'] - arrays_present['value']}
+
+
+def _culturali(arrays, pixel_res):
+    arr_present, arr_future = _clean(arrays)
+    params = BeneficiParameters(pixel_res, [True, False, True, False, False], [True, True, False, False],
+                                [True, False, True, False, False, True])
+    arrays_present, stats_present = benefici.culturali_state(arr_present, params)
+    arrays_future, stats_future = benefici.culturali_state(arr_future, params)
+    arr_output = np.zeros(arr_present.shape)
+    arr_output[np.where(arr_present < 88)] = stats_future['value'] - stats_present['value']
+    benefici.culturali_delta_transitions(TransitionMatrix(arr_present, arr_future), params)
+    return {'ROS_presente': arrays_present['ROS'], 'ROS_futuro': arrays_future['ROS'], 'delta': arr_output}
+
+
+def _sociali(arrays, pixel_res):
+    arr_present, arr_future = _clean(arrays)
+    params = BeneficiParameters(pixel_res, [True, False, True, False, False], [True, True, False, False],
+                                [True, False, True, False, False, True])
+    transitions = TransitionMatrix(arr_present, arr_future)
+    stats_present = benefici.sociali_state_stats(transitions.present, params)
+    stats_future = benefici.sociali_state_stats(transitions.future, params)
+    arrays_present = benefici.sociali_state_arrays(arr_present, stats_present['ROS'])
+    arrays_future = benefici.sociali_state_arrays(arr_future, stats_future['ROS'])
+    arr_output = np.zeros(arr_present.shape)
+    arr_output[np.where(arr_present < 88)] = stats_future['value'] - stats_present['value']
+    benefici.culturali_delta_transitions(TransitionMatrix(arr_present, arr_future), params)
+    return {'ROS_presente': arrays_present['ROS'], 'ROS_futuro': arrays_future['ROS'], 'delta': arr_output}
+
+
+def _carbonio_inputs(dataset):
+    return dataset.create_physical('carbonio', class_values('carbonio', dataset.n_classes, 0.0, 0.02))
+
+
+def _carbonio(arrays, pixel_res):
+    arr_present, arr_future = _clean(arrays)
+    arrays, _ = carbonio.sequestro(arr_present, arr_future, SequestroParameters(pixel_res))
+    return {'delta': arrays['value']}
+
+
+def _infiltrazione_inputs(dataset):
+    return dataset.create_physical('infiltrazione', class_values('infiltrazione', dataset.n_classes, 0.0, 50.0))
+
+
+def _infiltrazione(arrays, pixel_res):
+    arr_present, arr_future = _clean(arrays)
+    arrays, _ = infiltrazione.infiltrazione(arr_present, arr_future, InfiltrazioneParameters(pixel_res))
+    return {'delta': arrays['value']}
+
+
+def _inquinanti_inputs(dataset):
+    # Present rasters of the pollutants, then the future ones
+    paths = [dataset.create_physical(pollutant, class_values(pollutant, dataset.n_classes, 0.0, 1e-6))
+             for pollutant in POLLUTANTS]
+    return [present for present, _ in paths] + [future for _, future in paths]
+
+
+def _inquinanti(arrays, pixel_res):
+    n = len(POLLUTANTS)
+    arrays, _ = inquinanti.rimozione(dict(zip(POLLUTANTS, arrays[:n])), dict(zip(POLLUTANTS, arrays[n:])),
+                                     InquinantiParameters(pixel_res))
+    return {'delta': arrays['value']}
+
+
+# In the order of the SE Calcolo Complessivo inputs
+SERVICES = [
+    ServiceCase('sequestro_carbonio', _carbonio_inputs, _carbonio),
+    ServiceCase('rimozione_inquinanti', _inquinanti_inputs, _inquinanti),
+    ServiceCase('regolazione_temperatura', _lulc, _temperatura),
+    ServiceCase('protezione_idrogeologica', _lulc, _protezione),
+    ServiceCase('infiltrazione', _infiltrazione_inputs, _infiltrazione),
+    ServiceCase('benefici_culturali', _lulc, _culturali),
+    ServiceCase('benefici_sociali', _lulc, _sociali),
+    ServiceCase('biodiversita', _lulc, _biodiversita),
+    ServiceCase('produzione_agricola', _lulc, _produzione),
+    ServiceCase('impollinazione', _lulc, _impollinazione),
+]
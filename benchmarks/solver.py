@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Iterations and time of the current flow solves of the connectivity kernel
+on a synthetic land use grid. Exits with 1 when a solve needs more than
+--max-iterations conjugate gradient iterations (multigrid preconditioner
+only) or does not converge:
+
+    python benchmarks/solver.py --size 300 --sources 5
+"""
+
+import argparse
+import os
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.dirname(BENCHMARKS_DIR)
+for path in [BENCHMARKS_DIR, SCRIPTS_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+import numpy as np
+
+from se_torino.kernels import connettivita
+from se_torino.kernels.connettivita import ConnettivitaParameters
+from synthetic import N_CLASSES, SyntheticDataset
+
+
+def land_use(size, patch_size, seed):
+    """
+    Returns the present land use of a synthetic dataset as an array,
+    without writing it.
+    """
+    present, _ = SyntheticDataset(None, size, 0.0, N_CLASSES, patch_size, seed=seed).patches()
+    return np.repeat(np.repeat(present, patch_size, axis=0), patch_size, axis=1)[:size, :size]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Iterations of the SE Torino connectivity solves')
+    parser.add_argument('--size', type=int, default=300, help='side of the square grid in pixels')
+    parser.add_argument('--sources', type=int, default=5, help='number of focal patches')
+    parser.add_argument('--patch-size', type=int, default=16, help='side of the land use patches in pixels')
+    parser.add_argument('--min-area', type=float, default=0.05, help='minimum area of the focal patches (ha)')
+    parser.add_argument('--max-iterations', type=int, default=40,
+                        help='iterations allowed to a solve with the multigrid preconditioner')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if connettivita.sparse is None:
+        print('scipy not found')
+        return 1
+    arr = land_use(args.size, args.patch_size, args.seed)
+    params = ConnettivitaParameters(min_area=args.min_area, max_sources=args.sources)
+    start = time.perf_counter()
+    _, stats = connettivita.current_density(arr, params)
+    total_time = time.perf_counter() - start
+    preconditioner = 'jacobi' if connettivita.pyamg is None else 'amg'
+    print('%i x %i, %i sources, %s: %.3f s, iterations per source %s' % (
+        args.size, args.size, stats['n_sources'], preconditioner, total_time, stats['iterations']))
+    if stats['not_converged']:
+        print('%i solves did not converge' % stats['not_converged'])
+        return 1
+    if connettivita.pyamg is not None and stats['iterations'] and max(stats['iterations']) > args.max_iterations:
+        print('More than %i iterations per source' % args.max_iterations)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Synthetic present and future land use rasters for the benchmarks.
+
+The rasters are made of square patches of a random lucode, so that they
+have the spatial structure of a real land use map, and are written strip
+by strip: a 40000 x 40000 pair never needs to be held in memory.
+"""
+
+import os
+
+import numpy as np
+try:
+    from osgeo import gdal, osr
+except ImportError:
+    import gdal
+    import osr
+
+# Lucodes of the synthetic rasters are 1 ... N_CLASSES
+N_CLASSES = 87
+# Torino, WGS 84 / UTM zone 32N
+EPSG = 32632
+ORIGIN = (390000.0, 5000000.0)
+CREATION_OPTIONS = ['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER']
+
+
+class SyntheticDataset(object):
+    """
+    A pair of size x size land use rasters in folder. change_fraction is
+    the fraction of patches whose lucode changes in the future raster.
+    """
+
+    def __init__(self, folder, size, change_fraction=0.1, n_classes=N_CLASSES, patch_size=32, pixel_res=2,
+                 seed=0):
+        self.folder = folder
+        self.size = size
+        self.change_fraction = change_fraction
+        self.n_classes = n_classes
+        self.patch_size = patch_size
+        self.pixel_res = pixel_res
+        self.seed = seed
+
+    @property
+    def name(self):
+        return 'lulc_%i_c%g_k%i_p%i_s%i' % (self.size, self.change_fraction, self.n_classes, self.patch_size,
+                                             self.seed)
+
+    @property
+    def present_path(self):
+        return os.path.join(self.folder, self.name + '_presente.tif')
+
+    @property
+    def future_path(self):
+        return os.path.join(self.folder, self.name + '_futuro.tif')
+
+    def physical_path(self, service, state):
+        return os.path.join(self.folder, '%s_%s_%s.tif' % (self.name, service, state))
+
+    def patches(self):
+        """
+        Returns the present and future lucode of every patch.
+        """
+        rng = np.random.RandomState(self.seed)
+        n_patches = -(-self.size // self.patch_size)
+        present = rng.randint(1, self.n_classes + 1, (n_patches, n_patches)).astype(np.uint8)
+        changed = rng.random_sample((n_patches, n_patches)) < self.change_fraction
+        # A changed patch takes any lucode but its present one
+        shift = rng.randint(1, self.n_classes, (n_patches, n_patches))
+        future = np.where(changed, (present.astype(np.int64) - 1 + shift) % self.n_classes + 1, present)
+        return present, future.astype(np.uint8)
+
+    def create(self):
+        """
+        Writes the two land use rasters, unless they are already in folder.
+        """
+        if os.path.isfile(self.present_path) and os.path.isfile(self.future_path):
+            return self
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        for path, patches in zip([self.present_path, self.future_path], self.patches()):
+            self._write_patches(path, patches)
+        return self
+
+    def _create_raster(self, path, gdal_type):
+        ds = gdal.GetDriverByName('GTiff').Create(path, self.size, self.size, 1, gdal_type, CREATION_OPTIONS)
+        if ds is None:
+            raise IOError('Unable to create the raster %s' % path)
+        ds.SetGeoTransform([ORIGIN[0], self.pixel_res, 0, ORIGIN[1], 0, -self.pixel_res])
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(EPSG)
+        ds.SetProjection(srs.ExportToWkt())
+        return ds
+
+    def _strips(self):
+        # Strips of whole patches, about 64 MB of lucodes each
+        strip_rows = max(1, (64 * 1024 * 1024 // self.size) // self.patch_size) * self.patch_size
+        for yoff in range(0, self.size, strip_rows):
+            yield yoff, min(strip_rows, self.size - yoff)
+
+    def _write_patches(self, path, patches):
+        ds = self._create_raster(path, gdal.GDT_Byte)
+        band = ds.GetRasterBand(1)
+        for yoff, ysize in self._strips():
+            first = yoff // self.patch_size
+            last = -(-(yoff + ysize) // self.patch_size)
+            strip = np.repeat(np.repeat(patches[first:last], self.patch_size, axis=0), self.patch_size, axis=1)
+            band.WriteArray(strip[:ysize, :self.size], 0, yoff)
+        ds.FlushCache()
+        ds = None
+
+    def create_physical(self, service, values):
+        """
+        Writes, for both states, a Float32 raster with values[lucode] on
+        every pixel, standing in for the output of a physical stage
+        (e.g. the carbon stock of Calcolo C). Returns the two paths.
+        """
+        values = np.asarray(values, dtype=np.float32)
+        paths = []
+        for state, lulc_path in [('presente', self.present_path), ('futuro', self.future_path)]:
+            path = self.physical_path(service, state)
+            paths.append(path)
+            if os.path.isfile(path):
+                continue
+            lulc = gdal.Open(lulc_path)
+            lulc_band = lulc.GetRasterBand(1)
+            ds = self._create_raster(path, gdal.GDT_Float32)
+            band = ds.GetRasterBand(1)
+            for yoff, ysize in self._strips():
+                band.WriteArray(values[lulc_band.ReadAsArray(0, yoff, self.size, ysize)], 0, yoff)
+            ds.FlushCache()
+            ds = None
+        return paths
+
+
+def class_values(name, n_classes=N_CLASSES, low=0.0, high=1.0):
+    """
+    Returns random per-lucode values in [low, high) for a physical raster,
+    the same for every run with the same name.
+    """
+    rng = np.random.RandomState(sum(ord(char) for char in name))
+    values = np.zeros(n_classes + 1)
+    values[1:] = rng.uniform(low, high, n_classes)
+    return values
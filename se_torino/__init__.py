@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Shared helpers of the SE Torino processing scripts.
+
+The package must be kept in the same folder as the scripts: every script
+adds its own folder to sys.path before importing from se_torino.
+"""
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Computations of the SE algorithms, without QGIS.
+
+Every module works on NumPy arrays and on a parameters object and returns
+dicts of arrays and of report statistics, so the services can be run from
+batch jobs without a QgsApplication. The Processing scripts only read
+their parameters, load the rasters and write the outputs.
+
+Land use arrays are expected to be cleaned already (negative values set
+to 0, as load_raster callers do).
+"""
+
+
+class KernelParameters(object):
+    """
+    Parameters shared by all the kernels: the spatial resolution of the
+    rasters in meters.
+    """
+
+    def __init__(self, pixel_res=2):
+        self.pixel_res = pixel_res
+
+    @property
+    def area_pixel(self):
+        return self.pixel_res * self.pixel_res
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Accessibilità: walking time from the entrance points of an area over the
+land use grid (cost distance).
+
+Every lucode has a walking friction, 1 on the pedestrian paths and inf on
+the cells that cannot be crossed (buildings, water, railways). The travel
+cost is computed with a multi-source Dijkstra on the 8-neighbour grid,
+tile by tile: each tile is solved with a one pixel halo from the costs of
+its neighbours, and the tiles whose halo improves are queued again in a
+heap ordered by their lowest improved cost, until nothing changes. The
+tile solves use scipy.sparse.csgraph when available and a heapq Dijkstra
+otherwise.
+"""
+
+import heapq
+import math
+
+import numpy as np
+try:
+    from scipy import sparse
+    from scipy.sparse.csgraph import dijkstra
+except ImportError:
+    sparse = None
+
+from se_torino.kernels import KernelParameters
+from se_torino.lookup import LucodeTable
+
+# Walking speed on the pedestrian paths (m/min)
+WALK_SPEED = 75.0
+# Walking friction of each lucode, relative to the pedestrian paths (inf: not crossable)
+FRICTION_LUCODE = {}
+# Equipped areas, dog areas, cycle and pedestrian paths, playgrounds, sports grounds, bridges
+FRICTION_LUCODE.update((lucode, 1.0) for lucode in [7, 8, 9, 10, 11, 12, 13, 14, 17, 18, 26, 27, 66, 67, 80])
+# Green areas, tree lined infrastructures, harbour works
+FRICTION_LUCODE.update((lucode, 1.2) for lucode in [21, 22, 43, 44, 56])
+# Vehicular traffic areas, embankments
+FRICTION_LUCODE.update((lucode, 2.0) for lucode in [15, 16, 23, 24, 25])
+# Crops, meadows, pastures, vegetable gardens, nurseries
+FRICTION_LUCODE.update((lucode, 2.0) for lucode in [1, 2, 4, 5, 6, 29, 30, 37, 40, 41, 42, 57, 58, 59, 61, 62, 63,
+                                                    64, 65, 68, 69, 70, 73, 74, 75, 76, 79, 81])
+# Areas under transformation, surface drainages, natural landforms
+FRICTION_LUCODE.update((lucode, 2.5) for lucode in [19, 20, 34, 38, 39])
+# Woods
+FRICTION_LUCODE.update((lucode, 3.0) for lucode in [82, 83, 84, 85, 86, 87])
+# Buildings, water, landfills, transport and hydraulic works, walls, railways, pylons
+FRICTION_LUCODE.update((lucode, np.inf) for lucode in [3, 28, 31, 32, 33, 35, 36, 45, 46, 47, 48, 49, 50, 51, 52, 53,
+                                                       54, 55, 60, 71, 72, 77, 78])
+FRICTION_TABLE = LucodeTable(FRICTION_LUCODE, default=np.inf)
+
+# Offsets and lengths (pixels) of the steps between neighbour cells, one per pair
+STEPS = [(0, 1, 1.0), (1, 0, 1.0), (1, 1, math.sqrt(2)), (1, -1, math.sqrt(2))]
+# Weight of the super source edges of the csgraph solves, added to the initial costs
+# (csgraph drops the edges of weight 0)
+SOURCE_EPS = 1e-6
+
+
+class AccessibilitaParameters(KernelParameters):
+    """
+    max_time (min) is the walking time beyond which the accessibility is 0,
+    walk_speed (m/min) the speed on the pedestrian paths and tile the side
+    in pixels of the tiles of the cost distance.
+    """
+
+    def __init__(self, pixel_res=2, max_time=15, walk_speed=WALK_SPEED, tile=1024):
+        KernelParameters.__init__(self, pixel_res)
+        self.max_time = max_time
+        self.walk_speed = walk_speed
+        self.tile = tile
+
+
+def _window_costs_csgraph(friction, costs, pixel_res):
+    rows, cols = friction.shape
+    n = rows * cols
+    nodes = np.arange(n).reshape(rows, cols)
+    flat_friction = friction.ravel()
+    a_list = []
+    b_list = []
+    weights = []
+    for dy, dx, step in STEPS:
+        a = nodes[:rows - dy, max(0, -dx):cols - max(0, dx)].ravel()
+        b = nodes[dy:, max(0, dx):cols + min(0, dx)].ravel()
+        w = step * pixel_res * (flat_friction[a] + flat_friction[b]) / 2
+        passable = np.isfinite(w)
+        a_list.append(a[passable])
+        b_list.append(b[passable])
+        weights.append(w[passable])
+    # A super source (node n) reaches every cell with a cost through an edge of that cost
+    sources = np.flatnonzero(np.isfinite(costs.ravel()))
+    a_list.append(np.full(len(sources), n))
+    b_list.append(sources)
+    weights.append(costs.ravel()[sources].astype(np.float64) + SOURCE_EPS)
+    graph = sparse.csr_matrix((np.concatenate(weights), (np.concatenate(a_list), np.concatenate(b_list))),
+                              shape=(n + 1, n + 1))
+    dist = dijkstra(graph, directed=False, indices=n)[:n] - SOURCE_EPS
+    return dist.reshape(rows, cols)
+
+
+def _window_costs_heap(friction, costs, pixel_res):
+    rows, cols = friction.shape
+    costs = costs.astype(np.float64)
+    steps = [(dy, dx, step * pixel_res / 2) for dy, dx, step in STEPS] + \
+            [(-dy, -dx, step * pixel_res / 2) for dy, dx, step in STEPS]
+    heap = [(costs[r, c], r, c) for r, c in zip(*np.nonzero(np.isfinite(costs)))]
+    heapq.heapify(heap)
+    while heap:
+        cost, r, c = heapq.heappop(heap)
+        if cost > costs[r, c]:
+            continue
+        f = friction[r, c]
+        for dy, dx, half_step in steps:
+            y = r + dy
+            x = c + dx
+            if 0 <= y < rows and 0 <= x < cols:
+                new_cost = cost + half_step * (f + friction[y, x])
+                if new_cost < costs[y, x]:
+                    costs[y, x] = new_cost
+                    heapq.heappush(heap, (new_cost, y, x))
+    return costs
+
+
+def window_costs(friction, costs, pixel_res=2):
+    """
+    Returns the lowest travel costs of a window from the initial costs of
+    its cells (inf where unknown), with a Dijkstra over the window.
+    """
+    if sparse is not None:
+        return _window_costs_csgraph(friction, costs, pixel_res)
+    return _window_costs_heap(friction, costs, pixel_res)
+
+
+def cost_distance(friction, sources, pixel_res=2, tile=1024):
+    """
+    Returns the travel cost (m on the pedestrian paths) of every cell from
+    the nearest source cell, inf where no source can be reached.
+    """
+    rows, cols = friction.shape
+    costs = np.where(sources, 0, np.inf).astype(np.float32)
+    n_tile_rows = -(-rows // tile)
+    n_tile_cols = -(-cols // tile)
+
+    def window(tile_row, tile_col):
+        return (slice(max(0, tile_row * tile - 1), min(rows, (tile_row + 1) * tile + 1)),
+                slice(max(0, tile_col * tile - 1), min(cols, (tile_col + 1) * tile + 1)))
+
+    # Tiles to solve, by lowest improved cost; queued keeps the current key of each one
+    queued = {}
+    for tile_row in range(n_tile_rows):
+        for tile_col in range(n_tile_cols):
+            if np.any(sources[tile_row * tile:(tile_row + 1) * tile, tile_col * tile:(tile_col + 1) * tile]):
+                queued[(tile_row, tile_col)] = 0.0
+    heap = [(key, tile_row, tile_col) for (tile_row, tile_col), key in queued.items()]
+    heapq.heapify(heap)
+    while heap:
+        key, tile_row, tile_col = heapq.heappop(heap)
+        if queued.get((tile_row, tile_col)) != key:
+            continue
+        del queued[(tile_row, tile_col)]
+        rows_slice, cols_slice = window(tile_row, tile_col)
+        before = costs[rows_slice, cols_slice]
+        # Compared in float32, as stored, so rounding never counts as an improvement
+        after = window_costs(friction[rows_slice, cols_slice], before, pixel_res).astype(np.float32)
+        improved = after < before
+        if not np.any(improved):
+            continue
+        costs[rows_slice, cols_slice] = np.minimum(before, after)
+        # The neighbour tiles see the improved cells in their window
+        for neighbour_row in range(max(0, tile_row - 1), min(n_tile_rows, tile_row + 2)):
+            for neighbour_col in range(max(0, tile_col - 1), min(n_tile_cols, tile_col + 2)):
+                if (neighbour_row, neighbour_col) == (tile_row, tile_col):
+                    continue
+                neighbour_rows, neighbour_cols = window(neighbour_row, neighbour_col)
+                y0 = max(rows_slice.start, neighbour_rows.start) - rows_slice.start
+                y1 = min(rows_slice.stop, neighbour_rows.stop) - rows_slice.start
+                x0 = max(cols_slice.start, neighbour_cols.start) - cols_slice.start
+                x1 = min(cols_slice.stop, neighbour_cols.stop) - cols_slice.start
+                shared = improved[y0:y1, x0:x1]
+                if np.any(shared):
+                    new_key = float(np.min(after[y0:y1, x0:x1][shared]))
+                    if new_key < queued.get((neighbour_row, neighbour_col), np.inf):
+                        queued[(neighbour_row, neighbour_col)] = new_key
+                        heapq.heappush(heap, (new_key, neighbour_row, neighbour_col))
+    return costs
+
+
+def travel_time(arr, entrances, params):
+    """
+    Returns the walking time (min) of every pixel of a land use array from
+    the nearest entrance pixel. Entrance pixels are crossable whatever
+    their lucode.
+    """
+    friction = FRICTION_TABLE.map(arr)[0].astype(np.float32)
+    friction[entrances & ~np.isfinite(friction)] = 1.0
+    costs = cost_distance(friction, entrances, params.pixel_res, params.tile)
+    return costs / params.walk_speed
+
+
+def accessibility(time, params):
+    """
+    Returns the accessibility score (0-1) of the walking times: 1 at the
+    entrances, decreasing linearly to 0 at max_time.
+    """
+    return np.clip(1 - time / params.max_time, 0, 1)
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Benefici culturali and benefici sociali: recreation opportunity spectrum
+(ROS) of the land use and of the aspects of the area.
+"""
+
+import numpy as np
+
+from se_torino.kernels import KernelParameters
+from se_torino.kernels import prossimita
+from se_torino.lookup import LucodeTable
+
+# Scores of single lucode
+SCORE_LUCODE = {}
+SCORE_LUCODE[1] = 0.4
+SCORE_LUCODE[2] = 0.4
+SCORE_LUCODE[3] = 0.1
+SCORE_LUCODE[4] = 0.1
+SCORE_LUCODE[5] = 0.4
+SCORE_LUCODE[6] = 0.4
+SCORE_LUCODE[7] = 0.1
+SCORE_LUCODE[8] = 0
+SCORE_LUCODE[9] = 0.2
+SCORE_LUCODE[10] = 0.2
+SCORE_LUCODE[11] = 0.2
+SCORE_LUCODE[12] = 0.2
+SCORE_LUCODE[13] = 0.2
+SCORE_LUCODE[14] = 0.2
+SCORE_LUCODE[15] = 0.1
+SCORE_LUCODE[16] = 0.1
+SCORE_LUCODE[17] = 0.3
+SCORE_LUCODE[18] = 0.2
+SCORE_LUCODE[19] = 0.3
+SCORE_LUCODE[20] = 0
+SCORE_LUCODE[21] = 0.9
+SCORE_LUCODE[22] = 0.8
+SCORE_LUCODE[23] = 0.7
+SCORE_LUCODE[24] = 0.5
+SCORE_LUCODE[25] = 0.2
+SCORE_LUCODE[26] = 0.6
+SCORE_LUCODE[27] = 0.5
+SCORE_LUCODE[28] = 0.6
+SCORE_LUCODE[29] = 0.5
+SCORE_LUCODE[30] = 0.4
+SCORE_LUCODE[31] = 0.9
+SCORE_LUCODE[32] = 0
+SCORE_LUCODE[33] = 0
+SCORE_LUCODE[34] = 0.1
+SCORE_LUCODE[35] = 0
+SCORE_LUCODE[36] = 0
+SCORE_LUCODE[37] = 0.4
+SCORE_LUCODE[38] = 0.6
+SCORE_LUCODE[39] = 0.5
+SCORE_LUCODE[40] = 0.4
+SCORE_LUCODE[41] = 0.4
+SCORE_LUCODE[42] = 0.4
+SCORE_LUCODE[43] = 0.3
+SCORE_LUCODE[44] = 0.2
+SCORE_LUCODE[45] = 0.7
+SCORE_LUCODE[46] = 0
+SCORE_LUCODE[47] = 0
+SCORE_LUCODE[48] = 0.1
+SCORE_LUCODE[49] = 0.1
+SCORE_LUCODE[50] = 0
+SCORE_LUCODE[51] = 0
+SCORE_LUCODE[52] = 0
+SCORE_LUCODE[53] = 0.2
+SCORE_LUCODE[54] = 0.1
+SCORE_LUCODE[55] = 0
+SCORE_LUCODE[56] = 0.1
+SCORE_LUCODE[57] = 0.4
+SCORE_LUCODE[58] = 0.3
+SCORE_LUCODE[59] = 0.4
+SCORE_LUCODE[60] = 0
+SCORE_LUCODE[61] = 0.7
+SCORE_LUCODE[62] = 0.8
+SCORE_LUCODE[63] = 0.7
+SCORE_LUCODE[64] = 0.4
+SCORE_LUCODE[65] = 0.4
+SCORE_LUCODE[66] = 0
+SCORE_LUCODE[67] = 0
+SCORE_LUCODE[68] = 0.6
+SCORE_LUCODE[69] = 0.8
+SCORE_LUCODE[70] = 0.6
+SCORE_LUCODE[71] = 0.1
+SCORE_LUCODE[72] = 0
+SCORE_LUCODE[73] = 0.4
+SCORE_LUCODE[74] = 0.4
+SCORE_LUCODE[75] = 0.4
+SCORE_LUCODE[76] = 0.4
+SCORE_LUCODE[77] = 0
+SCORE_LUCODE[78] = 0.8
+SCORE_LUCODE[79] = 0.4
+SCORE_LUCODE[80] = 0
+SCORE_LUCODE[81] = 0
+SCORE_LUCODE[82] = 0.8
+SCORE_LUCODE[83] = 0.9
+SCORE_LUCODE[84] = 0.9
+SCORE_LUCODE[85] = 0.75
+SCORE_LUCODE[86] = 0.6
+SCORE_LUCODE[87] = 0.9
+
+# Economic values of each lucode
+VALUE_LUCODE = {}
+VALUE_LUCODE[1] = 1.44
+VALUE_LUCODE[2] = 1.44
+VALUE_LUCODE[3] = 0
+VALUE_LUCODE[4] = 1.44
+VALUE_LUCODE[5] = 1.44
+VALUE_LUCODE[6] = 1.44
+VALUE_LUCODE[7] = 1.44
+VALUE_LUCODE[8] = 0
+VALUE_LUCODE[9] = 2.36
+VALUE_LUCODE[10] = 2.36
+VALUE_LUCODE[11] = 0
+VALUE_LUCODE[12] = 0
+VALUE_LUCODE[13] = 0
+VALUE_LUCODE[14] = 0
+VALUE_LUCODE[15] = 0
+VALUE_LUCODE[16] = 0
+VALUE_LUCODE[17] = 2.36
+VALUE_LUCODE[18] = 0
+VALUE_LUCODE[19] = 1.44
+VALUE_LUCODE[20] = 0
+VALUE_LUCODE[21] = 2.36
+VALUE_LUCODE[22] = 2.36
+VALUE_LUCODE[23] = 2.36
+VALUE_LUCODE[24] = 2.36
+VALUE_LUCODE[25] = 0
+VALUE_LUCODE[26] = 2.36
+VALUE_LUCODE[27] = 2.36
+VALUE_LUCODE[28] = 0
+VALUE_LUCODE[29] = 1.44
+VALUE_LUCODE[30] = 1.44
+VALUE_LUCODE[31] = 0
+VALUE_LUCODE[32] = 0
+VALUE_LUCODE[33] = 0
+VALUE_LUCODE[34] = 0
+VALUE_LUCODE[35] = 0
+VALUE_LUCODE[36] = 0
+VALUE_LUCODE[37] = 1.44
+VALUE_LUCODE[38] = 1.44
+VALUE_LUCODE[39] = 1.44
+VALUE_LUCODE[40] = 1.44
+VALUE_LUCODE[41] = 1.44
+VALUE_LUCODE[42] = 1.44
+VALUE_LUCODE[43] = 1.44
+VALUE_LUCODE[44] = 1.44
+VALUE_LUCODE[45] = 0
+VALUE_LUCODE[46] = 0
+VALUE_LUCODE[47] = 0
+VALUE_LUCODE[48] = 0
+VALUE_LUCODE[49] = 0
+VALUE_LUCODE[50] = 0
+VALUE_LUCODE[51] = 0
+VALUE_LUCODE[52] = 0
+VALUE_LUCODE[53] = 0
+VALUE_LUCODE[54] = 0
+VALUE_LUCODE[55] = 0
+VALUE_LUCODE[56] = 0
+VALUE_LUCODE[57] = 1.44
+VALUE_LUCODE[58] = 1.44
+VALUE_LUCODE[59] = 1.44
+VALUE_LUCODE[60] = 0
+VALUE_LUCODE[61] = 1.44
+VALUE_LUCODE[62] = 1.44
+VALUE_LUCODE[63] = 1.44
+VALUE_LUCODE[64] = 1.44
+VALUE_LUCODE[65] = 1.44
+VALUE_LUCODE[66] = 0
+VALUE_LUCODE[67] = 0
+VALUE_LUCODE[68] = 1.44
+VALUE_LUCODE[69] = 1.44
+VALUE_LUCODE[70] = 1.44
+VALUE_LUCODE[71] = 0
+VALUE_LUCODE[72] = 0
+VALUE_LUCODE[73] = 1.44
+VALUE_LUCODE[74] = 1.44
+VALUE_LUCODE[75] = 1.44
+VALUE_LUCODE[76] = 1.44
+VALUE_LUCODE[77] = 0
+VALUE_LUCODE[78] = 0
+VALUE_LUCODE[79] = 1.44
+VALUE_LUCODE[80] = 0
+VALUE_LUCODE[81] = 0
+VALUE_LUCODE[82] = 1.49
+VALUE_LUCODE[83] = 1.49
+VALUE_LUCODE[84] = 1.49
+VALUE_LUCODE[85] = 1.49
+VALUE_LUCODE[86] = 1.49
+VALUE_LUCODE[87] = 1.49
+
+# Accessibility scores of single lucode
+SCORE_ACC = {}
+SCORE_ACC[11] = 0.9
+SCORE_ACC[13] = 0.7
+SCORE_ACC[3] = 0.7
+
+# Belvedere, primary river, protected area, secondary river, monumental tree
+SCORE_NATURAL_ASPECTS = np.array([0.9, 0.8, 0.8, 0.65, 0.7])
+# Urban parks > 2 ha, 0.5 - 2 ha, < 0.5 ha, historic garden
+SCORE_URBAN_GREEN = [1, 0.9, 0.8, 0.7]
+# Playground, sports ground, dog area, kiosk, toilets, fountain
+SCORE_FR = [0.9, 0.8, 0.7, 0.5, 0.4, 0.7]
+
+SCORE_TABLE = LucodeTable(SCORE_LUCODE)
+ACC_TABLE = LucodeTable(SCORE_ACC)
+VALUE_TABLE = LucodeTable(VALUE_LUCODE)
+# Accessibility and value of every slot of SCORE_TABLE: the lucodes of ACC_TABLE and
+# VALUE_TABLE are all in SCORE_TABLE, the unknown slot takes their defaults
+SLOT_LUCODES = np.arange(len(SCORE_TABLE.values))
+ACC_SLOTS = ACC_TABLE.map(SLOT_LUCODES)[0]
+VALUE_SLOTS = VALUE_TABLE.map(SLOT_LUCODES)[0]
+# Weight of the accessibility (0-1) and of the fruibility (0-1) in the ROS
+ACC_FR_WEIGHT = 0.7 / 2
+# Buffer (m) of the amenities of the fruibility
+FR_DISTANCE = 100
+# Pixels of the lucodes with both a score and an accessibility score
+ROS_TABLE = LucodeTable(dict((lucode, 1) for lucode in SCORE_ACC.keys() if lucode in SCORE_LUCODE.keys()))
+
+
+class BeneficiParameters(KernelParameters):
+    """
+    natural_aspects, urban_green and fruibility are the presence booleans
+    of the aspects of the area, in the order of SCORE_NATURAL_ASPECTS,
+    SCORE_URBAN_GREEN and SCORE_FR.
+    """
+
+    def __init__(self, pixel_res=2, natural_aspects=None, urban_green=None, fruibility=None):
+        KernelParameters.__init__(self, pixel_res)
+        self.natural_aspects = list(natural_aspects or [False] * len(SCORE_NATURAL_ASPECTS))
+        self.urban_green = list(urban_green or [False] * len(SCORE_URBAN_GREEN))
+        self.fruibility = list(fruibility or [False] * len(SCORE_FR))
+
+    @property
+    def natural_aspects_norm(self):
+        return np.sum(np.array(self.natural_aspects) * SCORE_NATURAL_ASPECTS) / 2.95
+
+    @property
+    def urban_green_norm(self):
+        return np.sum(np.array(self.urban_green) * SCORE_URBAN_GREEN) / 1.7
+
+    @property
+    def fruibility_norm(self):
+        return np.sum(np.array(self.fruibility) * SCORE_FR) / 3.6
+
+    def fruibility_pixels(self, shape, amenity_points, distance=FR_DISTANCE):
+        """
+        Returns the per-pixel fruibility (0-1): the amenities with a point
+        layer count on the pixels within distance (m) of one of their
+        points, the others as their presence boolean. amenity_points has
+        the (column, row) points of each amenity of SCORE_FR, or None.
+        """
+        fruibility = np.zeros(shape, dtype=np.float32)
+        for score, present, points in zip(SCORE_FR, self.fruibility, amenity_points):
+            if points is None:
+                fruibility += score * present
+            else:
+                fruibility += score * prossimita.within(points, shape, self.pixel_res, distance)
+        return fruibility / 3.6
+
+    @property
+    def ROS_base_slots(self):
+        """
+        ROS of every slot of SCORE_TABLE, for the aspects of the area,
+        without the accessibility and fruibility terms.
+        """
+        PR = (SCORE_TABLE.values + self.natural_aspects_norm + self.urban_green_norm) / 3
+        return PR * 0.3
+
+    @property
+    def ROS_slots(self):
+        """
+        ROS of every slot of SCORE_TABLE, with the accessibility scores of
+        the lucodes and the fruibility of the area.
+        """
+        return self.ROS_base_slots + ACC_FR_WEIGHT * (ACC_SLOTS / 2.3 + self.fruibility_norm)
+
+
+def culturali_state(arr, params, accessibility=None, fruibility=None):
+    """
+    Returns the per-pixel ROS raster of a land use array and the report
+    totals of the state (benefici culturali). The accessibility scores of
+    the lucodes are replaced by the per-pixel accessibility raster (0-1,
+    see accessibilita.accessibility()) and the fruibility of the area by
+    the per-pixel fruibility (see fruibility_pixels()) when given.
+    """
+    idx = SCORE_TABLE.indices(arr)
+    per_pixel = accessibility is not None or fruibility is not None
+    if not per_pixel:
+        ROS_slots = params.ROS_slots
+        ROS_array = ROS_slots[idx]
+    else:
+        if accessibility is None:
+            accessibility = ACC_SLOTS[idx] / 2.3
+        if fruibility is None:
+            fruibility = params.fruibility_norm
+        ROS_array = params.ROS_base_slots[idx] + ACC_FR_WEIGHT * (accessibility + fruibility)
+    # Pixels and ROS sum of every class in one bincount pass each, the value
+    # (euro per squared meter) is looked up per class
+    n_slots = len(SCORE_TABLE.values)
+    counts = np.bincount(idx.ravel(), minlength=n_slots)
+    ROS_sums = np.bincount(idx.ravel(), weights=ROS_array.ravel(), minlength=n_slots)
+    values = ROS_sums * VALUE_SLOTS * params.area_pixel
+    present = np.flatnonzero(counts)
+    ROS_means = ROS_sums[present] / counts[present]
+    labels = [str(slot) if slot != SCORE_TABLE.unknown_slot else 'altro' for slot in present]
+    stats = {
+        # Sum of the distinct ROS values of the raster (of the classes, with per-pixel terms)
+        'ROS': np.sum(np.unique(ROS_means if per_pixel else ROS_slots[present])),
+        'value': np.sum(values),
+        'n_pixel_valid': int(np.sum(counts[:SCORE_TABLE.unknown_slot])),
+        'unknown': SCORE_TABLE.unknown(arr, idx),
+        'classes': list(zip(labels, counts[present].tolist(), ROS_means.tolist(), values[present].tolist()))
+    }
+    return {'ROS': ROS_array}, stats
+
+
+def culturali_delta_transitions(transitions, params):
+    """
+    Returns the value delta of every lucode transition (benefici culturali),
+    for the ROS of the classes. The per-pixel accessibility and fruibility
+    depend on the position of the pixel and not only on its lucode, so
+    there is no per-transition delta when they are used.
+    """
+    slots = SCORE_TABLE.indices(np.arange(transitions.n_lucodes + 1))
+    # The last slot of the transition matrix collects the lucodes outside the legend
+    slots[-1] = SCORE_TABLE.unknown_slot
+    values = (params.ROS_slots * VALUE_SLOTS)[slots] * params.area_pixel
+    return {'value': transitions.delta(values)}
+
+
+def sociali_state_stats(histogram, params, accessibility=None, fruibility=None):
+    """
+    Returns the report totals of a state from its LucodeHistogram (benefici
+    sociali): the ROS of the area, the sum of the ROS raster and the value.
+    The accessibility scores of the lucodes and the fruibility of the
+    area are replaced by the mean accessibility and fruibility (0-1) of
+    the pixels of the area when given.
+    """
+    # Summing scores for each distinct lucode, lucodes without an accessibility score count 0
+    lucodes = histogram.lucodes()
+    score_lucode_tot = float(np.sum(SCORE_TABLE.take(SCORE_TABLE.indices(lucodes))))
+    acc_score_tot = float(np.sum(ACC_TABLE.take(ACC_TABLE.indices(lucodes)))) / 2.3
+    unknown = SCORE_TABLE.unknown_in(histogram)
+    unknown.update(VALUE_TABLE.unknown_in(histogram))
+    if accessibility is not None:
+        acc_score_tot = accessibility
+    if fruibility is None:
+        fruibility = params.fruibility_norm
+    PR = (score_lucode_tot + params.natural_aspects_norm + params.urban_green_norm) / 3
+    acc_fr = (acc_score_tot + fruibility) / 2
+    ROS = PR * 0.3 + (acc_fr * 0.7)
+    return {
+        'ROS': ROS,
+        'ROS_sum': ROS_TABLE.total(histogram) * ROS,
+        'value': VALUE_TABLE.total(histogram) * params.area_pixel * ROS,
+        'n_pixel_valid': VALUE_TABLE.n_known(histogram),
+        'unknown': unknown
+    }
+
+
+def sociali_state_arrays(arr, ROS):
+    """
+    Returns the ROS raster of a land use array for the ROS of the area.
+    """
+    return {'ROS': ROS_TABLE.take(ROS_TABLE.indices(arr)) * ROS}
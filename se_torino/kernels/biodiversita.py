@@ -0,0 +1,486 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Biodiversita: habitat quality of every lucode, reduced by the threats.
+"""
+
+import numpy as np
+
+from se_torino.kernels import KernelParameters
+from se_torino.kernels.convolution import DECAY_LINEAR, decay_kernel, fft_convolve
+from se_torino.lookup import LucodeTable
+
+# Scores of single lucode
+H_SCORE_LUCODE = {}
+H_SCORE_LUCODE[1] = 0.4
+H_SCORE_LUCODE[2] = 0.4
+H_SCORE_LUCODE[3] = 0
+H_SCORE_LUCODE[4] = 0.5
+H_SCORE_LUCODE[5] = 0.5
+H_SCORE_LUCODE[6] = 0.5
+H_SCORE_LUCODE[7] = 0.1
+H_SCORE_LUCODE[8] = 0
+H_SCORE_LUCODE[9] = 0.15
+H_SCORE_LUCODE[10] = 0.05
+H_SCORE_LUCODE[11] = 0
+H_SCORE_LUCODE[12] = 0.05
+H_SCORE_LUCODE[13] = 0
+H_SCORE_LUCODE[14] = 0.05
+H_SCORE_LUCODE[15] = 0
+H_SCORE_LUCODE[16] = 0.05
+H_SCORE_LUCODE[17] = 0.15
+H_SCORE_LUCODE[18] = 0
+H_SCORE_LUCODE[19] = 0.1
+H_SCORE_LUCODE[20] = 0
+H_SCORE_LUCODE[21] = 1
+H_SCORE_LUCODE[22] = 0.85
+H_SCORE_LUCODE[23] = 0.6
+H_SCORE_LUCODE[24] = 0.25
+H_SCORE_LUCODE[25] = 0
+H_SCORE_LUCODE[26] = 0.15
+H_SCORE_LUCODE[27] = 0.1
+H_SCORE_LUCODE[28] = 0
+H_SCORE_LUCODE[29] = 0.5
+H_SCORE_LUCODE[30] = 0.4
+H_SCORE_LUCODE[31] = 1
+H_SCORE_LUCODE[32] = 0
+H_SCORE_LUCODE[33] = 0
+H_SCORE_LUCODE[34] = 0.1
+H_SCORE_LUCODE[35] = 0
+H_SCORE_LUCODE[36] = 0
+H_SCORE_LUCODE[37] = 0.5
+H_SCORE_LUCODE[38] = 0.75
+H_SCORE_LUCODE[39] = 0.5
+H_SCORE_LUCODE[40] = 0.4
+H_SCORE_LUCODE[41] = 0.4
+H_SCORE_LUCODE[42] = 0.4
+H_SCORE_LUCODE[43] = 0.5
+H_SCORE_LUCODE[44] = 0.3
+H_SCORE_LUCODE[45] = 0.5
+H_SCORE_LUCODE[46] = 0.15
+H_SCORE_LUCODE[47] = 0
+H_SCORE_LUCODE[48] = 0.35
+H_SCORE_LUCODE[49] = 0.1
+H_SCORE_LUCODE[50] = 0
+H_SCORE_LUCODE[51] = 0
+H_SCORE_LUCODE[52] = 0
+H_SCORE_LUCODE[53] = 0.15
+H_SCORE_LUCODE[54] = 0.05
+H_SCORE_LUCODE[55] = 0
+H_SCORE_LUCODE[56] = 0
+H_SCORE_LUCODE[57] = 0.45
+H_SCORE_LUCODE[58] = 0.4
+H_SCORE_LUCODE[59] = 0.4
+H_SCORE_LUCODE[60] = 0
+H_SCORE_LUCODE[61] = 0.45
+H_SCORE_LUCODE[62] = 0.65
+H_SCORE_LUCODE[63] = 0.55
+H_SCORE_LUCODE[64] = 0.4
+H_SCORE_LUCODE[65] = 0.4
+H_SCORE_LUCODE[66] = 0
+H_SCORE_LUCODE[67] = 0
+H_SCORE_LUCODE[68] = 0.5
+H_SCORE_LUCODE[69] = 0.65
+H_SCORE_LUCODE[70] = 0.55
+H_SCORE_LUCODE[71] = 0.05
+H_SCORE_LUCODE[72] = 0
+H_SCORE_LUCODE[73] = 0.4
+H_SCORE_LUCODE[74] = 0.5
+H_SCORE_LUCODE[75] = 0.4
+H_SCORE_LUCODE[76] = 0.4
+H_SCORE_LUCODE[77] = 0
+H_SCORE_LUCODE[78] = 0.7
+H_SCORE_LUCODE[79] = 0.55
+H_SCORE_LUCODE[80] = 0
+H_SCORE_LUCODE[81] = 0
+H_SCORE_LUCODE[82] = 0.9
+H_SCORE_LUCODE[83] = 1
+H_SCORE_LUCODE[84] = 1
+H_SCORE_LUCODE[85] = 0.75
+H_SCORE_LUCODE[86] = 0.6
+H_SCORE_LUCODE[87] = 1
+
+# Dictionary of economic value for each lucode
+VALUE_LUCODE = {}
+VALUE_LUCODE[1] = 0.16
+VALUE_LUCODE[2] = 0.16
+VALUE_LUCODE[3] = 0
+VALUE_LUCODE[4] = 0.16
+VALUE_LUCODE[5] = 0.16
+VALUE_LUCODE[6] = 0.16
+VALUE_LUCODE[7] = 0.03
+VALUE_LUCODE[8] = 0
+VALUE_LUCODE[9] = 0.23
+VALUE_LUCODE[10] = 0.23
+VALUE_LUCODE[11] = 0
+VALUE_LUCODE[12] = 0.01
+VALUE_LUCODE[13] = 0
+VALUE_LUCODE[14] = 0.01
+VALUE_LUCODE[15] = 0
+VALUE_LUCODE[16] = 0.01
+VALUE_LUCODE[17] = 0.23
+VALUE_LUCODE[18] = 0
+VALUE_LUCODE[19] = 0.03
+VALUE_LUCODE[20] = 0
+VALUE_LUCODE[21] = 0.23
+VALUE_LUCODE[22] = 0.23
+VALUE_LUCODE[23] = 0.03
+VALUE_LUCODE[24] = 0.01
+VALUE_LUCODE[25] = 0
+VALUE_LUCODE[26] = 0.03
+VALUE_LUCODE[27] = 0.01
+VALUE_LUCODE[28] = 0
+VALUE_LUCODE[29] = 0.16
+VALUE_LUCODE[30] = 0.16
+VALUE_LUCODE[31] = 0
+VALUE_LUCODE[32] = 0.03
+VALUE_LUCODE[33] = 0.01
+VALUE_LUCODE[34] = 0.01
+VALUE_LUCODE[35] = 0
+VALUE_LUCODE[36] = 0
+VALUE_LUCODE[37] = 0.16
+VALUE_LUCODE[38] = 0
+VALUE_LUCODE[39] = 0.16
+VALUE_LUCODE[40] = 0.16
+VALUE_LUCODE[41] = 0.16
+VALUE_LUCODE[42] = 0.16
+VALUE_LUCODE[43] = 0.03
+VALUE_LUCODE[44] = 0.03
+VALUE_LUCODE[45] = 0
+VALUE_LUCODE[46] = 0.03
+VALUE_LUCODE[47] = 0
+VALUE_LUCODE[48] = 0.03
+VALUE_LUCODE[49] = 0.01
+VALUE_LUCODE[50] = 0
+VALUE_LUCODE[51] = 0
+VALUE_LUCODE[52] = 0
+VALUE_LUCODE[53] = 0.03
+VALUE_LUCODE[54] = 0.01
+VALUE_LUCODE[55] = 0
+VALUE_LUCODE[56] = 0
+VALUE_LUCODE[57] = 0.16
+VALUE_LUCODE[58] = 0.16
+VALUE_LUCODE[59] = 0.16
+VALUE_LUCODE[60] = 0
+VALUE_LUCODE[61] = 0.16
+VALUE_LUCODE[62] = 0.16
+VALUE_LUCODE[63] = 0.16
+VALUE_LUCODE[64] = 0.16
+VALUE_LUCODE[65] = 0.16
+VALUE_LUCODE[66] = 0
+VALUE_LUCODE[67] = 0
+VALUE_LUCODE[68] = 0.16
+VALUE_LUCODE[69] = 0.16
+VALUE_LUCODE[70] = 0
+VALUE_LUCODE[71] = 0.03
+VALUE_LUCODE[72] = 0
+VALUE_LUCODE[73] = 0.16
+VALUE_LUCODE[74] = 0.16
+VALUE_LUCODE[75] = 0.16
+VALUE_LUCODE[76] = 0.16
+VALUE_LUCODE[77] = 0
+VALUE_LUCODE[78] = 0
+VALUE_LUCODE[79] = 0.16
+VALUE_LUCODE[80] = 0
+VALUE_LUCODE[81] = 0.91
+VALUE_LUCODE[82] = 0.91
+VALUE_LUCODE[83] = 0.91
+VALUE_LUCODE[84] = 0.91
+VALUE_LUCODE[85] = 0.91
+VALUE_LUCODE[86] = 0.91
+VALUE_LUCODE[87] = 0.91
+
+H_SCORE_TABLE = LucodeTable(H_SCORE_LUCODE)
+VALUE_TABLE = LucodeTable(VALUE_LUCODE)
+# Economic value times habitat score, the per-lucode value before the threat factor.
+# It has the lucodes of H_SCORE_TABLE, so both tables map a raster with the same indices
+VALUE_H_TABLE = LucodeTable(dict((lucode, VALUE_LUCODE.get(lucode, 0.0) * H_SCORE_LUCODE[lucode])
+                                 for lucode in H_SCORE_LUCODE))
+
+# Score of each distance option of a threat, from 'assenti' to 'entro'
+THREAT_VALUES = [0, 1, 5, 10]
+# Multiplier of the habitat score for the total threat score (10 or more: 0.10)
+THREAT_FACTORS = [1, 0.80, 0.75, 0.70, 0.60, 0.50, 0.45, 0.40, 0.30, 0.20, 0.10]
+# Upper limits (m) of the 'entro' and 'tra' distance options of each threat, in
+# the order of BiodiversitaParameters.threats. Beyond the last one the threat
+# counts as absent. The options of the other buildings skip 400-500 m, which
+# is counted in the 200-400 m option.
+THREAT_BANDS = [
+    [100, 200, 400],
+    [100, 250, 500],
+    [100, 200, 500],
+    [250, 500, 1000],
+    [50, 100, 200],
+    [250, 500, 1000],
+    [250, 500, 1000],
+    [100, 200, 400],
+    [100, 200, 400],
+    [100, 250, 500],
+]
+MAX_THREAT_LEVEL = len(THREAT_FACTORS) - 1
+THREAT_FACTOR_ARRAY = np.array(THREAT_FACTORS)
+# Habitat quality for every (threat level, lucode slot) pair
+Q_LEVEL_TABLE = np.outer(THREAT_FACTOR_ARRAY, H_SCORE_TABLE.values)
+# Exponent of the habitat degradation curve (InVEST habitat quality)
+DEGRADATION_Z = 2.5
+
+
+class BiodiversitaParameters(KernelParameters):
+    """
+    threats holds the distance option (0 ... 3) of the ten threats of a
+    state: residential, industrial and other buildings, pedestrian, cycle,
+    vehicle and secondary roads, equipped areas, transformation areas and
+    landfills.
+    """
+
+    def __init__(self, pixel_res=2, threats=None):
+        KernelParameters.__init__(self, pixel_res)
+        self.threats = list(threats or [0] * 10)
+
+    @property
+    def threat_score(self):
+        return sum(THREAT_VALUES[threat] for threat in self.threats)
+
+    @property
+    def factor(self):
+        return THREAT_FACTORS[min(self.threat_score, 10)]
+
+    def factor_without(self, threats):
+        """
+        Returns the threat factor of the options of the threats not in
+        threats, e.g. of those not given by a layer.
+        """
+        score = sum(THREAT_VALUES[option] for threat, option in enumerate(self.threats) if threat not in threats)
+        return THREAT_FACTORS[min(score, 10)]
+
+    @property
+    def Q_table(self):
+        """
+        Habitat quality of each lucode, with the threat factor applied.
+        """
+        return H_SCORE_TABLE.scaled(self.factor)
+
+    @property
+    def value_table(self):
+        """
+        Value of a pixel of each lucode: economic value x habitat quality x
+        pixel area.
+        """
+        return VALUE_H_TABLE.scaled(self.factor * self.area_pixel)
+
+    @property
+    def value_level_table(self):
+        """
+        Value of a pixel for every (threat level, lucode slot) pair.
+        """
+        return np.outer(THREAT_FACTOR_ARRAY, VALUE_H_TABLE.values) * self.area_pixel
+
+
+def threat_options(distance, threat):
+    """
+    Returns the distance option (0 ... 3, from 'assenti' to 'entro') of
+    every pixel of a distance raster (m) from a threat.
+    """
+    bands = THREAT_BANDS[threat]
+    return (len(bands) - np.searchsorted(bands, distance, side='left')).astype(np.uint8)
+
+
+def threat_levels(params, shape, distances):
+    """
+    Returns the per-pixel threat level, min(threat score, 10), of a raster
+    of the given shape. distances yields (threat, distance raster) pairs
+    for the threats given by a layer and can be a generator, so that one
+    distance raster at a time is held; the other threats keep their option
+    in params. Returns None when no threat has a distance raster.
+    """
+    levels = None
+    by_layer = set()
+    for threat, distance in distances:
+        if levels is None:
+            levels = np.zeros(shape, dtype=np.uint8)
+        levels += np.array(THREAT_VALUES, dtype=np.uint8)[threat_options(distance, threat)]
+        # The score can reach 100, clip it at every step to stay in uint8
+        np.minimum(levels, MAX_THREAT_LEVEL, out=levels)
+        by_layer.add(threat)
+    if levels is None:
+        return None
+    levels += min(sum(THREAT_VALUES[option] for threat, option in enumerate(params.threats)
+                      if threat not in by_layer), MAX_THREAT_LEVEL)
+    np.minimum(levels, MAX_THREAT_LEVEL, out=levels)
+    return levels
+
+
+class DegradationParameters(KernelParameters):
+    """
+    Parameters of the habitat degradation mode: decay of the threats with
+    the distance (DECAY_LINEAR or DECAY_EXPONENTIAL), half saturation
+    constant of the degradation curve and, for each threat, the maximum
+    distance of its effect (m) and its weight.
+    """
+
+    def __init__(self, pixel_res=2, decay=DECAY_LINEAR, half_saturation=0.05, max_distances=None, weights=None):
+        KernelParameters.__init__(self, pixel_res)
+        self.decay = decay
+        self.half_saturation = half_saturation
+        self.max_distances = list(max_distances or [bands[-1] for bands in THREAT_BANDS])
+        self.weights = list(weights or [1.0] * len(THREAT_BANDS))
+
+
+def degradation(params, shape, masks, feedback=None):
+    """
+    Returns the per-pixel habitat degradation of a raster of the given
+    shape: the weighted mean, over the threats, of the threat rasters
+    convolved with their decay kernel. masks yields (threat, threat raster)
+    pairs and can be a generator. Returns None without threat rasters.
+    """
+    degradation_arr = None
+    total_weight = 0.0
+    for threat, mask in masks:
+        if degradation_arr is None:
+            degradation_arr = np.zeros(shape, dtype=np.float32)
+        kernel = decay_kernel(params.max_distances[threat], params.pixel_res, params.decay)
+        degradation_arr += params.weights[threat] * fft_convolve(mask, kernel, feedback)
+        total_weight += params.weights[threat]
+    if degradation_arr is None:
+        return None
+    if total_weight > 0:
+        degradation_arr /= total_weight
+    return degradation_arr
+
+
+def degradation_factors(degradation_arr, params):
+    """
+    Returns the per-pixel habitat score multiplier of a degradation raster,
+    1 - D^z / (D^z + k^z) with k the half saturation constant.
+    """
+    d_z = np.power(degradation_arr, DEGRADATION_Z, dtype=np.float64)
+    return 1 - d_z / (d_z + params.half_saturation ** DEGRADATION_Z)
+
+
+def threat_factors(levels):
+    """
+    Returns the per-pixel habitat score multiplier of a threat level raster.
+    """
+    return THREAT_FACTOR_ARRAY[levels]
+
+
+def state_arrays(arr, params, levels=None, factors=None):
+    """
+    Returns the habitat quality Q (0-1) and value rasters of a land use
+    array, one gather each. With the per-pixel threat levels of
+    threat_levels() the gathers are done in the (level, lucode) tables;
+    per-pixel factors (degradation_factors()) multiply the unthreatened
+    quality and value.
+    """
+    # Both tables have the lucodes of H_SCORE_TABLE, so they share the indices
+    idx = H_SCORE_TABLE.indices(arr)
+    if factors is not None:
+        return {'Q': H_SCORE_TABLE.take(idx) * factors,
+                'value': VALUE_H_TABLE.take(idx) * (factors * params.area_pixel)}
+    if levels is None:
+        return {'Q': params.Q_table.take(idx), 'value': params.value_table.take(idx)}
+    return {'Q': Q_LEVEL_TABLE[levels, idx], 'value': params.value_level_table[levels, idx]}
+
+
+def habitat_mask(arr, threshold=0):
+    """
+    Returns the habitat pixels of a land use array: the lucodes with an
+    habitat score above threshold.
+    """
+    return H_SCORE_TABLE.take(H_SCORE_TABLE.indices(arr)) > threshold
+
+
+def state_stats(histogram, params):
+    """
+    Returns the report totals of a state from its LucodeHistogram: the mean
+    habitat quality and the total value.
+    """
+    return {
+        'Q_mean': params.Q_table.total(histogram) / histogram.n_pixel,
+        'value': params.value_table.total(histogram),
+        'unknown': H_SCORE_TABLE.unknown_in(histogram)
+    }
+
+
+def pixel_state_stats(arrays):
+    """
+    Returns the report totals of a state from its Q and value rasters, when
+    the threats are given per pixel and the lucode counts are not enough.
+    """
+    return {'Q_mean': np.mean(arrays['Q']), 'value': np.sum(arrays['value'])}
+
+
+def delta_transitions(transitions, params_present, params_future, factors_present=None, factors_future=None):
+    """
+    Returns the value delta of every lucode transition, each state with its
+    own threat factor. When the threats of a state are given per pixel,
+    factors_present or factors_future hold the sum of the per-pixel
+    factors of every transition (TransitionMatrix.weighted()).
+    """
+    if factors_present is None and factors_future is None:
+        return {'value': transitions.delta(transitions.class_values(params_present.value_table),
+                                           transitions.class_values(params_future.value_table))}
+    if factors_present is None:
+        factors_present = transitions.counts * params_present.factor
+    if factors_future is None:
+        factors_future = transitions.counts * params_future.factor
+    values = transitions.class_values(VALUE_H_TABLE, params_present.area_pixel)
+    return {'value': factors_future * values[np.newaxis, :] - factors_present * values[:, np.newaxis]}
+
+
+class ThreatConfiguration(object):
+    """
+    One threat setting of a sweep: a name and the threat options of the
+    present and of the future state. With rasters=True the Q and value
+    rasters of the configuration are wanted too.
+    """
+
+    def __init__(self, name, threats_present, threats_future, rasters=False):
+        self.name = name
+        self.threats_present = list(threats_present)
+        self.threats_future = list(threats_future)
+        self.rasters = rasters
+
+    def parameters(self, pixel_res):
+        """
+        Returns the BiodiversitaParameters of the present and future state.
+        """
+        return (BiodiversitaParameters(pixel_res, self.threats_present),
+                BiodiversitaParameters(pixel_res, self.threats_future))
+
+
+def sweep(transitions, configurations, pixel_res=2):
+    """
+    Evaluates every ThreatConfiguration on the same TransitionMatrix: the
+    threat factor only scales the class tables, so each configuration
+    costs O(classes^2) whatever the raster size. Returns one dict of
+    report totals for each configuration.
+    """
+    rows = []
+    for configuration in configurations:
+        params_present, params_future = configuration.parameters(pixel_res)
+        stats_present = state_stats(transitions.present, params_present)
+        stats_future = state_stats(transitions.future, params_future)
+        delta = delta_transitions(transitions, params_present, params_future)
+        rows.append({
+            'name': configuration.name,
+            'score_present': params_present.threat_score,
+            'score_future': params_future.threat_score,
+            'factor_present': params_present.factor,
+            'factor_future': params_future.factor,
+            'Q_mean_present': stats_present['Q_mean'],
+            'Q_mean_future': stats_future['Q_mean'],
+            'value_present': stats_present['value'],
+            'value_future': stats_future['value'],
+            'delta': float(np.sum(delta['value']))
+        })
+    return rows
@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Sequestro di carbonio: value of the carbon stock change between the present
+and the future state.
+
+The carbon stock trajectory simulates the stock year by year over the
+present -> future horizon. Every pixel belongs to the class of its
+(present lucode, future lucode) transition and the stock of every class
+is computed for every year as a years x classes matrix: the above-ground
+carbon lost by the transition is lost in the first year, the carbon
+gained grows with a Chapman-Richards curve of the planted species and the
+soil carbon moves linearly from the present to the future lucode stock
+over soil_years (20 years, the IPCC default). The yearly rasters and the
+value raster are gathers of the class rows on the class raster.
+"""
+
+import numpy as np
+
+from se_torino.kernels import KernelParameters
+from se_torino.lookup import LucodeTable
+from se_torino.transition import N_LUCODES, TransitionMatrix
+
+# Soil carbon of each lucode (ton C/mq)
+C_SOIL_LUCODE = {}
+C_SOIL_LUCODE[1] = 0.0056
+C_SOIL_LUCODE[2] = 0.0056
+C_SOIL_LUCODE[3] = 0
+C_SOIL_LUCODE[4] = 0.0056
+C_SOIL_LUCODE[5] = 0.0056
+C_SOIL_LUCODE[6] = 0.0056
+C_SOIL_LUCODE[7] = 0.0056
+C_SOIL_LUCODE[8] = 0
+C_SOIL_LUCODE[9] = 0.0056
+C_SOIL_LUCODE[10] = 0
+C_SOIL_LUCODE[11] = 0
+C_SOIL_LUCODE[12] = 0
+C_SOIL_LUCODE[13] = 0
+C_SOIL_LUCODE[14] = 0
+C_SOIL_LUCODE[15] = 0
+C_SOIL_LUCODE[16] = 0
+C_SOIL_LUCODE[17] = 0
+C_SOIL_LUCODE[18] = 0
+C_SOIL_LUCODE[19] = 0.0056
+C_SOIL_LUCODE[20] = 0
+C_SOIL_LUCODE[21] = 0.0056
+C_SOIL_LUCODE[22] = 0.0056
+C_SOIL_LUCODE[23] = 0.0056
+C_SOIL_LUCODE[24] = 0.0056
+C_SOIL_LUCODE[25] = 0
+C_SOIL_LUCODE[26] = 0.0056
+C_SOIL_LUCODE[27] = 0
+C_SOIL_LUCODE[28] = 0
+C_SOIL_LUCODE[29] = 0.0056
+C_SOIL_LUCODE[30] = 0.0056
+C_SOIL_LUCODE[31] = 0
+C_SOIL_LUCODE[32] = 0.0056
+C_SOIL_LUCODE[33] = 0.0056
+C_SOIL_LUCODE[34] = 0.0056
+C_SOIL_LUCODE[35] = 0
+C_SOIL_LUCODE[36] = 0
+C_SOIL_LUCODE[37] = 0.0056
+C_SOIL_LUCODE[38] = 0.0056
+C_SOIL_LUCODE[39] = 0.0056
+C_SOIL_LUCODE[40] = 0.0056
+C_SOIL_LUCODE[41] = 0.0056
+C_SOIL_LUCODE[42] = 0.0056
+C_SOIL_LUCODE[43] = 0.0056
+C_SOIL_LUCODE[44] = 0.0056
+C_SOIL_LUCODE[45] = 0
+C_SOIL_LUCODE[46] = 0
+C_SOIL_LUCODE[47] = 0
+C_SOIL_LUCODE[48] = 0.0056
+C_SOIL_LUCODE[49] = 0.0056
+C_SOIL_LUCODE[50] = 0
+C_SOIL_LUCODE[51] = 0
+C_SOIL_LUCODE[52] = 0
+C_SOIL_LUCODE[53] = 0.0056
+C_SOIL_LUCODE[54] = 0.0056
+C_SOIL_LUCODE[55] = 0
+C_SOIL_LUCODE[56] = 0
+C_SOIL_LUCODE[57] = 0.0056
+C_SOIL_LUCODE[58] = 0.0056
+C_SOIL_LUCODE[59] = 0.0056
+C_SOIL_LUCODE[60] = 0
+C_SOIL_LUCODE[61] = 0.00679
+C_SOIL_LUCODE[62] = 0.00679
+C_SOIL_LUCODE[63] = 0.00679
+C_SOIL_LUCODE[64] = 0.0056
+C_SOIL_LUCODE[65] = 0.0056
+C_SOIL_LUCODE[66] = 0
+C_SOIL_LUCODE[67] = 0
+C_SOIL_LUCODE[68] = 0.00679
+C_SOIL_LUCODE[69] = 0.00679
+C_SOIL_LUCODE[70] = 0.00679
+C_SOIL_LUCODE[71] = 0
+C_SOIL_LUCODE[72] = 0
+C_SOIL_LUCODE[73] = 0.0056
+C_SOIL_LUCODE[74] = 0.0056
+C_SOIL_LUCODE[75] = 0.0056
+C_SOIL_LUCODE[76] = 0.0056
+C_SOIL_LUCODE[77] = 0
+C_SOIL_LUCODE[78] = 0
+C_SOIL_LUCODE[79] = 0.0056
+C_SOIL_LUCODE[80] = 0
+C_SOIL_LUCODE[81] = 0
+C_SOIL_LUCODE[82] = 0.0061
+C_SOIL_LUCODE[83] = 0.0061
+C_SOIL_LUCODE[84] = 0.0061
+C_SOIL_LUCODE[85] = 0.0061
+C_SOIL_LUCODE[86] = 0.0061
+C_SOIL_LUCODE[87] = 0.0061
+
+# Above-ground carbon of each lucode without a species mix (ton C/mq)
+C_ABOVE_LUCODE = {}
+C_ABOVE_LUCODE[1] = 0
+C_ABOVE_LUCODE[2] = 0
+C_ABOVE_LUCODE[3] = 0
+C_ABOVE_LUCODE[4] = 0
+C_ABOVE_LUCODE[5] = 0
+C_ABOVE_LUCODE[6] = 0
+C_ABOVE_LUCODE[7] = 0.000047
+C_ABOVE_LUCODE[8] = 0
+C_ABOVE_LUCODE[9] = 0.001439
+C_ABOVE_LUCODE[10] = 0
+C_ABOVE_LUCODE[11] = 0
+C_ABOVE_LUCODE[12] = 0
+C_ABOVE_LUCODE[13] = 0
+C_ABOVE_LUCODE[14] = 0
+C_ABOVE_LUCODE[15] = 0
+C_ABOVE_LUCODE[16] = 0
+C_ABOVE_LUCODE[17] = 0.000535
+C_ABOVE_LUCODE[18] = 0
+C_ABOVE_LUCODE[19] = 0.003
+C_ABOVE_LUCODE[20] = 0
+C_ABOVE_LUCODE[21] = 0.005
+C_ABOVE_LUCODE[22] = 0
+C_ABOVE_LUCODE[23] = 0.00029
+C_ABOVE_LUCODE[24] = 0
+C_ABOVE_LUCODE[25] = 0
+C_ABOVE_LUCODE[26] = 0.000073
+C_ABOVE_LUCODE[27] = 0
+C_ABOVE_LUCODE[28] = 0
+C_ABOVE_LUCODE[29] = 0.00003
+C_ABOVE_LUCODE[30] = 0
+C_ABOVE_LUCODE[31] = 0
+C_ABOVE_LUCODE[32] = 0.003
+C_ABOVE_LUCODE[33] = 0
+C_ABOVE_LUCODE[34] = 0
+C_ABOVE_LUCODE[35] = 0
+C_ABOVE_LUCODE[36] = 0
+C_ABOVE_LUCODE[37] = 0
+C_ABOVE_LUCODE[38] = 0.005
+C_ABOVE_LUCODE[39] = 0
+C_ABOVE_LUCODE[40] = 0
+C_ABOVE_LUCODE[41] = 0
+C_ABOVE_LUCODE[42] = 0
+C_ABOVE_LUCODE[43] = 0.0106
+C_ABOVE_LUCODE[44] = 0.003
+C_ABOVE_LUCODE[45] = 0
+C_ABOVE_LUCODE[46] = 0.000756
+C_ABOVE_LUCODE[47] = 0
+C_ABOVE_LUCODE[48] = 0.000756
+C_ABOVE_LUCODE[49] = 0
+C_ABOVE_LUCODE[50] = 0
+C_ABOVE_LUCODE[51] = 0
+C_ABOVE_LUCODE[52] = 0
+C_ABOVE_LUCODE[53] = 0.0003
+C_ABOVE_LUCODE[54] = 0
+C_ABOVE_LUCODE[55] = 0
+C_ABOVE_LUCODE[56] = 0
+C_ABOVE_LUCODE[57] = 0.00001
+C_ABOVE_LUCODE[58] = 0
+C_ABOVE_LUCODE[59] = 0
+C_ABOVE_LUCODE[60] = 0
+C_ABOVE_LUCODE[61] = 0
+C_ABOVE_LUCODE[62] = 0.00001
+C_ABOVE_LUCODE[63] = 0
+C_ABOVE_LUCODE[64] = 0
+C_ABOVE_LUCODE[65] = 0
+C_ABOVE_LUCODE[66] = 0
+C_ABOVE_LUCODE[67] = 0
+C_ABOVE_LUCODE[68] = 0
+C_ABOVE_LUCODE[69] = 0.00001
+C_ABOVE_LUCODE[70] = 0
+C_ABOVE_LUCODE[71] = 0
+C_ABOVE_LUCODE[72] = 0
+C_ABOVE_LUCODE[73] = 0
+C_ABOVE_LUCODE[74] = 0.00001
+C_ABOVE_LUCODE[75] = 0
+C_ABOVE_LUCODE[76] = 0
+C_ABOVE_LUCODE[77] = 0
+C_ABOVE_LUCODE[78] = 0
+C_ABOVE_LUCODE[79] = 0
+C_ABOVE_LUCODE[80] = 0
+C_ABOVE_LUCODE[81] = 0
+C_ABOVE_LUCODE[82] = 0.006
+C_ABOVE_LUCODE[83] = 0.02
+C_ABOVE_LUCODE[84] = 0.02
+C_ABOVE_LUCODE[85] = 0.0218
+C_ABOVE_LUCODE[86] = 0.016
+C_ABOVE_LUCODE[87] = 0.006
+
+# Lucodes that accept trees
+TREE_LUCODES = [7, 9, 17, 19, 21, 23, 26, 29, 32, 38, 43, 44, 46, 48, 53, 57, 62, 69, 70, 74, 82, 83, 84, 85, 86, 87]
+
+C_SOIL_TABLE = LucodeTable(C_SOIL_LUCODE)
+C_ABOVE_TABLE = LucodeTable(dict((lucode, C_ABOVE_LUCODE[lucode]) for lucode in TREE_LUCODES))
+
+# Defaults of the growth of the planted trees, to be calibrated on the
+# planted species: they are not measured values. The growth follows a
+# Chapman-Richards curve (1 - exp(-k t)) ** shape, maturity is the age at
+# which it reaches MATURITY_FRACTION of its asymptote, which fixes k
+GROWTH_SHAPE = 3.0
+DEFAULT_MATURITY = 30
+MATURITY_FRACTION = 0.95
+# Years for the soil carbon to reach the stock of the new lucode
+SOIL_TRANSITION_YEARS = 20
+
+
+class SequestroParameters(KernelParameters):
+    """
+    value is the price of the carbon (euro/ton), present and future the
+    years of the two states, r and c the discount and the carbon price
+    change rates (%).
+    """
+
+    def __init__(self, pixel_res=2, value=81.84, present=2021, future=2030, r=0, c=3):
+        KernelParameters.__init__(self, pixel_res)
+        self.value = value
+        self.present = present
+        self.future = future
+        self.r = r
+        self.c = c
+
+    @property
+    def years(self):
+        return self.future - self.present
+
+    @property
+    def coeff(self):
+        arr_years = np.array(range(0, self.years))
+        return sum(1 / ((1 + self.r / 100) ** arr_years * ((1 + self.c / 100) ** arr_years)))
+
+    @property
+    def discount(self):
+        """
+        Discount factor of the sequestration of every year of the horizon,
+        the terms of coeff.
+        """
+        arr_years = np.arange(self.years)
+        return 1 / ((1 + self.r / 100.0) ** arr_years * ((1 + self.c / 100.0) ** arr_years))
+
+
+def sequestro(arr_present, arr_future, params):
+    """
+    Returns the value and difference rasters of the carbon stock rasters
+    (ton Corg per pixel) of the two states, and the report totals.
+    """
+    coeff = params.coeff
+    # Calculate coeff sequestration
+    arr_diff = arr_future - arr_present
+    arr_diff_norm = arr_diff / float(params.years)
+    carbon_sequestration_value = params.value * arr_diff_norm * coeff
+    total_area = arr_present.size * params.area_pixel
+    stats = {
+        'present': np.sum(arr_present),
+        'future': np.sum(arr_future),
+        'difference': np.sum(arr_diff),
+        'total_area': total_area,
+        'value': np.sum(carbon_sequestration_value)
+    }
+    stats['present_value'] = (stats['present'] * params.value * coeff) / float(params.years)
+    stats['future_value'] = (stats['future'] * params.value * coeff) / float(params.years)
+    return {'value': carbon_sequestration_value, 'difference': arr_diff}, stats
+
+
+class TraiettoriaParameters(SequestroParameters):
+    """
+    maturity is the number of years for a planted tree to reach its mature
+    carbon, age the age of the trees when planted, shape the exponent of
+    their growth curve and soil_years the years for the soil carbon to
+    reach the stock of the new lucode.
+    """
+
+    def __init__(self, pixel_res=2, value=81.84, present=2021, future=2030, r=0, c=3, maturity=DEFAULT_MATURITY,
+                 age=0, soil_years=SOIL_TRANSITION_YEARS, shape=GROWTH_SHAPE):
+        SequestroParameters.__init__(self, pixel_res, value, present, future, r, c)
+        self.maturity = maturity
+        self.age = age
+        self.soil_years = soil_years
+        self.shape = shape
+
+    @property
+    def year_list(self):
+        return list(range(self.present, self.future + 1))
+
+
+def growth_fraction(years, maturity, age=0, shape=GROWTH_SHAPE):
+    """
+    Returns the years x species matrix of the fraction of the mature carbon
+    of trees planted at the given age, after every number of years. The
+    trees are planted in the first year, so the fraction of year 0 is 0.
+    """
+    t = np.asarray(years, dtype=np.float64)[:, np.newaxis]
+    maturity = np.atleast_1d(np.asarray(maturity, dtype=np.float64))[np.newaxis, :]
+    k = -np.log(1 - MATURITY_FRACTION) / maturity
+    fraction = ((1 - np.exp(-k * (t + age))) / (1 - np.exp(-k * maturity))) ** shape
+    return np.where(t > 0, np.minimum(fraction, 1.0), 0.0)
+
+
+def class_stocks(params, growth=None, n_lucodes=N_LUCODES):
+    """
+    Returns the (years + 1) x classes matrix of the carbon stock (ton C per
+    pixel) of every (present lucode, future lucode) class, the classes
+    numbered as TransitionMatrix.pairs(). growth is the fraction of the
+    gained above-ground carbon reached every year, by default the curve
+    of params.maturity.
+    """
+    transitions = TransitionMatrix(n_lucodes=n_lucodes)
+    n_slots = n_lucodes + 1
+    t = np.arange(params.years + 1)
+    if growth is None:
+        growth = growth_fraction(t, params.maturity, params.age, params.shape)[:, 0]
+    above = transitions.class_values(C_ABOVE_TABLE, params.area_pixel)
+    soil = transitions.class_values(C_SOIL_TABLE, params.area_pixel)
+    above_present = np.repeat(above, n_slots)
+    above_future = np.tile(above, n_slots)
+    soil_present = np.repeat(soil, n_slots)
+    soil_future = np.tile(soil, n_slots)
+    gain = np.maximum(above_future - above_present, 0)
+    loss = np.maximum(above_present - above_future, 0)
+    soil_fraction = np.minimum(t / float(params.soil_years), 1.0) if params.soil_years > 0 else (t > 0) * 1.0
+    return (above_present[np.newaxis, :] - loss[np.newaxis, :] * (t[:, np.newaxis] > 0) +
+            gain[np.newaxis, :] * np.asarray(growth)[:, np.newaxis] +
+            soil_present[np.newaxis, :] + (soil_future - soil_present)[np.newaxis, :] * soil_fraction[:, np.newaxis])
+
+
+def class_values(stocks, params):
+    """
+    Returns the value (euro) of the sequestration of every class over the
+    horizon: the yearly stock changes, discounted and priced. With a linear
+    stock change it is the value of sequestro().
+    """
+    return params.value * np.dot(params.discount, np.diff(stocks, axis=0))
+
+
+def traiettoria(arr_present, arr_future, params, growth=None):
+    """
+    Returns the class raster of the (present, future) lucode pairs, the
+    years x classes stock matrix, the per-class values and the report
+    totals: the stock and the discounted value of every year.
+    """
+    transitions = TransitionMatrix()
+    n_classes = (transitions.n_lucodes + 1) ** 2
+    # Fewer than 2 ** 16 classes, stored as uint16 to save memory
+    classes = transitions.pairs(arr_present, arr_future).astype(np.uint16)
+    counts = np.bincount(classes.ravel(), minlength=n_classes)
+    stocks = class_stocks(params, growth, transitions.n_lucodes)
+    values = class_values(stocks, params)
+    stock_totals = np.dot(stocks, counts)
+    year_values = params.value * params.discount * np.diff(stock_totals)
+    stats = {
+        'years': params.year_list,
+        'stock': stock_totals,
+        'sequestration': np.diff(stock_totals),
+        'year_value': year_values,
+        'value': float(np.dot(values, counts)),
+        'total_area': arr_present.size * params.area_pixel
+    }
+    return classes, stocks, values, stats
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Connettività ecologica: current flow between the habitat patches on the
+land use grid (circuit theory, as Circuitscape).
+
+Every cell is a node with a resistance derived from the habitat score of
+its lucode, joined to its 4 neighbours by the harmonic mean of their
+conductances. The largest habitat patches are the focal regions: each of
+them in turn is grounded while the others inject 1 A each, and the
+absolute currents of all the solves are summed per cell. A patch is
+grounded by a large penalty on the diagonal of its cells, so all the
+systems share the pattern of the Laplacian. They are solved with conjugate
+gradients, preconditioned by an algebraic multigrid hierarchy of each
+grounded system when pyamg is available (Jacobi otherwise): a hierarchy
+built with other cells grounded takes several times the iterations and
+costs more than it saves. Cells can be aggregated in blocks to reduce the
+size of the grid. Needs scipy.
+"""
+
+import numpy as np
+try:
+    from scipy import sparse
+    from scipy.sparse.linalg import cg
+except ImportError:
+    sparse = None
+try:
+    import pyamg
+except ImportError:
+    pyamg = None
+
+from se_torino.kernels import KernelParameters
+from se_torino.kernels import patches
+from se_torino.kernels.biodiversita import H_SCORE_TABLE
+
+# Conductance to the ground of the grounded cells, relative to the largest
+# diagonal of the Laplacian
+GROUND_PENALTY = 1e8
+
+
+class ConnettivitaParameters(KernelParameters):
+    """
+    max_resistance is the resistance of the cells with habitat score 0
+    (1 for score 1), coarsening the side in pixels of the aggregated cells,
+    threshold the habitat score of the focal patches, min_area (ha) their
+    minimum area, max_sources the number of focal patches (the largest
+    ones) and tolerance the relative residual of the solves.
+    """
+
+    def __init__(self, pixel_res=2, max_resistance=100, coarsening=1, threshold=0.5, min_area=1.0,
+                 max_sources=20, tolerance=1e-6):
+        KernelParameters.__init__(self, pixel_res)
+        self.max_resistance = max_resistance
+        self.coarsening = max(1, int(coarsening))
+        self.threshold = threshold
+        self.min_area = min_area
+        self.max_sources = max_sources
+        self.tolerance = tolerance
+
+    @property
+    def cell_size(self):
+        return self.pixel_res * self.coarsening
+
+    @property
+    def conductance_values(self):
+        # Resistance grows linearly with 1 - H, lucodes out of the table have H = 0
+        return 1.0 / (1.0 + (self.max_resistance - 1.0) * (1.0 - H_SCORE_TABLE.values))
+
+
+def block_mean(arr, factor):
+    """
+    Returns the mean of arr over blocks of factor x factor pixels; the
+    blocks on the right and bottom borders average the pixels they hold.
+    """
+    if factor == 1:
+        return arr.astype(np.float32)
+    rows, cols = arr.shape
+    out_rows = -(-rows // factor)
+    out_cols = -(-cols // factor)
+    sums = np.zeros((out_rows * factor, out_cols * factor), dtype=np.float32)
+    sums[:rows, :cols] = arr
+    counts = np.zeros((out_rows, factor, out_cols, factor), dtype=np.float32)
+    counts.reshape(sums.shape)[:rows, :cols] = 1
+    return sums.reshape(out_rows, factor, out_cols, factor).sum(axis=(1, 3)) / counts.sum(axis=(1, 3))
+
+
+def block_expand(arr, factor, shape):
+    """
+    Returns the aggregated cells of arr repeated over their pixels,
+    cropped to the shape of the original raster.
+    """
+    if factor == 1:
+        return arr
+    return np.repeat(np.repeat(arr, factor, axis=0), factor, axis=1)[:shape[0], :shape[1]]
+
+
+def conductance_grid(arr, params):
+    """
+    Returns the conductance of the (aggregated) cells of a land use array
+    and the mask of their habitat, the cells with habitat score above the
+    threshold on at least half of their pixels.
+    """
+    idx = H_SCORE_TABLE.indices(arr)
+    conductance = block_mean(params.conductance_values.astype(np.float32)[idx], params.coarsening)
+    habitat = block_mean(H_SCORE_TABLE.take(idx) > params.threshold, params.coarsening) >= 0.5
+    return conductance, habitat
+
+
+def grid_edges(conductance):
+    """
+    Returns the (node, node, conductance) arrays of the 4-neighbour edges
+    of a conductance grid, nodes numbered row by row.
+    """
+    rows, cols = conductance.shape
+    nodes = np.arange(rows * cols).reshape(rows, cols)
+    a = np.concatenate([nodes[:, :-1].ravel(), nodes[:-1, :].ravel()])
+    b = np.concatenate([nodes[:, 1:].ravel(), nodes[1:, :].ravel()])
+    g_a = conductance.ravel()[a].astype(np.float64)
+    g_b = conductance.ravel()[b].astype(np.float64)
+    return a, b, 2 * g_a * g_b / (g_a + g_b)
+
+
+def laplacian(n, a, b, g):
+    """
+    Returns the sparse Laplacian (CSR) of the graph with n nodes and the
+    edges (a, b) of conductance g.
+    """
+    degree = np.bincount(a, weights=g, minlength=n) + np.bincount(b, weights=g, minlength=n)
+    rows = np.concatenate([a, b, np.arange(n)])
+    cols = np.concatenate([b, a, np.arange(n)])
+    values = np.concatenate([-g, -g, degree])
+    return sparse.csr_matrix((values, (rows, cols)), shape=(n, n))
+
+
+def diagonal_positions(A):
+    """
+    Returns the position in A.data of the diagonal entry of every row of a
+    CSR matrix, whose diagonal is stored in full.
+    """
+    entry_rows = np.repeat(np.arange(A.shape[0]), np.diff(A.indptr))
+    positions = np.flatnonzero(A.indices == entry_rows)
+    if len(positions) != A.shape[0]:
+        raise ValueError('The diagonal of the matrix must be stored in full')
+    return positions
+
+
+def preconditioner(A):
+    """
+    Returns the algebraic multigrid preconditioner of A, None without
+    pyamg.
+    """
+    if pyamg is None:
+        return None
+    return pyamg.smoothed_aggregation_solver(A).aspreconditioner(cycle='V')
+
+
+def solve(A, b, tolerance, M=None):
+    """
+    Solves the symmetric positive definite system A x = b with conjugate
+    gradients, preconditioned by M (Jacobi when M is None). Returns x,
+    True if the solve converged and the number of iterations.
+    """
+    if M is None:
+        M = sparse.diags(1.0 / A.diagonal())
+    iterations = [0]
+
+    def count(xk):
+        iterations[0] += 1
+
+    try:
+        x, info = cg(A, b, rtol=tolerance, M=M, maxiter=10 * A.shape[0], callback=count)
+    except TypeError:
+        # scipy < 1.12
+        iterations[0] = 0
+        x, info = cg(A, b, tol=tolerance, M=M, maxiter=10 * A.shape[0], callback=count)
+    return x, info == 0, iterations[0]
+
+
+def focal_patches(habitat, params):
+    """
+    Returns the labels of the habitat patches of the grid and the labels
+    of the focal ones: at least min_area, the largest max_sources.
+    """
+    labels, n = patches.label(habitat)
+    areas = np.bincount(labels.ravel(), minlength=n + 1)[1:] * params.cell_size ** 2 / 10000.0
+    order = np.argsort(areas)[::-1]
+    order = order[areas[order] >= params.min_area][:params.max_sources]
+    return labels, order + 1
+
+
+def current_density(arr, params):
+    """
+    Returns the cumulative current (A) of every cell of a land use array,
+    at the size of the array, and the report statistics.
+    """
+    if sparse is None:
+        raise ImportError('The connectivity kernel needs scipy')
+    conductance, habitat = conductance_grid(arr, params)
+    rows, cols = conductance.shape
+    n = rows * cols
+    labels, sources = focal_patches(habitat, params)
+    a, b, g = grid_edges(conductance)
+    L = laplacian(n, a, b, g)
+
+    # Cells of every patch from a single sort of the labels
+    flat_labels = labels.ravel()
+    order = np.argsort(flat_labels, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(np.bincount(flat_labels, minlength=int(np.max(labels)) + 1))])
+    source_nodes = [order[starts[source]:starts[source + 1]] for source in sources]
+    # Each focal patch injects 1 A, spread over its cells
+    injection = np.zeros(n)
+    for nodes in source_nodes:
+        injection[nodes] = 1.0 / len(nodes)
+
+    current = np.zeros(n)
+    not_converged = 0
+    iterations = []
+    if len(sources) >= 2:
+        diagonal = diagonal_positions(L)
+        degree = L.data[diagonal].copy()
+        penalty = GROUND_PENALTY * np.max(degree)
+        for ground in source_nodes:
+            free = np.ones(n, dtype=bool)
+            free[ground] = False
+            # The Laplacian is grounded in place and restored after the solve,
+            # the hierarchy is built on the grounded system
+            L.data[diagonal[ground]] += penalty
+            M = preconditioner(L)
+            voltage, converged, n_iterations = solve(L, np.where(free, injection, 0.0), params.tolerance, M)
+            L.data[diagonal[ground]] = degree[ground]
+            not_converged += not converged
+            iterations.append(n_iterations)
+            # Node current: half of the absolute currents through its edges and sources,
+            # all the current of the grounded cells flows to the ground
+            edge_current = np.abs(g * (voltage[a] - voltage[b]))
+            node_current = np.bincount(a, weights=edge_current, minlength=n) + \
+                np.bincount(b, weights=edge_current, minlength=n)
+            node_current[free] = 0.5 * (node_current[free] + injection[free])
+            current += node_current
+    current = current.reshape(rows, cols).astype(np.float32)
+    stats = {
+        'n_patches': int(np.max(labels)),
+        'n_sources': len(sources),
+        'source_area': float(sum(len(nodes) for nodes in source_nodes) * params.cell_size ** 2 / 10000.0),
+        'current_mean': float(np.mean(current)),
+        'current_max': float(np.max(current)),
+        'not_converged': not_converged,
+        'iterations': iterations
+    }
+    return block_expand(current, params.coarsening, arr.shape), stats
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Convolution of large rasters with large kernels, by FFT on tiles.
+
+At 2 m resolution a 1 km kernel is 1001 pixels wide: direct convolution
+costs 10^6 operations per pixel. Every output tile is computed instead
+from the input window around it (overlap-save) with a real FFT of fixed
+size, so memory depends on the tile and not on the raster, and the tiles
+whose window is empty are skipped.
+"""
+
+import math
+
+import numpy as np
+
+DECAY_LINEAR = 0
+DECAY_EXPONENTIAL = 1
+
+
+def decay_kernel(max_distance, pixel_res, decay=DECAY_LINEAR):
+    """
+    Returns the square kernel of a distance decay, normalized to sum 1:
+    1 - d / max_distance for the linear decay, exp(-2.99 d / max_distance)
+    for the exponential one, 0 beyond max_distance.
+    """
+    radius = max(0, int(math.ceil(max_distance / float(pixel_res))))
+    offsets = np.arange(-radius, radius + 1) * float(pixel_res)
+    distance = np.hypot(offsets[:, np.newaxis], offsets[np.newaxis, :])
+    if max_distance <= 0:
+        kernel = np.ones((1, 1))
+    elif decay == DECAY_EXPONENTIAL:
+        kernel = np.exp(-2.99 * distance / max_distance)
+    else:
+        kernel = 1 - distance / max_distance
+    kernel[distance > max_distance] = 0
+    return kernel / np.sum(kernel)
+
+
+def fft_shape(kernel_size, min_size=256):
+    """
+    Returns the (power of two) FFT size and the output tile size used with
+    a kernel of kernel_size pixels: the FFT is about four times the
+    kernel, so that most of each transform is useful output.
+    """
+    overlap = kernel_size - 1
+    n = 2 ** int(math.ceil(math.log(max(4 * overlap, min_size), 2)))
+    return n, n - overlap
+
+
+def fft_convolve(arr, kernel, feedback=None):
+    """
+    Returns the convolution of arr with an odd sized square kernel, same
+    shape as arr (values outside arr count as 0), as float32.
+    """
+    rows, cols = arr.shape
+    kernel_size = kernel.shape[0]
+    radius = kernel_size // 2
+    n, tile = fft_shape(kernel_size)
+    kernel_fft = np.fft.rfft2(kernel, s=(n, n))
+    out = np.zeros((rows, cols), dtype=np.float32)
+    window = np.zeros((n, n))
+    tiles = [(yoff, xoff) for yoff in range(0, rows, tile) for xoff in range(0, cols, tile)]
+    for tile_id, (yoff, xoff) in enumerate(tiles):
+        if feedback is not None and feedback.isCanceled():
+            break
+        ysize = min(tile, rows - yoff)
+        xsize = min(tile, cols - xoff)
+        # Input window: the tile with a margin of one radius, clipped to arr
+        y0 = max(0, yoff - radius)
+        y1 = min(rows, yoff + ysize + radius)
+        x0 = max(0, xoff - radius)
+        x1 = min(cols, xoff + xsize + radius)
+        block = arr[y0:y1, x0:x1]
+        if not np.any(block):
+            continue
+        window[:] = 0
+        wy = y0 - (yoff - radius)
+        wx = x0 - (xoff - radius)
+        window[wy:wy + (y1 - y0), wx:wx + (x1 - x0)] = block
+        conv = np.fft.irfft2(np.fft.rfft2(window) * kernel_fft, s=(n, n))
+        # Overlap-save: the first kernel_size - 1 rows and columns wrap around
+        out[yoff:yoff + ysize, xoff:xoff + xsize] = conv[kernel_size - 1:kernel_size - 1 + ysize,
+                                                         kernel_size - 1:kernel_size - 1 + xsize]
+        if feedback is not None:
+            feedback.setProgress(100.0 * (tile_id + 1) / len(tiles))
+    # FFT round-off around the exact zeros
+    np.maximum(out, 0, out=out)
+    return out
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Impollinazione: pollination value of every lucode.
+"""
+
+from se_torino.kernels import KernelParameters
+from se_torino.lookup import LucodeTable
+
+# SE valore impollinazione per lucode
+VALUE_LUCODE = {}
+VALUE_LUCODE[1] = 0
+VALUE_LUCODE[2] = 0
+VALUE_LUCODE[3] = 0
+VALUE_LUCODE[4] = 0.0161
+VALUE_LUCODE[5] = 0
+VALUE_LUCODE[6] = 0.0161
+VALUE_LUCODE[7] = 0.0187
+VALUE_LUCODE[8] = 0
+VALUE_LUCODE[9] = 0.0187
+VALUE_LUCODE[10] = 0.0187
+VALUE_LUCODE[11] = 0
+VALUE_LUCODE[12] = 0.0161
+VALUE_LUCODE[13] = 0
+VALUE_LUCODE[14] = 0.0161
+VALUE_LUCODE[15] = 0
+VALUE_LUCODE[16] = 0.0161
+VALUE_LUCODE[17] = 0.0187
+VALUE_LUCODE[18] = 0
+VALUE_LUCODE[19] = 0.0187
+VALUE_LUCODE[20] = 0
+VALUE_LUCODE[21] = 0.0187
+VALUE_LUCODE[22] = 0.0187
+VALUE_LUCODE[23] = 0.0187
+VALUE_LUCODE[24] = 0.0161
+VALUE_LUCODE[25] = 0
+VALUE_LUCODE[26] = 0.0187
+VALUE_LUCODE[27] = 0.0161
+VALUE_LUCODE[28] = 0
+VALUE_LUCODE[29] = 0.0187
+VALUE_LUCODE[30] = 0.0161
+VALUE_LUCODE[31] = 0
+VALUE_LUCODE[32] = 0.0187
+VALUE_LUCODE[33] = 0.0161
+VALUE_LUCODE[34] = 0.0161
+VALUE_LUCODE[35] = 0
+VALUE_LUCODE[36] = 0
+VALUE_LUCODE[37] = 0.02
+VALUE_LUCODE[38] = 0.0187
+VALUE_LUCODE[39] = 0.0161
+VALUE_LUCODE[40] = 0
+VALUE_LUCODE[41] = 0
+VALUE_LUCODE[42] = 0
+VALUE_LUCODE[43] = 0.0187
+VALUE_LUCODE[44] = 0.0187
+VALUE_LUCODE[45] = 0
+VALUE_LUCODE[46] = 0.0187
+VALUE_LUCODE[47] = 0
+VALUE_LUCODE[48] = 0.0187
+VALUE_LUCODE[49] = 0.0187
+VALUE_LUCODE[50] = 0
+VALUE_LUCODE[51] = 0
+VALUE_LUCODE[52] = 0
+VALUE_LUCODE[53] = 0.0187
+VALUE_LUCODE[54] = 0
+VALUE_LUCODE[55] = 0
+VALUE_LUCODE[56] = 0
+VALUE_LUCODE[57] = 0.0187
+VALUE_LUCODE[58] = 0.0196
+VALUE_LUCODE[59] = 0
+VALUE_LUCODE[60] = 0
+VALUE_LUCODE[61] = 0.0161
+VALUE_LUCODE[62] = 0.0187
+VALUE_LUCODE[63] = 0.0161
+VALUE_LUCODE[64] = 0.0161
+VALUE_LUCODE[65] = 0
+VALUE_LUCODE[66] = 0
+VALUE_LUCODE[67] = 0
+VALUE_LUCODE[68] = 0.0161
+VALUE_LUCODE[69] = 0.0187
+VALUE_LUCODE[70] = 0.0161
+VALUE_LUCODE[71] = 0.0161
+VALUE_LUCODE[72] = 0
+VALUE_LUCODE[73] = 0
+VALUE_LUCODE[74] = 0.0187
+VALUE_LUCODE[75] = 0
+VALUE_LUCODE[76] = 0
+VALUE_LUCODE[77] = 0
+VALUE_LUCODE[78] = 0
+VALUE_LUCODE[79] = 0.0161
+VALUE_LUCODE[80] = 0
+VALUE_LUCODE[81] = 0
+VALUE_LUCODE[82] = 0.0187
+VALUE_LUCODE[83] = 0.0187
+VALUE_LUCODE[84] = 0.0187
+VALUE_LUCODE[85] = 0.0187
+VALUE_LUCODE[86] = 0.0187
+VALUE_LUCODE[87] = 0.0187
+
+VALUE_TABLE = LucodeTable(VALUE_LUCODE)
+
+
+class ImpollinazioneParameters(KernelParameters):
+    pass
+
+
+def state_arrays(arr, params):
+    """
+    Returns the pollination value raster of a land use array.
+    """
+    arr_value = VALUE_TABLE.take(VALUE_TABLE.indices(arr))
+    arr_value *= params.area_pixel
+    return {'value': arr_value}
+
+
+def state_stats(histogram, params):
+    """
+    Returns the report totals of a state from its LucodeHistogram.
+    """
+    return {'value': VALUE_TABLE.total(histogram) * params.area_pixel, 'unknown': VALUE_TABLE.unknown_in(histogram)}
+
+
+def delta_transitions(transitions, params):
+    """
+    Returns the value delta of every lucode transition.
+    """
+    return {'value': transitions.delta(transitions.class_values(VALUE_TABLE, params.area_pixel))}
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Infiltrazione: value of the water infiltrated in the present and the future
+state.
+"""
+
+import numpy as np
+
+from se_torino.kernels import KernelParameters
+
+# Value euro per cubic meter
+VALUE_COEFF = 300
+# Rows of a LAI raster evaluated at once by interception()
+CHUNK_ROWS = 256
+
+
+class InfiltrazioneParameters(KernelParameters):
+    pass
+
+
+def infiltrazione(arr_present, arr_future, params):
+    """
+    Returns the value delta raster of the infiltration rasters (mm) of the
+    two states, and the report totals.
+    """
+    area_pixel = params.area_pixel
+    # Convert to squared meters and assign value
+    arr_value_present = VALUE_COEFF * (arr_present / 1000) * area_pixel
+    arr_value_future = VALUE_COEFF * (arr_future / 1000) * area_pixel
+    arr_diff_tot = arr_value_future - arr_value_present
+    stats = {
+        'present': np.sum(arr_present),
+        'future': np.sum(arr_future),
+        'present_value': np.sum(arr_value_present),
+        'future_value': np.sum(arr_value_future),
+        'value': np.sum(arr_diff_tot)
+    }
+    stats['present_volume'] = stats['present'] / 1000 * area_pixel
+    stats['future_volume'] = stats['future'] / 1000 * area_pixel
+    stats['difference'] = stats['future'] - stats['present']
+    stats['difference_volume'] = stats['difference'] / 1000 * area_pixel
+    return {'value': arr_diff_tot}, stats
+
+
+def interception(arr_lai, conc, scale=1.0, fallback=0.0, idx=None, chunk_rows=CHUNK_ROWS):
+    """
+    Returns the rain intercepted by the canopy (mm) of every pixel of a
+    LAI raster, Sv = Smax * (1 - exp(-nu * conc / Smax)) with
+    Smax = 0.935 + 0.498 * LAI - 0.00575 * LAI and nu = 0.046 * LAI. A
+    measured LAI is dimensionless and used as it is (scale 1); scale only
+    reproduces the per-pixel LAI of the lucode table of Calcolo
+    infiltrazione, which is multiplied by the pixel area.
+
+    The expression is evaluated in place, chunk_rows rows at a time, in two
+    buffers of the chunk size, so the result is the only full size array.
+    Pixels where the LAI is missing (NaN or negative) take fallback: a
+    scalar, or with idx the per-slot values of a LucodeTable taken at the
+    slots idx of the pixels.
+    """
+    arr_lai = np.asarray(arr_lai)
+    rows = arr_lai.shape[0]
+    arr_sv = np.empty(arr_lai.shape, dtype=np.float64)
+    smax_buffer = np.empty((min(chunk_rows, rows),) + arr_lai.shape[1:], dtype=np.float64)
+    ratio_buffer = np.empty_like(smax_buffer)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for start in range(0, rows, chunk_rows):
+            stop = min(start + chunk_rows, rows)
+            lai = arr_lai[start:stop]
+            smax = smax_buffer[:stop - start]
+            ratio = ratio_buffer[:stop - start]
+            sv = arr_sv[start:stop]
+            np.multiply(lai, (0.498 - 0.00575) * scale, out=smax)
+            smax += 0.935
+            # -nu * conc / Smax
+            np.multiply(lai, -0.046 * scale * conc, out=ratio)
+            ratio /= smax
+            # Smax * (1 - exp(x)) = -Smax * expm1(x)
+            np.expm1(ratio, out=ratio)
+            np.multiply(smax, ratio, out=sv)
+            np.negative(sv, out=sv)
+            missing = ~(lai >= 0)
+            if np.any(missing):
+                sv[missing] = fallback if idx is None else fallback[idx[start:stop][missing]]
+    return arr_sv
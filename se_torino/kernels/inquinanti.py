@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Rimozione inquinanti: value of the NO2, PM10 and ozone removal of the
+present and the future state.
+"""
+
+import numpy as np
+
+from se_torino.kernels import KernelParameters
+
+# Euro per ton of removed pollutant
+EURO_COEFF = {
+    'NO2': 77641.89,
+    'PM10': 17132.56,
+    'ozono': 14658.11
+}
+POLLUTANTS = ['NO2', 'PM10', 'ozono']
+
+
+class InquinantiParameters(KernelParameters):
+    """
+    euro_coeff maps every pollutant to its value (euro/ton).
+    """
+
+    def __init__(self, pixel_res=2, euro_coeff=None):
+        KernelParameters.__init__(self, pixel_res)
+        self.euro_coeff = dict(EURO_COEFF)
+        if euro_coeff:
+            self.euro_coeff.update(euro_coeff)
+
+
+def rimozione(arrays_present, arrays_future, params):
+    """
+    Returns the value delta raster of the removal rasters (ton per pixel)
+    of the two states, given as dicts keyed on the pollutants, and the
+    report totals.
+    """
+    arr_diff_tot = None
+    stats = {'present': {}, 'future': {}, 'present_value': 0.0, 'future_value': 0.0, 'difference': 0.0}
+    for pollutant in POLLUTANTS:
+        arr_present = arrays_present[pollutant]
+        arr_future = arrays_future[pollutant]
+        coeff = params.euro_coeff[pollutant]
+        stats['present'][pollutant] = np.sum(arr_present)
+        stats['future'][pollutant] = np.sum(arr_future)
+        stats['present_value'] += stats['present'][pollutant] * coeff
+        stats['future_value'] += stats['future'][pollutant] * coeff
+        stats['difference'] += stats['future'][pollutant] - stats['present'][pollutant]
+        arr_diff = arr_future * coeff - arr_present * coeff
+        arr_diff_tot = arr_diff if arr_diff_tot is None else arr_diff_tot + arr_diff
+    stats['total_area'] = arrays_present[POLLUTANTS[0]].size * params.area_pixel
+    stats['value'] = np.sum(arr_diff_tot)
+    return {'value': arr_diff_tot}, stats
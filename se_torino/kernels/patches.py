@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Patch metrics of a habitat mask: number and area of the patches, edge
+density and mean nearest patch distance.
+
+Patches are the 8-connected components of the mask. The raster is
+labeled tile by tile (with scipy.ndimage when available, with a run based
+NumPy labeling otherwise) and the labels touching across the tile borders
+are merged afterwards, so only one tile at a time is held in memory. The
+nearest patch distances need scipy (cKDTree).
+"""
+
+import numpy as np
+try:
+    from scipy import ndimage
+    from scipy.spatial import cKDTree
+except ImportError:
+    ndimage = None
+    cKDTree = None
+
+# 8-connectivity, as the FRAGSTATS default
+EIGHT_CONNECTED = np.ones((3, 3), dtype=bool)
+# Upper limits (ha) of the patch size classes of the report
+AREA_CLASSES = [0.1, 1.0, 10.0]
+
+
+def connected_roots(n, a, b):
+    """
+    Returns the root of every node 0 ... n-1 of the graph with the edges
+    (a[i], b[i]): the smallest node of its connected component.
+    """
+    parent = np.arange(n)
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    while a.size:
+        root_a = parent[a]
+        root_b = parent[b]
+        if np.array_equal(root_a, root_b):
+            break
+        # Hook the larger root of every edge to the smaller one
+        np.minimum.at(parent, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
+        # Pointer jumping until every node points to its root
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+    return parent
+
+
+def _expand(starts, counts):
+    # Concatenation of the ranges starts[i] ... starts[i] + counts[i] - 1
+    offsets = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + offsets
+
+
+def label_runs(mask):
+    """
+    Labels the 8-connected components of a boolean mask with NumPy only:
+    the runs of every row are joined to the overlapping runs of the row
+    above. Returns the labels (0 outside the mask) and their number.
+    """
+    rows, cols = mask.shape
+    labels = np.zeros((rows, cols), dtype=np.int64)
+    padded = np.zeros((rows, cols + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    change = np.diff(padded, axis=1)
+    run_rows, run_starts = np.nonzero(change == 1)
+    _, run_ends = np.nonzero(change == -1)
+    n_runs = len(run_rows)
+    if n_runs == 0:
+        return labels, 0
+    # Runs sorted by row and column, the row stride keeps the rows apart
+    width = cols + 2
+    starts_key = run_rows * width + run_starts
+    ends_key = run_rows * width + run_ends
+    previous_row = (run_rows - 1) * width
+    # Runs of the previous row touching each run, diagonals included
+    first = np.searchsorted(ends_key, previous_row + run_starts, side='left')
+    last = np.searchsorted(starts_key, previous_row + run_ends, side='right')
+    counts = np.clip(last - first, 0, None)
+    roots = connected_roots(n_runs, _expand(first, counts), np.repeat(np.arange(n_runs), counts))
+    _, run_labels = np.unique(roots, return_inverse=True)
+    lengths = run_ends - run_starts
+    labels.ravel()[_expand(run_rows * cols + run_starts, lengths)] = np.repeat(run_labels + 1, lengths)
+    return labels, int(np.max(run_labels)) + 1
+
+
+def label(mask):
+    """
+    Returns the 8-connected labels of a boolean mask and their number.
+    """
+    if ndimage is not None:
+        labels, n = ndimage.label(mask, structure=EIGHT_CONNECTED)
+        return labels.astype(np.int64), n
+    return label_runs(mask)
+
+
+def _border_pairs(first, second):
+    """
+    Returns the (label, label) pairs of two facing label lines, on the
+    same position and on the diagonals.
+    """
+    pairs = []
+    for shift in [-1, 0, 1]:
+        if shift < 0:
+            a, b = first[-shift:], second[:shift]
+        elif shift > 0:
+            a, b = first[:-shift], second[shift:]
+        else:
+            a, b = first, second
+        touching = (a > 0) & (b > 0)
+        pairs.append((a[touching], b[touching]))
+    return pairs
+
+
+def nearest_patch_distances(points, point_patches, n_patches):
+    """
+    Returns, for every patch, the distance between its border points and
+    the nearest border point of another patch (inf for a single patch).
+    The neighbours of each point are searched with a growing k, only
+    while they can still lower the distance of their patch.
+    """
+    distances = np.full(n_patches, np.inf)
+    if n_patches < 2:
+        return distances
+    tree = cKDTree(points)
+    pending = np.arange(len(points))
+    k = 8
+    while pending.size:
+        k = min(k, len(points))
+        dist, idx = tree.query(points[pending], k=k)
+        other = point_patches[idx] != point_patches[pending][:, np.newaxis]
+        found = np.any(other, axis=1)
+        nearest = dist[np.arange(len(pending)), np.argmax(other, axis=1)]
+        np.minimum.at(distances, point_patches[pending[found]], nearest[found])
+        if k == len(points):
+            break
+        # Points without another patch among their k neighbours are farther
+        # than the k-th one: they matter only if that beats their patch
+        unresolved = pending[~found]
+        pending = unresolved[dist[~found, -1] < distances[point_patches[unresolved]]]
+        k *= 4
+    return distances
+
+
+def patch_metrics(read_window, rows, cols, habitat, pixel_res=2, tile=2048, nearest=True):
+    """
+    Returns the patch metrics of a raster of rows x cols pixels, read with
+    read_window(xoff, yoff, xsize, ysize) one tile at a time; habitat(arr)
+    returns the boolean habitat mask of a window. With nearest=True and
+    scipy available the mean nearest patch distance is computed too.
+    """
+    nearest = nearest and cKDTree is not None
+    label_offset = 0
+    areas = []
+    pairs = []
+    n_edges = 0
+    border_points = []
+    border_labels = []
+    previous_bottom = None
+    for yoff in range(0, rows, tile):
+        ysize = min(tile, rows - yoff)
+        top = np.zeros(cols, dtype=np.int64)
+        bottom = np.zeros(cols, dtype=np.int64)
+        previous_right = None
+        for xoff in range(0, cols, tile):
+            xsize = min(tile, cols - xoff)
+            # Window with a one pixel halo, for the edges across the tile borders
+            y0 = max(0, yoff - 1)
+            y1 = min(rows, yoff + ysize + 1)
+            x0 = max(0, xoff - 1)
+            x1 = min(cols, xoff + xsize + 1)
+            window = np.zeros((ysize + 2, xsize + 2), dtype=bool)
+            window[y0 - yoff + 1:y1 - yoff + 1, x0 - xoff + 1:x1 - xoff + 1] = habitat(
+                read_window(x0, y0, x1 - x0, y1 - y0))
+            mask = window[1:-1, 1:-1]
+            labels, n = label(mask)
+            areas.append(np.bincount(labels.ravel(), minlength=n + 1)[1:])
+            labels[labels > 0] += label_offset
+            label_offset += n
+
+            # Habitat edges with the pixels on the right and below, inside the raster
+            n_edges += np.count_nonzero(mask[:, :-1] != mask[:, 1:])
+            n_edges += np.count_nonzero(mask[:-1, :] != mask[1:, :])
+            if x1 > xoff + xsize:
+                n_edges += np.count_nonzero(mask[:, -1] != window[1:-1, -1])
+            if y1 > yoff + ysize:
+                n_edges += np.count_nonzero(mask[-1, :] != window[-1, 1:-1])
+
+            if nearest:
+                # Border pixels: habitat pixels with a 4-neighbour out of the habitat
+                interior = window[:-2, 1:-1] & window[2:, 1:-1] & window[1:-1, :-2] & window[1:-1, 2:]
+                border_rows, border_cols = np.nonzero(mask & ~interior)
+                border_points.append(np.column_stack([(border_cols + xoff + 0.5) * pixel_res,
+                                                      (border_rows + yoff + 0.5) * pixel_res]))
+                border_labels.append(labels[border_rows, border_cols])
+
+            # Labels on the tile borders, merged at the end
+            if previous_right is not None:
+                pairs += _border_pairs(previous_right, labels[:, 0])
+            previous_right = labels[:, -1]
+            top[xoff:xoff + xsize] = labels[0]
+            bottom[xoff:xoff + xsize] = labels[-1]
+        if previous_bottom is not None:
+            pairs += _border_pairs(previous_bottom, top)
+        previous_bottom = bottom
+
+    # Patches are the labels connected across the tile borders
+    if pairs:
+        roots = connected_roots(label_offset + 1, np.concatenate([a for a, _ in pairs]),
+                                np.concatenate([b for _, b in pairs]))
+    else:
+        roots = np.arange(label_offset + 1)
+    patch_ids, patch_of_label = np.unique(roots[1:], return_inverse=True)
+    n_patches = len(patch_ids)
+    area_pixel = pixel_res * pixel_res
+    patch_areas = np.bincount(patch_of_label, weights=np.concatenate(areas), minlength=n_patches) * area_pixel / 10000.0
+    landscape_area = rows * cols * area_pixel / 10000.0
+
+    metrics = {
+        'n_patches': n_patches,
+        'habitat_area': float(np.sum(patch_areas)),
+        'mean_area': float(np.mean(patch_areas)) if n_patches else 0.0,
+        'median_area': float(np.median(patch_areas)) if n_patches else 0.0,
+        'p90_area': float(np.percentile(patch_areas, 90)) if n_patches else 0.0,
+        'largest_area': float(np.max(patch_areas)) if n_patches else 0.0,
+        'area_classes': np.bincount(np.searchsorted(AREA_CLASSES, patch_areas, side='right'),
+                                    minlength=len(AREA_CLASSES) + 1).tolist(),
+        'edge_density': n_edges * pixel_res / landscape_area,
+        'nearest_mean': None
+    }
+    metrics['largest_patch_index'] = 100.0 * metrics['largest_area'] / landscape_area
+    if nearest and n_patches >= 2:
+        points = np.concatenate(border_points)
+        point_patches = patch_of_label[np.concatenate(border_labels) - 1]
+        distances = nearest_patch_distances(points, point_patches, n_patches)
+        metrics['nearest_mean'] = float(np.mean(distances[np.isfinite(distances)]))
+    return metrics
+
+
+def array_reader(arr):
+    """
+    Returns a read_window function for patch_metrics over an array.
+    """
+    return lambda xoff, yoff, xsize, ysize: arr[yoff:yoff + ysize, xoff:xoff + xsize]
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Population served by the green areas of SE Benefici sociali.
+
+The population raster and the pixels of every green area class are summed
+by blocks (e.g. 50 x 50 m), window by window, so the rasters are never
+held in memory. A block is served by a class when a block holding that
+class is within the walking catchment distance: the cost distance of
+Accessibilità over the block grid, with the walking friction of every
+block summed from its pixels. The served population of a class is the
+population of its served blocks.
+
+The friction of a block is the mean friction of its crossable pixels
+divided by the share of crossable pixels, so blocks mostly covered by
+barriers (water, railways, motorways) are slow to cross and blocks without
+crossable pixels cannot be crossed. Those blocks are served when one of
+their neighbours is within the catchment.
+"""
+
+import math
+
+import numpy as np
+
+from se_torino.kernels import KernelParameters
+from se_torino.kernels.accessibilita import FRICTION_TABLE, cost_distance
+from se_torino.kernels.benefici import VALUE_TABLE
+from se_torino.lookup import LucodeTable
+
+# Green area classes and their lucodes
+GREEN_CLASSES = [
+    ('Area verde', [21, 22]),
+    ('Infrastruttura alberata', [43, 44]),
+    ('Bosco', [82, 83, 84, 85, 86, 87]),
+    ('Area giochi bimbi', [17, 18]),
+    ('Attrezzatura sportiva', [26, 27]),
+    ('Area cani', [9, 10]),
+]
+# Class of every lucode, 1 ... n (0 for the lucodes of no class)
+GREEN_CLASS_TABLE = LucodeTable(dict((lucode, n + 1) for n, (_, lucodes) in enumerate(GREEN_CLASSES)
+                                     for lucode in lucodes))
+
+
+class PopolazioneParameters(KernelParameters):
+    """
+    block is the side (m) of the aggregation blocks and catchment the
+    walking distance (m on the pedestrian paths) within which a green area
+    serves the population.
+    """
+
+    def __init__(self, pixel_res=2, block=50, catchment=300):
+        KernelParameters.__init__(self, pixel_res)
+        self.block = block
+        self.catchment = catchment
+
+    @property
+    def block_pixels(self):
+        return max(1, int(round(self.block / float(self.pixel_res))))
+
+    @property
+    def block_size(self):
+        return self.block_pixels * self.pixel_res
+
+
+class PopulationBlocks(object):
+    """
+    Population, green class pixels, green class values (sum of the
+    per-lucode values) and walking friction of the blocks of a rows x cols
+    raster, accumulated window by window with update().
+    """
+
+    def __init__(self, rows, cols, params):
+        self.params = params
+        self.block_rows = -(-rows // params.block_pixels)
+        self.block_cols = -(-cols // params.block_pixels)
+        n_blocks = self.block_rows * self.block_cols
+        self.population = np.zeros(n_blocks)
+        self.green = np.zeros((len(GREEN_CLASSES) + 1, n_blocks), dtype=np.int64)
+        self.values = np.zeros(len(GREEN_CLASSES) + 1)
+        self.pixels = np.zeros(n_blocks)
+        self.crossable = np.zeros(n_blocks)
+        self.friction_sum = np.zeros(n_blocks)
+
+    def update(self, arr, population, xoff=0, yoff=0):
+        """
+        Adds a window of the land use and population rasters, at (xoff,
+        yoff), to the blocks. Population nodata must be set to 0.
+        """
+        ysize, xsize = arr.shape
+        block_pixels = self.params.block_pixels
+        block_row = (np.arange(yoff, yoff + ysize) // block_pixels)[:, np.newaxis]
+        block_col = (np.arange(xoff, xoff + xsize) // block_pixels)[np.newaxis, :]
+        blocks = (block_row * self.block_cols + block_col).ravel()
+        n_blocks = len(self.population)
+        self.population += np.bincount(blocks, weights=np.ravel(population), minlength=n_blocks)
+        green_class = GREEN_CLASS_TABLE.take(GREEN_CLASS_TABLE.indices(arr)).astype(np.intp).ravel()
+        n_classes = len(GREEN_CLASSES) + 1
+        self.green += np.bincount(green_class * n_blocks + blocks,
+                                  minlength=n_classes * n_blocks).reshape(n_classes, n_blocks)
+        self.values += np.bincount(green_class, weights=VALUE_TABLE.map(arr)[0].ravel(), minlength=n_classes)
+        friction = FRICTION_TABLE.map(arr)[0].ravel()
+        crossable = np.isfinite(friction)
+        self.pixels += np.bincount(blocks, minlength=n_blocks)
+        self.crossable += np.bincount(blocks[crossable], minlength=n_blocks)
+        self.friction_sum += np.bincount(blocks[crossable], weights=friction[crossable], minlength=n_blocks)
+        return self
+
+    @property
+    def friction(self):
+        """
+        Returns the walking friction of the blocks, inf for the blocks
+        without crossable pixels.
+        """
+        friction = np.full(len(self.pixels), np.inf)
+        crossable = self.crossable > 0
+        friction[crossable] = self.friction_sum[crossable] * self.pixels[crossable] / self.crossable[crossable] ** 2
+        return friction.reshape(self.block_rows, self.block_cols)
+
+    def served(self, green_blocks, friction=None):
+        """
+        Returns True on the blocks within the walking catchment distance of
+        one of the green_blocks. Green blocks are crossable whatever their
+        friction.
+        """
+        green_blocks = green_blocks.reshape(self.block_rows, self.block_cols)
+        if not np.any(green_blocks):
+            return np.zeros(green_blocks.shape, dtype=bool)
+        if friction is None:
+            friction = self.friction
+        friction = np.where(green_blocks & ~np.isfinite(friction), 1.0, friction).astype(np.float32)
+        block_size = self.params.block_size
+        costs = cost_distance(friction, green_blocks, block_size)
+        # The blocks that cannot be crossed are reached from their neighbours
+        reach = costs.copy()
+        rows, cols = costs.shape
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                if dy == 0 and dx == 0:
+                    continue
+                step = block_size * (math.sqrt(2) if dy and dx else 1.0)
+                target = reach[max(0, dy):rows + min(0, dy), max(0, dx):cols + min(0, dx)]
+                np.minimum(target, costs[max(0, -dy):rows + min(0, -dy), max(0, -dx):cols + min(0, -dx)] + step,
+                           out=target)
+        reach = np.where(np.isfinite(friction), costs, reach)
+        return reach <= self.params.catchment
+
+    def stats(self, ROS):
+        """
+        Returns the total population and, for every green class, its area
+        (ha), served population and value (euro, for the ROS of the area).
+        """
+        classes = []
+        friction = self.friction
+        for n, (name, _) in enumerate(GREEN_CLASSES):
+            served = self.served(self.green[n + 1] > 0, friction).ravel()
+            classes.append({
+                'name': name,
+                'area': float(np.sum(self.green[n + 1])) * self.params.area_pixel / 10000.0,
+                'served': float(np.sum(self.population[served])),
+                'value': self.values[n + 1] * self.params.area_pixel * ROS
+            })
+        served_any = self.served(np.sum(self.green[1:], axis=0) > 0, friction).ravel()
+        return {
+            'population': float(np.sum(self.population)),
+            'served': float(np.sum(self.population[served_any])),
+            'classes': classes
+        }
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Produzione agricola: crop production of every lucode and its value.
+"""
+
+from se_torino.kernels import KernelParameters
+from se_torino.lookup import LucodeTable
+
+# SE valore produzione agricola per lucode
+PRODUCTION_LUCODE = {}
+PRODUCTION_LUCODE[1] = 0
+PRODUCTION_LUCODE[2] = 0.001053
+PRODUCTION_LUCODE[3] = 0
+PRODUCTION_LUCODE[4] = 0.003
+PRODUCTION_LUCODE[5] = 0.003
+PRODUCTION_LUCODE[6] = 0.002154
+PRODUCTION_LUCODE[7] = 0
+PRODUCTION_LUCODE[8] = 0
+PRODUCTION_LUCODE[9] = 0
+PRODUCTION_LUCODE[10] = 0
+PRODUCTION_LUCODE[11] = 0
+PRODUCTION_LUCODE[12] = 0
+PRODUCTION_LUCODE[13] = 0
+PRODUCTION_LUCODE[14] = 0
+PRODUCTION_LUCODE[15] = 0
+PRODUCTION_LUCODE[16] = 0
+PRODUCTION_LUCODE[17] = 0
+PRODUCTION_LUCODE[18] = 0
+PRODUCTION_LUCODE[19] = 0
+PRODUCTION_LUCODE[20] = 0
+PRODUCTION_LUCODE[21] = 0
+PRODUCTION_LUCODE[22] = 0
+PRODUCTION_LUCODE[23] = 0
+PRODUCTION_LUCODE[24] = 0
+PRODUCTION_LUCODE[25] = 0
+PRODUCTION_LUCODE[26] = 0
+PRODUCTION_LUCODE[27] = 0
+PRODUCTION_LUCODE[28] = 0
+PRODUCTION_LUCODE[29] = 0.001053
+PRODUCTION_LUCODE[30] = 0.001053
+PRODUCTION_LUCODE[31] = 0
+PRODUCTION_LUCODE[32] = 0
+PRODUCTION_LUCODE[33] = 0
+PRODUCTION_LUCODE[34] = 0
+PRODUCTION_LUCODE[35] = 0
+PRODUCTION_LUCODE[36] = 0
+PRODUCTION_LUCODE[37] = 0.00245
+PRODUCTION_LUCODE[38] = 0
+PRODUCTION_LUCODE[39] = 0
+PRODUCTION_LUCODE[40] = 0.00055
+PRODUCTION_LUCODE[41] = 0.0012
+PRODUCTION_LUCODE[42] = 0.004465
+PRODUCTION_LUCODE[43] = 0
+PRODUCTION_LUCODE[44] = 0
+PRODUCTION_LUCODE[45] = 0
+PRODUCTION_LUCODE[46] = 0
+PRODUCTION_LUCODE[47] = 0
+PRODUCTION_LUCODE[48] = 0
+PRODUCTION_LUCODE[49] = 0
+PRODUCTION_LUCODE[50] = 0
+PRODUCTION_LUCODE[51] = 0
+PRODUCTION_LUCODE[52] = 0
+PRODUCTION_LUCODE[53] = 0
+PRODUCTION_LUCODE[54] = 0
+PRODUCTION_LUCODE[55] = 0
+PRODUCTION_LUCODE[56] = 0
+PRODUCTION_LUCODE[57] = 0.002318
+PRODUCTION_LUCODE[58] = 0.002318
+PRODUCTION_LUCODE[59] = 0.00051
+PRODUCTION_LUCODE[60] = 0
+PRODUCTION_LUCODE[61] = 0
+PRODUCTION_LUCODE[62] = 0
+PRODUCTION_LUCODE[63] = 0
+PRODUCTION_LUCODE[64] = 0.0025
+PRODUCTION_LUCODE[65] = 0.000273
+PRODUCTION_LUCODE[66] = 0
+PRODUCTION_LUCODE[67] = 0
+PRODUCTION_LUCODE[68] = 0.0011
+PRODUCTION_LUCODE[69] = 0.0011
+PRODUCTION_LUCODE[70] = 0.0011
+PRODUCTION_LUCODE[71] = 0
+PRODUCTION_LUCODE[72] = 0
+PRODUCTION_LUCODE[73] = 0.000246
+PRODUCTION_LUCODE[74] = 0.001053
+PRODUCTION_LUCODE[75] = 0.001053
+PRODUCTION_LUCODE[76] = 0.0007
+PRODUCTION_LUCODE[77] = 0
+PRODUCTION_LUCODE[78] = 0
+PRODUCTION_LUCODE[79] = 0
+PRODUCTION_LUCODE[80] = 0
+PRODUCTION_LUCODE[81] = 0.002318
+PRODUCTION_LUCODE[82] = 0
+PRODUCTION_LUCODE[83] = 0
+PRODUCTION_LUCODE[84] = 0
+PRODUCTION_LUCODE[85] = 0
+PRODUCTION_LUCODE[86] = 0
+PRODUCTION_LUCODE[87] = 0
+
+PRODUCTION_TABLE = LucodeTable(PRODUCTION_LUCODE)
+
+
+class ProduzioneParameters(KernelParameters):
+    """
+    price_lucode is the {lucode: price (euro/ton)} dict of the crops, the
+    lucodes without a price have no value.
+    """
+
+    def __init__(self, pixel_res=2, price_lucode=None):
+        KernelParameters.__init__(self, pixel_res)
+        self.price_lucode = dict(price_lucode or {})
+        # Value of the production for each lucode with a price
+        value_lucode = {}
+        for lucode in PRODUCTION_LUCODE.keys():
+            if lucode in self.price_lucode.keys():
+                value_lucode[lucode] = self.price_lucode[lucode] * PRODUCTION_LUCODE[lucode]
+        if not value_lucode:
+            value_lucode[0] = 0.0
+        self.value_table = LucodeTable(value_lucode)
+
+
+def state_arrays(arr, params):
+    """
+    Returns the production and value rasters of a land use array.
+    """
+    arr_production = PRODUCTION_TABLE.take(PRODUCTION_TABLE.indices(arr)) * params.area_pixel
+    arr_value = params.value_table.take(params.value_table.indices(arr)) * params.area_pixel
+    return {'production': arr_production, 'value': arr_value}
+
+
+def state_stats(histogram, params):
+    """
+    Returns the report totals of a state from its LucodeHistogram.
+    """
+    return {
+        'production': PRODUCTION_TABLE.total(histogram) * params.area_pixel,
+        'value': params.value_table.total(histogram) * params.area_pixel,
+        'n_valid_pixel': PRODUCTION_TABLE.n_known(histogram),
+        'lucodes': histogram.lucodes(),
+        'unknown': PRODUCTION_TABLE.unknown_in(histogram)
+    }
+
+
+def delta_transitions(transitions, params):
+    """
+    Returns the production and value delta of every lucode transition.
+    """
+    return {
+        'production': transitions.delta(transitions.class_values(PRODUCTION_TABLE, params.area_pixel)),
+        'value': transitions.delta(transitions.class_values(params.value_table, params.area_pixel))
+    }
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Distance of the pixel centres from the nearest point of a point layer
+(e.g. the amenities of SE Benefici), given as pixel coordinates.
+
+The points are indexed in a KD-tree (scipy cKDTree) and the pixel
+centres are queried a block of rows at a time, with an upper bound on the
+distance so most queries stop early. Without scipy every point updates
+the pixels of its window of radius max_distance.
+"""
+
+import numpy as np
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# Rows of pixel centres of every KD-tree query
+CHUNK_ROWS = 128
+
+
+def nearest_distance(points, shape, pixel_res=2, max_distance=np.inf, chunk_rows=CHUNK_ROWS):
+    """
+    Returns the distance (m) of every pixel centre of a grid of the given
+    shape from the nearest of the (column, row) points, inf beyond
+    max_distance or without points.
+    """
+    rows, cols = shape
+    distances = np.full(shape, np.inf, dtype=np.float32)
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) == 0:
+        return distances
+    if cKDTree is not None:
+        tree = cKDTree(points * pixel_res)
+        x = (np.arange(cols) + 0.5) * pixel_res
+        for row_start in range(0, rows, chunk_rows):
+            row_end = min(rows, row_start + chunk_rows)
+            y = (np.arange(row_start, row_end) + 0.5) * pixel_res
+            centres = np.column_stack([np.tile(x, row_end - row_start), np.repeat(y, cols)])
+            d, _ = tree.query(centres, distance_upper_bound=max_distance)
+            distances[row_start:row_end] = d.reshape(row_end - row_start, cols)
+        return distances
+    radius = int(np.ceil(max_distance / pixel_res)) if np.isfinite(max_distance) else max(rows, cols)
+    for col, row in points:
+        row_start = max(0, int(np.floor(row)) - radius)
+        row_end = min(rows, int(np.floor(row)) + radius + 1)
+        col_start = max(0, int(np.floor(col)) - radius)
+        col_end = min(cols, int(np.floor(col)) + radius + 1)
+        if row_start >= row_end or col_start >= col_end:
+            continue
+        dy = (np.arange(row_start, row_end) + 0.5 - row) * pixel_res
+        dx = (np.arange(col_start, col_end) + 0.5 - col) * pixel_res
+        d = np.sqrt(dy[:, np.newaxis] ** 2 + dx[np.newaxis, :] ** 2)
+        d[d > max_distance] = np.inf
+        window = distances[row_start:row_end, col_start:col_end]
+        np.minimum(window, d, out=window)
+    return distances
+
+
+def within(points, shape, pixel_res=2, max_distance=100):
+    """
+    Returns True on the pixels whose centre is within max_distance (m) of
+    one of the points.
+    """
+    return np.isfinite(nearest_distance(points, shape, pixel_res, max_distance))
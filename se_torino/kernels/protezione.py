@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Protezione idrogeologica: rain retained by every lucode with the SCS curve
+number method.
+"""
+
+from se_torino.kernels import KernelParameters
+from se_torino.lookup import LucodeTable
+
+# Curve number of each lucode for the hydrologic groups A, B, C, D
+CN_LUCODE = {}
+CN_LUCODE[1] = [64, 76, 84, 88]
+CN_LUCODE[2] = [64, 76, 84, 88]
+CN_LUCODE[3] = [71, 81, 87, 90]
+CN_LUCODE[4] = [57, 70, 78, 82]
+CN_LUCODE[5] = [57, 70, 78, 82]
+CN_LUCODE[6] = [30, 58, 70, 77]
+CN_LUCODE[7] = [83, 89, 92, 93]
+CN_LUCODE[8] = [98, 98, 98, 98]
+CN_LUCODE[9] = [43, 65, 76, 82]
+CN_LUCODE[10] = [43, 65, 76, 82]
+CN_LUCODE[11] = [98, 98, 98, 98]
+CN_LUCODE[12] = [72, 82, 87, 89]
+CN_LUCODE[13] = [98, 98, 98, 98]
+CN_LUCODE[14] = [72, 82, 87, 89]
+CN_LUCODE[15] = [98, 98, 98, 98]
+CN_LUCODE[16] = [72, 82, 87, 89]
+CN_LUCODE[17] = [43, 65, 76, 82]
+CN_LUCODE[18] = [98, 98, 98, 98]
+CN_LUCODE[19] = [77, 86, 91, 94]
+CN_LUCODE[20] = [98, 98, 98, 98]
+CN_LUCODE[21] = [43, 61, 76, 82]
+CN_LUCODE[22] = [43, 61, 76, 82]
+CN_LUCODE[23] = [74, 84, 88, 90]
+CN_LUCODE[24] = [74, 84, 88, 90]
+CN_LUCODE[25] = [98, 98, 98, 98]
+CN_LUCODE[26] = [49, 69, 79, 84]
+CN_LUCODE[27] = [49, 69, 79, 84]
+CN_LUCODE[28] = [100, 100, 100, 100]
+CN_LUCODE[29] = [60, 72, 81, 84]
+CN_LUCODE[30] = [60, 72, 81, 84]
+CN_LUCODE[31] = [100, 100, 100, 100]
+CN_LUCODE[32] = [68, 79, 86, 89]
+CN_LUCODE[33] = [68, 79, 86, 89]
+CN_LUCODE[34] = [50, 70, 80, 85]
+CN_LUCODE[35] = [81, 88, 91, 93]
+CN_LUCODE[36] = [60, 74, 83, 87]
+CN_LUCODE[37] = [57, 70, 78, 82]
+CN_LUCODE[38] = [73, 83, 88, 91]
+CN_LUCODE[39] = [73, 83, 88, 91]
+CN_LUCODE[40] = [64, 76, 84, 88]
+CN_LUCODE[41] = [64, 76, 84, 88]
+CN_LUCODE[42] = [64, 76, 84, 88]
+CN_LUCODE[43] = [77, 85, 90, 92]
+CN_LUCODE[44] = [98, 98, 98, 98]
+CN_LUCODE[45] = [100, 100, 100, 100]
+CN_LUCODE[46] = [98, 98, 98, 98]
+CN_LUCODE[47] = [98, 98, 98, 98]
+CN_LUCODE[48] = [77, 85, 90, 92]
+CN_LUCODE[49] = [77, 85, 90, 92]
+CN_LUCODE[50] = [98, 98, 98, 98]
+CN_LUCODE[51] = [98, 98, 98, 98]
+CN_LUCODE[52] = [98, 98, 98, 98]
+CN_LUCODE[53] = [77, 85, 90, 92]
+CN_LUCODE[54] = [77, 85, 90, 92]
+CN_LUCODE[55] = [98, 98, 98, 98]
+CN_LUCODE[56] = [98, 98, 98, 98]
+CN_LUCODE[57] = [0, 72, 81, 84]
+CN_LUCODE[58] = [0, 72, 81, 84]
+CN_LUCODE[59] = [64, 76, 84, 88]
+CN_LUCODE[60] = [98, 98, 98, 98]
+CN_LUCODE[61] = [35, 56, 70, 77]
+CN_LUCODE[62] = [35, 56, 70, 77]
+CN_LUCODE[63] = [35, 56, 70, 77]
+CN_LUCODE[64] = [60, 72, 81, 84]
+CN_LUCODE[65] = [60, 72, 81, 84]
+CN_LUCODE[66] = [98, 98, 98, 98]
+CN_LUCODE[67] = [98, 98, 98, 98]
+CN_LUCODE[68] = [30, 58, 70, 77]
+CN_LUCODE[69] = [35, 56, 70, 77]
+CN_LUCODE[70] = [35, 56, 70, 77]
+CN_LUCODE[71] = [77, 85, 90, 92]
+CN_LUCODE[72] = [98, 98, 98, 98]
+CN_LUCODE[73] = [64, 76, 84, 88]
+CN_LUCODE[74] = [64, 76, 84, 88]
+CN_LUCODE[75] = [64, 76, 84, 88]
+CN_LUCODE[76] = [64, 76, 84, 88]
+CN_LUCODE[77] = [98, 98, 98, 98]
+CN_LUCODE[78] = [100, 100, 100, 100]
+CN_LUCODE[79] = [77, 86, 91, 94]
+CN_LUCODE[80] = [92, 92, 92, 92]
+CN_LUCODE[81] = [92, 92, 92, 92]
+CN_LUCODE[82] = [40, 63, 75, 81]
+CN_LUCODE[83] = [36, 60, 73, 79]
+CN_LUCODE[84] = [36, 60, 73, 79]
+CN_LUCODE[85] = [45, 66, 77, 83]
+CN_LUCODE[86] = [45, 66, 77, 83]
+CN_LUCODE[87] = [36, 60, 73, 79]
+
+# Value euro per cubic meter
+VALUE_COEFF = 300
+
+
+class ProtezioneParameters(KernelParameters):
+    """
+    rain_tot is the rainfall of the event (mm), gruppo_id the hydrologic
+    soil group (0 ... 3 for A ... D). Pn_table and Pe_table hold the net
+    and effective rain of each lucode.
+    """
+
+    def __init__(self, pixel_res=2, rain_tot=50.0, gruppo_id=0):
+        KernelParameters.__init__(self, pixel_res)
+        self.rain_tot = rain_tot
+        self.gruppo_id = gruppo_id
+        # Net and effective rain for each lucode of the hydrologic group
+        Pn_lucode = {}
+        Pe_lucode = {}
+        for lucode in CN_LUCODE.keys():
+            try:
+                S = (25400 / CN_LUCODE[lucode][gruppo_id]) - 254
+                IA = S / 10
+                Pn = rain_tot - IA
+                Pe_lucode[lucode] = (Pn ** 2) / (Pn + S)
+                Pn_lucode[lucode] = Pn
+            except ZeroDivisionError:
+                pass
+        # Both tables have the same lucodes, so they share the indices
+        self.Pn_table = LucodeTable(Pn_lucode)
+        self.Pe_table = LucodeTable(Pe_lucode)
+
+
+def state_arrays(arr, params):
+    """
+    Returns the net rain, effective rain and value rasters of a land use
+    array.
+    """
+    idx = params.Pn_table.indices(arr)
+    arr_Pn = params.Pn_table.take(idx)
+    arr_Pe = params.Pe_table.take(idx)
+    # Convert to squared meters and assign value
+    arr_value = VALUE_COEFF * ((arr_Pn - arr_Pe) / 1000) * params.area_pixel
+    return {'Pn': arr_Pn, 'Pe': arr_Pe, 'value': arr_value}
+
+
+def state_stats(histogram, params):
+    """
+    Returns the report totals of a state from its LucodeHistogram: the
+    retained rain (mm summed over the pixels and mc) and its value.
+    """
+    retained = params.Pn_table.total(histogram) - params.Pe_table.total(histogram)
+    volume = retained / 1000 * params.area_pixel
+    return {
+        'retained': retained,
+        'volume': volume,
+        'value': VALUE_COEFF * volume,
+        'lucodes': histogram.lucodes(),
+        'unknown': params.Pn_table.unknown_in(histogram)
+    }
+
+
+def delta_transitions(transitions, params):
+    """
+    Returns the retained rain (mm summed over the pixels) and value delta
+    of every lucode transition.
+    """
+    retained = transitions.class_values(params.Pn_table) - transitions.class_values(params.Pe_table)
+    value = VALUE_COEFF * retained / 1000 * params.area_pixel
+    return {'retained': transitions.delta(retained), 'value': transitions.delta(value)}
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Regolazione della temperatura: heat mitigation of every lucode.
+"""
+
+from se_torino.kernels import KernelParameters
+from se_torino.lookup import LucodeTable
+
+# HM dictionary
+HM_LUCODE = {}
+HM_LUCODE[1] = 4.62718336
+HM_LUCODE[2] = 3.83420036
+HM_LUCODE[3] = 0.4823722
+HM_LUCODE[4] = 4.42937216
+HM_LUCODE[5] = 4.93675407
+HM_LUCODE[6] = 4.15857601
+HM_LUCODE[7] = 3.03540913
+HM_LUCODE[8] = 0.86425104
+HM_LUCODE[9] = 2.82585889
+HM_LUCODE[10] = 1.91524496
+HM_LUCODE[11] = 0.67386976
+HM_LUCODE[12] = 1.85691874
+HM_LUCODE[13] = 0.57390328
+HM_LUCODE[14] = 2.44235093
+HM_LUCODE[15] = 0.78460174
+HM_LUCODE[16] = 2.25657445
+HM_LUCODE[17] = 2.00661297
+HM_LUCODE[18] = 1.11856046
+HM_LUCODE[19] = 2.96848245
+HM_LUCODE[20] = 0.51584438
+HM_LUCODE[21] = 3.66727253
+HM_LUCODE[22] = 2.15298825
+HM_LUCODE[23] = 2.79566511
+HM_LUCODE[24] = 3.28726693
+HM_LUCODE[25] = 1.11711756
+HM_LUCODE[26] = 2.74429667
+HM_LUCODE[27] = 2.11703174
+HM_LUCODE[28] = 3.31600525
+HM_LUCODE[29] = 4.1666852
+HM_LUCODE[30] = 4.14721283
+HM_LUCODE[31] = 2.22970933
+HM_LUCODE[32] = 0.8684379
+HM_LUCODE[33] = 0.95477925
+HM_LUCODE[34] = 3.57055523
+HM_LUCODE[35] = 0.21495761
+HM_LUCODE[36] = 0.38677367
+HM_LUCODE[37] = 5.20694318
+HM_LUCODE[38] = 3.81729612
+HM_LUCODE[39] = 3.3219752
+HM_LUCODE[40] = 4.45037633
+HM_LUCODE[41] = 4.73611724
+HM_LUCODE[42] = 4.30607209
+HM_LUCODE[43] = 2.13796834
+HM_LUCODE[44] = 1.81924634
+HM_LUCODE[45] = 2.48564168
+HM_LUCODE[46] = 1.07186001
+HM_LUCODE[47] = 0.53461912
+HM_LUCODE[48] = 1.95442937
+HM_LUCODE[49] = 1.11875979
+HM_LUCODE[50] = 1.1334159
+HM_LUCODE[51] = 0.91150442
+HM_LUCODE[52] = 1.95317116
+HM_LUCODE[53] = 3.5382051
+HM_LUCODE[54] = 3.30428226
+HM_LUCODE[55] = 1.92616705
+HM_LUCODE[56] = 0.39094275
+HM_LUCODE[57] = 2.41044505
+HM_LUCODE[58] = 3.20739734
+HM_LUCODE[59] = 4.38517119
+HM_LUCODE[60] = 0.64614399
+HM_LUCODE[61] = 4.16470902
+HM_LUCODE[62] = 4.29626227
+HM_LUCODE[63] = 4.28313385
+HM_LUCODE[64] = 4.45815007
+HM_LUCODE[65] = 3.35787101
+HM_LUCODE[66] = 1.57321618
+HM_LUCODE[67] = 1.99595624
+HM_LUCODE[68] = 3.06093165
+HM_LUCODE[69] = 4.0867662
+HM_LUCODE[70] = 4.37100281
+HM_LUCODE[71] = 2.09081137
+HM_LUCODE[72] = 0.84961896
+HM_LUCODE[73] = 4.6212141
+HM_LUCODE[74] = 4.92998582
+HM_LUCODE[75] = 3.88542519
+HM_LUCODE[76] = 5.09573919
+HM_LUCODE[77] = 2.57326408
+HM_LUCODE[78] = 2.31943221
+HM_LUCODE[79] = 2.1070807
+HM_LUCODE[80] = 4.42278093
+HM_LUCODE[81] = 3.59365177
+HM_LUCODE[82] = 4.43509066
+HM_LUCODE[83] = 5.37128195
+HM_LUCODE[84] = 5.01703229
+HM_LUCODE[85] = 5.24431647
+HM_LUCODE[86] = 5.16957513
+HM_LUCODE[87] = 4.71936258
+
+HM_TABLE = LucodeTable(HM_LUCODE)
+
+# Value euro of the heat mitigation
+VALUE_COEFF = 1.6 * 0.1
+
+
+class TemperaturaParameters(KernelParameters):
+    pass
+
+
+def state_arrays(arr, params):
+    """
+    Returns the heat mitigation and value rasters of a land use array.
+    """
+    arr_HM = HM_TABLE.take(HM_TABLE.indices(arr))
+    arr_HM *= params.area_pixel
+    return {'HM': arr_HM, 'value': arr_HM * VALUE_COEFF}
+
+
+def state_stats(histogram, params):
+    """
+    Returns the report totals of a state from its LucodeHistogram.
+    """
+    HM_tot = HM_TABLE.total(histogram) * params.area_pixel
+    return {'HM': HM_tot, 'value': HM_tot * VALUE_COEFF, 'unknown': HM_TABLE.unknown_in(histogram)}
+
+
+def delta_transitions(transitions, params):
+    """
+    Returns the heat mitigation and value delta of every lucode transition.
+    """
+    HM_values = transitions.class_values(HM_TABLE, params.area_pixel)
+    return {'HM': transitions.delta(HM_values), 'value': transitions.delta(HM_values * VALUE_COEFF)}
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Lookup of the per-lucode tables (H_score_lucode, value_lucode, c_soil, ...)
+on land use rasters.
+"""
+
+import copy
+
+import numpy as np
+
+
+class LucodeTable(object):
+    """
+    Dense version of a {lucode: value} table, stored as a NumPy array
+    indexed by lucode. A land use raster is mapped to the table values with
+    a single gather, instead of one np.where pass per lucode.
+
+    The last slot of the array holds the default value and is used for the
+    pixels whose lucode is not in the table.
+    """
+
+    def __init__(self, table, default=0.0):
+        n_slots = int(max(table.keys())) + 2
+        self.default = default
+        self.values = np.full(n_slots, default, dtype=np.float64)
+        self.known = np.zeros(n_slots, dtype=bool)
+        for lucode, value in table.items():
+            self.values[int(lucode)] = value
+            self.known[int(lucode)] = True
+        self.unknown_slot = n_slots - 1
+        if n_slots <= 256:
+            self.index_dtype = np.uint8
+        else:
+            self.index_dtype = np.intp
+
+    def indices(self, arr):
+        """
+        Returns the slot of every pixel of a lucode raster. Lucodes that are
+        negative, not integer or not in the table point to the unknown slot.
+        """
+        arr = np.asarray(arr)
+        valid = (arr >= 0) & (arr < self.unknown_slot)
+        if arr.dtype.kind == 'f':
+            valid &= (arr == np.floor(arr))
+        idx = np.where(valid, arr, self.unknown_slot).astype(self.index_dtype)
+        idx[~self.known[idx]] = self.unknown_slot
+        return idx
+
+    def take(self, idx):
+        """
+        Returns the table values for the slots computed by indices().
+        """
+        return self.values[idx]
+
+    def known_mask(self, idx):
+        """
+        Returns True for the pixels whose lucode is in the table.
+        """
+        return idx != self.unknown_slot
+
+    def unknown(self, arr, idx):
+        """
+        Returns a {lucode: n_pixel} dict of the lucodes not found in the table.
+        """
+        unknown_pixels = idx == self.unknown_slot
+        if not np.any(unknown_pixels):
+            return {}
+        lucodes, counts = np.unique(np.asarray(arr)[unknown_pixels], return_counts=True)
+        return dict(zip(lucodes.tolist(), counts.tolist()))
+
+    def map(self, arr):
+        """
+        Maps a lucode raster to the table values in one gather pass.
+        Returns the mapped array and the {lucode: n_pixel} dict of the
+        lucodes not found in the table.
+        """
+        idx = self.indices(arr)
+        return self.take(idx), self.unknown(arr, idx)
+
+    def scaled(self, scale):
+        """
+        Returns a copy of the table with every value, the default included,
+        multiplied by scale. The copy has the same lucodes, so it can take
+        the indices computed by this table.
+        """
+        table = copy.copy(self)
+        table.values = self.values * scale
+        table.default = self.default * scale
+        return table
+
+    def total(self, histogram):
+        """
+        Returns the sum of the table values over all the pixels counted in a
+        LucodeHistogram, as a dot product of class counts and values.
+        Lucodes not in the table count as the default value.
+        """
+        n = min(len(histogram.counts), len(self.values) - 1)
+        known_total = np.dot(histogram.counts[:n], np.where(self.known[:n], self.values[:n], 0.0))
+        n_unknown = histogram.n_pixel - self.n_known(histogram)
+        return float(known_total + n_unknown * self.default)
+
+    def n_known(self, histogram):
+        """
+        Returns the number of pixels counted in a LucodeHistogram whose lucode
+        is in the table.
+        """
+        n = min(len(histogram.counts), len(self.values) - 1)
+        return int(np.dot(histogram.counts[:n], self.known[:n]))
+
+    def unknown_in(self, histogram):
+        """
+        Returns the {lucode: n_pixel} dict of the lucodes of a LucodeHistogram
+        that are not in the table.
+        """
+        unknown = dict(histogram.other)
+        for lucode in np.flatnonzero(histogram.counts):
+            if lucode >= len(self.known) - 1 or not self.known[lucode]:
+                unknown[int(lucode)] = int(histogram.counts[lucode])
+        return unknown
+
+
+class LucodeHistogram(object):
+    """
+    Number of pixels of every lucode of a land use raster, computed with a
+    single bincount pass. Report totals only depend on these counts, so
+    they are computed in O(classes) with LucodeTable.total().
+
+    The histogram can be accumulated window by window with update().
+    Integer lucodes in [0, n_lucodes) are counted in the counts array,
+    the other values in the other dict.
+    """
+
+    def __init__(self, arr=None, n_lucodes=256):
+        self.counts = np.zeros(n_lucodes, dtype=np.int64)
+        self.other = {}
+        self.dtype = None
+        if arr is not None:
+            self.update(arr)
+
+    @property
+    def n_pixel(self):
+        return int(np.sum(self.counts)) + sum(self.other.values())
+
+    def update(self, arr):
+        """
+        Adds the pixels of arr to the histogram.
+        """
+        arr = np.asarray(arr)
+        if self.dtype is None:
+            self.dtype = arr.dtype
+        n_lucodes = len(self.counts)
+        valid = (arr >= 0) & (arr < n_lucodes)
+        if arr.dtype.kind == 'f':
+            valid &= (arr == np.floor(arr))
+        idx = np.where(valid, arr, 0).astype(np.intp)
+        idx[~valid] = n_lucodes
+        counts = np.bincount(idx.ravel(), minlength=n_lucodes + 1)
+        self.counts += counts[:n_lucodes]
+        if counts[n_lucodes] > 0:
+            values, other_counts = np.unique(arr[~valid], return_counts=True)
+            for value, count in zip(values.tolist(), other_counts.tolist()):
+                self.other[value] = self.other.get(value, 0) + count
+        return self
+
+    def lucodes(self):
+        """
+        Returns the sorted array of the distinct values of the raster, as
+        np.unique() would on the raster itself.
+        """
+        values = sorted(np.flatnonzero(self.counts).tolist() + list(self.other.keys()))
+        return np.array(values, dtype=self.dtype)
+
+
+def describe_unknown(unknown):
+    """
+    Formats the {lucode: n_pixel} dict returned by LucodeTable.map().
+    """
+    return ', '.join('%g (%i pixel)' % (lucode, n_pixel) for lucode, n_pixel in sorted(unknown.items()))
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Concurrent execution of the independent parts of an algorithm.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+def map_states(function, states):
+    """
+    Calls function on every item of states (e.g. the present and the
+    future raster) on a thread pool, one thread per item, and returns the
+    results in the same order.
+
+    GDAL reads and the NumPy kernels release the GIL, so independent states
+    run in parallel. Exceptions raised by function are raised again here.
+    Parameters must be read from the Processing context before the call:
+    function must not use the context or the feedback object.
+    """
+    states = list(states)
+    if len(states) < 2:
+        return [function(state) for state in states]
+    with ThreadPoolExecutor(max_workers=len(states)) as executor:
+        return list(executor.map(function, states))
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Processing parameters shared by the SE Torino algorithms.
+"""
+
+import os
+
+import numpy as np
+from qgis.core import (NULL,
+                       QgsProcessing,
+                       QgsProcessingException,
+                       QgsProcessingParameterDefinition,
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterRasterLayer)
+
+from se_torino.raster import OutputProfile
+from se_torino.species import CATALOGUE
+from se_torino.threats import FeatureLayer, split_layer_uri
+
+FORMATO_DATI = 'FORMATO_DATI'
+COMPRESSIONE = 'COMPRESSIONE'
+TILED = 'TILED'
+DIM_BLOCCO = 'DIM_BLOCCO'
+BIGTIFF = 'BIGTIFF'
+COG = 'COG'
+TABELLA_SPECIE = 'TABELLA_SPECIE'
+INPUT_FUTURO = 'INPUT_FUTURO'
+DELTA = 'DELTA'
+
+# Phase of the Calcolo algorithms that computes both states
+BOTH_PHASES = 2
+
+# Fields of the species tables
+SPECIES_FIELD = 'Specie'
+COUNT_FIELD = 'Esemplari'
+
+
+def _add_advanced(algorithm, parameter):
+    parameter.setFlags(parameter.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+    algorithm.addParameter(parameter)
+
+
+def add_output_profile_parameters(algorithm):
+    """
+    Adds the output raster format parameters to an algorithm, among the
+    advanced parameters.
+    """
+    _add_advanced(
+        algorithm,
+        QgsProcessingParameterEnum(
+            FORMATO_DATI,
+            algorithm.tr('Formato dati raster in output'),
+            options=OutputProfile.DTYPES,
+            defaultValue=0
+        )
+    )
+    _add_advanced(
+        algorithm,
+        QgsProcessingParameterEnum(
+            COMPRESSIONE,
+            algorithm.tr('Compressione raster in output'),
+            options=[algorithm.tr('Nessuna'), 'DEFLATE', 'ZSTD', 'LZW'],
+            defaultValue=1
+        )
+    )
+    _add_advanced(
+        algorithm,
+        QgsProcessingParameterBoolean(
+            TILED,
+            algorithm.tr('Raster in output a tile'),
+            defaultValue=True
+        )
+    )
+    _add_advanced(
+        algorithm,
+        QgsProcessingParameterNumber(
+            DIM_BLOCCO,
+            algorithm.tr('Dimensione tile (pixel, multiplo di 16)'),
+            QgsProcessingParameterNumber.Integer,
+            256,
+            minValue=16
+        )
+    )
+    _add_advanced(
+        algorithm,
+        QgsProcessingParameterBoolean(
+            BIGTIFF,
+            algorithm.tr('Forza BigTIFF'),
+            defaultValue=False
+        )
+    )
+    _add_advanced(
+        algorithm,
+        QgsProcessingParameterBoolean(
+            COG,
+            algorithm.tr('Cloud Optimized GeoTIFF (COG)'),
+            defaultValue=False
+        )
+    )
+
+
+def output_profile(algorithm, parameters, context):
+    """
+    Returns the OutputProfile selected with the parameters added by
+    add_output_profile_parameters().
+    """
+    block_size = algorithm.parameterAsInt(parameters, DIM_BLOCCO, context)
+    tiled = algorithm.parameterAsBool(parameters, TILED, context) or algorithm.parameterAsBool(parameters, COG, context)
+    if tiled and block_size % 16 != 0:
+        raise QgsProcessingException(
+            algorithm.tr('La dimensione tile deve essere un multiplo di 16 pixel: %i') % block_size)
+    return OutputProfile(
+        dtype=OutputProfile.DTYPES[algorithm.parameterAsEnum(parameters, FORMATO_DATI, context)],
+        compress=OutputProfile.COMPRESSIONS[algorithm.parameterAsEnum(parameters, COMPRESSIONE, context)],
+        tiled=algorithm.parameterAsBool(parameters, TILED, context),
+        block_size=block_size,
+        bigtiff=algorithm.parameterAsBool(parameters, BIGTIFF, context),
+        cog=algorithm.parameterAsBool(parameters, COG, context)
+    )
+
+
+def output_profile_values(algorithm, parameters, context):
+    """
+    Returns the values of the output raster format parameters, to pass
+    them on to another SE algorithm.
+    """
+    return {
+        FORMATO_DATI: algorithm.parameterAsEnum(parameters, FORMATO_DATI, context),
+        COMPRESSIONE: algorithm.parameterAsEnum(parameters, COMPRESSIONE, context),
+        TILED: algorithm.parameterAsBool(parameters, TILED, context),
+        DIM_BLOCCO: algorithm.parameterAsInt(parameters, DIM_BLOCCO, context),
+        BIGTIFF: algorithm.parameterAsBool(parameters, BIGTIFF, context),
+        COG: algorithm.parameterAsBool(parameters, COG, context)
+    }
+
+
+def add_species_table_parameter(algorithm):
+    """
+    Adds the optional species table of the Calcolo algorithms, a CSV or a
+    layer with one row per species and the fields SPECIES_FIELD and
+    COUNT_FIELD.
+    """
+    algorithm.addParameter(
+        QgsProcessingParameterFeatureSource(
+            TABELLA_SPECIE,
+            algorithm.tr('Tabella specie (CSV o layer con i campi %s e %s, opzionale)') % (SPECIES_FIELD, COUNT_FIELD),
+            [QgsProcessing.TypeVector],
+            optional=True
+        )
+    )
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def species_counts(algorithm, parameters, context, slots, catalogue=CATALOGUE):
+    """
+    Returns the number of trees of every species of the catalogue, from the
+    (species, exemplars) parameter pairs of slots and from the rows of the
+    species table, and the {name: n_rows} dict of the species of the table
+    not found in the catalogue.
+    """
+    ids = [algorithm.parameterAsInt(parameters, species, context) for species, _ in slots]
+    counts = [algorithm.parameterAsInt(parameters, exemplars, context) for _, exemplars in slots]
+    names = []
+    source = algorithm.parameterAsSource(parameters, TABELLA_SPECIE, context)
+    if source is not None:
+        field_names = source.fields().names()
+        for field in [SPECIES_FIELD, COUNT_FIELD]:
+            if field not in field_names:
+                raise QgsProcessingException(algorithm.tr('Campo %s mancante nella tabella specie') % field)
+        for feature in source.getFeatures():
+            names.append(str(feature[SPECIES_FIELD]))
+            counts.append(_number(feature[COUNT_FIELD]))
+    if not names:
+        return catalogue.species_counts(ids, counts), {}
+    table_ids = catalogue.ids(names)
+    return (catalogue.species_counts(np.concatenate([ids, table_ids]), counts),
+            catalogue.unknown(names, table_ids))
+
+
+def add_both_phases_parameters(algorithm):
+    """
+    Adds the future land use raster and the delta option of the Calcolo
+    algorithms, used when their phase is BOTH_PHASES.
+    """
+    algorithm.addParameter(
+        QgsProcessingParameterRasterLayer(
+            INPUT_FUTURO,
+            algorithm.tr('Raster Uso suolo Stato di progetto (solo per entrambi gli stati)'),
+            [QgsProcessing.TypeRaster],
+            optional=True
+        )
+    )
+    algorithm.addParameter(
+        QgsProcessingParameterBoolean(
+            DELTA,
+            algorithm.tr('Scrivi anche il raster differenza (solo per entrambi gli stati)'),
+            defaultValue=False
+        )
+    )
+
+
+def phase_states(algorithm, parameters, context, phase_parameter, input_parameter):
+    """
+    Returns the (phase, land use raster URI) pairs of the states to compute:
+    the state of the selected phase on the input raster, or with BOTH_PHASES
+    the present state on the input raster and the future state on the
+    INPUT_FUTURO raster.
+    """
+    phase = algorithm.parameterAsEnum(parameters, phase_parameter, context)
+    uri = algorithm.parameterAsRasterLayer(parameters, input_parameter, context).dataProvider().dataSourceUri()
+    if phase != BOTH_PHASES:
+        return [(phase, uri)]
+    future_raster = algorithm.parameterAsRasterLayer(parameters, INPUT_FUTURO, context)
+    if future_raster is None:
+        raise QgsProcessingException(
+            algorithm.tr('Per entrambi gli stati indicare il raster Uso suolo Stato di progetto'))
+    return [(0, uri), (1, future_raster.dataProvider().dataSourceUri())]
+
+
+def vector_layer_source(layer):
+    """
+    Returns the source of a vector layer for the se_torino.threats readers:
+    the layer URI when OGR can open it as it is (a file of the ogr provider
+    without a subset filter), otherwise a FeatureLayer copy of the features
+    QGIS returns, e.g. for memory, PostGIS or WFS layers. None when layer is
+    None.
+    """
+    if layer is None:
+        return None
+    uri = layer.source()
+    if layer.providerType() == 'ogr' and not layer.subsetString() and os.path.isfile(split_layer_uri(uri)[0]):
+        return uri
+    fields = [field.name() for field in layer.fields()]
+    features = [(bytes(feature.geometry().asWkb()), [None if value == NULL else value for value in feature.attributes()])
+                for feature in layer.getFeatures() if feature.hasGeometry()]
+    return FeatureLayer(layer.name(), uri, features, fields)
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Raster input/output helpers shared by the SE Torino algorithms.
+"""
+
+import os
+import uuid
+import numpy as np
+try:
+    from osgeo import gdal
+except ImportError:
+    import gdal
+
+from se_torino.lookup import LucodeHistogram
+from se_torino.transition import N_LUCODES, TransitionMatrix
+
+# Minimum number of pixels read at once when walking a raster by windows.
+# Striped GeoTIFFs have one-row native blocks, so small native blocks are
+# grouped together until a window holds at least this many pixels.
+MIN_WINDOW_PIXELS = 1024 * 1024
+
+
+def iter_windows(band, min_pixels=MIN_WINDOW_PIXELS):
+    """
+    Yields the (xoff, yoff, xsize, ysize) windows covering the whole band.
+    Windows follow the GDAL native block size of the band; when native
+    blocks are smaller than min_pixels, full-width rows of blocks are
+    grouped together.
+    """
+    cols = band.XSize
+    rows = band.YSize
+    block_x, block_y = band.GetBlockSize()
+    if block_x * block_y < min_pixels:
+        block_x = cols
+        block_y = block_y * max(1, -(-min_pixels // (cols * block_y)))
+    block_x = min(block_x, cols)
+    block_y = min(block_y, rows)
+    for yoff in range(0, rows, block_y):
+        ysize = min(block_y, rows - yoff)
+        for xoff in range(0, cols, block_x):
+            xsize = min(block_x, cols - xoff)
+            yield xoff, yoff, xsize, ysize
+
+
+def sum_rasters(sources, target_band, windowed=True, feedback=None):
+    """
+    Sums the first band of every source dataset into target_band.
+    With windowed=True the rasters are walked window by window, so memory
+    depends on the block size and not on the raster size; otherwise the
+    whole raster is read at once.
+    Returns the sum of all the output pixels.
+    """
+    first_band = sources[0].GetRasterBand(1)
+    if windowed:
+        windows = list(iter_windows(first_band))
+    else:
+        windows = [(0, 0, first_band.XSize, first_band.YSize)]
+    total = 0.0
+    for window_id, (xoff, yoff, xsize, ysize) in enumerate(windows):
+        if feedback is not None and feedback.isCanceled():
+            break
+        arr_block = np.zeros((ysize, xsize))
+        for source in sources:
+            arr_block += source.GetRasterBand(1).ReadAsArray(xoff, yoff, xsize, ysize)
+        target_band.WriteArray(arr_block, xoff, yoff)
+        total += np.sum(arr_block)
+        if feedback is not None:
+            feedback.setProgress(100.0 * (window_id + 1) / len(windows))
+    return total
+
+
+def load_raster(uri):
+    """
+    Opens the raster at uri and reads its first band.
+    Returns the GDAL dataset and the band array.
+    """
+    ds = gdal.Open(uri)
+    if ds is None:
+        raise IOError('Unable to open the raster %s' % uri)
+    return ds, ds.GetRasterBand(1).ReadAsArray()
+
+
+class OutputProfile(object):
+    """
+    Data type and GeoTIFF creation options of the output rasters.
+
+    dtype is 'Float32' or 'Float64'; compress is None, 'DEFLATE', 'ZSTD'
+    or 'LZW' and is always used with the floating point predictor. With
+    cog=True the rasters are written as Cloud Optimized GeoTIFF.
+    """
+
+    DTYPES = ['Float32', 'Float64']
+    COMPRESSIONS = [None, 'DEFLATE', 'ZSTD', 'LZW']
+
+    def __init__(self, dtype='Float32', compress='DEFLATE', tiled=True, block_size=256, bigtiff=False,
+                 cog=False):
+        if dtype not in self.DTYPES:
+            raise ValueError('Unsupported output data type: %s' % dtype)
+        if compress not in self.COMPRESSIONS:
+            raise ValueError('Unsupported compression: %s' % compress)
+        if tiled and block_size % 16 != 0:
+            raise ValueError('The block size must be a multiple of 16: %i' % block_size)
+        self.dtype = dtype
+        self.compress = compress
+        self.tiled = tiled
+        self.block_size = block_size
+        self.bigtiff = bigtiff
+        self.cog = cog
+
+    @property
+    def gdal_type(self):
+        return gdal.GetDataTypeByName(self.dtype)
+
+    def for_memory(self):
+        """
+        Returns the profile of the intermediate rasters kept in /vsimem/:
+        same data type, no compression and no COG layout.
+        """
+        return OutputProfile(dtype=self.dtype, compress=None, tiled=self.tiled, block_size=self.block_size,
+                             bigtiff=self.bigtiff, cog=False)
+
+    def gtiff_options(self):
+        """
+        Returns the creation options of the GTiff driver.
+        """
+        options = []
+        if self.tiled:
+            options += ['TILED=YES', 'BLOCKXSIZE=%i' % self.block_size, 'BLOCKYSIZE=%i' % self.block_size]
+        if self.compress is not None:
+            options += ['COMPRESS=%s' % self.compress, 'PREDICTOR=3']
+        if self.bigtiff:
+            options.append('BIGTIFF=YES')
+        else:
+            options.append('BIGTIFF=IF_SAFER')
+        return options
+
+    def cog_options(self):
+        """
+        Returns the creation options of the COG driver.
+        """
+        options = ['BLOCKSIZE=%i' % self.block_size]
+        if self.compress is not None:
+            options += ['COMPRESS=%s' % self.compress, 'PREDICTOR=FLOATING_POINT']
+        else:
+            options.append('COMPRESS=NONE')
+        if self.bigtiff:
+            options.append('BIGTIFF=YES')
+        else:
+            options.append('BIGTIFF=IF_SAFER')
+        return options
+
+
+class RasterWriter(object):
+    """
+    Output raster with the same georeferencing as a reference dataset,
+    created according to an OutputProfile, with a single band unless
+    bands is given.
+
+    The bands can be written all at once or window by window; `band` is
+    the first band. close() flushes the raster to disk. COG files cannot be
+    written in place, so they are built as a compressed, tiled GTiff on
+    disk next to the destination and copied to the COG layout by close(),
+    which then deletes the temporary file.
+    """
+
+    def __init__(self, path, cols, rows, reference, profile=None, bands=1):
+        if profile is None:
+            profile = OutputProfile()
+        self.path = path
+        self.profile = profile
+        if profile.cog:
+            self._create_path = os.path.splitext(path)[0] + '_tmp_%s.tif' % uuid.uuid4().hex
+        else:
+            self._create_path = path
+        self.dataset = gdal.GetDriverByName('GTiff').Create(
+            self._create_path, cols, rows, bands, profile.gdal_type,
+            # Band interleaving, the bands are written one at a time
+            profile.gtiff_options() + (['INTERLEAVE=BAND'] if bands > 1 else []))
+        if self.dataset is None:
+            raise IOError('Unable to create the output raster %s' % path)
+        self.dataset.SetGeoTransform(reference.GetGeoTransform())  ##sets same geotransform as input
+        self.dataset.SetProjection(reference.GetProjection())  ##sets same projection as input
+        self.band = self.dataset.GetRasterBand(1)
+
+    def write(self, array, xoff=0, yoff=0, band=1):
+        self.dataset.GetRasterBand(band).WriteArray(array, xoff, yoff)
+
+    def set_description(self, band, description):
+        self.dataset.GetRasterBand(band).SetDescription(description)
+
+    def close(self):
+        self.dataset.FlushCache()  ##saves to disk!!
+        if self.profile.cog:
+            cog = gdal.GetDriverByName('COG').CreateCopy(self.path, self.dataset, options=self.profile.cog_options())
+            if cog is None:
+                raise IOError('Unable to create the output raster %s' % self.path)
+            cog = None
+        self.band = None
+        self.dataset = None
+        if self.profile.cog:
+            gdal.GetDriverByName('GTiff').Delete(self._create_path)
+
+
+def write_raster(path, array, reference, profile=None):
+    """
+    Writes a 2D array to a single band raster at path, with the
+    georeferencing of the reference dataset and the options of profile.
+    """
+    [rows, cols] = array.shape
+    writer = RasterWriter(path, cols, rows, reference, profile)
+    writer.write(array)
+    writer.close()
+
+
+def write_lucode_constant(path, value, lucode_uri, reference, profile=None, n_lucodes=N_LUCODES):
+    """
+    Writes value on the pixels of the land use raster at lucode_uri with a
+    lucode below n_lucodes, 0 elsewhere, window by window. The constant
+    raster is never held in memory and its compressed tiles take almost
+    no space on disk.
+    """
+    ds = gdal.Open(lucode_uri)
+    if ds is None:
+        raise IOError('Unable to open the raster %s' % lucode_uri)
+    band = ds.GetRasterBand(1)
+    writer = RasterWriter(path, band.XSize, band.YSize, reference, profile)
+    for xoff, yoff, xsize, ysize in iter_windows(band):
+        arr = band.ReadAsArray(xoff, yoff, xsize, ysize)
+        writer.write(np.where(arr < n_lucodes, value, 0.0), xoff, yoff)
+    writer.close()
+
+
+def memory_path(file_name):
+    """
+    Returns a unique /vsimem/ path for an intermediate raster that is only
+    read back by the same QGIS process.
+    """
+    return '/vsimem/se_torino/%s/%s' % (uuid.uuid4().hex, file_name)
+
+
+def release_raster(path):
+    """
+    Frees an intermediate raster created at a memory_path().
+    """
+    if path.startswith('/vsimem/'):
+        gdal.Unlink(path)
+
+
+def intermediate_path(folder, file_name, save):
+    """
+    Returns the path of an intermediate raster: in folder when save is
+    True, in /vsimem/ otherwise.
+    """
+    if save:
+        return folder + '/' + file_name
+    return memory_path(file_name)
+
+
+def raster_histogram(uri, feedback=None):
+    """
+    Returns the LucodeHistogram of the first band of the land use raster
+    at uri, reading it window by window. Negative values are counted as 0,
+    as the SE algorithms do when they clean their inputs.
+    """
+    ds = gdal.Open(uri)
+    if ds is None:
+        raise IOError('Unable to open the raster %s' % uri)
+    band = ds.GetRasterBand(1)
+    histogram = LucodeHistogram()
+    for xoff, yoff, xsize, ysize in iter_windows(band):
+        if feedback is not None and feedback.isCanceled():
+            break
+        arr = band.ReadAsArray(xoff, yoff, xsize, ysize)
+        arr[arr < 0] = 0
+        histogram.update(arr)
+    return ds, histogram
+
+
+def raster_transitions(present_uri, future_uri, feedback=None):
+    """
+    Returns the present dataset and the TransitionMatrix of the first band
+    of the present and future land use rasters, reading them window by
+    window. Negative values are counted as 0.
+    """
+    ds_present = gdal.Open(present_uri)
+    ds_future = gdal.Open(future_uri)
+    if ds_present is None or ds_future is None:
+        raise IOError('Unable to open the rasters %s, %s' % (present_uri, future_uri))
+    if (ds_present.RasterXSize != ds_future.RasterXSize or
+            ds_present.RasterYSize != ds_future.RasterYSize):
+        raise ValueError('Present and future rasters must have the same size')
+    band_present = ds_present.GetRasterBand(1)
+    band_future = ds_future.GetRasterBand(1)
+    transitions = TransitionMatrix()
+    for xoff, yoff, xsize, ysize in iter_windows(band_present):
+        if feedback is not None and feedback.isCanceled():
+            break
+        arr_present = band_present.ReadAsArray(xoff, yoff, xsize, ysize)
+        arr_future = band_future.ReadAsArray(xoff, yoff, xsize, ysize)
+        arr_present[arr_present < 0] = 0
+        arr_future[arr_future < 0] = 0
+        transitions.update(arr_present, arr_future)
+    return ds_present, transitions
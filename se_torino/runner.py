@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Execution of the SE algorithms as separate qgis_process processes.
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class SEModule(object):
+    """
+    Description of one SE algorithm run by the runner.
+
+    lulc and years are the (present, future) parameter names of the
+    land use rasters and of the years, lulc is None for the algorithms
+    that read precomputed rasters. inputs are the parameters without a
+    default that the runner cannot fill, they must be given in the
+    module section of the parameters file. complessivo is the input of
+    SE Calcolo Complessivo fed with the delta raster.
+    """
+
+    def __init__(self, key, name, lulc, years, delta, complessivo, inputs=()):
+        self.key = key
+        self.name = name
+        self.lulc = lulc
+        self.years = years
+        self.delta = delta
+        self.complessivo = complessivo
+        self.inputs = inputs
+
+    @property
+    def algorithm_id(self):
+        return 'script:' + self.name
+
+
+# The nine SE algorithms, in the order of the SE Calcolo Complessivo inputs
+SE_MODULES = [
+    SEModule('sequestro_carbonio', 'SE Sequesto Carbonio', None, ('INPUT3', 'INPUT4'),
+             'SE_01_carbon_sequestration_delta_euro.tiff', 'INPUT1', ('INPUT1', 'INPUT2')),
+    SEModule('rimozione_inquinanti', 'SE Rimozione Inquinanti', None, ('INPUTPRE', 'INPUTFUT'),
+             'SE_02_rimozione_inquinanti_delta_euro.tiff', 'INPUT2',
+             ('INPUTNP', 'INPUTPP', 'INPUTOP', 'INPUTNF', 'INPUTPF', 'INPUTOF')),
+    SEModule('regolazione_temperatura', 'SE Regolazione temperatura', ('INPUTRP', 'INPUTRF'), ('INPUTPRE', 'INPUTFUT'),
+             'SE_03_regolazione_temperatura_delta_euro.tiff', 'INPUT3'),
+    SEModule('protezione_idrogeologica', 'SE Protezione idrogeologica', ('INPUTRP', 'INPUTRF'), ('INPUTPRE', 'INPUTFUT'),
+             'SE_04_protezione_idrogeologica_delta_euro.tiff', 'INPUT4'),
+    SEModule('infiltrazione', 'SE Infiltrazione', None, ('INPUTPRE', 'INPUTFUT'),
+             'SE_05_infiltrazione_delta_euro.tiff', 'INPUT5', ('INPUTRP', 'INPUTRF')),
+    SEModule('benefici_culturali', 'SE Benefici culturali', ('INPUTRP', 'INPUTRF'), ('INPUTPRE', 'INPUTFUT'),
+             'SE_06_benefici_culturali_delta_euro.tiff', 'INPUT6'),
+    SEModule('biodiversita', 'SE Biodiversita', ('INPUT1', 'INPUT2'), ('INPUT3', 'INPUT4'),
+             'SE_07_biodiversità_delta_euro.tiff', 'INPUT7'),
+    SEModule('produzione_agricola', 'SE Produzione agricola', ('INPUTRP', 'INPUTRF'), ('INPUTPRE', 'INPUTFUT'),
+             'SE_08_produzione_agricola_delta_euro.tiff', 'INPUT8'),
+    SEModule('impollinazione', 'SE Impollinazione', ('INPUTRP', 'INPUTRF'), ('INPUTPRE', 'INPUTFUT'),
+             'SE_09_impollinazione_delta_euro.tiff', 'INPUT9'),
+]
+
+QGIS_PROCESS_NAMES = ['qgis_process', 'qgis_process-qgis.bat', 'qgis_process-qgis-ltr.bat']
+
+
+def find_qgis_process(prefix_path=None):
+    """
+    Returns the path of the qgis_process executable, looking first in the
+    bin folder of the QGIS installation and then in the PATH.
+    """
+    for name in QGIS_PROCESS_NAMES:
+        if prefix_path:
+            path = os.path.join(prefix_path, 'bin', name)
+            if os.path.isfile(path):
+                return path
+        path = shutil.which(name)
+        if path is not None:
+            return path
+    return None
+
+
+def missing_inputs(module_parameters):
+    """
+    Returns the (module, parameter names) pairs of the modules whose
+    inputs are not given in module_parameters, the dictionary read from
+    the parameters file. Checked before starting any process, since a
+    single failed module stops SE Calcolo Complessivo.
+    """
+    missing = []
+    for module in SE_MODULES:
+        given = module_parameters.get(module.key, {})
+        names = [name for name in module.inputs if given.get(name) in (None, '')]
+        if names:
+            missing.append((module, names))
+    return missing
+
+
+def format_value(value):
+    """
+    Formats a parameter value for the qgis_process command line.
+    """
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, tuple)):
+        return ','.join(format_value(item) for item in value)
+    return str(value)
+
+
+class ModuleResult(object):
+    """
+    Outcome of one SE algorithm run: exit code, wall time (s), peak
+    resident memory (MB, None where the platform does not report it),
+    log file and the files written in the output folder.
+    """
+
+    def __init__(self, module, returncode, wall_time, peak_rss, log_path, outputs):
+        self.module = module
+        self.returncode = returncode
+        self.wall_time = wall_time
+        self.peak_rss = peak_rss
+        self.log_path = log_path
+        self.outputs = outputs
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    @property
+    def delta_path(self):
+        for output in self.outputs:
+            if os.path.basename(output) == self.module.delta:
+                return output
+        return None
+
+
+def _wait(process):
+    """
+    Waits for process and returns its exit code and peak resident memory
+    in MB. The memory is only available where os.wait4 exists.
+    """
+    if not hasattr(os, 'wait4'):
+        return process.wait(), None
+    _, status, usage = os.wait4(process.pid, 0)
+    # Popen must not reap the process again
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    if sys.platform == 'darwin':
+        peak_rss = usage.ru_maxrss / (1024.0 * 1024.0)
+    else:
+        peak_rss = usage.ru_maxrss / 1024.0
+    return process.returncode, peak_rss
+
+
+def run_module(qgis_process, module, parameters, output_folder):
+    """
+    Runs one SE algorithm with qgis_process, writing its outputs and its
+    log in output_folder. Returns a ModuleResult.
+    """
+    if not os.path.isdir(output_folder):
+        os.makedirs(output_folder)
+    command = [qgis_process, 'run', module.algorithm_id, '--']
+    for name, value in parameters.items():
+        command.append('%s=%s' % (name, format_value(value)))
+    log_path = os.path.join(output_folder, 'log.txt')
+    start = time.time()
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+        returncode, peak_rss = _wait(process)
+    wall_time = time.time() - start
+    outputs = sorted(os.path.join(output_folder, name) for name in os.listdir(output_folder)
+                     if name != 'log.txt')
+    return ModuleResult(module, returncode, wall_time, peak_rss, log_path, outputs)
+
+
+def run_modules(qgis_process, jobs, workers, feedback=None):
+    """
+    Runs the (module, parameters, output_folder) jobs, at most workers at
+    a time, each in its own qgis_process process. Returns the ModuleResult
+    list in the order of jobs.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(run_module, qgis_process, module, parameters, output_folder)
+                   for module, parameters, output_folder in jobs]
+        for n_done, _ in enumerate(as_completed(futures)):
+            if feedback is not None:
+                feedback.setProgress(100.0 * (n_done + 1) / len(jobs))
+    return [future.result() for future in futures]
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Tree species of the Calcolo algorithms and their coefficients.
+
+The coefficients are NumPy arrays indexed by species id (the position in
+SPECIES, which is also the index of the species enum parameters), so the
+species of hundreds of thousands of inventory trees are mapped to their
+coefficients with a single gather, and the totals of a species mix are a
+dot product of its per-species tree counts with a coefficient array.
+
+CATALOGUE is built once, when the module is first imported, and shared by
+all the algorithms of the session.
+"""
+
+import re
+
+import numpy as np
+
+# Species groups of the SE Torino parameters, with their Latin names
+SPECIES = ['Abete (Picea abies, glauca, omorika, orientalis, pungens)', 'Acero seconda grandezza (Acer campestre, cappadocicum, pseudoplatanus, platanoides, platanoides Schwedleri, platanoides Crimson King, rubrum, saccharinum)', 'Acero terza grandezza (Acer negundo, opalus,palmatum, palmatum v. dissectum, x freemanii)', 'Bagolaro (Celtis australis, occidentalis)',
+           'Carpino (Carpinus betulus, betulus fastigiata,Ostrya carpinifolia)', 'Cedro (Cedrus atlantica, atlantica v. glauca, deodara, libani)', 'Ciliegio da fiore (Prunus cerasifera, domestica, fruticosa, Kanzan,pissardii, serrulata, subhirtella)', 'Frassino (Fraxinus americana, excelsior, excelsior Pendula)',
+           'Ippocastano (Aesculus hippocastanum, pavia)', 'Olmo  (Ulmus laevis, minor,parvifolia,pumila)', 'Pino (Pinus halepensis, nigra, pinea, strobus, sylvestris, wallichiana)', 'Pioppo (Populus alba,canescens, nigra, nigra var. italica, tremula, x canadensis)',
+           'Platano (Platanus orientalis, occidentalis, hybrida)', 'Quercia (Quercus coccinea, ilex, petraea, pubescens, robur, robur Fastigiata, rubra)', 'Tiglio (Tilia cordata, cordata Greenspire, platyphyllos, x europaea)']
+
+# Carbon stored by a tree of the species (ton C)
+C_SEQUESTRATION = [0.18, 0.41, 0.34, 0.75, 0.38, 0.39, 0.2, 0.35, 0.44, 0.48, 0.31, 0.67, 0.7, 0.44, 0.28]
+# LAI of the interception of Calcolo infiltrazione
+LAI_INTERCEPTION = [0.18, 0.41, 0.34, 0.75, 0.38, 0.39, 0.2, 0.35, 0.44, 0.48, 0.31, 0.67, 0.7, 0.44, 0.28]
+# Ozone removed by a tree of the species (g/year)
+OZONO = [131.01, 89.10, 82.33, 207.25, 56.98, 206.24, 23.76, 100.70, 115.94, 116.61, 90.25, 85.20, 209.79, 89.54,
+         122.20]
+# LAI of the PM10 deposition of Calcolo Rimozione Inquinanti
+LAI = [7.73, 5.41, 4.48, 7.52, 4.71, 8.25, 3.9, 4.54, 6.13, 6.66, 5.24, 4.61, 6.38, 0.44, 6.41]
+# Days with leaves in a year
+LEAF_DAYS = [365, 215, 215, 215, 215, 365, 265, 215, 215, 215, 365, 215, 215, 215, 215]
+
+# Id of the species not found in a table
+UNKNOWN_SPECIES = -1
+
+
+def _normalize(name):
+    return re.sub(r'\s+', ' ', str(name).strip().lower())
+
+
+def species_aliases(names):
+    """
+    Returns a {normalized name: species id} dict of the names a species can
+    be given with in an inventory: its id, its full name, its Italian name
+    and the Latin binomials listed in parentheses. A genus alone is an alias
+    only when all its species belong to the same group.
+    """
+    aliases = {}
+    genera = {}
+    for species_id, name in enumerate(names):
+        aliases[str(species_id)] = species_id
+        aliases[_normalize(name)] = species_id
+        common, _, latin = name.partition('(')
+        aliases[_normalize(common)] = species_id
+        genus = None
+        for part in latin.rstrip(')').split(','):
+            words = part.split()
+            if not words:
+                continue
+            if words[0][0].isupper() and len(words) > 1:
+                genus = words[0]
+                words = words[1:]
+            if genus is None:
+                continue
+            genera.setdefault(genus.lower(), set()).add(species_id)
+            # 'x freemanii' is the epithet of a hybrid
+            epithet = ' '.join(words[:2]) if words[0] == 'x' and len(words) > 1 else words[0]
+            aliases.setdefault(_normalize(genus + ' ' + epithet), species_id)
+    for genus, ids in genera.items():
+        if len(ids) == 1:
+            aliases.setdefault(genus, ids.pop())
+    return aliases
+
+
+class SpeciesTable(object):
+    """
+    Species names and per-species coefficient arrays, e.g.
+    SpeciesTable(SPECIES, c_sequestration=C_SEQUESTRATION).
+    """
+
+    def __init__(self, names, **coefficients):
+        self.names = list(names)
+        self.coefficients = {}
+        for key, values in coefficients.items():
+            values = np.asarray(values, dtype=np.float64)
+            if len(values) != len(self.names):
+                raise ValueError('The coefficient %s must have one value per species' % key)
+            self.coefficients[key] = values
+        self.aliases = species_aliases(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def species_id(self, name):
+        """
+        Returns the id of a species name of an inventory, UNKNOWN_SPECIES
+        when it is not recognized. The full Latin name is tried first, then
+        its binomial and its genus.
+        """
+        key = _normalize(name)
+        try:
+            # Ids read from numeric fields, e.g. 3.0
+            if float(key) == int(float(key)):
+                key = str(int(float(key)))
+        except (ValueError, OverflowError):
+            pass
+        words = key.split(' ')
+        for candidate in [key, ' '.join(words[:3]) if len(words) > 2 and words[1] == 'x' else None,
+                          ' '.join(words[:2]), words[0]]:
+            if candidate is not None and candidate in self.aliases:
+                return self.aliases[candidate]
+        return UNKNOWN_SPECIES
+
+    def ids(self, names):
+        """
+        Returns the species ids of an array of names, resolving every
+        distinct name once.
+        """
+        unique_names, inverse = np.unique(np.asarray(names, dtype=str), return_inverse=True)
+        unique_ids = np.array([self.species_id(name) for name in unique_names], dtype=np.intp)
+        return unique_ids[inverse]
+
+    def take(self, key, ids):
+        """
+        Returns the coefficient key of the species ids, 0 for the unknown
+        species.
+        """
+        values = np.append(self.coefficients[key], 0.0)
+        return values[np.where(np.asarray(ids) >= 0, ids, len(self.names))]
+
+    def species_counts(self, ids, counts):
+        """
+        Returns the number of trees of every species, summing the counts of
+        the rows of a species mix. Unknown species and invalid counts are
+        skipped.
+        """
+        ids = np.asarray(ids, dtype=np.intp).ravel()
+        counts = np.asarray(counts, dtype=np.float64).ravel()
+        valid = (ids >= 0) & np.isfinite(counts) & (counts > 0)
+        return np.bincount(ids[valid], weights=counts[valid], minlength=len(self.names))
+
+    def total(self, key, species_counts):
+        """
+        Returns the sum over the species of the coefficient key times the
+        number of trees of the species.
+        """
+        return float(np.dot(species_counts, self.coefficients[key]))
+
+    def unknown(self, names, ids):
+        """
+        Returns a {name: n_points} dict of the names not recognized.
+        """
+        unknown_points = np.asarray(ids) == UNKNOWN_SPECIES
+        if not np.any(unknown_points):
+            return {}
+        unknown_names, counts = np.unique(np.asarray(names, dtype=str)[unknown_points], return_counts=True)
+        return dict(zip(unknown_names.tolist(), counts.tolist()))
+
+
+CATALOGUE = SpeciesTable(SPECIES, c_sequestration=C_SEQUESTRATION, lai_interception=LAI_INTERCEPTION, ozono=OZONO,
+                         lai=LAI, leaf_days=LEAF_DAYS)
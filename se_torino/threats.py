@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Distance rasters from the threat vector layers of SE Biodiversita.
+
+A threat layer is rasterized on the grid of the land use raster and the
+Euclidean distance (m) of every pixel from the nearest threat pixel is
+computed, with scipy when available and with the GDAL proximity
+algorithm otherwise. Distance rasters are cached on disk, keyed on the
+layer file and on the grid, so reruns of a scenario read them back.
+
+Layers that OGR cannot open from their URI (QGIS memory, PostGIS or WFS
+layers, or layers with a subset filter) are passed as a FeatureLayer, a
+copy of their features, wherever a layer URI is expected.
+
+The point layers of the amenities of SE Benefici and of the tree inventory
+of Calcolo C are read here too, as pixel coordinates on the grid of the
+land use raster.
+"""
+
+import hashlib
+import os
+import tempfile
+import uuid
+
+import numpy as np
+try:
+    from osgeo import gdal, ogr
+except ImportError:
+    import gdal
+    import ogr
+try:
+    from scipy import ndimage
+except ImportError:
+    ndimage = None
+
+DEFAULT_CACHE_FOLDER = os.path.join(tempfile.gettempdir(), 'se_torino_minacce')
+
+
+def split_layer_uri(uri):
+    """
+    Returns the path and the layer name (None for the first layer) of an
+    OGR layer URI such as 'minacce.gpkg|layername=strade'.
+    """
+    parts = uri.split('|')
+    layer_name = None
+    for option in parts[1:]:
+        key, _, value = option.partition('=')
+        if key.strip().lower() == 'layername':
+            layer_name = value.strip()
+    return parts[0], layer_name
+
+
+def _grid_dataset(reference, gdal_type, driver='MEM', path=''):
+    ds = gdal.GetDriverByName(driver).Create(path, reference.RasterXSize, reference.RasterYSize, 1, gdal_type,
+                                             [] if driver == 'MEM' else ['TILED=YES', 'COMPRESS=DEFLATE',
+                                                                         'PREDICTOR=3', 'BIGTIFF=IF_SAFER'])
+    if ds is None:
+        raise IOError('Unable to create the raster %s' % path)
+    ds.SetGeoTransform(reference.GetGeoTransform())
+    ds.SetProjection(reference.GetProjection())
+    return ds
+
+
+class FeatureLayer(object):
+    """
+    Copy of the features of a vector layer, as (WKB geometry, [attribute
+    values]) pairs, with the names of the fields of the values. key
+    identifies the source and the geometries of the features, for the
+    DistanceCache.
+    """
+
+    def __init__(self, name, uri, features, fields=()):
+        self.name = name
+        self.uri = uri
+        self.features = list(features)
+        self.fields = list(fields)
+        digest = hashlib.sha1(repr(uri).encode('utf-8'))
+        for wkb, _ in self.features:
+            digest.update(wkb)
+        self.key = digest.hexdigest()
+
+    def open(self):
+        """
+        Returns a new OGR memory data source and layer with the geometries,
+        so concurrent states never share a read cursor.
+        """
+        source = ogr.GetDriverByName('Memory').CreateDataSource('')
+        layer = source.CreateLayer(str(self.name))
+        for wkb, _ in self.features:
+            feature = ogr.Feature(layer.GetLayerDefn())
+            feature.SetGeometry(ogr.CreateGeometryFromWkb(wkb))
+            layer.CreateFeature(feature)
+        return source, layer
+
+
+def _open_layer(uri):
+    # The data source is returned too, the layer is valid while it is referenced
+    if isinstance(uri, FeatureLayer):
+        return uri.open()
+    path, layer_name = split_layer_uri(uri)
+    source = ogr.Open(path)
+    if source is None:
+        raise IOError('Unable to open the vector layer %s' % uri)
+    layer = source.GetLayerByName(layer_name) if layer_name else source.GetLayer(0)
+    if layer is None:
+        raise IOError('Unable to open the vector layer %s' % uri)
+    return source, layer
+
+
+def rasterize_layer(uri, reference):
+    """
+    Rasterizes the features of the vector layer at uri on the grid of the
+    reference dataset. Returns the in-memory dataset, 1 on the pixels
+    touched by a feature and 0 elsewhere.
+    """
+    source, layer = _open_layer(uri)
+    ds = _grid_dataset(reference, gdal.GDT_Byte)
+    gdal.RasterizeLayer(ds, [1], layer, burn_values=[1], options=['ALL_TOUCHED=TRUE'])
+    return ds
+
+
+def layer_points(uri, reference):
+    """
+    Returns the (column, row) coordinates, in pixels of the grid of the
+    reference dataset, of the points of the vector layer at uri: every
+    part of the multipoints and the centroid of the other geometries.
+    """
+    return layer_point_attributes(uri, reference, [])[0]
+
+
+def layer_point_attributes(uri, reference, fields):
+    """
+    Returns the (column, row) coordinates of the points of the vector
+    layer at uri, as layer_points, and the list of the values of every
+    field of fields, one per point (None when the field is not set).
+    """
+    x_origin, x_size, _, y_origin, _, y_size = reference.GetGeoTransform()
+    coords = []
+    values = [[] for _ in fields]
+    for geometry, feature_values in _layer_features(uri, fields):
+        if geometry is None:
+            continue
+        if ogr.GT_Flatten(geometry.GetGeometryType()) == ogr.wkbMultiPoint:
+            parts = [geometry.GetGeometryRef(i) for i in range(geometry.GetGeometryCount())]
+        else:
+            parts = [geometry.Centroid()]
+        for point in parts:
+            coords.append(((point.GetX() - x_origin) / x_size, (point.GetY() - y_origin) / y_size))
+            for field_values, value in zip(values, feature_values):
+                field_values.append(value)
+    return np.array(coords, dtype=np.float64).reshape(-1, 2), values
+
+
+def _layer_features(uri, fields):
+    # Yields the geometry and the values of fields of every feature
+    if isinstance(uri, FeatureLayer):
+        field_indices = []
+        for field in fields:
+            if field not in uri.fields:
+                raise ValueError('The vector layer %s has no field %s' % (uri.name, field))
+            field_indices.append(uri.fields.index(field))
+        for wkb, attributes in uri.features:
+            yield ogr.CreateGeometryFromWkb(wkb), [attributes[index] for index in field_indices]
+        return
+    source, layer = _open_layer(uri)
+    definition = layer.GetLayerDefn()
+    field_indices = []
+    for field in fields:
+        index = definition.GetFieldIndex(field)
+        if index < 0:
+            raise ValueError('The vector layer %s has no field %s' % (uri, field))
+        field_indices.append(index)
+    for feature in layer:
+        yield feature.GetGeometryRef(), [feature.GetField(index) if feature.IsFieldSetAndNotNull(index) else None
+                                         for index in field_indices]
+
+
+def distance_transform(mask_ds):
+    """
+    Returns the Euclidean distance (m) of every pixel from the nearest
+    non zero pixel of a single band dataset, inf when there is none.
+    """
+    mask = mask_ds.GetRasterBand(1).ReadAsArray()
+    if not np.any(mask):
+        return np.full(mask.shape, np.inf, dtype=np.float32)
+    geotransform = mask_ds.GetGeoTransform()
+    if ndimage is not None:
+        return ndimage.distance_transform_edt(mask == 0, sampling=(abs(geotransform[5]), abs(geotransform[1]))
+                                              ).astype(np.float32)
+    proximity_ds = _grid_dataset(mask_ds, gdal.GDT_Float32)
+    gdal.ComputeProximity(mask_ds.GetRasterBand(1), proximity_ds.GetRasterBand(1),
+                          ['VALUES=1', 'DISTUNITS=GEO'])
+    return proximity_ds.GetRasterBand(1).ReadAsArray()
+
+
+class DistanceCache(object):
+    """
+    Folder of the distance rasters already computed. The key of a raster
+    is the layer URI with the size and modification time of its file, or
+    the key of a FeatureLayer, and the grid (size, geotransform and
+    projection) of the land use raster. Layers without either, e.g. an URI
+    that is not a file, are not cached.
+    """
+
+    def __init__(self, folder=None):
+        self.folder = folder or DEFAULT_CACHE_FOLDER
+
+    def key(self, uri, reference):
+        grid = [reference.RasterXSize, reference.RasterYSize, tuple(reference.GetGeoTransform()),
+                reference.GetProjection()]
+        if isinstance(uri, FeatureLayer):
+            parts = [uri.key] + grid
+        else:
+            path, _ = split_layer_uri(uri)
+            if not os.path.isfile(path):
+                return None
+            stat = os.stat(path)
+            parts = [os.path.abspath(uri), stat.st_size, stat.st_mtime] + grid
+        return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+    def path(self, uri, reference):
+        """
+        Returns the path of the cached distance raster, None when the layer
+        cannot be cached.
+        """
+        key = self.key(uri, reference)
+        if key is None:
+            return None
+        if isinstance(uri, FeatureLayer):
+            name = uri.name
+        else:
+            name = os.path.splitext(os.path.basename(split_layer_uri(uri)[0]))[0]
+        name = ''.join(char if char.isalnum() else '_' for char in name)
+        return os.path.join(self.folder, '%s_%s.tif' % (name, key[:16]))
+
+    def distance(self, uri, reference):
+        """
+        Returns the distance raster (m) of the threat layer at uri on the
+        grid of the reference dataset, from the cache when available.
+        """
+        path = self.path(uri, reference)
+        if path is not None and os.path.isfile(path):
+            ds = gdal.Open(path)
+            if ds is not None:
+                return ds.GetRasterBand(1).ReadAsArray()
+        distance = distance_transform(rasterize_layer(uri, reference))
+        if path is None:
+            return distance
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        # Written under a temporary name, both states may compute the same layer
+        tmp_path = '%s.%s.tif' % (path, uuid.uuid4().hex)
+        ds = _grid_dataset(reference, gdal.GDT_Float32, 'GTiff', tmp_path)
+        ds.GetRasterBand(1).WriteArray(distance)
+        ds.FlushCache()
+        ds = None
+        os.replace(tmp_path, path)
+        return distance
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Cross-tabulation of the present and future land use rasters.
+"""
+
+import os
+
+import numpy as np
+
+from se_torino.lookup import LucodeHistogram
+
+# Lucodes of the SE Torino land use legend are 0 ... 87
+N_LUCODES = 88
+
+
+class TransitionMatrix(object):
+    """
+    Number of pixels for every (present lucode, future lucode) pair,
+    computed with a single bincount pass over both rasters.
+
+    Every SE delta is value(future lucode) - value(present lucode) on the
+    same pixel, so the delta total of a per-lucode table only depends on
+    these counts. counts has one row and one column more than the
+    lucodes: the last slot collects the lucodes outside [0, n_lucodes).
+    The histograms of the two states are accumulated in the same pass.
+    """
+
+    def __init__(self, arr_present=None, arr_future=None, n_lucodes=N_LUCODES):
+        self.counts = np.zeros((n_lucodes + 1, n_lucodes + 1), dtype=np.int64)
+        self.present = LucodeHistogram()
+        self.future = LucodeHistogram()
+        if arr_present is not None:
+            self.update(arr_present, arr_future)
+
+    @property
+    def n_lucodes(self):
+        return len(self.counts) - 1
+
+    @property
+    def n_changed(self):
+        """
+        Number of pixels whose lucode changes between the two states.
+        """
+        return int(np.sum(self.counts) - np.trace(self.counts[:-1, :-1]))
+
+    def _slots(self, arr):
+        arr = np.asarray(arr)
+        valid = (arr >= 0) & (arr < self.n_lucodes)
+        if arr.dtype.kind == 'f':
+            valid &= (arr == np.floor(arr))
+        idx = np.where(valid, arr, 0).astype(np.intp)
+        idx[~valid] = self.n_lucodes
+        return idx
+
+    def pairs(self, arr_present, arr_future):
+        """
+        Returns the index of the (present lucode, future lucode) pair of
+        every pixel in the flattened matrix, present slot * (n_lucodes + 1)
+        + future slot.
+        """
+        if np.shape(arr_present) != np.shape(arr_future):
+            raise ValueError('Present and future rasters must have the same size')
+        return self._slots(arr_present) * (self.n_lucodes + 1) + self._slots(arr_future)
+
+    def update(self, arr_present, arr_future):
+        """
+        Adds the pixels of a pair of windows of the present and future
+        rasters to the matrix.
+        """
+        n_slots = self.n_lucodes + 1
+        pair = self.pairs(arr_present, arr_future)
+        self.counts += np.bincount(pair.ravel(), minlength=n_slots * n_slots).reshape(n_slots, n_slots)
+        self.present.update(arr_present)
+        self.future.update(arr_future)
+        return self
+
+    def weighted(self, arr_present, arr_future, weights):
+        """
+        Returns the sum of the per-pixel weights of every (present lucode,
+        future lucode) pair of the two rasters, e.g. a per-pixel factor
+        that cannot be folded into the class values.
+        """
+        n_slots = self.n_lucodes + 1
+        pair = self.pairs(arr_present, arr_future)
+        return np.bincount(pair.ravel(), weights=np.ravel(weights),
+                           minlength=n_slots * n_slots).reshape(n_slots, n_slots)
+
+    def class_values(self, table, scale=1.0):
+        """
+        Returns the values of a LucodeTable for the slots of the matrix,
+        multiplied by scale. Lucodes not in the table take the default.
+        """
+        values = np.full(self.n_lucodes + 1, table.default, dtype=np.float64)
+        n = min(self.n_lucodes, len(table.values) - 1)
+        values[:n] = np.where(table.known[:n], table.values[:n], table.default)
+        return values * scale
+
+    def delta(self, present_values, future_values=None):
+        """
+        Returns the matrix of the delta totals of every transition, from the
+        per-slot values of the present and of the future state (the same
+        values when future_values is None).
+        """
+        if future_values is None:
+            future_values = present_values
+        return self.counts * (future_values[np.newaxis, :] - present_values[:, np.newaxis])
+
+    def delta_total(self, present_values, future_values=None):
+        return float(np.sum(self.delta(present_values, future_values)))
+
+    def labels(self):
+        return [str(lucode) for lucode in range(self.n_lucodes)] + ['altro']
+
+    def save_npy(self, path):
+        np.save(path, self.counts)
+
+    def save_csv(self, path):
+        write_matrix_csv(path, self.counts, self.labels(), '%d')
+
+    @classmethod
+    def load_npy(cls, path):
+        counts = np.load(path)
+        transitions = cls(n_lucodes=len(counts) - 1)
+        transitions.counts[:] = counts
+        return transitions
+
+
+def write_matrix_csv(path, matrix, labels, fmt='%f'):
+    """
+    Writes a transition matrix as CSV, present lucodes on the rows and
+    future lucodes on the columns.
+    """
+    with open(path, 'w') as f:
+        f.write('presente/futuro,' + ','.join(labels) + '\n')
+        for label, row in zip(labels, matrix):
+            f.write(label + ',' + ','.join(fmt % value for value in row) + '\n')
+
+
+def transition_delta_path(delta_raster_path):
+    """
+    Returns the path of the per-transition delta matrix written next to
+    the delta raster of an SE algorithm.
+    """
+    return os.path.splitext(delta_raster_path)[0] + '_transizioni.npy'
+
+
+def save_transition_delta(delta_raster_path, delta):
+    """
+    Writes the per-transition delta matrix of an SE algorithm next to its
+    delta raster, where SE Calcolo Complessivo looks for it.
+    """
+    np.save(transition_delta_path(delta_raster_path), delta)
+
+
+def load_transition_delta(delta_raster_path, n_lucodes=N_LUCODES):
+    """
+    Returns the per-transition delta matrix written next to a delta raster,
+    None if the SE algorithm did not write it. Raises ValueError if the
+    matrix is older than the raster, i.e. left by a previous run, or if it
+    is not a matrix of n_lucodes lucodes.
+    """
+    path = transition_delta_path(delta_raster_path)
+    if not os.path.isfile(path):
+        return None
+    if os.path.isfile(delta_raster_path) and os.path.getmtime(path) < os.path.getmtime(delta_raster_path):
+        raise ValueError('%s is older than %s' % (path, delta_raster_path))
+    delta = np.load(path)
+    if delta.shape != (n_lucodes + 1, n_lucodes + 1):
+        raise ValueError('%s has shape %s, expected %s' % (path, delta.shape, (n_lucodes + 1, n_lucodes + 1)))
+    return delta
+
+
+def top_transitions(delta, labels, n=10):
+    """
+    Returns the n (present label, future label, delta) transitions with the
+    largest absolute delta, skipping the unchanged lucodes.
+    """
+    delta = np.array(delta, dtype=np.float64)
+    np.fill_diagonal(delta, 0.0)
+    order = np.argsort(np.abs(delta), axis=None)[::-1][:n]
+    rows, cols = np.unravel_index(order, delta.shape)
+    return [(labels[row], labels[col], delta[row, col]) for row, col in zip(rows, cols) if delta[row, col] != 0]